@@ -0,0 +1,465 @@
+#!/usr/bin/env python3
+
+"""
+A render cache that can be shared between build directories (and people).
+Rendering `gem_alphas(legends=["A"])` once is enough; everyone else with the
+same parameters (and the same `.scad` files) just gets a copy::
+
+    $ ./scripts/riskeycap_full.py --out /tmp/out --cache /mnt/shared/keycap_cache
+    $ ./scripts/riskeycap_full.py --out /tmp/out --cache http://buildbox:8766
+
+    # The HTTP stand-in for when there's no shared filesystem:
+    buildbox$ ./scripts/artifactcache.py serve /var/cache/keycaps --max-size 50G
+    $ ./scripts/artifactcache.py stats /mnt/shared/keycap_cache
+
+Layout of a cache directory::
+
+    blobs/ab/abcdef...   Rendered files, named by the sha256 of their content
+    actions/12/1234...   JSON per job key: which blob + how it was rendered
+    stats.json           Hit/miss/store/eviction counters
+
+The job key (`cache_key()`) covers everything that affects the output: the
+`-D` definitions, OpenSCAD arguments, file type, whether colorscad is used,
+and the contents of the `.scad` files.  Everything gets written to a
+temporary file first and renamed into place so readers never see a partial
+blob.  Blobs are checked against their hash when fetched.  With a size cap
+(`--cache-size`/`--max-size`) the least recently used blobs (fetching one
+counts as using it) get evicted whenever a store pushes the cache over it.
+"""
+
+# stdlib imports
+import os
+import re
+import sys
+import json
+import time
+import fcntl
+import hashlib
+import argparse
+import threading
+import contextlib
+import urllib.request
+import urllib.error
+from pathlib import Path
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+# Our own stuff
+from csgtree import sources_digest
+
+DEFAULT_PORT = 8766
+CACHE_VERSION = 1 # Bump this if what gets cached (or the key) changes
+STATS = ("hits", "misses", "stores", "evictions", "bytes_fetched",
+         "bytes_stored", "bytes_evicted")
+SIZE_UNITS = {"": 1, "K": 1024, "M": 1024**2, "G": 1024**3, "T": 1024**4}
+
+class CacheException(Exception):
+    """
+    Raised when the cache can't be used (bad location, server unreachable).
+    """
+    pass
+
+def parse_size(value):
+    """
+    Parses a size like "500M" or "20G" (or plain bytes) into bytes.
+    """
+    match = re.fullmatch(r"\s*([\d.]+)\s*([KMGT]?)i?B?\s*", str(value), re.I)
+    if not match:
+        raise CacheException(f"Invalid size: {value!r} (try e.g. 20G)")
+    return int(float(match.group(1)) * SIZE_UNITS[match.group(2).upper()])
+
+def cache_key(keycap):
+    """
+    Returns the key *keycap*'s output gets cached under.  Unlike
+    `journal.job_hash()` it doesn't include any paths (those differ between
+    machines) but it does cover the contents of the `.scad` files.
+    """
+    parts = [
+        str(CACHE_VERSION), keycap.definitions(), keycap.openscad_args,
+        keycap.file_type, str(keycap.uses_colorscad()),
+        sources_digest(keycap.keycap_playground_path),
+    ]
+    return hashlib.sha256("\0".join(parts).encode("utf-8")).hexdigest()
+
+def _sharded(directory, name):
+    return Path(directory) / name[:2] / name
+
+def _write_atomic(path, data):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temp = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    with open(temp, "wb") as f:
+        f.write(data)
+    os.replace(temp, path)
+
+def _copy_verified(source, dest, digest):
+    """
+    Copies *source* to *dest* (atomically) making sure its content matches
+    *digest* along the way.  Returns the number of bytes copied or `None` if
+    the content didn't match.
+    """
+    dest = Path(dest)
+    temp = dest.with_name(f".{dest.name}.cache.tmp")
+    sha = hashlib.sha256()
+    size = 0
+    with open(source, "rb") as src, open(temp, "wb") as out:
+        for chunk in iter(lambda: src.read(1024*1024), b""):
+            sha.update(chunk)
+            out.write(chunk)
+            size += len(chunk)
+    if sha.hexdigest() != digest:
+        temp.unlink()
+        return None
+    os.replace(temp, dest)
+    return size
+
+class DirectoryCache(object):
+    """
+    A cache in *path* (which can be on a shared filesystem; everything is
+    written atomically and stats/eviction use a lock file).  *max_bytes*
+    caps the total size of the blobs (`None` means no limit).
+    """
+    def __init__(self, path, max_bytes=None):
+        self.path = Path(path)
+        self.max_bytes = max_bytes
+        self.blobs = self.path / "blobs"
+        self.actions = self.path / "actions"
+        try:
+            self.blobs.mkdir(parents=True, exist_ok=True)
+            self.actions.mkdir(parents=True, exist_ok=True)
+        except OSError as e:
+            raise CacheException(f"Can't use {self.path} as a cache: {e}")
+
+    def __str__(self):
+        return str(self.path)
+
+    @contextlib.contextmanager
+    def _locked(self):
+        with open(self.path / ".lock", "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _count(self, **increments):
+        with self._locked():
+            stats = self.stats()
+            for name, value in increments.items():
+                stats[name] = stats.get(name, 0) + value
+            _write_atomic(self.path / "stats.json",
+                json.dumps(stats, indent=2).encode("utf-8"))
+
+    def stats(self):
+        """
+        Returns the cache's counters (see `STATS`) plus its current size.
+        """
+        try:
+            with open(self.path / "stats.json") as f:
+                stats = json.load(f)
+        except (OSError, ValueError):
+            stats = {}
+        for name in STATS:
+            stats.setdefault(name, 0)
+        return stats
+
+    def lookup(self, key):
+        """
+        Returns the action entry (dict) for *key* or `None`.
+        """
+        try:
+            with open(_sharded(self.actions, key)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def read_blob(self, digest):
+        """
+        Returns the path of blob *digest* (marking it as recently used) or
+        `None` if it isn't there (anymore).
+        """
+        path = _sharded(self.blobs, digest)
+        try:
+            os.utime(path) # The mtime doubles as the LRU timestamp
+        except OSError:
+            return None
+        return path
+
+    def fetch(self, key, dest):
+        """
+        Copies the output cached under *key* to *dest*.  Returns its action
+        entry (how it was rendered) or `None` on a miss.
+        """
+        entry = self.lookup(key)
+        blob = self.read_blob(entry["blob"]) if entry else None
+        size = _copy_verified(blob, dest, entry["blob"]) if blob else None
+        if size is None:
+            self._count(misses=1)
+            return None
+        self._count(hits=1, bytes_fetched=size)
+        return entry
+
+    def store_blob(self, digest, data):
+        path = _sharded(self.blobs, digest)
+        if path.exists():
+            os.utime(path)
+        else:
+            _write_atomic(path, data)
+
+    def store_action(self, key, entry):
+        _write_atomic(_sharded(self.actions, key),
+            json.dumps(entry).encode("utf-8"))
+
+    def publish(self, key, source, meta=None):
+        """
+        Stores the file at *source* under *key* along with *meta* (a dict of
+        how it was rendered: name, duration, peak memory, etc).
+        """
+        data = Path(source).read_bytes()
+        digest = hashlib.sha256(data).hexdigest()
+        self.store_blob(digest, data)
+        entry = dict(meta or {}, blob=digest, size=len(data), stored=time.time())
+        self.store_action(key, entry)
+        self._count(stores=1, bytes_stored=len(data))
+        self.evict()
+        return entry
+
+    def size(self):
+        return sum(p.stat().st_size for p in self.blobs.glob("*/*")
+                   if not p.name.startswith("."))
+
+    def evict(self, max_bytes=None):
+        """
+        Deletes the least recently used blobs until the cache is under
+        *max_bytes* (defaults to the cache's own limit).  Action entries that
+        point at evicted blobs just turn into misses.  Returns how many blobs
+        were evicted.
+        """
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        if max_bytes is None:
+            return 0
+        with self._locked():
+            blobs = []
+            for path in self.blobs.glob("*/*"):
+                if path.name.startswith("."):
+                    continue
+                try:
+                    stat = path.stat()
+                except OSError:
+                    continue
+                blobs.append((stat.st_mtime, stat.st_size, path))
+            total = sum(size for _, size, _ in blobs)
+            evicted = 0
+            freed = 0
+            for _, size, path in sorted(blobs):
+                if total <= max_bytes:
+                    break
+                try:
+                    path.unlink()
+                except OSError:
+                    continue
+                total -= size
+                freed += size
+                evicted += 1
+        if evicted:
+            self._count(evictions=evicted, bytes_evicted=freed)
+        return evicted
+
+class HttpCache(object):
+    """
+    Client for a cache served by `serve()` (same interface as
+    `DirectoryCache`).
+    """
+    def __init__(self, url, timeout=60):
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+        try:
+            self.stats()
+        except CacheException as e:
+            raise CacheException(f"Can't use {url} as a cache: {e}")
+
+    def __str__(self):
+        return self.url
+
+    def _request(self, path, data=None, method="GET"):
+        request = urllib.request.Request(
+            self.url + path, data=data, method=method)
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                return response.read()
+        except urllib.error.HTTPError as e:
+            if e.code == 404:
+                return None
+            raise CacheException(f"{method} {path}: {e}")
+        except (urllib.error.URLError, OSError) as e:
+            raise CacheException(f"{method} {path}: {e}")
+
+    def stats(self):
+        return json.loads(self._request("/stats"))
+
+    def fetch(self, key, dest):
+        try:
+            entry = self._request(f"/actions/{key}")
+            entry = json.loads(entry) if entry else None
+            data = self._request(f"/blobs/{entry['blob']}") if entry else None
+        except CacheException:
+            return None # A cache that's down is just a cache miss
+        if data is None or hashlib.sha256(data).hexdigest() != entry["blob"]:
+            return None
+        _write_atomic(Path(dest), data)
+        return entry
+
+    def publish(self, key, source, meta=None):
+        data = Path(source).read_bytes()
+        digest = hashlib.sha256(data).hexdigest()
+        self._request(f"/blobs/{digest}", data=data, method="PUT")
+        entry = dict(meta or {}, blob=digest, size=len(data), stored=time.time())
+        self._request(f"/actions/{key}",
+            data=json.dumps(entry).encode("utf-8"), method="PUT")
+        return entry
+
+def open_cache(spec, max_bytes=None):
+    """
+    Returns the cache for *spec*: an `HttpCache` for http(s):// URLs,
+    otherwise a `DirectoryCache`.
+    """
+    if re.match(r"https?://", spec):
+        return HttpCache(spec)
+    return DirectoryCache(spec, max_bytes=max_bytes)
+
+class CacheHandler(BaseHTTPRequestHandler):
+    """
+    Serves a `DirectoryCache` (`self.server.cache`) over HTTP.
+    """
+    NAME = re.compile(r"^/(blobs|actions)/([0-9a-f]{64})$")
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, body, code=200, content_type="application/json"):
+        self.send_response(code)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        cache = self.server.cache
+        if self.path == "/stats":
+            stats = cache.stats()
+            stats["size"] = cache.size()
+            stats["max_size"] = cache.max_bytes
+            self._send(json.dumps(stats).encode("utf-8"))
+            return
+        match = self.NAME.match(self.path)
+        if not match:
+            self._send(b"{}", 404)
+        elif match.group(1) == "actions":
+            entry = cache.lookup(match.group(2))
+            if entry is None or not cache.read_blob(entry["blob"]):
+                cache._count(misses=1)
+                self._send(b"{}", 404)
+            else:
+                self._send(json.dumps(entry).encode("utf-8"))
+        else:
+            path = cache.read_blob(match.group(2))
+            if path is None:
+                self._send(b"{}", 404)
+                return
+            data = path.read_bytes()
+            cache._count(hits=1, bytes_fetched=len(data))
+            self._send(data, content_type="application/octet-stream")
+
+    def do_PUT(self):
+        cache = self.server.cache
+        match = self.NAME.match(self.path)
+        if not match:
+            self._send(b"{}", 404)
+            return
+        data = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        name = match.group(2)
+        if match.group(1) == "blobs":
+            if hashlib.sha256(data).hexdigest() != name:
+                self._send(b'{"error": "content does not match hash"}', 400)
+                return
+            cache.store_blob(name, data)
+        else:
+            try:
+                entry = json.loads(data)
+            except ValueError:
+                self._send(b'{"error": "bad JSON"}', 400)
+                return
+            cache.store_action(name, entry)
+            cache._count(stores=1, bytes_stored=entry.get("size", 0))
+            cache.evict()
+        self._send(b"{}")
+
+def serve(cache, host="0.0.0.0", port=DEFAULT_PORT):
+    """
+    Serves *cache* (a `DirectoryCache`) over HTTP until interrupted.
+    """
+    server = ThreadingHTTPServer((host, port), CacheHandler)
+    server.daemon_threads = True
+    server.cache = cache
+    print(f"Serving {cache} on port {server.server_port}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+def print_stats(stats):
+    """
+    Prints the counters from a cache's `stats()`.
+    """
+    lookups = stats["hits"] + stats["misses"]
+    rate = f" ({stats['hits']/lookups:.0%} hit rate)" if lookups else ""
+    print(f"hits: {stats['hits']}, misses: {stats['misses']}{rate}")
+    print(f"stores: {stats['stores']}, evictions: {stats['evictions']}")
+    print(f"fetched: {stats['bytes_fetched']/1024**2:.1f}MB, stored: "
+          f"{stats['bytes_stored']/1024**2:.1f}MB, evicted: "
+          f"{stats['bytes_evicted']/1024**2:.1f}MB")
+    if stats.get("size") is not None:
+        limit = (f" of {stats['max_size']/1024**2:.1f}MB"
+                 if stats.get("max_size") else "")
+        print(f"size: {stats['size']/1024**2:.1f}MB{limit}")
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Manage/serve a shared render cache.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    server = subparsers.add_parser("serve",
+        help="Serve a cache directory over HTTP.")
+    server.add_argument('path', help="The cache directory.")
+    server.add_argument('--max-size',
+        metavar='<size>', type=str, default=None,
+        help="Evict the least recently used files beyond this (e.g. 50G).")
+    server.add_argument('--host', type=str, default="0.0.0.0")
+    server.add_argument('--port', type=int, default=DEFAULT_PORT)
+    stats = subparsers.add_parser("stats", help="Show cache statistics.")
+    stats.add_argument('cache', help="Cache directory or URL.")
+    evict = subparsers.add_parser("evict",
+        help="Evict least recently used files down to a size.")
+    evict.add_argument('path', help="The cache directory.")
+    evict.add_argument('--max-size',
+        metavar='<size>', type=str, required=True)
+    args = parser.parse_args()
+    try:
+        if args.command == "serve":
+            max_bytes = parse_size(args.max_size) if args.max_size else None
+            serve(DirectoryCache(args.path, max_bytes=max_bytes),
+                host=args.host, port=args.port)
+        elif args.command == "stats":
+            cache = open_cache(args.cache)
+            stats = cache.stats()
+            if isinstance(cache, DirectoryCache):
+                stats["size"] = cache.size()
+            print_stats(stats)
+        else:
+            cache = DirectoryCache(args.path)
+            evicted = cache.evict(parse_size(args.max_size))
+            print(f"Evicted {evicted} file(s)")
+    except CacheException as e:
+        print(e)
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
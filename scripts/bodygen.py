@@ -0,0 +1,477 @@
+#!/usr/bin/env python3
+
+"""
+Generates keycap bodies (the "keycap" part without legends, homing dots or
+stems) as meshes directly with NumPy instead of OpenSCAD.  Blanks don't need
+anything OpenSCAD is good at so there's no point waiting minutes for CGAL to
+union a bunch of hulls when the same shape can be written out in a few
+milliseconds::
+
+    $ ./scripts/bodygen.py --out /tmp/bodies riskeycap_full         # All the blanks
+    $ ./scripts/bodygen.py --out /tmp/bodies gem_full 1U_blank Q    # Q's body
+    $ ./scripts/bodygen.py --out /tmp/bodies --compare riskeycap_full 1U_blank
+
+The body is built the same way `_poly_keycap()` builds it (see `shell.py`
+for the model):
+
+ * The sides are the layers (rounded rectangles) lofted together column by
+   column, cut off where they meet the dish.
+ * The top is the dish surface (or the flat top where the dish doesn't reach)
+   sampled in rings inside the line where the dish meets the sides.
+ * The interior is the same thing again, shrunk by `wall_thickness`
+   (`uniform_wall_thickness`), or the trapezoidal cutout capped at
+   `dish_thickness` below the dish.
+
+Points along the straight sides and the number of rings come from
+`--max-error` (see `tessellation.py`) so the dish never strays further than
+that from the real (round) surface.
+
+Only the riskeycap and GEM profiles (and custom keycaps shaped like them:
+4 sides, no tilt, no layer rotation, a regular cylinder/sphere dish) are
+supported; anything else raises `BodyException` so it can be left to
+OpenSCAD.  `--compare` renders the same bodies with OpenSCAD
+(`RENDER=["keycap"]`, no legends; kept in `reference/` under the output
+directory) and checks that the two agree within `COMPARE_TOLERANCE` (bounding
+box) and `VOLUME_TOLERANCE` (volume).
+
+.. note::
+
+    Requires NumPy (`pip install numpy`).
+"""
+
+# stdlib imports
+import sys
+import math
+import time
+import asyncio
+import argparse
+import importlib
+from pathlib import Path
+# 3rd party stuff
+from colorama import Style
+# Our own stuff
+from mesh import weld, save_mesh, load_mesh, rotation_matrix
+from mesh import MeshException, np
+from shell import Shell, ShellException, profile_parameters
+from tessellation import DEFAULT_MAX_ERROR, dish_radius
+from jobspec import JobSpec
+
+SUPPORTED_PROFILES = ("riskeycap", "gem", "") # "" means a custom keycap
+GEM_CORNER_FN = 4 # GEM_keycap() ignores dish_corner_fn (chamfered corners)
+TOP_THICKNESS = 0.01 # The top layer is a slice this thick (see keycaps.scad)
+CROSSING_ITERATIONS = 40 # Bisection steps when finding where the dish meets the sides
+COMPARE_TOLERANCE = 0.05 # mm
+VOLUME_TOLERANCE = 0.02 # Fraction of the OpenSCAD body's volume
+REFERENCE_DIR = "reference"
+
+class BodyException(Exception):
+    """
+    Raised when a keycap's body can't be generated (unsupported parameters
+    or no NumPy).
+    """
+    pass
+
+def require_numpy():
+    if np is None:
+        raise BodyException(
+            "NumPy is required to generate bodies (pip install numpy)")
+
+def outline(size, radius, corner_fn, side_points=(0, 0)):
+    """
+    Returns the `(N, 2)` outline of `squarish_rpoly(xy=size, r=radius)`
+    (counterclockwise, starting at the +X end of the +Y side's corner) with
+    `ceil(corner_fn/4)` segments per corner (like `squarish_rpoly_points()`
+    in `utils.scad`) plus *side_points* `(x, y)` extra points along each
+    straight side parallel to X and Y (they don't change the shape but give
+    the dish more places to bend).  Outlines with the same *corner_fn* and
+    *side_points* always have the same number of points so they can be
+    lofted together.
+    """
+    half_x = (size[0] - radius*2 if size[0] > radius else radius/10)/2
+    half_y = (size[1] - radius*2 if size[1] > radius else radius/10)/2
+    segments = max(1, math.ceil(corner_fn/4)) if radius > 0 else 0
+    corners = np.array([
+        [half_x, half_y], [-half_x, half_y], [-half_x, -half_y],
+        [half_x, -half_y]])
+    if segments:
+        steps = np.arange(segments + 1)/segments
+    else: # Sharp corners are just one point
+        steps = np.array([0.5])
+    pieces = []
+    for c, corner in enumerate(corners):
+        angles = np.radians(90*(c + steps))
+        arc = corner + radius*np.stack([np.cos(angles), np.sin(angles)], axis=1)
+        pieces.append(arc)
+        # The straight side from the end of this corner to the next one:
+        following = corners[(c + 1) % 4] + radius*np.array(
+            [np.cos(np.radians(90*(c + 1 + steps[0]))),
+             np.sin(np.radians(90*(c + 1 + steps[0])))])
+        count = side_points[c % 2]
+        if count:
+            t = (np.arange(count) + 1)/(count + 1)
+            pieces.append(arc[-1] + (following - arc[-1])*t[:, None])
+    return np.concatenate(pieces)
+
+def _strip(rows):
+    """
+    Returns the (outward-facing) triangles joining each row of *rows* (an
+    index array of shape `(rows, N)`; rows going up, each one counterclockwise
+    when viewed from above) to the next one.
+    """
+    lower, upper = rows[:-1], rows[1:]
+    lower_next = np.roll(lower, -1, axis=1)
+    upper_next = np.roll(upper, -1, axis=1)
+    first = np.stack([lower, lower_next, upper_next], axis=-1)
+    second = np.stack([lower, upper_next, upper], axis=-1)
+    return np.concatenate([first.reshape(-1, 3), second.reshape(-1, 3)])
+
+def _cap(boundary, center, height_at, rings, start):
+    """
+    Fills the (counterclockwise) *boundary* loop (`(N, 3)` points) with
+    *rings* rings of points shrinking towards *center* (`(x, y)`), each
+    point's Z coming from *height_at* (the boundary keeps its own).  Returns
+    `(points, faces)` (facing up; *start* is the index of the first point
+    in the final vertex array).
+    """
+    count = len(boundary)
+    flat = boundary[:, :2] - center
+    scales = 1 - np.arange(1, rings)/rings
+    inner = center + flat[None, :, :]*scales[:, None, None]
+    inner = inner.reshape(-1, 2)
+    middle = np.asarray(center, float).reshape(1, 2)
+    xy = np.concatenate([inner, middle])
+    points = np.concatenate([
+        boundary, np.column_stack([xy, height_at(xy[:, 0], xy[:, 1])])])
+    rows = start + np.arange(rings*count).reshape(rings, count)
+    faces = _strip(rows) # Outer ring "below" the inner one means facing up
+    last = rows[-1]
+    fan = np.column_stack([
+        last, np.roll(last, -1), np.full(count, start + rings*count)])
+    return points, np.concatenate([faces, fan])
+
+def _crossings(below, above, dish):
+    """
+    Returns the points (`(N, 3)`) where the segments from *below* to *above*
+    meet the *dish* surface (a `Shell.dish_bottom_at()`) given that *below*
+    is under it and *above* isn't.
+    """
+    low = np.zeros(len(below))
+    high = np.ones(len(below))
+    for _ in range(CROSSING_ITERATIONS):
+        middle = (low + high)/2
+        point = below + (above - below)*middle[:, None]
+        under = point[:, 2] < dish(point[:, 0], point[:, 1])
+        low = np.where(under, middle, low)
+        high = np.where(under, high, middle)
+    return below + (above - below)*high[:, None]
+
+class Body(object):
+    """
+    Generates the body of *keycap* (a `Keycap`) with the dish within
+    *max_error* (mm) of the real thing.  Raises `BodyException` if the
+    keycap isn't supported.
+    """
+    def __init__(self, keycap, max_error=DEFAULT_MAX_ERROR):
+        require_numpy()
+        self.keycap = keycap
+        self.max_error = max_error
+        profile = keycap.key_profile or ""
+        if profile not in SUPPORTED_PROFILES:
+            raise BodyException(f"Unsupported key_profile: {profile}")
+        try:
+            self.params = profile_parameters(keycap)
+        except ShellException as e:
+            raise BodyException(str(e))
+        params = self.params
+        unsupported = [
+            name for name, value in (
+                ("dish_invert", params["dish_invert"]),
+                ("dish_tilt", params["dish_tilt"]),
+                ("polygon_layer_rotation", params["polygon_layer_rotation"]),
+                ("polygon_edges != 4", params["polygon_edges"] != 4),
+                ("dish_x/dish_y", params["dish_x"] or params["dish_y"]),
+                ("stem_snap_fit", keycap.stem_snap_fit),
+                ("homing_dot_length",
+                    keycap.homing_dot_length and keycap.homing_dot_width))
+            if value]
+        if params["dish_type"] not in ("cylinder", "sphere"):
+            unsupported.append(f"dish_type={params['dish_type']}")
+        if params["dish_depth"] <= 0:
+            unsupported.append("dish_depth <= 0")
+        if unsupported:
+            raise BodyException(
+                f"{keycap.name} can't be generated (" + ", ".join(unsupported)
+                + "); use OpenSCAD")
+        self.corner_fn = (
+            GEM_CORNER_FN if profile == "gem" else keycap.dish_corner_fn)
+        # Spacing between points that keeps the dish within max_error (the
+        # sagitta of a chord of length s on a circle of radius r is s²/8r):
+        self.spacing = math.sqrt(8*dish_radius(params)*max_error)
+        self.side_points = tuple(
+            max(0, math.ceil(side/self.spacing) - 1) for side in (
+                params["length"] - params["top_difference"],
+                params["width"] - params["top_difference"]))
+
+    def _outline(self, size, radius):
+        return outline(size, radius, self.corner_fn, self.side_points)
+
+    def _shell(self, params, start=0):
+        """
+        Returns `(points, faces, bottom)` for the outer surface of the
+        `_poly_keycap()` made with *params* (sides and top; facing out):
+        *bottom* is the indices of its bottom outline (the open end).
+        """
+        shell = Shell(**params)
+        dish = shell.dish_bottom_at
+        layers = shell.layers
+        top_z = layers[-1].offset[2] + TOP_THICKNESS
+        rows = []
+        for l, section in enumerate(layers):
+            ox, oy, oz = section.offset
+            flat = self._outline(section.size, section.radius) + (ox, oy)
+            z = top_z if l == len(layers) - 1 else oz
+            rows.append(np.column_stack([flat, np.full(len(flat), z)]))
+        rows = np.array(rows) # (layers + 1, N, 3)
+        count = rows.shape[1]
+        # Cut each column off where it goes into the dish (the rest of the
+        # column collapses onto that point and gets welded away):
+        cut = rows[:, :, 2] >= dish(rows[:, :, 0], rows[:, :, 1])
+        if cut[0].any():
+            raise BodyException("The dish goes all the way through")
+        columns = np.arange(count)
+        crossing = np.where(cut.any(axis=0), cut.argmax(axis=0), len(rows))
+        crossed = columns[crossing < len(rows)]
+        ends = rows[-1].copy()
+        ends[crossed] = _crossings(
+            rows[crossing[crossed] - 1, crossed],
+            rows[crossing[crossed], crossed], dish)
+        beyond = np.arange(len(rows))[:, None] >= crossing[None, :]
+        rows = np.where(beyond[:, :, None], ends[None, :, :], rows)
+        indices = start + np.arange(rows.size//3).reshape(len(rows), count)
+        sides = _strip(indices)
+        # The top: the dish (or the flat top where the dish doesn't reach)
+        center = (params["dish_x"] + params["top_x"],
+                  params["dish_y"] + params["top_y"])
+        reach = np.max(np.hypot(ends[:, 0] - center[0], ends[:, 1] - center[1]))
+        rings = max(2, math.ceil(reach/self.spacing))
+
+        def height_at(x, y):
+            return np.minimum(dish(x, y), top_z)
+
+        cap_points, cap_faces = _cap(
+            ends, center, height_at, rings, indices[-1, 0])
+        points = np.concatenate([rows.reshape(-1, 3), cap_points[count:]])
+        return points, np.concatenate([sides, cap_faces]), indices[0]
+
+    def _trapezoid(self, start=0):
+        """
+        Same as `_shell()` but for the interior cutout used when
+        `uniform_wall_thickness` is off (a frustum capped `dish_thickness`
+        below the bottom of the dish).
+        """
+        params = self.params
+        keycap = self.keycap
+        wall = keycap.wall_thickness
+        height = params["height"]
+        radius = params["corner_radius"]
+        crf = radius*params["corner_radius_curve"]/1.5
+        bottom = self._outline(
+            (params["length"] - wall*2, params["width"] - wall*2), radius)
+        top = self._outline(
+            (params["length"] - wall*2 - params["top_difference"] - crf,
+             params["width"] - wall*2 - params["top_difference"] - crf),
+            radius) + (params["top_x"], params["top_y"])
+        z = min(height - params["dish_depth"] - keycap.dish_thickness, height)
+        t = z/height
+        middle = bottom + (top - bottom)*t
+        count = len(bottom)
+        rows = np.array([
+            np.column_stack([bottom, np.zeros(count)]),
+            np.column_stack([middle, np.full(count, z)])])
+        indices = start + np.arange(2*count).reshape(2, count)
+        center = (params["top_x"]*t, params["top_y"]*t)
+        cap_points, cap_faces = _cap(
+            rows[-1], center, lambda x, y: np.full(x.shape, z), 1,
+            indices[-1, 0])
+        points = np.concatenate([rows.reshape(-1, 3), cap_points[count:]])
+        return points, np.concatenate([_strip(indices), cap_faces]), indices[0]
+
+    def mesh(self):
+        """
+        Returns the body as a (watertight) `Mesh`, rotated by `key_rotation`
+        just like the OpenSCAD output.
+        """
+        keycap = self.keycap
+        params = self.params
+        outer, outer_faces, outer_bottom = self._shell(params)
+        if keycap.uniform_wall_thickness:
+            wall = keycap.wall_thickness
+            inner_params = dict(params,
+                height=params["height"] - wall,
+                length=params["length"] - wall*2,
+                width=params["width"] - wall*2,
+                corner_radius=params["corner_radius"]/1.25)
+            inner, inner_faces, inner_bottom = self._shell(
+                inner_params, start=len(outer))
+        else:
+            inner, inner_faces, inner_bottom = self._trapezoid(
+                start=len(outer))
+        if np.nanmax(inner[:, 2]) >= np.nanmax(outer[:, 2]):
+            raise BodyException(
+                f"{keycap.name}: the interior pokes through the top")
+        # Join the bottom outlines (facing down):
+        rows = np.array([inner_bottom, outer_bottom])
+        bottom = _strip(rows)
+        faces = np.concatenate([outer_faces, inner_faces[:, ::-1], bottom])
+        vertices = np.concatenate([outer, inner])
+        if keycap.key_rotation and any(keycap.key_rotation):
+            vertices = vertices @ rotation_matrix(keycap.key_rotation).T
+        mesh = weld(vertices, faces)
+        if not mesh.is_watertight():
+            raise BodyException(f"{keycap.name}: generated a leaky mesh")
+        return mesh
+
+def body_file(keycap, out):
+    """
+    Where the body of *keycap* goes (`<out>/<name>_body.<file_type>`).
+    """
+    return Path(out) / f"{keycap.name}_body.{keycap.file_type}"
+
+def generate(keycap, out, max_error=DEFAULT_MAX_ERROR):
+    """
+    Writes the body of *keycap* to `body_file()` and returns `(path, mesh,
+    seconds)`.
+    """
+    start = time.perf_counter()
+    mesh = Body(keycap, max_error=max_error).mesh()
+    elapsed = time.perf_counter() - start
+    path = body_file(keycap, out)
+    save_mesh(mesh, path, name=keycap.name)
+    return path, mesh, elapsed
+
+def compare(mesh, reference):
+    """
+    Compares *mesh* (a generated body) to *reference* (the same body from
+    OpenSCAD).  Returns a list of problems (empty if they agree).
+    """
+    problems = []
+    for label, ours, theirs in zip(
+            ("min", "max"), mesh.bounds(), reference.bounds()):
+        off = np.abs(ours - theirs)
+        if np.any(off > COMPARE_TOLERANCE):
+            problems.append(
+                f"Bounding box {label} is off by "
+                + "/".join(f"{v:.3f}" for v in off) + "mm (X/Y/Z)")
+    volume, expected = float(mesh.volume()), float(reference.volume())
+    if abs(volume - expected) > abs(expected)*VOLUME_TOLERANCE:
+        problems.append(
+            f"Volume is {volume:.1f}mm³ (OpenSCAD: {expected:.1f}mm³)")
+    return problems
+
+def reference_job(keycap, out):
+    """
+    Returns a new keycap (*keycap* is left alone) that renders just the body
+    (no legends, no stem) with OpenSCAD into the reference directory under
+    *out*.
+    """
+    spec = JobSpec.from_keycap(keycap, output_path=Path(out) / REFERENCE_DIR)
+    return spec.with_params(render=["keycap"], legends=[""]).keycap()
+
+async def render_references(keycaps, out, max_runners):
+    # Imported here so generating bodies doesn't need anything OpenSCAD related
+    from engine import RenderEngine
+    engine = RenderEngine(max_runners=max_runners, validate=False)
+    semaphore = asyncio.Semaphore(max_runners)
+
+    async def render(job):
+        async with semaphore:
+            return await engine.render(job)
+
+    jobs = [reference_job(keycap, out) for keycap in keycaps]
+    Path(out, REFERENCE_DIR).mkdir(parents=True, exist_ok=True)
+    results = await asyncio.gather(*[
+        render(job) for job in jobs if not job.output_file.exists()])
+    return {result.keycap.name: result for result in results}
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Generate keycap bodies (no legends/stems) without "
+                    "OpenSCAD.")
+    parser.add_argument('--out',
+        metavar='<filepath>', type=str, default=".",
+        help='Where the generated files will go.')
+    parser.add_argument('--max-error',
+        metavar='<mm>', type=float, default=DEFAULT_MAX_ERROR,
+        help=f"Maximum chord error of the dish in mm (default: "
+             f"{DEFAULT_MAX_ERROR}).")
+    parser.add_argument('--compare',
+        required=False, action='store_true',
+        help="Also render the bodies with OpenSCAD and check that they match.")
+    parser.add_argument('--jobs',
+        metavar='<n>', type=int, default=4,
+        help='How many OpenSCAD processes to run at once for --compare.')
+    parser.add_argument('module',
+        metavar="module",
+        help="The keyset script (e.g. riskeycap_full).")
+    parser.add_argument('names',
+        nargs='*', metavar="name",
+        help="Only generate the bodies of these keycaps (default: all the "
+             "blanks).")
+    args = parser.parse_args()
+    keycaps = importlib.import_module(args.module).KEYCAPS
+    if args.names:
+        lowered = [name.lower() for name in args.names]
+        keycaps = [k for k in keycaps if k.name.lower() in lowered]
+    else:
+        keycaps = [k for k in keycaps if not any(k.legends)]
+    if not keycaps:
+        print("No keycaps to generate")
+        sys.exit(1)
+    Path(args.out).mkdir(parents=True, exist_ok=True)
+    generated = {}
+    failed = 0
+    for keycap in keycaps:
+        if keycap.name in generated:
+            continue # Duplicate name (e.g. the two "Z"s in some keysets)
+        try:
+            path, mesh, elapsed = generate(keycap, args.out, args.max_error)
+        except BodyException as e: # Leave it to OpenSCAD
+            print(Style.BRIGHT + f"Skipped {keycap.name}: {e}" + Style.RESET_ALL)
+            continue
+        generated[keycap.name] = (keycap, mesh)
+        print(f"{path}: {len(mesh)} triangles, {float(mesh.volume()):.1f}mm³ "
+              f"in {elapsed*1000:.1f}ms")
+    if args.compare and generated:
+        print(Style.BRIGHT + "Rendering the OpenSCAD references..."
+              + Style.RESET_ALL, flush=True)
+        results = asyncio.run(render_references(
+            [keycap for keycap, _ in generated.values()], args.out, args.jobs))
+        for name, (keycap, mesh) in generated.items():
+            result = results.get(name)
+            if result is not None and not result.ok:
+                failed += 1
+                print(Style.BRIGHT + f"{name}: OpenSCAD failed"
+                      + Style.RESET_ALL)
+                continue
+            try:
+                reference = load_mesh(
+                    reference_job(keycap, args.out).output_file)
+            except (MeshException, OSError) as e:
+                failed += 1
+                print(Style.BRIGHT + f"{name}: could not load the reference: "
+                      f"{e}" + Style.RESET_ALL)
+                continue
+            problems = compare(mesh, reference)
+            if problems:
+                failed += 1
+                print(Style.BRIGHT + f"{name}: doesn't match OpenSCAD"
+                      + Style.RESET_ALL)
+                for problem in problems:
+                    print(f"    {problem}")
+            else:
+                print(f"{name}: matches OpenSCAD")
+    if failed:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,420 @@
+#!/usr/bin/env python3
+
+"""
+The command line interface shared by all the whole-keyboard scripts
+(`riskeycap_full.py`, `gem_full.py`, `riskeyboard_70.py`, etc).  Each of those
+scripts just defines a list of `Keycap` objects and hands it off to `main()`::
+
+    if __name__ == "__main__":
+        main(KEYCAPS, description="Render a full set of GEM keycaps.")
+
+Rendering is crash-safe and resumable: every keycap is rendered to a temporary
+file that only gets renamed into place when OpenSCAD finishes successfully and
+the results are recorded in a build journal (see `journal.py`) in the output
+directory.  So if a build gets interrupted just run the same command again and
+it'll continue exactly where it left off.  Rendering itself is handled by
+`engine.py` which streams OpenSCAD's output as it happens and cleans up after
+itself when you hit Ctrl-C.
+
+Not sure how long a build is going to take?  Add `--plan` to see what would
+get rendered along with time/memory estimates (see `planner.py`) without
+actually rendering anything.
+
+Before anything gets rendered every font the keycaps use is checked (is it
+installed?  does it have all the legend characters?) and the build stops if
+any are missing since OpenSCAD would just quietly use some other font.  Then
+every keycap's legends are checked against the top of the keycap (see
+`legends.py`) and any that won't fit get flagged along with a suggested
+size/offset that will.  Lastly every job gets evaluated (not rendered) by
+OpenSCAD to catch parameter mistakes like an unknown `key_profile` in a few
+seconds (see `preflight.py`); jobs that fail that get skipped.
+
+To let Ninja drive the build instead use `--ninja` (see `buildgraph.py`).  To
+split a build across machines use `--shard i/N` (see `sharding.py`).  With
+`--cache` renders are shared with other build directories (and people) via a
+shared directory or HTTP cache (see `artifactcache.py`).  With `--max-error`
+each keycap's `dish_fn`/`dish_corner_fn`/`polygon_layers`/`$fn` get worked out
+from a maximum chord error (see `tessellation.py`).
+"""
+
+# stdlib imports
+import os, sys
+import argparse
+import asyncio
+# 3rd party stuff
+from colorama import Style
+from colorama import init as color_init
+color_init()
+# Our own stuff
+from journal import BuildJournal
+from engine import RenderEngine, MAX_RUNNERS
+from costmodel import CostModel
+from planner import plan, print_plan, job_status
+from preflight import preflight, print_preflight
+from csgtree import cached_stats
+from buildgraph import write_ninja
+from artifactcache import (
+    open_cache, cache_key, parse_size, CacheException)
+from sharding import (
+    parse_shard, select_shard, write_manifest, manifest_name, ShardException)
+from tessellation import apply_tessellation
+from jobspec import JobSpec, legends_spec
+
+def print_keycaps(keycaps):
+    """
+    Prints the names of all the given *keycaps*.
+    """
+    print(Style.BRIGHT +
+          f"Here's all the keycaps we can render:\n" + Style.RESET_ALL)
+    keycap_names = ", ".join(a.name for a in keycaps)
+    print(f"{keycap_names}")
+
+def select_specs(keycaps, out, names=None, legends=False):
+    """
+    Returns the `JobSpec` of every keycap that needs rendering into *out*
+    (including legends-only jobs if *legends* is `True`).  If *names* is given
+    only keycaps with those names (case insensitive) will be included.
+    *keycaps* are left untouched.
+    """
+    specs = []
+    if names:
+        lowered = [name.lower() for name in names]
+        selected = [k for k in keycaps if k.name.lower() in lowered]
+        found = {k.name.lower() for k in selected}
+        for name in names:
+            if name.lower() not in found:
+                print(f"Cound not find a keycap named {name}")
+    else:
+        selected = keycaps
+    seen = set()
+    for keycap in selected:
+        if keycap.name in seen:
+            # Two jobs writing the same file at the same time would clobber
+            # each other (e.g. the duplicate "Z" in some of the keysets)
+            continue
+        seen.add(keycap.name)
+        specs.append(JobSpec.from_keycap(keycap, output_path=out))
+    if legends:
+        for spec in list(specs):
+            if spec.param("legends") == ("",):
+                continue # No actual legends
+            specs.append(legends_spec(spec))
+    return specs
+
+def select_jobs(keycaps, out, names=None, legends=False):
+    """
+    Same as `select_specs()` but returns a fresh `Keycap` for each job (so
+    they can be changed without affecting *keycaps*).
+    """
+    return [spec.keycap()
+        for spec in select_specs(keycaps, out, names=names, legends=legends)]
+
+def print_problems(results):
+    """
+    Prints a summary of all the keycaps that failed or had suspicious output
+    (missing fonts, CGAL errors, etc) in *results* (`RenderResult` list).
+    """
+    for result in results:
+        if result.ok and not result.problems:
+            continue
+        name = result.keycap.name
+        if result.cancelled:
+            status = "cancelled"
+        elif result.validation and not result.validation.ok:
+            status = "failed validation"
+        elif result.retcode:
+            status = f"failed (exit code {result.retcode})"
+        else:
+            status = "rendered with warnings"
+        print(Style.BRIGHT + f"{name}: {status}" + Style.RESET_ALL)
+        for category, line in result.problems:
+            print(f"    [{category}] {line}")
+
+def print_font_problems(jobs):
+    """
+    Checks the fonts used by all *jobs* (see `legends.font_preflight()`) and
+    prints any problems.  Returns the names of the keycaps with problems.
+    """
+    from legends import font_preflight
+    from fonts import require_fonttools, FontException
+    try:
+        require_fonttools()
+    except FontException:
+        print(Style.BRIGHT + "NumPy/fontTools aren't installed; skipping "
+              "font checks" + Style.RESET_ALL)
+        return []
+    flagged = font_preflight(
+        [k for k in jobs if list(k.render) != ["legends"]])
+    for name, problems in flagged.items():
+        print(Style.BRIGHT + f"{name}: font problems" + Style.RESET_ALL)
+        for problem in problems:
+            print(f"    {problem}")
+    return list(flagged)
+
+def print_legend_problems(jobs):
+    """
+    Checks that the legends of all *jobs* fit on their keycaps (see
+    `legends.py`) and prints any that don't.  Returns the names of the
+    keycaps with problems.
+    """
+    from legends import legend_problems
+    from fonts import require_fonttools, FontException
+    try:
+        require_fonttools()
+    except FontException:
+        print(Style.BRIGHT + "NumPy/fontTools aren't installed; skipping "
+              "legend checks" + Style.RESET_ALL)
+        return []
+    flagged = []
+    for keycap in jobs:
+        if list(keycap.render) == ["legends"]:
+            continue # Same legends as the keycap itself
+        problems = legend_problems(keycap)
+        if not problems:
+            continue
+        flagged.append(keycap.name)
+        print(Style.BRIGHT + f"{keycap.name}: legends don't fit"
+              + Style.RESET_ALL)
+        for problem in problems:
+            print(f"    {problem}")
+    return flagged
+
+def fetch_from_cache(jobs, cache, journal):
+    """
+    Copies every job in *jobs* that's in *cache* (see `artifactcache.py`)
+    into place (recording it in *journal*).  Returns the jobs that still need
+    rendering.
+    """
+    remaining = []
+    for keycap in jobs:
+        entry = cache.fetch(cache_key(keycap), keycap.output_file)
+        if entry is None:
+            remaining.append(keycap)
+            continue
+        journal.finish(keycap, entry.get("duration", 0.0),
+            entry.get("peak_memory_mb"), validation=entry.get("validation"))
+        print(Style.BRIGHT + f"{keycap.output_file}: copied from the cache"
+              + Style.RESET_ALL)
+    return remaining
+
+def cache_publisher(cache):
+    """
+    Returns an `on_result` callback for `RenderEngine.run()` that stores
+    every successful render in *cache*.
+    """
+    def publish(result):
+        if not result.ok:
+            return
+        keycap = result.keycap
+        try:
+            cache.publish(cache_key(keycap), keycap.output_file, {
+                "name": keycap.name,
+                "duration": round(result.duration, 3),
+                "peak_memory_mb": result.peak_memory_mb,
+                "validation": result.validation.stats
+                    if result.validation else None,
+            })
+        except (CacheException, OSError) as e:
+            print(Style.BRIGHT + f"Could not store {keycap.name} in the "
+                  f"cache: {e}" + Style.RESET_ALL)
+    return publish
+
+def main(keycaps, description="Render a full set of keycaps."):
+    """
+    Parses the command line and renders *keycaps* accordingly.
+    """
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument('--out',
+        metavar='<filepath>', type=str, default=".",
+        help='Where the generated files will go.')
+    parser.add_argument('--force',
+        required=False, action='store_true',
+        help='Forcibly re-render keycaps even if they already exist.')
+    parser.add_argument('--legends',
+        required=False, action='store_true',
+        help='If True, generate a separate set of stl files for legends.')
+    parser.add_argument('--keycaps',
+        required=False, action='store_true',
+        help='If True, prints out the names of all keycaps we can render.')
+    parser.add_argument('--jobs',
+        metavar='<n>', type=int, default=MAX_RUNNERS,
+        help=f'How many OpenSCAD processes to run at once (default: {MAX_RUNNERS}).')
+    parser.add_argument('--quiet',
+        required=False, action='store_true',
+        help="Only show OpenSCAD output that looks like a problem (warnings, "
+             "errors, missing fonts, etc).")
+    parser.add_argument('--no-validate',
+        required=False, action='store_true',
+        help="Don't check rendered keycaps for problems (non-manifold, wrong "
+             "size, floating stems, etc; see validate.py).")
+    parser.add_argument('--no-legend-check',
+        required=False, action='store_true',
+        help="Don't check fonts or that legends fit on their keycaps before "
+             "rendering (see legends.py).")
+    parser.add_argument('--skip-bad-fonts',
+        required=False, action='store_true',
+        help="Skip keycaps with missing fonts/glyphs (and render the rest) "
+             "instead of stopping.")
+    parser.add_argument('--no-preflight',
+        required=False, action='store_true',
+        help="Don't check keycaps for parameter mistakes by evaluating them in "
+             "OpenSCAD before rendering (see preflight.py).")
+    parser.add_argument('--plan',
+        required=False, action='store_true',
+        help="Don't render anything; just print what would be rendered along "
+             "with time and memory estimates.")
+    parser.add_argument('--cache',
+        metavar='<dir|url>', type=str,
+        default=os.environ.get("KEYCAP_CACHE"),
+        help="Shared render cache (a directory or http:// URL; see "
+             "artifactcache.py).  Defaults to $KEYCAP_CACHE.")
+    parser.add_argument('--cache-size',
+        metavar='<size>', type=str, default=None,
+        help="Size cap for a --cache directory (e.g. 20G); least recently "
+             "used files get evicted beyond it.")
+    parser.add_argument('--shard',
+        metavar='<i/N>', type=str, default=None,
+        help="Only render shard i of N (e.g. 2/4; cost-balanced and the same "
+             "on every machine) and write a shard manifest (see sharding.py).")
+    parser.add_argument('--ninja',
+        required=False, action='store_true',
+        help="Don't render anything; write a build.ninja (in --out) that "
+             "renders everything with Ninja instead (see buildgraph.py).")
+    parser.add_argument('--formats',
+        metavar='<ext,...>', type=str, default=None,
+        help="With --ninja: make a target for each of these formats (e.g. "
+             "3mf,stl) instead of just each keycap's own file_type.")
+    parser.add_argument('--split',
+        required=False, action='store_true',
+        help="Render each keycap's body and stem (etc) as separate jobs at the "
+             "same time and merge them afterwards (as separate, overlapping "
+             "shells; see engine.py).  With --ninja: make them separate "
+             "targets.")
+    parser.add_argument('--max-error',
+        metavar='<mm>', type=float, default=None,
+        help="Work out dish_fn/dish_corner_fn/polygon_layers/$fn for each "
+             "keycap from this maximum chord error (e.g. 0.02; see "
+             "tessellation.py) instead of using the fixed values.")
+    parser.add_argument('names',
+        nargs='*', metavar="name",
+        help='Optional name of specific keycap you wish to render')
+    args = parser.parse_args()
+    if len(sys.argv) == 1:
+        parser.print_help()
+        print("")
+        print_keycaps(keycaps)
+        sys.exit(1)
+    if args.keycaps:
+        print_keycaps(keycaps)
+        sys.exit(1)
+    if not os.path.exists(args.out):
+        print(Style.BRIGHT +
+              f"Output path, '{args.out}' does not exist; making it..."
+              + Style.RESET_ALL)
+        os.mkdir(args.out)
+    print(Style.BRIGHT + f"Outputting to: {args.out}" + Style.RESET_ALL)
+    journal = BuildJournal(args.out)
+    selected = select_jobs(keycaps, args.out,
+        names=args.names, legends=args.legends)
+    if args.max_error:
+        changed = apply_tessellation(selected, args.max_error)
+        print(Style.BRIGHT + f"Adaptive tessellation ({args.max_error}mm): "
+              f"adjusted {len(changed)} of {len(selected)} job(s)"
+              + Style.RESET_ALL)
+    all_jobs = selected
+    if args.shard:
+        try:
+            shard = parse_shard(args.shard)
+        except ShardException as e:
+            parser.error(str(e))
+        selected = select_shard(all_jobs, *shard)
+        print(Style.BRIGHT + f"Shard {shard[0]}/{shard[1]}: {len(selected)} "
+              f"of {len(all_jobs)} job(s)" + Style.RESET_ALL)
+    if args.ninja:
+        formats = args.formats.split(",") if args.formats else None
+        path = write_ninja(selected, args.out, formats=formats,
+            split=args.split, max_runners=args.jobs)
+        print(f"Wrote {path}; run `ninja -C {args.out}` to render")
+        sys.exit(0)
+    if not args.no_legend_check:
+        bad_fonts = print_font_problems(selected)
+        if bad_fonts and not args.skip_bad_fonts and not args.plan:
+            print(Style.BRIGHT +
+                f"{len(bad_fonts)} keycap(s) have font problems; install the "
+                f"fonts or use --skip-bad-fonts to render everything else"
+                + Style.RESET_ALL)
+            sys.exit(1)
+        if bad_fonts and args.skip_bad_fonts:
+            # Legends-only jobs have the same name + "_legends"
+            skipped = set(bad_fonts) | {f"{n}_legends" for n in bad_fonts}
+            selected = [k for k in selected if k.name not in skipped]
+        print_legend_problems(selected)
+    cache = None
+    if args.cache:
+        try:
+            cache = open_cache(args.cache, max_bytes=
+                parse_size(args.cache_size) if args.cache_size else None)
+        except CacheException as e:
+            print(Style.BRIGHT + f"Not using the cache: {e}" + Style.RESET_ALL)
+    if args.plan:
+        if not args.no_preflight:
+            # The CSG stats preflighting leaves behind make for better
+            # estimates of keycaps that have never been rendered (no point
+            # for the ones that won't get rendered at all):
+            missing = [
+                k for k in selected if cached_stats(k) is None
+                and job_status(k, journal, cache, args.force) == "render"]
+            if missing:
+                print(Style.BRIGHT + f"Preflighting {len(missing)} job(s)..."
+                      + Style.RESET_ALL, flush=True)
+                print_preflight(preflight(missing, max_runners=args.jobs))
+        model = CostModel().calibrate(journal)
+        planned = plan(selected, journal, force=args.force, model=model,
+            cache=cache, split=args.split)
+        print_plan(planned, args.jobs, model=model)
+        sys.exit(0)
+    jobs = []
+    for keycap in selected:
+        if not args.force and journal.is_done(keycap):
+            print(Style.BRIGHT +
+                f"{keycap.output_file} exists; skipping..."
+                + Style.RESET_ALL)
+            continue
+        jobs.append(keycap)
+    if cache and jobs:
+        before = len(jobs)
+        jobs = fetch_from_cache(jobs, cache, journal)
+        print(Style.BRIGHT + f"Cache ({cache}): {before - len(jobs)} hit(s), "
+              f"{len(jobs)} miss(es)" + Style.RESET_ALL)
+    rejected = []
+    if jobs and not args.no_preflight:
+        print(Style.BRIGHT + f"Preflighting {len(jobs)} job(s)..."
+              + Style.RESET_ALL, flush=True)
+        rejected = print_preflight(preflight(jobs, max_runners=args.jobs))
+        jobs = [k for k in jobs if k.name not in rejected]
+    engine = RenderEngine(max_runners=args.jobs, journal=journal,
+        quiet=args.quiet, validate=not args.no_validate,
+        split=args.split)
+    if not args.no_validate and not engine.validate:
+        print(Style.BRIGHT + "NumPy isn't installed; skipping validation"
+              + Style.RESET_ALL)
+    results = asyncio.run(engine.run(jobs,
+        on_result=cache_publisher(cache) if cache else None))
+    print_problems(results)
+    if engine.cancelled:
+        sys.exit(130)
+    if args.shard:
+        path = os.path.join(args.out, manifest_name(*shard))
+        write_manifest(path, *shard, all_jobs, selected, journal=journal)
+        print(Style.BRIGHT + f"Wrote shard manifest {path}" + Style.RESET_ALL)
+    failed = [result for result in results if not result.ok]
+    if failed:
+        print(Style.BRIGHT +
+            f"{len(failed)} keycap(s) failed to render: "
+            + ", ".join(r.keycap.name for r in failed) + Style.RESET_ALL)
+    if rejected:
+        print(Style.BRIGHT +
+            f"{len(rejected)} keycap(s) failed preflight (not rendered): "
+            + ", ".join(rejected) + Style.RESET_ALL)
+    if failed or rejected:
+        sys.exit(1)
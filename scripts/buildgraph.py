@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+
+"""
+Exports a keyset build as a Ninja build file so Ninja's scheduler (and its
+dependency tracking) can take care of incremental, parallel rebuilds and so
+it can be hooked into other build tooling.  Every keyset script can write one
+via `build.py`::
+
+    $ ./scripts/riskeyboard_70.py --out /tmp/output_dir --legends --ninja
+    $ ninja -C /tmp/output_dir             # Render everything
+    $ ninja -C /tmp/output_dir tilde       # Just the tilde keycap (+legends)
+
+Each artifact (keycap, legends, and with `--split` the body and stem
+separately; once per `--formats` format) is its own target.  Its inputs are
+its parameter file (the `-D` definitions, in `.params/` next to the outputs)
+and all the `.scad` files so changing one keycap's parameters only re-renders
+that keycap while changing the `.scad` files re-renders everything.
+Parameter files only get rewritten when they change and `build.ninja`
+regenerates itself whenever the keyset scripts change.  Outputs are written
+to a temporary file and renamed into place (like `engine.py` does) so a
+failed or interrupted render never leaves a truncated file behind.
+"""
+
+# stdlib imports
+import os
+import sys
+import shlex
+from pathlib import Path
+# Our own stuff
+from journal import partial_output_file
+from jobspec import JobSpec, artifact_specs
+
+NINJA_FILE = "build.ninja"
+PARAMS_DIR = ".params"
+
+def ninja_escape(text):
+    """
+    Escapes *text* for use in a Ninja variable value.
+    """
+    return text.replace("$", "$$")
+
+def ninja_path(path):
+    """
+    Escapes *path* for use in a Ninja `build` line.
+    """
+    return ninja_escape(str(path)).replace(" ", "$ ").replace(":", "$:")
+
+def artifact_jobs(keycap, formats=None, split=False):
+    """
+    Returns the jobs (keycap copies) for each artifact of *keycap*: one per
+    format in *formats* (defaults to the keycap's own `file_type`) and, if
+    *split* is `True`, one per render target (so the body and stem become
+    separate targets).
+    """
+    spec = JobSpec.from_keycap(keycap)
+    targets = [spec.render]
+    if split and len(spec.render) > 1:
+        targets = None # One per target
+    return [job.keycap()
+        for job in artifact_specs(spec, targets=targets, formats=formats)]
+
+def write_if_changed(path, content):
+    """
+    Writes *content* to *path* unless it already has exactly that content (so
+    its mtime only changes when it really changed).  Returns `True` if it was
+    written.
+    """
+    path = Path(path)
+    try:
+        if path.read_text() == content:
+            return False
+    except OSError:
+        pass
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temp = path.with_name(f"{path.name}.tmp")
+    temp.write_text(content)
+    os.replace(temp, path)
+    return True
+
+def render_command(job, params_file):
+    """
+    Returns the shell command (already escaped for Ninja) that renders *job*
+    atomically using the definitions in *params_file*.  Runs from the output
+    directory with whatever `Keycap.environment()` adds (e.g. openscad's
+    directory in `$PATH` for colorscad.sh).
+    """
+    playground = Path(job.keycap_playground_path).resolve()
+    job = JobSpec.from_keycap(job).with_params(
+        keycap_playground_path=playground).keycap()
+    output = Path(job.output_file.name)
+    partial = partial_output_file(output)
+    definitions = job.definitions()
+    args = [
+        f'"$(cat {shlex.quote(str(params_file))})"' if arg == definitions
+        else shlex.quote(arg)
+        for arg in job.args(output_file=partial)]
+    env = job.environment()
+    exports = [
+        f"{var}={shlex.quote(value)}" for var, value in sorted(env.items())
+        if os.environ.get(var) != value]
+    command = (f"{' '.join(exports + args)} && "
+               f"mv -f {shlex.quote(str(partial))} {shlex.quote(str(output))}")
+    return ninja_escape(command)
+
+def scad_sources(keycap_playground_path):
+    """
+    Returns all the `.scad` files *keycap_playground_path* could depend on.
+    """
+    directory = Path(keycap_playground_path).resolve().parent
+    return sorted(directory.glob("*.scad"))
+
+def write_ninja(keycaps, out, formats=None, split=False,
+        max_runners=None, generator=None):
+    """
+    Writes `build.ninja` (and the parameter files) for *keycaps* (jobs from
+    `build.select_jobs()`) into the *out* directory.  *max_runners* limits how
+    many OpenSCAD processes Ninja runs at once (regardless of `-j`).
+    *generator* is the command line (list) that regenerates the file (defaults
+    to how we were run).  Returns the path to `build.ninja`.
+    """
+    out = Path(out)
+    if generator is None:
+        generator = [sys.executable, *sys.argv]
+    lines = [
+        "# Generated by build.py --ninja; don't edit (it gets regenerated)",
+        "ninja_required_version = 1.7",
+        "",
+    ]
+    if max_runners:
+        lines += ["pool openscad", f"  depth = {max_runners}", ""]
+    lines += [
+        "rule openscad",
+        "  command = $cmd",
+        "  description = Rendering $out",
+        "  restat = 1",
+    ]
+    if max_runners:
+        lines.append("  pool = openscad")
+    lines += [
+        "",
+        "rule regenerate",
+        "  command = cd "
+            + ninja_escape(shlex.quote(os.getcwd())) + " && "
+            + ninja_escape(" ".join(shlex.quote(arg) for arg in generator)),
+        "  description = Regenerating $out",
+        "  generator = 1",
+        "  restat = 1",
+        "",
+    ]
+    sources = set()
+    params_files = []
+    by_keycap = {} # Phony target name -> outputs
+    builds = []
+    for keycap in keycaps:
+        sources.update(scad_sources(keycap.keycap_playground_path))
+        # Legends-only jobs go under the same phony target as their keycap:
+        name = keycap.name
+        if list(keycap.render) == ["legends"] and name.endswith("_legends"):
+            name = name[:-len("_legends")]
+        for job in artifact_jobs(keycap, formats=formats, split=split):
+            output = job.output_file.name
+            params_file = Path(PARAMS_DIR) / f"{output}.params"
+            write_if_changed(out / params_file, job.definitions())
+            params_files.append(params_file)
+            by_keycap.setdefault(name, []).append(output)
+            builds.append((output, params_file, render_command(job, params_file)))
+    implicit = " ".join(ninja_path(source) for source in sorted(sources))
+    for output, params_file, command in builds:
+        lines += [
+            f"build {ninja_path(output)}: openscad {ninja_path(params_file)}"
+            f" | {implicit}",
+            f"  cmd = {command}",
+        ]
+    lines.append("")
+    for name, outputs in by_keycap.items():
+        if name in outputs:
+            continue # Would be a cycle (no extension)
+        lines.append(f"build {ninja_path(name)}: phony "
+                     + " ".join(ninja_path(o) for o in outputs))
+    scripts = [Path(arg).resolve() for arg in generator[1:2] if arg.endswith(".py")]
+    scripts += sorted(Path(__file__).resolve().parent.glob("*.py"))
+    lines += [
+        "",
+        f"build {NINJA_FILE} | "
+            + " ".join(ninja_path(p) for p in params_files)
+            + ": regenerate | "
+            + " ".join(ninja_path(s) for s in dict.fromkeys(scripts)),
+        "",
+        "default " + " ".join(ninja_path(o) for o, _, _ in builds),
+        "",
+    ]
+    path = out / NINJA_FILE
+    write_if_changed(path, "\n".join(lines))
+    return path
@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+
+"""
+A (very) simple model of how long a keycap will take to render and how much
+memory OpenSCAD will need to do it.  It works in "cost units" where a plain
+1U keycap+stem with the default settings (`dish_fn=256`, `polygon_layers=10`,
+one legend) is roughly 1.0.  The units are converted into seconds and
+megabytes using coefficients that get calibrated against the durations and
+peak memory recorded in build journals (see `journal.py`).  If there's no
+history to go on we fall back to some conservative defaults.
+
+Keycaps that have been through `preflight.py` also have their CSG tree stats
+(see `csgtree.py`) recorded.  Those describe the actual work (facets going
+into hulls/booleans, text, etc) rather than the parameters so once enough
+jobs with them have been rendered render times get estimated from those
+instead (`CostModel.source()` says which one was used).
+"""
+
+# stdlib imports
+import math
+# 3rd party stuff
+try:
+    import numpy as np
+except ImportError: # Only needed to fit every CSG weight separately
+    np = None
+# Our own stuff
+from csgtree import cached_stats
+
+# Defaults used when there's no history to calibrate against (measured on a
+# mid-range desktop with OpenSCAD 2022.12 + fast-csg):
+DEFAULT_SECONDS_PER_UNIT = 90.0
+DEFAULT_BASE_MEMORY_MB = 250.0
+DEFAULT_MEMORY_MB_PER_UNIT = 350.0
+
+# These are used to normalize things so that a default 1U keycap is ~1 unit
+_REFERENCE_AREA = 18.25 * 18.25
+_REFERENCE_DISH = 256
+_REFERENCE_LAYERS = 10
+_REFERENCE_CORNER_FN = 64
+
+# Rough relative cost of each CSG stat (see `csgtree.CsgStats`) per unit.
+# These only matter until there's enough history to fit them separately:
+CSG_WEIGHTS = {
+    "boolean_facets": 1/20000,
+    "hull_facets": 1/80000,
+    "minkowski_facets": 1/2000000,
+    "text_chars": 1/20,
+    "facets": 1/200000,
+}
+# How many rendered jobs with CSG stats we need before using them at all
+MIN_CSG_SAMPLES = 3
+
+def features(keycap):
+    """
+    Returns a dict of the (numeric) parameters of *keycap* that have the
+    biggest impact on how long it takes to render.  This gets stored in the
+    build journal along with how long the render actually took.
+    """
+    legends = [legend for legend in keycap.legends if legend]
+    render = list(keycap.render)
+    stats = cached_stats(keycap)
+    return {
+        "area": round(keycap.key_length * keycap.key_width, 3),
+        "dish_fn": keycap.dish_fn,
+        "dish_corner_fn": keycap.dish_corner_fn,
+        "dish_type": keycap.dish_type,
+        "dish_invert": bool(keycap.dish_invert),
+        "polygon_layers": keycap.polygon_layers,
+        "uniform_wall_thickness": bool(keycap.uniform_wall_thickness),
+        "legends": len(legends),
+        "legend_carved": bool(keycap.legend_carved),
+        "stems": len(keycap.stem_locations),
+        "render": render,
+        "csg": stats.as_dict() if stats else None,
+    }
+
+def loft_facets(polygon_layers, dish_corner_fn):
+    """
+    Returns how many facets the body's polyhedron has (see `loft()` in
+    utils.scad): two triangles per outline point between each pair of
+    layers plus the top and bottom.  Outlines have four rounded corners of
+    `ceil(dish_corner_fn/4)+1` points each.
+    """
+    points = 4 * (math.ceil(dish_corner_fn / 4) + 1)
+    return 2 * polygon_layers * points + 2
+
+def cost_units(feats):
+    """
+    Turns a *feats* dict (from `features()`) into a single "cost units" number.
+    """
+    render = feats["render"]
+    size = math.sqrt(feats["area"] / _REFERENCE_AREA)
+    layers, corner_fn = feats["polygon_layers"], feats["dish_corner_fn"]
+    # The body is a single polyhedron lofted through the layer outlines so it
+    # costs whatever its facets cost in the booleans it goes through:
+    body = loft_facets(layers, corner_fn) / loft_facets(
+        _REFERENCE_LAYERS, _REFERENCE_CORNER_FN)
+    if feats["uniform_wall_thickness"]:
+        body *= 2 # The interior is another whole _poly_keycap()
+    # Dish resolution matters a lot more with spheres (fn^2 facets)
+    dish_ratio = feats["dish_fn"] / _REFERENCE_DISH
+    if feats["dish_invert"]:
+        # Inverted dishes are still one hull() of polygon_layers rounded
+        # slices (dish_corner_fn; dish_fn doesn't matter) union()'d onto the
+        # body:
+        dish = 0.2 * layers * corner_fn / (
+            _REFERENCE_LAYERS * _REFERENCE_CORNER_FN)
+    elif feats["dish_type"] == "sphere":
+        dish = dish_ratio ** 2
+    else:
+        dish = dish_ratio
+    # The body's weight used to be 0.35 when it was polygon_layers hull()s
+    # (~4 facets per outline point each) union()'d together.  By
+    # `CSG_WEIGHTS` that's 2720 facets in hulls plus the same in booleans for
+    # the reference keycap (0.17 units) vs 1362 facets in booleans (0.07) for
+    # the loft, so 0.35 * 0.07/0.17:
+    keycap = (0.25 + 0.14 * body + 0.4 * dish) * size
+    # Each legend gets intersection()'d with the band of the top under its
+    # footprint (carved legends get a second one for the dish underneath)
+    legend = 0.3 * keycap * (2 if feats["legend_carved"] else 1)
+    units = 0.0
+    if "keycap" in render or "%keycap" in render:
+        units += keycap + legend * feats["legends"]
+    if "stem" in render:
+        # Stems need the keycap's shape too (for the top and interior walls)
+        units += 0.35 * keycap + 0.1 * feats["stems"]
+    if "legends" in render:
+        units += legend * max(feats["legends"], 1)
+    if "underset_mask" in render:
+        units += 0.35 * keycap + legend * feats["legends"]
+    return max(units, 0.05)
+
+def csg_vector(csg):
+    """
+    Returns the stats in *csg* (a `CsgStats.as_dict()`) that `CSG_WEIGHTS`
+    applies to as a list (same order).
+    """
+    return [csg.get(name, 0) for name in CSG_WEIGHTS]
+
+def csg_units(csg):
+    """
+    Turns *csg* stats (from `csgtree.CsgStats.as_dict()`) into cost units
+    using the default `CSG_WEIGHTS`.
+    """
+    return max(sum(
+        w*x for w, x in zip(CSG_WEIGHTS.values(), csg_vector(csg))), 0.05)
+
+class CostModel(object):
+    """
+    Estimates render time (seconds) and peak memory (MB) for keycaps.  Call
+    `calibrate()` with some build journals to make the estimates match reality
+    on the machine that did the rendering.
+    """
+    def __init__(self):
+        self.seconds_per_unit = DEFAULT_SECONDS_PER_UNIT
+        self.base_memory_mb = DEFAULT_BASE_MEMORY_MB
+        self.memory_mb_per_unit = DEFAULT_MEMORY_MB_PER_UNIT
+        self.samples = 0
+        # Seconds per unit of each CSG stat (`None` until calibrated):
+        self.csg_seconds = None
+        self.csg_samples = 0
+
+    def calibrate(self, *journals):
+        """
+        Fits the model's coefficients to the jobs recorded in *journals*
+        (`BuildJournal` instances).  Only successfully-completed jobs with
+        recorded features are used.
+        """
+        times = []
+        memories = []
+        csg_times = []
+        for journal in journals:
+            for entry in journal.entries.values():
+                if entry.get("status") != "done" or "features" not in entry:
+                    continue
+                units = cost_units(entry["features"])
+                times.append((units, entry["duration"]))
+                if entry["features"].get("csg"):
+                    csg_times.append(
+                        (entry["features"]["csg"], entry["duration"]))
+                if entry.get("peak_memory_mb"):
+                    memories.append((units, entry["peak_memory_mb"]))
+        self.samples = len(times)
+        if times:
+            # Least squares through the origin: t = k * units
+            self.seconds_per_unit = (
+                sum(u * t for u, t in times) / sum(u * u for u, t in times))
+        if len(memories) > 1:
+            # Ordinary least squares: mem = base + k * units
+            n = len(memories)
+            mean_u = sum(u for u, m in memories) / n
+            mean_m = sum(m for u, m in memories) / n
+            var_u = sum((u - mean_u) ** 2 for u, m in memories)
+            if var_u > 0:
+                slope = sum(
+                    (u - mean_u) * (m - mean_m) for u, m in memories) / var_u
+                if slope > 0:
+                    self.memory_mb_per_unit = slope
+                    self.base_memory_mb = max(mean_m - slope * mean_u, 0)
+        self._calibrate_csg(csg_times)
+        return self
+
+    def _calibrate_csg(self, csg_times):
+        """
+        Fits the seconds per unit of each CSG stat to *csg_times* (a list of
+        `(csg, seconds)`).  With plenty of samples (and NumPy) every weight
+        gets fitted separately (non-negative least squares); otherwise the
+        default `CSG_WEIGHTS` just get scaled.
+        """
+        self.csg_samples = len(csg_times)
+        if self.csg_samples < MIN_CSG_SAMPLES:
+            self.csg_seconds = None
+            return
+        # Scaled defaults (least squares through the origin):
+        units = [csg_units(csg) for csg, _ in csg_times]
+        scale = (sum(u*t for u, (_, t) in zip(units, csg_times))
+                 / sum(u*u for u in units))
+        self.csg_seconds = [w*scale for w in CSG_WEIGHTS.values()]
+        if np is None or self.csg_samples < 2*len(CSG_WEIGHTS):
+            return
+        x = np.array([csg_vector(csg) for csg, _ in csg_times], float)
+        y = np.array([t for _, t in csg_times], float)
+        active = list(range(x.shape[1]))
+        while active: # Drop stats that come out negative and refit
+            fit = np.linalg.lstsq(x[:, active], y, rcond=None)[0]
+            if (fit >= 0).all():
+                break
+            active = [a for a, w in zip(active, fit) if w >= 0]
+        if active and fit.any():
+            weights = [0.0]*x.shape[1]
+            for a, w in zip(active, fit):
+                weights[a] = float(w)
+            self.csg_seconds = weights
+
+    def source(self, keycap):
+        """
+        Returns what `estimate()` bases its time estimate for *keycap* on:
+        "csg" (its CSG tree stats) or "model" (its parameters).
+        """
+        if self.csg_seconds is not None and cached_stats(keycap):
+            return "csg"
+        return "model"
+
+    def estimate(self, keycap):
+        """
+        Returns `(seconds, peak_memory_mb)` for rendering *keycap*.
+        """
+        feats = features(keycap)
+        units = cost_units(feats)
+        seconds = units * self.seconds_per_unit
+        if self.csg_seconds is not None and feats["csg"]:
+            seconds = max(sum(w*x for w, x in zip(
+                self.csg_seconds, csg_vector(feats["csg"]))), 1.0)
+        return seconds, self.base_memory_mb + units * self.memory_mb_per_unit
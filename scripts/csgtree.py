@@ -0,0 +1,417 @@
+#!/usr/bin/env python3
+
+"""
+Predicts how expensive a keycap will be to render by looking at its CSG tree
+instead of rendering it.  Exporting to `.csg` only evaluates the script (no
+CGAL/manifold involved) so it takes about a second, and the tree says a lot
+about how much work the real render will be: how many `hull()`s,
+`difference()`s, `intersection()`s, and `minkowski()`s there are, how many
+facets (`$fn`-weighted) go into each of them, and how much `text()` is in
+there::
+
+    $ ./scripts/csgtree.py riskeyboard_70 tilde numlock
+    tilde: 12 hull, 4 difference, 3 intersection, 0 minkowski, ...
+
+The stats get cached (`~/.cache/keycap_playground/csg/`) keyed on the
+keycap's parameters and the contents of the `.scad` files so `preflight.py`
+(which exports `.csg` anyway) fills the cache for free and `costmodel.py` can
+use them both for estimates and for calibrating against the render times
+recorded in build journals.
+"""
+
+# stdlib imports
+import os
+import re
+import sys
+import json
+import math
+import hashlib
+import argparse
+import importlib
+import subprocess
+import tempfile
+from pathlib import Path
+# 3rd party stuff
+from colorama import Style
+
+CACHE_DIR = Path(
+    os.environ.get("XDG_CACHE_HOME", Path.home() / ".cache")
+) / "keycap_playground" / "csg"
+# Bump this whenever what's in `CsgStats` changes
+CACHE_VERSION = 1
+# Rough number of outline edges OpenSCAD ends up with per character of text()
+EDGES_PER_CHAR = 40
+# OpenSCAD's defaults for $fa/$fs
+DEFAULT_FA = 12
+DEFAULT_FS = 2
+
+# What we need to find our way through a .csg file quickly (big polygon()s can
+# have tens of thousands of numbers in them so we skip over those in chunks):
+_NODE = re.compile(r"\s*([%#!*]?)([A-Za-z_$][\w$]*)\s*\(")
+_ARG_TOKENS = re.compile(r'"(?:[^"\\]|\\.)*"|[\[\]()]|,')
+_NAMED = re.compile(r"\s*(\$?\w+)\s*=\s*(.*)", re.S)
+
+# Operations we count:
+OPERATIONS = ("hull", "difference", "intersection", "union", "minkowski",
+              "linear_extrude", "rotate_extrude", "offset", "projection")
+
+class CsgException(Exception):
+    """
+    Raised when a `.csg` file can't be parsed (or exported).
+    """
+    pass
+
+class CsgNode(object):
+    """
+    A node in a CSG tree: *name* (e.g. "difference"), *args* (a dict of the
+    named arguments as strings), and *children*.
+    """
+    def __init__(self, name, args, children=None):
+        self.name = name
+        self.args = args
+        self.children = children or []
+
+    def number(self, name, default=0.0):
+        """
+        Returns argument *name* as a float (or *default* if it isn't a plain
+        number).
+        """
+        try:
+            return float(self.args[name])
+        except (KeyError, ValueError):
+            return default
+
+def _split_args(text):
+    """
+    Splits the argument list *text* (what's between the parens) into a dict
+    of name -> value string.  Positional arguments get their index as name.
+    """
+    args = {}
+    depth = 0
+    start = 0
+    parts = []
+    for match in _ARG_TOKENS.finditer(text):
+        token = match.group()
+        if token in "[(":
+            depth += 1
+        elif token in "])":
+            depth -= 1
+        elif token == "," and depth == 0:
+            parts.append(text[start:match.start()])
+            start = match.end()
+    parts.append(text[start:])
+    for i, part in enumerate(p for p in parts if p.strip()):
+        named = _NAMED.match(part)
+        if named:
+            args[named.group(1)] = named.group(2).strip()
+        else:
+            args[str(i)] = part.strip()
+    return args
+
+def parse_csg(text):
+    """
+    Parses the contents of a `.csg` file and returns the top-level
+    `CsgNode`s.
+    """
+    root = []
+    stack = [root]
+    pos = 0
+    end = len(text)
+    while pos < end:
+        char = text[pos]
+        if char.isspace() or char == ";":
+            pos += 1
+            continue
+        if char == "}":
+            if len(stack) == 1:
+                raise CsgException(f"Unbalanced '}}' at offset {pos}")
+            stack.pop()
+            pos += 1
+            continue
+        if text.startswith("//", pos):
+            newline = text.find("\n", pos)
+            pos = end if newline < 0 else newline + 1
+            continue
+        match = _NODE.match(text, pos)
+        if not match:
+            raise CsgException(
+                f"Unexpected {text[pos:pos+20]!r} at offset {pos}")
+        depth = 1
+        args_start = match.end()
+        for token in _ARG_TOKENS.finditer(text, args_start):
+            value = token.group()
+            if value == "(":
+                depth += 1
+            elif value == ")":
+                depth -= 1
+                if not depth:
+                    break
+        if depth:
+            raise CsgException(f"Unterminated {match.group(2)}()")
+        node = CsgNode(match.group(2),
+            _split_args(text[args_start:token.start()]))
+        stack[-1].append(node)
+        pos = token.end()
+        while pos < end and text[pos].isspace():
+            pos += 1
+        if pos < end and text[pos] == "{":
+            stack.append(node.children)
+            pos += 1
+    if len(stack) != 1:
+        raise CsgException("Unexpected end of file (missing '}')")
+    return root
+
+def fragments(r, fn=0, fa=DEFAULT_FA, fs=DEFAULT_FS):
+    """
+    Returns how many segments OpenSCAD uses for a circle of radius *r*
+    (same as `get_fragments_from_r()` in OpenSCAD).
+    """
+    if r < 1e-9:
+        return 3
+    if fn > 0:
+        return max(int(fn), 3)
+    return int(math.ceil(max(min(360/fa, r*2*math.pi/fs), 5)))
+
+def _count_vectors(value):
+    """
+    Returns how many vectors a (nested) vector literal like `[[0, 0], [1, 0]]`
+    holds (0 if it isn't a literal).
+    """
+    value = value.strip()
+    if not value.startswith("["):
+        return 0
+    return max(value.count("[") - 1, 0)
+
+class CsgStats(object):
+    """
+    What's in a CSG tree that matters for render cost:
+
+    * *counts*: How many of each operation in `OPERATIONS` there are.
+    * *facets*: Total facets/edges of all the primitives (`$fn`-weighted).
+    * *hull_facets*: Facets that go into `hull()`s (cheap-ish per facet).
+    * *boolean_facets*: Facets that go into `difference()`/`intersection()`
+      (the expensive part of a CGAL render).
+    * *minkowski_facets*: Sum of the products of the facets of each
+      `minkowski()`'s children (these get *really* expensive).
+    * *text_nodes*/*text_chars*: How many `text()`s (legends) and characters.
+    """
+    FIELDS = ("facets", "hull_facets", "boolean_facets", "minkowski_facets",
+              "text_nodes", "text_chars")
+
+    def __init__(self, **kwargs):
+        self.counts = dict.fromkeys(OPERATIONS, 0)
+        self.counts.update(kwargs.pop("counts", {}))
+        for field in self.FIELDS:
+            setattr(self, field, kwargs.get(field, 0))
+
+    def as_dict(self):
+        stats = {field: getattr(self, field) for field in self.FIELDS}
+        stats["counts"] = dict(self.counts)
+        return stats
+
+    def __str__(self):
+        counts = ", ".join(
+            f"{n} {op}" for op, n in self.counts.items() if n)
+        return (f"{counts or 'no operations'}; {self.facets} facets "
+                f"({self.hull_facets} in hulls, {self.boolean_facets} in "
+                f"booleans, {self.minkowski_facets} minkowski), "
+                f"{self.text_nodes} text ({self.text_chars} chars)")
+
+def _facets(node, stats, inherited):
+    """
+    Walks *node* (recursively) adding to *stats* and returns the facets (or
+    edges for 2D) it produces.  *inherited* is the `($fn, $fa, $fs)` of the
+    parent in case *node* doesn't set its own.
+    """
+    fn = node.number("$fn", inherited[0])
+    fa = node.number("$fa", inherited[1]) or DEFAULT_FA
+    fs = node.number("$fs", inherited[2]) or DEFAULT_FS
+    special = (fn, fa, fs)
+    name = node.name
+    children = [_facets(child, stats, special) for child in node.children]
+    if name in stats.counts:
+        stats.counts[name] += 1
+    if name == "circle":
+        return fragments(node.number("r", 1), *special)
+    if name == "sphere":
+        n = fragments(node.number("r", 1), *special)
+        return n*((n + 1)//2)
+    if name == "cylinder":
+        radius = max(node.number("r1", 1), node.number("r2", 1))
+        return fragments(radius, *special) + 2
+    if name in ("square", "cube"):
+        return 4 if name == "square" else 6
+    if name == "polygon":
+        return _count_vectors(node.args.get("points", "")) or 3
+    if name == "polyhedron":
+        return (_count_vectors(node.args.get("faces", ""))
+                or _count_vectors(node.args.get("triangles", "")) or 4)
+    if name == "text":
+        text = node.args.get("text", node.args.get("0", '""'))
+        chars = max(len(text.strip('"')), 1)
+        stats.text_nodes += 1
+        stats.text_chars += chars
+        return chars*EDGES_PER_CHAR
+    total = sum(children)
+    if name == "linear_extrude":
+        slices = max(node.number("slices", 1), 1)
+        return total*(slices + 2)
+    if name == "rotate_extrude":
+        return total*fragments(10, *special)
+    if name == "hull":
+        stats.hull_facets += total
+    elif name in ("difference", "intersection"):
+        stats.boolean_facets += total
+    elif name == "minkowski":
+        product = math.prod(max(c, 1) for c in children) if children else 0
+        stats.minkowski_facets += product
+        return product
+    return total
+
+def analyze(text):
+    """
+    Returns the `CsgStats` of the `.csg` file contents *text*.
+    """
+    stats = CsgStats()
+    for node in parse_csg(text):
+        stats.facets += _facets(node, stats, (0, DEFAULT_FA, DEFAULT_FS))
+    return stats
+
+_sources = {}
+
+def sources_digest(keycap_playground_path):
+    """
+    Returns a digest of all the `.scad` files next to *keycap_playground_path*
+    (the ones it `use`s) so cached stats get thrown out when they change.
+    """
+    directory = Path(keycap_playground_path).resolve().parent
+    if directory not in _sources:
+        digest = hashlib.sha256()
+        for path in sorted(directory.glob("*.scad")):
+            digest.update(path.name.encode("utf-8"))
+            digest.update(path.read_bytes())
+        _sources[directory] = digest.hexdigest()
+    return _sources[directory]
+
+def cache_file(keycap, cache_dir=CACHE_DIR):
+    """
+    Returns where the `CsgStats` of *keycap* get cached.
+    """
+    try:
+        sources = sources_digest(keycap.keycap_playground_path)
+    except OSError:
+        sources = ""
+    key = f"{CACHE_VERSION}\0{sources}\0{keycap.definitions()}"
+    digest = hashlib.sha256(key.encode("utf-8")).hexdigest()
+    return Path(cache_dir) / f"{digest[:32]}.json"
+
+def cached_stats(keycap):
+    """
+    Returns the cached `CsgStats` of *keycap* (or `None` if there aren't any).
+    """
+    try:
+        with open(cache_file(keycap)) as f:
+            return CsgStats(**json.load(f))
+    except (OSError, ValueError, TypeError):
+        return None
+
+def store_stats(keycap, stats):
+    """
+    Caches *stats* (`CsgStats`) for *keycap*.
+    """
+    path = cache_file(keycap)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    with open(temp, "w") as f:
+        json.dump(stats.as_dict(), f)
+    os.replace(temp, path)
+
+def csg_args(keycap, csg_file):
+    """
+    Returns the OpenSCAD command (as a list of arguments) that exports
+    *keycap*'s CSG tree to *csg_file* (plain OpenSCAD; never colorscad).
+    """
+    return [
+        str(keycap.openscad_path), *keycap.openscad_args.split(),
+        "-o", str(csg_file), "-D", keycap.definitions(),
+        str(keycap.keycap_playground_path),
+    ]
+
+def load_stats(keycap, csg_file):
+    """
+    Analyzes the exported *csg_file* of *keycap*, caches the result, and
+    returns the `CsgStats`.  Raises `CsgException` if it can't be parsed.
+    """
+    try:
+        text = Path(csg_file).read_text(errors="replace")
+    except OSError as e:
+        raise CsgException(f"Could not read {csg_file}: {e}")
+    stats = analyze(text)
+    store_stats(keycap, stats)
+    return stats
+
+def csg_stats(keycap, refresh=False):
+    """
+    Returns the `CsgStats` of *keycap*, exporting its CSG tree with OpenSCAD
+    if it isn't cached (or *refresh* is `True`).
+    """
+    if not refresh:
+        stats = cached_stats(keycap)
+        if stats is not None:
+            return stats
+    with tempfile.TemporaryDirectory(prefix="csgtree-") as directory:
+        csg_file = Path(directory) / "keycap.csg"
+        try:
+            proc = subprocess.run(csg_args(keycap, csg_file),
+                capture_output=True, text=True, timeout=120)
+        except (OSError, subprocess.TimeoutExpired) as e:
+            raise CsgException(f"Could not run OpenSCAD: {e}")
+        if proc.returncode or not csg_file.exists():
+            raise CsgException(
+                f"OpenSCAD failed to export {keycap.name}: "
+                f"{proc.stderr.strip()[-500:]}")
+        return load_stats(keycap, csg_file)
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Show what's in keycaps' CSG trees (hulls, booleans, "
+                    "facets, text) and their predicted render cost.")
+    parser.add_argument('--refresh',
+        required=False, action='store_true',
+        help="Re-export the CSG trees even if they're cached.")
+    parser.add_argument('--file',
+        metavar='<path>', type=str,
+        help="Just analyze this .csg file.")
+    parser.add_argument('module',
+        metavar="module", nargs='?',
+        help="The keyset script to check (e.g. riskeycap_full).")
+    parser.add_argument('names',
+        nargs='*', metavar="name",
+        help='Only check the keycaps with these names.')
+    args = parser.parse_args()
+    if args.file:
+        print(analyze(Path(args.file).read_text(errors="replace")))
+        return
+    if not args.module:
+        parser.error("a module (or --file) is required")
+    from costmodel import CostModel
+    model = CostModel()
+    keycaps = importlib.import_module(args.module).KEYCAPS
+    if args.names:
+        lowered = [name.lower() for name in args.names]
+        keycaps = [k for k in keycaps if k.name.lower() in lowered]
+    failed = 0
+    for keycap in keycaps:
+        try:
+            stats = csg_stats(keycap, refresh=args.refresh)
+        except CsgException as e:
+            failed += 1
+            print(Style.BRIGHT + f"{keycap.name}: {e}" + Style.RESET_ALL)
+            continue
+        seconds, memory_mb = model.estimate(keycap)
+        print(f"{keycap.name}: {stats}; ~{seconds:.0f}s, ~{memory_mb:.0f}MB")
+    if failed:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
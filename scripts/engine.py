@@ -0,0 +1,478 @@
+#!/usr/bin/env python3
+
+"""
+An asyncio-based render engine.  Runs up to `max_runners` OpenSCAD processes
+at a time (via `asyncio.create_subprocess_exec()`; no shell involved) and
+streams each one's stdout/stderr line by line, tagged with the name of the
+keycap being rendered::
+
+    [numpadminus] WARNING: Can't get font Gotham Rounded:style=Bold
+    [tilde] Total rendering time: 0:01:32.412
+
+Lines that look like trouble (missing fonts, CGAL errors, non-manifold
+warnings, etc) are classified as they come in so they can be highlighted
+right away and summarized at the end of the build (see `RenderResult`).
+
+Every OpenSCAD process is started in its own process group.  When the engine
+gets cancelled (e.g. Ctrl-C/SIGINT) all the process groups are terminated
+immediately (then killed if they don't exit within `KILL_TIMEOUT` seconds) so
+there's no orphaned OpenSCAD processes left chewing up CPU in the background.
+Renders are atomic (see `journal.py`) so cancelling never leaves a partial file
+behind.
+
+Each successful render is also validated (see `validate.py`) before it gets
+moved into place.  Validation runs in a process pool so it doesn't hold up
+the other renders.  Outputs that fail validation are kept next to where they
+would've gone as `<name>.invalid.<ext>` so you can take a look at them.
+
+Keycaps that render more than one thing (e.g. the usual `["keycap",
+"stem"]`) can be split into one job per render target (see `split_jobs()`)
+so the body and stem (and legends, underset masks...) get rendered by
+separate OpenSCAD processes at the same time.  The parts go into a `.parts`
+directory next to the output and get merged into the output file (see
+`mesh.merge_files()`) once they're all done.  The merged file is *not*
+unioned the way OpenSCAD would do it: the parts stay separate (overlapping)
+shells which slicers union when slicing.  Each part is validated on its own
+and then the merged file is validated as a whole (minus the connected
+components check since overlapping shells don't share any edges).  Splitting
+costs a bit more CPU overall (the stem needs the keycap's shape too) and
+changes the structure of the output so it only happens when asked for
+(`split=True`; `--split` in `build.py`).
+"""
+
+# stdlib imports
+import os
+import re
+import time
+import signal
+import asyncio
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+# 3rd party stuff
+from colorama import Fore, Style
+# Our own stuff
+from journal import partial_output_file
+from jobspec import JobSpec, artifact_specs
+try:
+    from validate import check_mesh, expectations
+    from mesh import merge_files, MeshException, np
+except ImportError: # NumPy isn't required if you don't validate (or split)
+    np = None
+
+MAX_RUNNERS = 8 # How many OpenSCAD processes to run at once
+KILL_TIMEOUT = 5 # Seconds to wait after SIGTERM before sending SIGKILL
+MEMORY_POLL_INTERVAL = 0.5 # Seconds between peak memory checks
+PARTS_DIR = ".parts" # Where split keycaps' parts get rendered (under the output dir)
+PART_FILE_TYPE = "stl" # Fastest for OpenSCAD to write and for us to merge
+# Render targets that come out empty (and make OpenSCAD fail) without legends:
+LEGEND_TARGETS = ("legends", "underset_mask")
+
+# How we classify OpenSCAD output (first match wins):
+LINE_CLASSES = [
+    ("font", re.compile(
+        r"can't (get|find|load) font|font .*not found|fontconfig", re.I)),
+    ("cgal", re.compile(r"CGAL", re.I)),
+    ("manifold", re.compile(r"2-manifold|not.*manifold|not closed", re.I)),
+    ("error", re.compile(r"\bERROR\b|Parser error|Execution aborted", re.I)),
+    ("warning", re.compile(r"\bWARNING\b|DEPRECATED", re.I)),
+    ("note", re.compile(r"\bNOTE: ")), # From note() in utils.scad
+]
+# Categories that should be considered problems (not just informational)
+PROBLEMS = ("font", "cgal", "manifold", "error", "warning", "validation")
+CLASS_COLORS = {
+    "font": Fore.MAGENTA,
+    "cgal": Fore.RED,
+    "manifold": Fore.RED,
+    "error": Fore.RED,
+    "warning": Fore.YELLOW,
+    "note": Fore.CYAN,
+    "validation": Fore.RED,
+}
+
+def classify(line):
+    """
+    Returns the category of an OpenSCAD output *line* (e.g. "font", "cgal",
+    "warning") or `None` if it's nothing special.
+    """
+    for category, regex in LINE_CLASSES:
+        if regex.search(line):
+            return category
+    return None
+
+def invalid_output_file(output_file):
+    """
+    Returns where an output that failed validation gets kept (e.g.
+    `tilde.invalid.3mf`).
+    """
+    return output_file.with_name(
+        f"{output_file.stem}.invalid{output_file.suffix}")
+
+def read_peak_memory(pid):
+    """
+    Returns the peak memory (VmHWM) of process *pid* in MB or `None` if it
+    can't be read (process is gone or not on Linux).
+    """
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+def split_jobs(keycap):
+    """
+    Returns one job (keycap copy) per render target of *keycap* (rendered to
+    `PARTS_DIR` as `PART_FILE_TYPE`) or an empty list if it only renders one
+    thing (or uses colorscad which needs everything in one go).  Preview-only
+    (`%`) targets are left out as are legend targets if it has no legends.
+    """
+    if keycap.uses_colorscad():
+        return []
+    targets = [target for target in keycap.render if not target.startswith("%")]
+    if not any(keycap.legends):
+        targets = [target for target in targets if target not in LEGEND_TARGETS]
+    if len(targets) < 2:
+        return []
+    spec = JobSpec.from_keycap(keycap)
+    return [part.keycap() for part in artifact_specs(spec,
+        targets=[(target,) for target in targets], formats=[PART_FILE_TYPE],
+        output_path=Path(keycap.output_path) / PARTS_DIR)]
+
+class RenderResult(object):
+    """
+    The outcome of rendering a single keycap.
+    """
+    def __init__(self, keycap):
+        self.keycap = keycap
+        self.retcode = None
+        self.duration = 0.0
+        self.peak_memory_mb = None
+        self.cancelled = False
+        self.lines = []
+        self.problems = [] # List of (category, line)
+        self.validation = None # ValidationReport
+
+    @property
+    def ok(self):
+        return self.retcode == 0 and not self.cancelled
+
+    @property
+    def output(self):
+        return "\n".join(self.lines)
+
+class RenderEngine(object):
+    """
+    Renders keycaps concurrently.  Example::
+
+        engine = RenderEngine(max_runners=8, journal=BuildJournal(out))
+        results = asyncio.run(engine.run(keycaps))
+
+    If *quiet* is `True` only classified lines (warnings, errors, etc) will be
+    printed as they come in.  If *validate* is `True` (and NumPy is
+    available) every output gets checked with `validate.check_mesh()`.
+    If *split* is `True` keycaps get split into one job per render target
+    (see `split_jobs()`) and the parts merged afterwards.  Splitting requires
+    NumPy (for merging the parts).
+    """
+    def __init__(self, max_runners=MAX_RUNNERS, journal=None, quiet=False,
+            validate=True, split=False):
+        self.max_runners = max_runners
+        self.journal = journal
+        self.quiet = quiet
+        self.validate = validate and np is not None
+        self.split = split if np is not None else False
+        self.executor = None # Process pool for validation
+        self.processes = {} # pid -> asyncio.subprocess.Process
+        self.tasks = []
+        self.cancelled = False
+
+    def emit(self, keycap, line, category=None):
+        """
+        Prints a line of output from *keycap*'s OpenSCAD process.
+        """
+        if self.quiet and not category:
+            return
+        color = CLASS_COLORS.get(category, "")
+        print(f"{Style.DIM}[{keycap.name}]{Style.RESET_ALL} "
+              f"{color}{line}{Style.RESET_ALL if color else ''}", flush=True)
+
+    async def _stream(self, stream, keycap, result):
+        while True:
+            raw = await stream.readline()
+            if not raw:
+                break
+            line = raw.decode("utf-8", errors="replace").rstrip()
+            if not line:
+                continue
+            category = classify(line)
+            result.lines.append(line)
+            if category in PROBLEMS:
+                result.problems.append((category, line))
+            self.emit(keycap, line, category)
+
+    async def _watch_memory(self, pid, result):
+        while True:
+            peak = read_peak_memory(pid)
+            if peak is not None:
+                result.peak_memory_mb = max(result.peak_memory_mb or 0, peak)
+            await asyncio.sleep(MEMORY_POLL_INTERVAL)
+
+    def _signal_group(self, pid, sig):
+        try:
+            os.killpg(pid, sig)
+        except (ProcessLookupError, PermissionError):
+            pass
+
+    async def _terminate(self, proc):
+        """
+        Terminates *proc*'s whole process group (SIGTERM then SIGKILL).
+        """
+        self._signal_group(proc.pid, signal.SIGTERM)
+        try:
+            await asyncio.wait_for(proc.wait(), KILL_TIMEOUT)
+        except asyncio.TimeoutError:
+            self._signal_group(proc.pid, signal.SIGKILL)
+            await proc.wait()
+
+    async def render(self, keycap, record=True):
+        """
+        Renders *keycap* (atomically) and returns a `RenderResult`.  If
+        *record* is `False` it won't be recorded in the journal (for parts of
+        a split keycap).
+        """
+        result = RenderResult(keycap)
+        output_file = keycap.output_file
+        tmp_file = partial_output_file(output_file)
+        journal = self.journal if record else None
+        if journal:
+            journal.start(keycap)
+        start = time.monotonic()
+        proc = None
+        try:
+            try:
+                proc = await asyncio.create_subprocess_exec(
+                    *keycap.args(output_file=tmp_file),
+                    env=keycap.environment(),
+                    stdout=asyncio.subprocess.PIPE,
+                    stderr=asyncio.subprocess.PIPE,
+                    start_new_session=True) # Gives it its own process group
+            except OSError as e: # e.g. Wrong openscad_path
+                result.retcode = 127
+                result.lines.append(f"Could not run OpenSCAD: {e}")
+                result.problems.append(("error", result.lines[-1]))
+                self.emit(keycap, result.lines[-1], "error")
+                if journal:
+                    journal.fail(keycap, 0.0, result.output)
+                return result
+            self.processes[proc.pid] = proc
+            memory_watcher = asyncio.ensure_future(
+                self._watch_memory(proc.pid, result))
+            try:
+                await asyncio.gather(
+                    self._stream(proc.stdout, keycap, result),
+                    self._stream(proc.stderr, keycap, result))
+                result.retcode = await proc.wait()
+            finally:
+                memory_watcher.cancel()
+            result.duration = time.monotonic() - start
+            if result.retcode == 0 and not tmp_file.exists():
+                result.retcode = 1
+                result.lines.append(f"OpenSCAD did not create {tmp_file}")
+            if result.retcode == 0 and self.validate:
+                await self._validate(keycap, tmp_file, result)
+            if result.retcode == 0:
+                os.replace(tmp_file, output_file)
+                if journal:
+                    journal.finish(
+                        keycap, result.duration, result.peak_memory_mb,
+                        validation=result.validation.stats
+                            if result.validation else None)
+            elif journal:
+                journal.fail(keycap, result.duration, result.output)
+        except asyncio.CancelledError:
+            result.cancelled = True
+            result.duration = time.monotonic() - start
+            if proc is not None and proc.returncode is None:
+                await self._terminate(proc)
+            if journal:
+                journal.fail(keycap, result.duration, "Cancelled")
+            raise
+        finally:
+            if proc is not None:
+                self.processes.pop(proc.pid, None)
+            if tmp_file.exists():
+                tmp_file.unlink()
+        return result
+
+    async def _validate(self, keycap, tmp_file, result, expected=None):
+        """
+        Checks the freshly-rendered *tmp_file* against *expected* (defaults to
+        `validate.expectations()` of *keycap*) and fails *result* if there's
+        anything wrong with it (keeping the file around for inspection).
+        """
+        if expected is None:
+            expected = expectations(keycap)
+        loop = asyncio.get_running_loop()
+        report = await loop.run_in_executor(
+            self.executor, check_mesh, str(tmp_file), expected)
+        result.validation = report
+        if report.ok:
+            return
+        result.retcode = 1
+        for problem in report.problems:
+            line = f"Validation failed: {problem}"
+            result.lines.append(line)
+            result.problems.append(("validation", problem))
+            self.emit(keycap, line, "validation")
+        os.replace(tmp_file, invalid_output_file(keycap.output_file))
+
+    async def render_split(self, keycap, parts, sem):
+        """
+        Renders *parts* (from `split_jobs()`; each one waits for a runner from
+        *sem*) at the same time and merges them into *keycap*'s output.
+        Returns a `RenderResult` for the whole thing (its peak memory is the
+        sum of the parts' since they run side by side).
+        """
+        result = RenderResult(keycap)
+        output_file = keycap.output_file
+        tmp_file = partial_output_file(output_file)
+        if self.journal:
+            self.journal.start(keycap)
+        start = time.monotonic()
+        Path(parts[0].output_path).mkdir(parents=True, exist_ok=True)
+
+        async def render_part(part):
+            async with sem:
+                print(Style.BRIGHT + f"Rendering {part.output_file}..."
+                      + Style.RESET_ALL, flush=True)
+                return await self.render(part, record=False)
+
+        try:
+            part_results = await asyncio.gather(
+                *(render_part(part) for part in parts))
+            result.duration = time.monotonic() - start
+            for part, part_result in zip(parts, part_results):
+                target = part.render[0]
+                result.lines += [f"[{target}] {line}" for line in part_result.lines]
+                result.problems += part_result.problems
+                if part_result.peak_memory_mb is not None:
+                    result.peak_memory_mb = (
+                        (result.peak_memory_mb or 0) + part_result.peak_memory_mb)
+            failed = [r for r in part_results if not r.ok]
+            if failed:
+                result.retcode = failed[0].retcode
+            else:
+                loop = asyncio.get_running_loop()
+                try:
+                    await loop.run_in_executor(self.executor, merge_files,
+                        [str(part.output_file) for part in parts],
+                        str(tmp_file), keycap.name)
+                    result.retcode = 0
+                except (MeshException, OSError, ValueError) as e:
+                    result.retcode = 1
+                    result.lines.append(f"Could not merge the parts: {e}")
+                    result.problems.append(("error", result.lines[-1]))
+                    self.emit(keycap, result.lines[-1], "error")
+            if result.retcode == 0 and self.validate:
+                # The parts' pieces were already counted (the merged shells
+                # don't share edges so they'd all count as separate pieces):
+                expected = dict(expectations(keycap), components=None)
+                await self._validate(keycap, tmp_file, result, expected)
+                result.validation.stats["parts"] = {
+                    part.render[0]: part_result.validation.stats
+                    for part, part_result in zip(parts, part_results)
+                    if part_result.validation}
+            if result.retcode == 0:
+                os.replace(tmp_file, output_file)
+                if self.journal:
+                    self.journal.finish(
+                        keycap, result.duration, result.peak_memory_mb,
+                        validation=result.validation.stats
+                            if result.validation else None)
+            elif self.journal:
+                self.journal.fail(keycap, result.duration, result.output)
+        except asyncio.CancelledError:
+            result.cancelled = True
+            result.duration = time.monotonic() - start
+            if self.journal:
+                self.journal.fail(keycap, result.duration, "Cancelled")
+            raise
+        finally:
+            for part in parts:
+                if part.output_file.exists():
+                    part.output_file.unlink()
+            if tmp_file.exists():
+                tmp_file.unlink()
+        return result
+
+    def cancel(self):
+        """
+        Cancels everything: pending jobs won't start and all running OpenSCAD
+        process groups get terminated.
+        """
+        if self.cancelled:
+            return
+        self.cancelled = True
+        print(Style.BRIGHT + "Cancelling; terminating all OpenSCAD processes..."
+              + Style.RESET_ALL, flush=True)
+        for pid in list(self.processes):
+            self._signal_group(pid, signal.SIGTERM)
+        for task in list(self.tasks):
+            task.cancel()
+
+    async def run(self, jobs, on_result=None):
+        """
+        Renders all *jobs* (keycaps) and returns a list of `RenderResult`
+        (in the same order).  *on_result* (if given) gets called with each
+        `RenderResult` as soon as it's available.  SIGINT/SIGTERM cancel the
+        whole run.
+        """
+        loop = asyncio.get_running_loop()
+        sem = asyncio.Semaphore(self.max_runners)
+        results = [RenderResult(keycap) for keycap in jobs]
+        async def run_job(i, keycap):
+            parts = split_jobs(keycap) if self.split else []
+            if parts:
+                results[i] = await self.render_split(keycap, parts, sem)
+            else:
+                async with sem:
+                    print(Style.BRIGHT + f"Rendering {keycap.output_file}..."
+                          + Style.RESET_ALL, flush=True)
+                    results[i] = await self.render(keycap)
+            if on_result:
+                on_result(results[i])
+
+        handled = []
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, self.cancel)
+                handled.append(sig)
+            except (NotImplementedError, RuntimeError):
+                pass # Windows or not the main thread
+        if self.validate:
+            self.executor = ProcessPoolExecutor(max_workers=self.max_runners)
+        try:
+            self.tasks = [
+                asyncio.ensure_future(run_job(i, keycap))
+                for i, keycap in enumerate(jobs)]
+            outcomes = await asyncio.gather(
+                *self.tasks, return_exceptions=True)
+        finally:
+            for sig in handled:
+                loop.remove_signal_handler(sig)
+            if self.executor:
+                self.executor.shutdown(cancel_futures=True)
+                self.executor = None
+        for result, outcome in zip(results, outcomes):
+            if isinstance(outcome, Exception): # A bug (not the render failing)
+                result.retcode = result.retcode or 1
+                result.lines.append(f"Render crashed: {outcome!r}")
+                result.problems.append(("error", result.lines[-1]))
+                self.emit(result.keycap, result.lines[-1], "error")
+        if self.cancelled:
+            for result in results:
+                if result.retcode is None:
+                    result.cancelled = True
+        return results
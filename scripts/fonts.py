@@ -0,0 +1,365 @@
+#!/usr/bin/env python3
+
+"""
+Finds the fonts legends use (the same `Family:style=Style` names OpenSCAD's
+`text()` takes) and reads glyph metrics/outlines out of them.  Reading a font
+is slow compared to everything else we do with it so the metrics of every
+glyph we've ever looked at get cached on disk (one JSON file per font file in
+`~/.cache/keycap_playground/fonts/`)::
+
+    >>> metrics = FontMetrics.for_font("Gotham Rounded:style=Bold")
+    >>> metrics.outline("Q", size=4.5) # (N, 2) array of points in mm
+    >>> metrics.missing("⌘Q") # Characters the font has no glyph for
+
+Fonts are looked up with fontconfig (`fc-match`) if it's installed (that's
+what OpenSCAD uses on Linux) or by scanning the usual font directories plus
+any listed in `OPENSCAD_FONT_PATH` otherwise.
+
+.. note::
+
+    Requires fontTools (`pip install fonttools`) and NumPy.
+"""
+
+# stdlib imports
+import os
+import json
+import shutil
+import hashlib
+import subprocess
+from pathlib import Path
+# 3rd party stuff
+try:
+    import numpy as np
+    from fontTools.ttLib import TTFont, TTLibError
+    from fontTools.pens.basePen import BasePen
+except ImportError:
+    TTFont = None
+    BasePen = object
+
+# What OpenSCAD falls back to when a legend doesn't specify a font
+DEFAULT_FONT = "Roboto"
+FONT_EXTENSIONS = (".ttf", ".otf")
+# OpenSCAD renders text() at 100dpi so the em square ends up this many times
+# bigger than the size you give it (which makes capital letters ~size tall)
+EM_PER_SIZE = 100/72
+# How many points each curve segment gets flattened into
+CURVE_STEPS = 4
+# Bump this whenever what gets cached per glyph changes
+CACHE_VERSION = 2
+CACHE_DIR = Path(
+    os.environ.get("XDG_CACHE_HOME", Path.home() / ".cache")
+) / "keycap_playground" / "fonts"
+
+class FontException(Exception):
+    """
+    Raised when a font can't be found or read (or fontTools isn't installed).
+    """
+    pass
+
+def require_fonttools():
+    if TTFont is None:
+        raise FontException(
+            "fontTools and NumPy are required for font metrics "
+            "(pip install fonttools numpy)")
+
+def parse_font_name(name):
+    """
+    Splits an OpenSCAD font name like "Gotham Rounded:style=Bold" into
+    `(family, style)`.  The style defaults to "Regular".
+    """
+    family, _, options = (name or DEFAULT_FONT).partition(":")
+    style = "Regular"
+    for option in options.split(":"):
+        key, _, value = option.partition("=")
+        if key.strip().lower() == "style" and value.strip():
+            style = value.strip()
+    return family.strip(), style
+
+def font_dirs():
+    """
+    Returns the directories we'll look for fonts in (when there's no
+    fontconfig) in order of preference.
+    """
+    dirs = [Path(p) for p in
+            os.environ.get("OPENSCAD_FONT_PATH", "").split(os.pathsep) if p]
+    home = Path.home()
+    dirs += [
+        home / ".fonts", home / ".local" / "share" / "fonts",
+        Path("/usr/local/share/fonts"), Path("/usr/share/fonts"),
+        home / "Library" / "Fonts", Path("/Library/Fonts"),
+        Path("/System/Library/Fonts"),
+        Path(os.environ.get("WINDIR", "C:/Windows")) / "Fonts",
+    ]
+    return [d for d in dirs if d.is_dir()]
+
+def _font_names(path):
+    """
+    Returns the set of `(family, style)` (lowercased) names *path* goes by.
+    """
+    names = set()
+    try:
+        font = TTFont(path, lazy=True, fontNumber=0)
+        table = font["name"]
+    except (TTLibError, KeyError, OSError):
+        return names
+    # Legacy (1/2) and typographic (16/17) family/subfamily names:
+    for family_id, style_id in ((1, 2), (16, 17)):
+        family = table.getDebugName(family_id)
+        style = table.getDebugName(style_id)
+        if family:
+            names.add((family.lower(), (style or "Regular").lower()))
+    full_name = table.getDebugName(4)
+    if full_name: # e.g. "Arial Black" + style "Regular"
+        names.add((full_name.lower(), "regular"))
+    font.close()
+    return names
+
+_index = None
+
+def font_index():
+    """
+    Returns a dict of `(family, style)` (lowercased) to font file paths for
+    every font in `font_dirs()`.  Built once per process.
+    """
+    global _index
+    if _index is None:
+        require_fonttools()
+        _index = {}
+        for directory in font_dirs():
+            for path in sorted(directory.rglob("*")):
+                if path.suffix.lower() not in FONT_EXTENSIONS:
+                    continue
+                for key in _font_names(path):
+                    _index.setdefault(key, path)
+    return _index
+
+def _fc_match(family, style):
+    """
+    Asks fontconfig for *family*/*style*.  Returns the path or `None` if
+    fontconfig would have to substitute a different font.
+    """
+    try:
+        output = subprocess.run(
+            ["fc-match", "--format=%{file}\n%{family}\n%{style}",
+             f"{family}:style={style}"],
+            capture_output=True, text=True, timeout=10).stdout
+    except (OSError, subprocess.TimeoutExpired):
+        return None
+    lines = output.split("\n")
+    if len(lines) < 3 or not lines[0]:
+        return None
+    families = [f.strip().lower() for f in lines[1].split(",")]
+    if family.lower() not in families:
+        return None # fc-match *always* returns something
+    return Path(lines[0])
+
+_found = {}
+
+def find_font(name):
+    """
+    Returns the `Path` of the font file OpenSCAD would use for *name* (e.g.
+    "Gotham Rounded:style=Bold") or `None` if it isn't installed.
+    """
+    family, style = parse_font_name(name)
+    key = (family.lower(), style.lower())
+    if key not in _found:
+        path = None
+        if shutil.which("fc-match"):
+            path = _fc_match(family, style)
+        if path is None:
+            index = font_index()
+            path = index.get(key)
+            if path is None and key[1] == "regular":
+                # Some fonts call their only style something else ("Book")
+                path = next(
+                    (p for (f, _), p in index.items() if f == key[0]), None)
+        _found[key] = path
+    return _found[key]
+
+class _OutlinePen(BasePen):
+    """
+    Collects the points of a glyph's outline (curves flattened into
+    `CURVE_STEPS` line segments each).
+    """
+    def __init__(self, glyphset):
+        super().__init__(glyphset)
+        self.points = []
+        self.current = (0, 0)
+
+    def _moveTo(self, point):
+        self.points.append(point)
+        self.current = point
+
+    def _lineTo(self, point):
+        self.points.append(point)
+        self.current = point
+
+    def _curveToOne(self, p1, p2, p3):
+        (x0, y0), (x1, y1), (x2, y2), (x3, y3) = self.current, p1, p2, p3
+        for step in range(1, CURVE_STEPS + 1):
+            t = step/CURVE_STEPS
+            a, b, c, d = (1-t)**3, 3*(1-t)**2*t, 3*(1-t)*t**2, t**3
+            self.points.append((a*x0 + b*x1 + c*x2 + d*x3,
+                                a*y0 + b*y1 + c*y2 + d*y3))
+        self.current = p3
+
+    def _qCurveToOne(self, p1, p2):
+        (x0, y0), (x1, y1), (x2, y2) = self.current, p1, p2
+        for step in range(1, CURVE_STEPS + 1):
+            t = step/CURVE_STEPS
+            a, b, c = (1-t)**2, 2*(1-t)*t, t**2
+            self.points.append((a*x0 + b*x1 + c*x2, a*y0 + b*y1 + c*y2))
+        self.current = p2
+
+class FontMetrics(object):
+    """
+    Glyph metrics (advance widths and outlines, in font units) for the font
+    file at *path*.  Glyphs are read from the font the first time they're
+    asked for and then cached on disk in *cache_dir* so the next run doesn't
+    need to open the font at all.
+    """
+    def __init__(self, path, cache_dir=CACHE_DIR):
+        require_fonttools()
+        self.path = Path(path)
+        stat = self.path.stat()
+        key = (f"{self.path.resolve()}:{stat.st_size}:{stat.st_mtime_ns}:"
+               f"{CACHE_VERSION}")
+        digest = hashlib.sha256(key.encode("utf-8")).hexdigest()[:16]
+        self.cache_file = Path(cache_dir) / f"{self.path.stem}-{digest}.json"
+        self._font = None
+        self.units_per_em = None
+        self.glyphs = {} # char -> {"advance": n, "points": [[x, y], ...]}
+        self.dirty = False
+        try:
+            with open(self.cache_file) as f:
+                cached = json.load(f)
+            self.units_per_em = cached["units_per_em"]
+            self.glyphs = cached["glyphs"]
+        except (OSError, ValueError, KeyError):
+            self.units_per_em = self.font["head"].unitsPerEm
+
+    _instances = {}
+
+    @classmethod
+    def for_font(cls, name):
+        """
+        Returns the (shared) `FontMetrics` for the OpenSCAD font *name*.
+        Raises `FontException` if the font isn't installed.
+        """
+        path = find_font(name)
+        if path is None:
+            raise FontException(f"Font not found: {name}")
+        if path not in cls._instances:
+            cls._instances[path] = cls(path)
+        return cls._instances[path]
+
+    @property
+    def font(self):
+        if self._font is None:
+            try:
+                self._font = TTFont(self.path, lazy=True, fontNumber=0)
+            except (TTLibError, OSError) as e:
+                raise FontException(f"Could not read {self.path}: {e}")
+        return self._font
+
+    def glyph(self, char):
+        """
+        Returns the (cached) metrics of *char*: a dict with its "advance" and
+        outline "points" (font units).  If the font doesn't have *char* it
+        gets the metrics of the font's `.notdef` glyph (the box OpenSCAD
+        would render) and `"missing": True`.
+        """
+        if char not in self.glyphs:
+            font = self.font
+            glyph_name = font.getBestCmap().get(ord(char))
+            missing = glyph_name is None
+            if missing:
+                glyph_name = font.getGlyphOrder()[0] # .notdef
+            glyphset = font.getGlyphSet()
+            pen = _OutlinePen(glyphset)
+            glyphset[glyph_name].draw(pen)
+            advance = font["hmtx"][glyph_name][0]
+            self.glyphs[char] = {
+                "advance": advance,
+                "points": [[round(x, 1), round(y, 1)] for x, y in pen.points],
+            }
+            if missing:
+                self.glyphs[char]["missing"] = True
+            self.dirty = True
+        return self.glyphs[char]
+
+    def missing(self, text):
+        """
+        Returns the characters of *text* this font doesn't have glyphs for.
+        """
+        return [c for c in dict.fromkeys(text)
+                if not c.isspace() and self.glyph(c).get("missing")]
+
+    def save(self):
+        """
+        Writes any newly-read glyphs to the cache file.
+        """
+        if not self.dirty:
+            return
+        self.cache_file.parent.mkdir(parents=True, exist_ok=True)
+        temp = self.cache_file.with_suffix(".tmp")
+        with open(temp, "w") as f:
+            json.dump({"units_per_em": self.units_per_em,
+                       "glyphs": self.glyphs}, f)
+        os.replace(temp, self.cache_file)
+        self.dirty = False
+
+    def scale(self, size):
+        """
+        Returns the mm per font unit of OpenSCAD's `text(size=size)`.
+        """
+        return size*EM_PER_SIZE/self.units_per_em
+
+    def advance(self, text, size):
+        """
+        Returns the total advance width (mm) of *text* at *size*.
+        """
+        return sum(self.glyph(c)["advance"] for c in text)*self.scale(size)
+
+    def outline(self, text, size):
+        """
+        Returns the outline points (`(N, 2)` array, mm) of *text* rendered at
+        *size* the way `draw_legend()` does it: `halign="center"` (centered on
+        the advance width) and `valign="center"` (centered on the ink).
+        Kerning is ignored.
+        """
+        scale = self.scale(size)
+        points = []
+        x = 0
+        for char in text:
+            glyph = self.glyph(char)
+            if glyph["points"]:
+                points.append(np.array(glyph["points"], float) + [x, 0])
+            x += glyph["advance"]
+        if not points:
+            return np.zeros((0, 2))
+        points = np.concatenate(points)
+        points[:, 0] -= x/2
+        points[:, 1] -= (points[:, 1].min() + points[:, 1].max())/2
+        return points*scale
+
+def warm_fontconfig():
+    """
+    Brings fontconfig's cache up to date (if fontconfig is installed) so the
+    OpenSCAD processes that are about to start in parallel don't all end up
+    rebuilding it at the same time.  Returns `True` if it was run.
+    """
+    if not shutil.which("fc-cache"):
+        return False
+    try:
+        subprocess.run(["fc-cache"], capture_output=True, timeout=300)
+    except (OSError, subprocess.TimeoutExpired):
+        return False
+    return True
+
+def save_all():
+    """
+    Writes every `FontMetrics` that's been used (with new glyphs) to disk.
+    """
+    for metrics in FontMetrics._instances.values():
+        metrics.save()
@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+
+"""
+Immutable, picklable render job descriptions.  A `JobSpec` is a snapshot of a
+keycap's parameters plus what to render (the artifact, e.g. `("legends",)`),
+in what format and where to put it.  Deriving jobs from keycaps (a legends
+pass, one job per render target, one per format, etc) goes through here so
+the keycaps in a keyset's `KEYCAPS` never get modified along the way::
+
+    >>> spec = JobSpec.from_keycap(keycap, output_path="/tmp/output_dir")
+    >>> legends = legends_spec(spec)      # tilde_legends.stl; spec is untouched
+    >>> parts = artifact_specs(spec)      # tilde_keycap.3mf, tilde_stem.3mf
+    >>> draft = spec.with_params(dish_fn=32)
+    >>> job = legends.keycap()            # A fresh Keycap that's all yours
+
+Since specs are (nested) tuples of plain values they can be hashed, compared,
+used as dict keys, and sent to process pools as-is (remote workers get
+`JobSpec.as_dict()`).  Either way they only need `keycap.py` on the other
+end, not the keyset script the keycap came from.  Whatever needs an actual
+`Keycap` (the engine, the journal, etc) gets a brand new one from
+`JobSpec.keycap()` so it's free to change it.
+"""
+
+# stdlib imports
+from pathlib import Path, PurePath
+from collections import namedtuple
+# Our own stuff
+from keycap import Keycap
+
+# Legends-only jobs are .stl since PrusaSlicer doesn't like .3mf for "parts"
+# for unknown reasons...
+LEGENDS_FILE_TYPE = "stl"
+# Keycap attributes that are fields of the spec itself (not in its params):
+SPEC_FIELDS = ("name", "render", "file_type", "output_path")
+
+def freeze(value):
+    """
+    Returns *value* with all its lists turned into tuples (recursively).
+    """
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(item) for item in value)
+    return value
+
+def thaw(value):
+    """
+    The opposite of `freeze()`: turns tuples back into lists (which is what
+    `Keycap.definitions()` expects; `str()` of a tuple isn't valid OpenSCAD).
+    """
+    if isinstance(value, tuple):
+        return [thaw(item) for item in value]
+    return value
+
+class JobSpec(namedtuple("JobSpec",
+        "name render file_type output_path params")):
+    """
+    One render job: *name*, *render* (tuple of `RENDER` targets),
+    *file_type*, *output_path* (a string) and *params* (a sorted tuple of
+    `(attribute, frozen value)` pairs with every other keycap attribute).
+    Use `JobSpec.from_keycap()` to make one and `_replace()` (or the helpers
+    below) to derive new ones.
+    """
+    __slots__ = ()
+
+    @classmethod
+    def from_keycap(cls, keycap, output_path=None):
+        """
+        Returns the spec for rendering *keycap* as-is (into *output_path* if
+        given instead of the keycap's own `output_path`).
+        """
+        params = tuple(sorted(
+            (attr, freeze(value)) for attr, value in vars(keycap).items()
+            if attr not in SPEC_FIELDS))
+        return cls(
+            name=keycap.name,
+            render=freeze(keycap.render),
+            file_type=keycap.file_type,
+            output_path=str(
+                keycap.output_path if output_path is None else output_path),
+            params=params)
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+        The opposite of `as_dict()`: returns the spec *data* describes.
+        """
+        return cls(
+            name=data["name"],
+            render=freeze(data["render"]),
+            file_type=data["file_type"],
+            output_path=str(data["output_path"]),
+            params=tuple(sorted(
+                (attr, freeze(value))
+                for attr, value in data["params"].items())))
+
+    def as_dict(self):
+        """
+        Returns this spec as a dict that can go through `json.dumps()` (e.g.
+        to send it to a render farm worker).  Paths become strings.
+        """
+        return {
+            "name": self.name,
+            "render": thaw(self.render),
+            "file_type": self.file_type,
+            "output_path": self.output_path,
+            "params": {
+                attr: str(value) if isinstance(value, PurePath) else thaw(value)
+                for attr, value in self.params},
+        }
+
+    def with_params(self, **changes):
+        """
+        Returns a copy of this spec with the keycap attributes in *changes*
+        set to new values (spec fields like `name` or `render` work too).
+        """
+        fields = {}
+        params = dict(self.params)
+        for attr, value in changes.items():
+            if attr == "output_path":
+                fields[attr] = str(value)
+            elif attr in SPEC_FIELDS:
+                fields[attr] = freeze(value)
+            else:
+                params[attr] = freeze(value)
+        return self._replace(params=tuple(sorted(params.items())), **fields)
+
+    @property
+    def output_file(self):
+        """
+        Where the job's output ends up (same as `Keycap.output_file`).
+        """
+        return Path(self.output_path) / f"{self.name}.{self.file_type}"
+
+    def param(self, attr, default=None):
+        """
+        Returns the (frozen) value of keycap attribute *attr*.
+        """
+        return dict(self.params).get(attr, default)
+
+    def keycap(self):
+        """
+        Returns a new `Keycap` for this job.  It's a plain `Keycap` (not
+        whatever subclass the spec came from; they only differ in their
+        `__init__()`) that nothing else has a reference to.
+        """
+        keycap = Keycap.__new__(Keycap)
+        for attr, value in self.params:
+            setattr(keycap, attr, thaw(value))
+        keycap.name = self.name
+        keycap.render = thaw(self.render)
+        keycap.file_type = self.file_type
+        keycap.output_path = self.output_path
+        return keycap
+
+def legends_spec(spec):
+    """
+    Returns the spec that renders just the legends of *spec* (for
+    multi-material, non-transparent legends).
+    """
+    return spec._replace(name=f"{spec.name}_legends", render=("legends",),
+        file_type=LEGENDS_FILE_TYPE)
+
+def artifact_specs(spec, targets=None, formats=None, output_path=None):
+    """
+    Returns a spec for each of *targets* (render targets; defaults to each of
+    *spec*'s) in each of *formats* (defaults to *spec*'s `file_type`), named
+    `<name>_<target>` and rendered into *output_path* (defaults to *spec*'s).
+    Use `targets=[spec.render]` to keep everything together (just change the
+    format/location).
+    """
+    if targets is None:
+        targets = [(target,) for target in spec.render]
+    specs = []
+    for file_type in formats or [spec.file_type]:
+        for render in targets:
+            render = freeze(render)
+            name = spec.name
+            if render != spec.render:
+                name = f"{spec.name}_{render[0].lstrip('%')}"
+            specs.append(spec._replace(name=name, render=render,
+                file_type=file_type,
+                output_path=str(output_path or spec.output_path)))
+    return specs
@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+
+"""
+Keeps track of which keycaps in a build have actually finished rendering so
+that an interrupted build (Ctrl-C, power outage, OOM killer, etc) can pick up
+exactly where it left off.
+
+OpenSCAD writes its output file as it goes so if it gets killed part way
+through you're left with a truncated `.3mf`/`.stl` that *looks* finished.  To
+avoid that `engine.RenderEngine` renders every keycap to a temporary file
+next to its final destination (see `partial_output_file()`) and only renames
+it into place (atomically) once OpenSCAD exits successfully.  Each result is
+recorded in a build journal (JSON) that lives in the output directory::
+
+    {
+        "<job hash>": {
+            "name": "tilde",
+            "output": "/tmp/output_dir/tilde.3mf",
+            "status": "done",
+            "output_hash": "<sha256 of the output file>",
+            "duration": 93.2,
+            "peak_memory_mb": 812.4,
+            "features": {...},
+            "finished": 1697040000.0
+        },
+        ...
+    }
+
+Rewriting the whole journal every time a job changes state would make a big
+build quadratic so changes get appended to a log next to it instead
+(`.keycap_journal.json.log`; one `[job hash, changed fields]` JSON record per
+line) that gets replayed on top of the journal when it's loaded.  Every
+`COMPACT_AFTER` records the log gets folded back into the journal.
+
+A keycap is only considered done if its job hash (which covers every parameter
+that gets passed to OpenSCAD) is in the journal as "done" *and* the file on
+disk still matches the recorded hash.  The recorded durations, peak memory,
+and features (see `costmodel.py`) double as the history that the build
+planner uses to estimate how long future builds will take.
+"""
+
+# stdlib imports
+import os
+import json
+import time
+import hashlib
+import threading
+from pathlib import Path
+# Our own stuff
+from costmodel import features
+
+JOURNAL_NAME = ".keycap_journal.json"
+COMPACT_AFTER = 256 # Log records before the journal gets rewritten in full
+
+def job_hash(keycap):
+    """
+    Returns a hash that uniquely identifies the render job for *keycap*.  It's
+    made from the OpenSCAD command line (minus the output location) so any
+    change to the keycap's parameters results in a new hash.
+    """
+    command = keycap.command(output_file=f"OUTPUT.{keycap.file_type}")
+    return hashlib.sha256(
+        f"{keycap.name}\0{command}".encode("utf-8")).hexdigest()
+
+def file_hash(path, chunk_size=1024*1024):
+    """
+    Returns the sha256 hex digest of the file at *path*.
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def partial_output_file(output_file):
+    """
+    Returns the temporary file we render to before renaming it to
+    *output_file*.  The extension is kept since OpenSCAD uses it to figure out
+    which format to export.
+    """
+    output_file = Path(output_file)
+    return output_file.with_name(f".{output_file.stem}.partial{output_file.suffix}")
+
+class BuildJournal(object):
+    """
+    A manifest of render jobs (job hash -> status, output hash, duration).
+    Every time a job changes state it gets appended to the log (see the
+    module docs) so nothing is lost if the build gets killed.  Safe to use
+    from multiple threads.
+    """
+    def __init__(self, path):
+        self.path = Path(path)
+        if self.path.is_dir():
+            self.path = self.path / JOURNAL_NAME
+        self.log_path = self.path.with_name(f"{self.path.name}.log")
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.logged = 0 # Records in the log
+        if self.path.exists():
+            try:
+                with open(self.path) as f:
+                    self.entries = json.load(f)
+            except ValueError:
+                # The journal itself is written atomically so this should
+                # never happen but a corrupt journal just means a full build
+                self.entries = {}
+        if self.log_path.exists():
+            self._replay()
+
+    def _replay(self):
+        """
+        Applies the records in the log to `self.entries`.
+        """
+        with open(self.log_path) as f:
+            for line in f:
+                try:
+                    job, fields = json.loads(line)
+                except ValueError:
+                    # Cut short by a crash (everything before it counts).
+                    # Nothing can go after it so compact on the next update:
+                    self.logged = COMPACT_AFTER
+                    break
+                self.entries.setdefault(job, {}).update(fields)
+                self.logged += 1
+
+    def save(self):
+        """
+        Writes the whole journal to disk and empties the log.  Uses a
+        temporary file + `os.replace()` so the journal can never end up
+        truncated.
+        """
+        tmp_path = self.path.with_name(f"{self.path.name}.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(self.entries, f, indent=2, sort_keys=True)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        # If we die right here the log just gets replayed again (harmless):
+        if self.log_path.exists():
+            self.log_path.unlink()
+        self.logged = 0
+
+    def _update(self, keycap, **fields):
+        job = job_hash(keycap)
+        fields = dict(
+            name=keycap.name, output=str(keycap.output_file), **fields)
+        with self.lock:
+            self.entries.setdefault(job, {}).update(fields)
+            if self.logged >= COMPACT_AFTER:
+                self.save()
+                return
+            with open(self.log_path, "a") as f:
+                f.write(json.dumps([job, fields], sort_keys=True) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            self.logged += 1
+
+    def entry(self, keycap):
+        """
+        Returns the journal entry for *keycap* (or `None`).
+        """
+        return self.entries.get(job_hash(keycap))
+
+    def is_done(self, keycap):
+        """
+        Returns `True` if *keycap* was rendered successfully with its current
+        parameters and the output file hasn't been truncated/changed since.
+        """
+        entry = self.entry(keycap)
+        if not entry or entry.get("status") != "done":
+            return False
+        output_file = keycap.output_file
+        if not output_file.exists():
+            return False
+        return file_hash(output_file) == entry.get("output_hash")
+
+    def start(self, keycap):
+        self._update(keycap, status="running", started=time.time())
+
+    def finish(self, keycap, duration, peak_memory_mb=None, validation=None):
+        self._update(keycap,
+            status="done", duration=round(duration, 3),
+            peak_memory_mb=peak_memory_mb, features=features(keycap),
+            validation=validation,
+            output_hash=file_hash(keycap.output_file), finished=time.time())
+
+    def fail(self, keycap, duration, output=""):
+        # Only keep the tail of the output; OpenSCAD can be chatty
+        self._update(keycap,
+            status="failed", duration=round(duration, 3),
+            error=output[-2000:], finished=time.time())
@@ -135,6 +135,7 @@ class Keycap(object):
             rotation=[[0,0,0]], rotation2=[[0,0,0]],
             scale=[[1,1,1]], underset=[[0,0,0]],
             legend_carved=False,
+            fn=None, # $fn (None means use the default in keycap_playground.scad)
             keycap_playground_path=Path("./keycap_playground.scad"),
             file_type="3mf",
             openscad_path=Path("/usr/bin/openscad"),
@@ -205,6 +206,7 @@ class Keycap(object):
         self.scale = scale
         self.underset = underset
         self.legend_carved = legend_carved
+        self.fn = fn
         self.file_type = file_type
         self.keycap_playground_path = keycap_playground_path
         self.colorscad_path = colorscad_path
@@ -250,35 +252,70 @@ class Keycap(object):
         scale: {self.scale}
         underset: {self.underset}"""
 
+    @property
+    def output_file(self):
+        """
+        Where the rendered keycap ends up (`output_path/name.file_type`).
+        """
+        return Path(self.output_path) / f"{self.name}.{self.file_type}"
+
     def __str__(self):
         """
         Returns the OpenSCAD command line to use to generate this keycap.
         """
-        first_part = (
-            f"{self.openscad_path} {self.openscad_args} -o "
-            f"'{self.output_path}'/'{self.name}.{self.file_type}' -D $'"
-        )
-        last_part = self.keycap_playground_path
-        render = self.render
-        if str(self.colorscad_path): # Use colorscad.sh
-            # Check to make sure it actually exists
-            if os.path.exists(self.colorscad_path):
-                # Add openscad to the $PATH variable so colorscad can find it
-                os.environ["PATH"] += f"{self.openscad_path.parent}"
-                first_part = (
-                    #f'PATH="${self.openscad_path.parent}:$PATH"; '
-                    f"{self.colorscad_path} -i {self.keycap_playground_path} "
-                    f"-o '{self.output_path}'/'{self.name}.{self.file_type}' "
-                    f"-p '{self.openscad_path}' "
-                    f"-- {self.openscad_args} -D $'"
-                )
-                last_part = ""
-                #render = ["keycap", "stem", "legends"]
+        return self.command()
+
+    def uses_colorscad(self):
+        """
+        Returns `True` if this keycap will be rendered using colorscad.sh
+        (i.e. `colorscad_path` points to an actual file).
+        """
+        # NOTE: str(Path("")) is "." which is why we check for a file here:
+        if not str(self.colorscad_path): # Don't use colorscad.sh
+            return False
+        # Check to make sure it actually exists
+        return os.path.isfile(self.colorscad_path)
+
+    def environment(self):
+        """
+        Returns the environment (a copy of `os.environ`) to run this keycap's
+        command in.  When colorscad.sh is used openscad's directory gets added
+        to `$PATH` so colorscad can find it.
+        """
+        env = dict(os.environ)
+        if self.uses_colorscad():
+            openscad_dir = str(Path(self.openscad_path).parent)
+            paths = env.get("PATH", "").split(os.pathsep)
+            if openscad_dir not in paths:
+                env["PATH"] = os.pathsep.join(paths + [openscad_dir])
+        return env
+
+    def render_targets(self):
+        """
+        Returns what will actually get passed to OpenSCAD as `RENDER` (a copy;
+        `self.render` is never modified).
+        """
+        render = list(self.render)
+        if self.uses_colorscad():
+            #render = ["keycap", "stem", "legends"]
+            if "legends" not in render:
                 render.append("legends")
+        return render
+
+    def definitions(self, legends=None, render=None):
+        """
+        Returns the variable assignments (e.g. `KEY_PROFILE="gem"; ...`) that
+        get passed to OpenSCAD via `-D`.  *legends* is the already-encoded
+        `LEGENDS` value (defaults to the JSON encoding of `self.legends`) and
+        *render* the `RENDER` list (defaults to `render_targets()`).
+        """
+        if render is None:
+            render = self.render_targets()
+        if legends is None:
+            legends = json.dumps(self.legends)
         # NOTE: Since OpenSCAD requires double quotes I'm using the json module
         #       to encode things that need it:
         return (
-            f"{first_part}"
             f"RENDER={json.dumps(render)}; "
             f"KEY_PROFILE={json.dumps(self.key_profile)}; "
             f"KEY_LENGTH={round(self.key_length,2)}; "
@@ -327,7 +364,7 @@ class Keycap(object):
             f"HOMING_DOT_X={self.homing_dot_x}; "
             f"HOMING_DOT_Y={self.homing_dot_y}; "
             f"HOMING_DOT_Z={self.homing_dot_z}; "
-            f"LEGENDS={self.quote(self.legends)}; "
+            f"LEGENDS={legends}; "
             f"LEGEND_FONTS={json.dumps(self.fonts)}; "
             f"LEGEND_FONT_SIZES={self.font_sizes}; "
             f"LEGEND_TRANS={self.trans}; "
@@ -336,11 +373,67 @@ class Keycap(object):
             f"LEGEND_ROTATION2={self.rotation2}; "
             f"LEGEND_SCALE={self.scale}; "
             f"LEGEND_UNDERSET={self.underset}; "
+            + (f"$fn={self.fn}; " if self.fn else "") +
 # NOTE: For some reason I have to duplicate RENDER here for it to work properly:
-            f"RENDER={json.dumps(render)};' "
+            f"RENDER={json.dumps(render)};"
+        )
+
+    def command(self, output_file=None):
+        """
+        Returns the OpenSCAD command line that renders this keycap to
+        *output_file* (defaults to `self.output_file`).  Rendering somewhere
+        else is how `engine.RenderEngine` avoids leaving half-written files in
+        the output directory (it renders to a `.partial` file and renames it
+        into place when it's done; see `journal.partial_output_file()`).
+        """
+        if output_file is None:
+            output_file = self.output_file
+        output_file = Path(output_file)
+        first_part = (
+            f"{self.openscad_path} {self.openscad_args} -o "
+            f"'{output_file.parent}'/'{output_file.name}' -D $'"
+        )
+        last_part = self.keycap_playground_path
+        if self.uses_colorscad():
+            first_part = (
+                #f'PATH="${self.openscad_path.parent}:$PATH"; '
+                f"{self.colorscad_path} -i {self.keycap_playground_path} "
+                f"-o '{output_file.parent}'/'{output_file.name}' "
+                f"-p '{self.openscad_path}' "
+                f"-- {self.openscad_args} -D $'"
+            )
+            last_part = ""
+        return (
+            f"{first_part}"
+            f"{self.definitions(legends=self.quote(self.legends))}' "
             f"{last_part}"
         )
 
+    def args(self, output_file=None):
+        """
+        Returns the OpenSCAD command (as a list of arguments) that renders this
+        keycap to *output_file* (defaults to `self.output_file`).  Unlike
+        `command()` this is meant to be executed directly (no shell) so
+        there's no need to worry about escaping quotes in legends.
+        """
+        if output_file is None:
+            output_file = self.output_file
+        openscad_args = self.openscad_args.split()
+        definitions = self.definitions()
+        if self.uses_colorscad():
+            return [
+                str(self.colorscad_path),
+                "-i", str(self.keycap_playground_path),
+                "-o", str(output_file),
+                "-p", str(self.openscad_path),
+                "--", *openscad_args, "-D", definitions,
+            ]
+        return [
+            str(self.openscad_path), *openscad_args,
+            "-o", str(output_file), "-D", definitions,
+            str(self.keycap_playground_path),
+        ]
+
     def postinit(self, **kwargs):
         """
         Override anything passed in via kwargs
@@ -0,0 +1,446 @@
+#!/usr/bin/env python3
+
+"""
+Works out where each of a keycap's legends will end up on its top (using the
+font outlines from `fonts.py` and the shell model from `shell.py`) so legends
+that hang off the edge of the usable top area can be caught *before* spending
+minutes rendering them.  It can also suggest a `font_sizes`/`trans` that'll
+fit instead of finding one by trial and error::
+
+    $ ./scripts/legends.py riskeycap_full numpadminus Tab
+    $ ./scripts/legends.py --center riskeycap_full  # Also suggest centering
+
+Legends are positioned exactly like `poly_keycap()` does it (`trans`,
+`rotation`, `scale`, `trans2`, `rotation2`, `underset`) and then followed
+along their extrusion direction until they hit the top of the keycap.  Only
+legends that land on the top get checked; front/side legends (e.g.
+`rotation=[[68,0,0]]`) are left alone.
+
+`font_preflight()` checks that every font a keyset uses is actually installed
+(OpenSCAD silently substitutes a different font if it isn't) and has glyphs
+for all the legend characters::
+
+    $ ./scripts/legends.py --fonts riskeyboard_70
+
+.. note::
+
+    Requires NumPy and fontTools (`pip install numpy fonttools`).
+"""
+
+# stdlib imports
+import re
+import sys
+import argparse
+import importlib
+# 3rd party stuff
+from colorama import Style
+# Our own stuff
+from fonts import (
+    FontMetrics, FontException, DEFAULT_FONT, find_font, save_all,
+    warm_fontconfig)
+from shell import Shell, ShellException, np
+from mesh import rotation_matrix
+
+# How close (mm) a legend is allowed to get to the edge of the top
+LEGEND_MARGIN = 0.5
+# We won't suggest shrinking a legend below this size
+MIN_FONT_SIZE = 2
+# Legends whose extrusion points less upward than this are front/side legends
+MIN_TOP_FACING = 0.5
+# Iterations used to find where a legend's extrusion meets the top
+LANDING_ITERATIONS = 4
+# OpenSCAD string escapes (legends like "\\u005c" get passed through as-is)
+SCAD_ESCAPE = re.compile(
+    r'\\(u[0-9a-fA-F]{4}|U[0-9a-fA-F]{6}|x[0-9a-fA-F]{2}|[\\"ntr])')
+SCAD_ESCAPES = {"\\": "\\", '"': '"', "n": "\n", "t": "\t", "r": "\r"}
+
+def unescape(text):
+    """
+    Returns *text* with OpenSCAD's string escapes (`\\u005c` etc) decoded.
+    """
+    def decode(match):
+        escape = match.group(1)
+        if escape[0] in "uUx":
+            return chr(int(escape[1:], 16))
+        return SCAD_ESCAPES[escape]
+    return SCAD_ESCAPE.sub(decode, text or "")
+
+def _pick(values, i, default):
+    """
+    Mirrors the `legend_trans[i] ? legend_trans[i] : legend_trans[0]`
+    fallback `poly_keycap()` uses for per-legend settings.
+    """
+    if i < len(values) and values[i]:
+        return values[i]
+    if values and values[0]:
+        return values[0]
+    return default
+
+class Placement(object):
+    """
+    Everything that determines where legend number *index* of a keycap goes.
+    """
+    def __init__(self, keycap, index):
+        self.index = index
+        self.text = unescape(keycap.legends[index])
+        self.font = _pick(keycap.fonts, index, DEFAULT_FONT)
+        self.size = _pick(keycap.font_sizes, index, 6)
+        self.trans = list(_pick(keycap.trans, index, [0, 0, 0]))
+        self.trans2 = list(_pick(keycap.trans2, index, [0, 0, 0]))
+        self.rotation = list(_pick(keycap.rotation, index, [0, 0, 0]))
+        self.rotation2 = list(_pick(keycap.rotation2, index, [0, 0, 0]))
+        self.scale = list(_pick(keycap.scale, index, [1, 1, 1]))
+        self.underset = list(_pick(keycap.underset, index, [0, 0, 0]))
+
+    def transform(self, tilt=0):
+        """
+        Returns the 4x4 matrix that puts the legend in place (*tilt* is the
+        `tilt_above_curved` rotation applied to curved-tilt dishes).
+        """
+        def translate(v):
+            m = np.eye(4)
+            m[:3, 3] = (list(v) + [0, 0, 0])[:3]
+            return m
+
+        def rotate(v):
+            m = np.eye(4)
+            m[:3, :3] = rotation_matrix((list(v) + [0, 0, 0])[:3])
+            return m
+
+        scale = np.diag((list(self.scale) + [1, 1, 1])[:3] + [1])
+        return (translate(self.underset) @ translate(self.trans2)
+                @ rotate(self.rotation2) @ translate(self.trans)
+                @ rotate(self.rotation) @ scale @ rotate([tilt, 0, 0]))
+
+class LegendFit(object):
+    """
+    The result of checking one legend: *status* is one of "ok", "overflow",
+    "side" (not on the top so not checked), "empty" or "no font".  For
+    overflowing legends *size* and *trans* are the suggested replacements
+    (`None` if shrinking to `MIN_FONT_SIZE` still doesn't do it).
+    """
+    def __init__(self, placement, status, overflow=0.0, size=None,
+                 trans=None, message=""):
+        self.placement = placement
+        self.status = status
+        self.overflow = overflow
+        self.size = size
+        self.trans = trans
+        self.message = message
+        self.bounds = None # (min_xy, max_xy) of where it lands on the top
+
+    @property
+    def ok(self):
+        return self.status != "overflow"
+
+class LegendSolver(object):
+    """
+    Checks (and fits) the legends of *keycap* against its top.
+    """
+    def __init__(self, keycap, row=1):
+        self.keycap = keycap
+        self.shell = Shell.from_keycap(keycap, row=row)
+        tilt = self.shell.dish_tilt if self.shell.dish_tilt_curve else 0
+        self.tilt = tilt
+        self.top = self.shell.layers[-1]
+
+    def land(self, placement, points, trans=None):
+        """
+        Returns the `(N, 2)` XY coordinates where the legend *points* (2D,
+        in the legend's own plane) meet the top of the keycap along the
+        legend's extrusion direction.  Points that miss the keycap are NaN.
+        """
+        if trans is not None:
+            placement = _moved(placement, trans)
+        matrix = placement.transform(self.tilt)
+        base = (np.c_[points, np.zeros(len(points)), np.ones(len(points))]
+                @ matrix.T)[:, :3]
+        direction = matrix[:3, 2]
+        t = np.zeros(len(points))
+        for _ in range(LANDING_ITERATIONS):
+            landed = base + t[:, None]*direction
+            z = self.shell.height_at(landed[:, 0], landed[:, 1])
+            t = (z - base[:, 2])/direction[2]
+        return (base + t[:, None]*direction)[:, :2]
+
+    def overflow(self, xy):
+        """
+        Returns how far (mm) the worst of the *xy* points goes past the
+        usable top area (0 if they're all inside).
+        """
+        if not len(xy):
+            return 0.0
+        margin, _ = self.top.locate(xy[:, 0], xy[:, 1])
+        if np.isnan(margin).any():
+            return np.inf # Missed the keycap entirely
+        return max(0.0, LEGEND_MARGIN - float(margin.min()))
+
+    def _shift(self, xy):
+        """
+        Returns the XY shift that moves the box around *xy* inside the usable
+        top area (as much as possible).
+        """
+        half = np.array(self.top.size)/2 - LEGEND_MARGIN - self.top.radius/2
+        center = np.array(self.top.offset[:2])
+        low, high = xy.min(axis=0) - center, xy.max(axis=0) - center
+        shift = np.zeros(2)
+        for axis in (0, 1):
+            if high[axis] - low[axis] > 2*half[axis]:
+                shift[axis] = -(low[axis] + high[axis])/2 # Just center it
+            elif low[axis] < -half[axis]:
+                shift[axis] = -half[axis] - low[axis]
+            elif high[axis] > half[axis]:
+                shift[axis] = half[axis] - high[axis]
+        return shift
+
+    def _shifted_trans(self, placement, shift):
+        """
+        Returns *placement*'s `trans` adjusted so the legend moves by *shift*
+        (XY, in keycap coordinates).
+        """
+        # trans gets applied after rotation2 so undo that to move in XY:
+        local = rotation_matrix(placement.rotation2).T @ [shift[0], shift[1], 0]
+        return [round(float(a + b), 2) for a, b in
+                zip((placement.trans + [0, 0, 0])[:3], local)]
+
+    def _try(self, placement, metrics, size):
+        """
+        Returns `(trans, overflow)` for *placement* at *size* after shifting
+        it back onto the top if it's hanging off.
+        """
+        points = metrics.outline(placement.text, size)
+        xy = self.land(placement, points)
+        if np.isnan(xy).any():
+            return placement.trans, np.inf
+        trans = self._shifted_trans(placement, self._shift(xy))
+        return trans, self.overflow(self.land(placement, points, trans))
+
+    def fit(self, placement, center=False):
+        """
+        Checks *placement* and returns a `LegendFit`.  If *center* the
+        suggested `trans` centers the legend on the top even if it fits.
+        """
+        if not placement.text:
+            return LegendFit(placement, "empty")
+        matrix = placement.transform(self.tilt)
+        direction = matrix[:3, 2]/np.linalg.norm(matrix[:3, 2])
+        if direction[2] < MIN_TOP_FACING:
+            return LegendFit(placement, "side")
+        try:
+            metrics = FontMetrics.for_font(placement.font)
+        except FontException as e:
+            return LegendFit(placement, "no font", message=str(e))
+        points = metrics.outline(placement.text, placement.size)
+        xy = self.land(placement, points)
+        overflow = self.overflow(xy) if len(xy) else 0.0
+        result = LegendFit(placement, "ok", overflow=overflow)
+        if len(xy) and not np.isnan(xy).any():
+            result.bounds = (xy.min(axis=0), xy.max(axis=0))
+        if center and len(xy) and not np.isnan(xy).any():
+            middle = (xy.min(axis=0) + xy.max(axis=0))/2
+            shift = np.array(self.top.offset[:2]) - middle
+            result.trans = self._shifted_trans(placement, shift)
+        if not overflow:
+            return result
+        result.status = "overflow"
+        if np.isinf(overflow):
+            result.message = f"{placement.text!r} misses the top entirely"
+        else:
+            result.message = (f"{placement.text!r} goes {overflow:.2f}mm past "
+                              f"the edge of the top")
+        # Can we just move it?
+        trans, remaining = self._try(placement, metrics, placement.size)
+        if not remaining:
+            result.size, result.trans = placement.size, trans
+            return result
+        # Nope; find the biggest size that fits (moving it as needed)
+        low, high = MIN_FONT_SIZE, placement.size
+        trans, remaining = self._try(placement, metrics, low)
+        if remaining:
+            return result # Won't fit at any sensible size
+        best = (low, trans)
+        for _ in range(12):
+            middle = (low + high)/2
+            trans, remaining = self._try(placement, metrics, middle)
+            if remaining:
+                high = middle
+            else:
+                low = middle
+                best = (middle, trans)
+        result.size = np.floor(best[0]*10)/10
+        result.trans = self._try(placement, metrics, result.size)[0]
+        return result
+
+    def check(self, center=False):
+        """
+        Returns a `LegendFit` for each of the keycap's legends.
+        """
+        fits = [self.fit(Placement(self.keycap, i), center=center and i == 0)
+                for i in range(len(self.keycap.legends))]
+        save_all()
+        return fits
+
+def _moved(placement, trans):
+    moved = object.__new__(Placement)
+    moved.__dict__.update(placement.__dict__)
+    moved.trans = trans
+    return moved
+
+def _overlaps(fits):
+    """
+    Returns the pairs of *fits* whose legends land on top of each other.
+    """
+    placed = [f for f in fits if f.bounds is not None]
+    pairs = []
+    for i, a in enumerate(placed):
+        for b in placed[i + 1:]:
+            if (np.all(a.bounds[0] < b.bounds[1])
+                    and np.all(b.bounds[0] < a.bounds[1])):
+                pairs.append((a, b))
+    return pairs
+
+def legend_problems(keycap, row=1):
+    """
+    Returns a list of human-readable problems with *keycap*'s legends
+    (overflowing or overlapping legends).  Fonts that can't be found and
+    keycaps that can't be modeled are skipped.
+    """
+    if not any(keycap.legends):
+        return []
+    try:
+        fits = LegendSolver(keycap, row=row).check()
+    except ShellException:
+        return []
+    problems = []
+    for fit in fits:
+        if fit.status != "overflow":
+            continue
+        problem = fit.message
+        if fit.size is not None:
+            problem += (f" (try font_sizes[{fit.placement.index}]="
+                        f"{fit.size:g}, trans[{fit.placement.index}]="
+                        f"{fit.trans})")
+        problems.append(problem)
+    for a, b in _overlaps(fits):
+        problems.append(
+            f"{a.placement.text!r} and {b.placement.text!r} overlap")
+    return problems
+
+def font_problems(keycap):
+    """
+    Returns a list of human-readable problems with the fonts *keycap*'s
+    legends use: fonts that aren't installed (OpenSCAD would silently use
+    some other font) and characters the font has no glyph for.
+    """
+    if set(keycap.render) <= {"stem"}:
+        return [] # No legends in the output
+    problems = []
+    missing_fonts = set()
+    for i, legend in enumerate(keycap.legends):
+        if not legend:
+            continue
+        placement = Placement(keycap, i)
+        if find_font(placement.font) is None:
+            if placement.font not in missing_fonts:
+                missing_fonts.add(placement.font)
+                problems.append(f"Font not installed: {placement.font}")
+            continue
+        try:
+            missing = FontMetrics.for_font(placement.font).missing(
+                placement.text)
+        except FontException as e:
+            problems.append(str(e))
+            continue
+        for char in missing:
+            problems.append(
+                f"{placement.font} has no glyph for {char!r} "
+                f"(U+{ord(char):04X}) in legend {placement.text!r}")
+    return problems
+
+def font_preflight(keycaps):
+    """
+    Checks the fonts of all *keycaps* (see `font_problems()`) after bringing
+    fontconfig's cache up to date.  Returns a dict of keycap name to its
+    list of problems (only keycaps with problems are included).
+    """
+    warm_fontconfig()
+    flagged = {}
+    for keycap in keycaps:
+        problems = font_problems(keycap)
+        if problems:
+            flagged[keycap.name] = problems
+    save_all()
+    return flagged
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Check that keycap legends fit on the top (without "
+                    "rendering anything) and suggest sizes/offsets that do.")
+    parser.add_argument('--center',
+        required=False, action='store_true',
+        help="Also suggest a trans that centers the first legend.")
+    parser.add_argument('--row',
+        metavar='<n>', type=int, default=1,
+        help="Row for profiles with per-row shapes (DCS, DSS, KAT).")
+    parser.add_argument('--fonts',
+        required=False, action='store_true',
+        help="Only check that the fonts are installed and have glyphs for "
+             "every legend.")
+    parser.add_argument('module',
+        metavar="module",
+        help="The keyset script to check (e.g. riskeycap_full).")
+    parser.add_argument('names',
+        nargs='*', metavar="name",
+        help='Only check the keycaps with these names.')
+    args = parser.parse_args()
+    keycaps = importlib.import_module(args.module).KEYCAPS
+    if args.names:
+        lowered = [name.lower() for name in args.names]
+        keycaps = [k for k in keycaps if k.name.lower() in lowered]
+    if args.fonts:
+        flagged = font_preflight(keycaps)
+        for name, problems in flagged.items():
+            print(Style.BRIGHT + f"{name}:" + Style.RESET_ALL)
+            for problem in problems:
+                print(f"    {problem}")
+        if flagged:
+            print(Style.BRIGHT + f"{len(flagged)} keycap(s) have font "
+                  f"problems" + Style.RESET_ALL)
+            sys.exit(1)
+        print(f"All fonts used by {len(keycaps)} keycap(s) are installed")
+        return
+    failed = 0
+    for keycap in keycaps:
+        try:
+            fits = LegendSolver(keycap, row=args.row).check(center=args.center)
+        except ShellException as e:
+            print(f"{keycap.name}: {e}")
+            continue
+        overlaps = _overlaps(fits)
+        bad = [f for f in fits if not f.ok]
+        if bad or overlaps:
+            failed += 1
+            print(Style.BRIGHT + f"{keycap.name}:" + Style.RESET_ALL)
+        else:
+            print(f"{keycap.name}:")
+        for fit in fits:
+            placement = fit.placement
+            if fit.status == "empty":
+                continue
+            line = f"    [{placement.index}] {placement.text!r}: {fit.status}"
+            if fit.message:
+                line += f" ({fit.message})"
+            if fit.size is not None:
+                line += f"; try size={fit.size:g} trans={fit.trans}"
+            elif fit.trans is not None:
+                line += f"; centered trans={fit.trans}"
+            print(line)
+        for a, b in overlaps:
+            print(f"    {a.placement.text!r} and {b.placement.text!r} overlap")
+    if failed:
+        print(Style.BRIGHT + f"{failed} keycap(s) have legends that don't fit"
+              + Style.RESET_ALL)
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,538 @@
+#!/usr/bin/env python3
+
+"""
+Loads the meshes OpenSCAD spits out (binary/ASCII `.stl` and `.3mf`) into NumPy
+arrays and provides some basic (vectorized) analysis of them: watertightness,
+volume, bounding box, and connected components.  Meshes can also be written
+back out as binary STL or (multi-object) 3MF files and separately-rendered
+parts merged back into one file (`merge_files()`).
+
+Everything is vectorized (no Python-level loop per vertex or triangle) so
+processing a whole keyset's worth of files only takes a few seconds:
+
+ * Binary STLs are memory-mapped straight into a structured array
+   (`stl_records()`; no copies at all until you do math on them).
+ * ASCII STLs and 3MF files get tokenized by C code (`bytes.split()`/`re`)
+   and converted to numbers by NumPy in one go (no XML tree gets built).
+ * Welding (`weld()`) hashes the quantized coordinates so it only has to sort
+   one integer per vertex (falling back to a full row sort if two different
+   vertices ever end up with the same hash).
+ * Writing formats the whole vertex/triangle list with a single `%` operation
+   (3MF) or writes the structured array directly (STL).
+
+Meshes are represented as a `Mesh` which is just a `(N, 3)` float array of
+(welded) vertices and a `(M, 3)` int array of triangles (vertex indices)::
+
+    >>> mesh = load_mesh("/tmp/output_dir/tilde.3mf")
+    >>> len(mesh.faces), mesh.volume(), mesh.bounds()
+
+.. note::
+
+    Requires NumPy (`pip install numpy`).
+"""
+
+# stdlib imports
+import re
+import mmap
+import zipfile
+from pathlib import Path
+# 3rd party stuff
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Vertices closer together than this (mm) are considered the same vertex
+WELD_TOLERANCE = 1e-5
+# Odd 64-bit multipliers used to hash quantized vertex coordinates:
+HASH_MULTIPLIERS = (0x9E3779B97F4A7C15, 0xC2B2AE3D27D4EB4F, 0x165667B19E3779F9)
+# The core 3MF namespace (what OpenSCAD and colorscad use)
+NS_3MF = "{http://schemas.microsoft.com/3dmanufacturing/core/2015/02}"
+# An XML attribute (for 3MF files that `_attributes()` can't handle):
+ATTRIBUTE = re.compile(rb"""([\w:]+)\s*=\s*["']([^"']*)["']""")
+
+class MeshException(Exception):
+    """
+    Raised when a mesh can't be loaded (bad/unsupported file or no NumPy).
+    """
+    pass
+
+def require_numpy():
+    if np is None:
+        raise MeshException(
+            "NumPy is required for mesh analysis (pip install numpy)")
+
+def stl_dtype():
+    """
+    Returns the NumPy dtype of a binary STL triangle record (50 bytes).
+    """
+    return np.dtype([
+        ("normal", "<f4", (3,)), ("vertices", "<f4", (3, 3)),
+        ("attr", "<u2")])
+
+class Mesh(object):
+    """
+    A triangle mesh: *vertices* `(N, 3)` float64 and *faces* `(M, 3)` int64.
+    """
+    def __init__(self, vertices, faces):
+        self.vertices = vertices
+        self.faces = faces
+
+    def __len__(self):
+        return len(self.faces)
+
+    def triangles(self):
+        """
+        Returns the `(M, 3, 3)` array of triangle vertex coordinates.
+        """
+        return self.vertices[self.faces]
+
+    def areas(self):
+        """
+        Returns the area of each triangle.
+        """
+        tris = self.triangles()
+        return np.linalg.norm(
+            np.cross(tris[:, 1] - tris[:, 0], tris[:, 2] - tris[:, 0]),
+            axis=1) / 2.0
+
+    def bounds(self):
+        """
+        Returns `(min_xyz, max_xyz)` of the mesh.
+        """
+        used = self.vertices[np.unique(self.faces)]
+        return used.min(axis=0), used.max(axis=0)
+
+    def extents(self):
+        low, high = self.bounds()
+        return high - low
+
+    def volume(self):
+        """
+        Returns the signed volume of the mesh (negative means it's inside-out).
+        Only meaningful if the mesh is watertight.
+        """
+        tris = self.triangles()
+        return np.einsum(
+            "ij,ij->i", tris[:, 0], np.cross(tris[:, 1], tris[:, 2])
+        ).sum() / 6.0
+
+    def edges(self):
+        """
+        Returns the `(3M, 2)` array of directed edges (one per triangle side).
+        """
+        return self.faces[:, [0, 1, 1, 2, 2, 0]].reshape(-1, 2)
+
+    def edge_stats(self):
+        """
+        Returns `(boundary_edges, non_manifold_edges, misoriented_edges)`.
+        A closed, consistently-oriented (watertight) mesh has zero of each.
+        """
+        directed = self.edges()
+        undirected = np.sort(directed, axis=1)
+        _, counts = np.unique(undirected, axis=0, return_counts=True)
+        _, directed_counts = np.unique(directed, axis=0, return_counts=True)
+        return (
+            int((counts == 1).sum()),
+            int((counts > 2).sum()),
+            int((directed_counts > 1).sum()))
+
+    def is_watertight(self):
+        return self.edge_stats() == (0, 0, 0)
+
+    def component_labels(self):
+        """
+        Returns an array with the connected component label of each face.
+        Faces sharing a vertex belong to the same component.  Uses vectorized
+        label propagation + pointer jumping (no Python-level loop per face).
+        """
+        labels = np.arange(len(self.vertices))
+        edges = self.edges()
+        a, b = edges[:, 0], edges[:, 1]
+        while True:
+            lowest = np.minimum(labels[a], labels[b])
+            updated = labels.copy()
+            np.minimum.at(updated, a, lowest)
+            np.minimum.at(updated, b, lowest)
+            updated = updated[updated] # Pointer jumping
+            if np.array_equal(updated, labels):
+                break
+            labels = updated
+        return labels[self.faces[:, 0]]
+
+    def components(self):
+        """
+        Returns a list of `Mesh` (one per connected component), biggest
+        (most triangles) first.
+        """
+        labels = self.component_labels()
+        unique, counts = np.unique(labels, return_counts=True)
+        order = unique[np.argsort(-counts, kind="stable")]
+        return [Mesh(self.vertices, self.faces[labels == label])
+                for label in order]
+
+def _hash_rows(keys):
+    """
+    Returns a 64-bit hash of each row of *keys* (`(N, 3)` int64).
+    """
+    hashes = np.zeros(len(keys), dtype=np.uint64)
+    with np.errstate(over="ignore"): # Wrapping around is the whole point
+        for column, multiplier in enumerate(HASH_MULTIPLIERS):
+            hashes ^= keys[:, column].astype(np.uint64) * np.uint64(multiplier)
+            hashes ^= hashes >> np.uint64(29)
+    return hashes
+
+def weld(vertices, faces, tolerance=WELD_TOLERANCE):
+    """
+    Merges duplicate vertices (STL stores three per triangle) and drops any
+    triangles that end up degenerate.  Returns a new `Mesh` (with float64
+    vertices).
+    """
+    keys = np.rint(np.multiply(
+        vertices, 1.0 / tolerance, dtype=np.float64)).astype(np.int64)
+    _, first, inverse = np.unique(
+        _hash_rows(keys), return_index=True, return_inverse=True)
+    if not np.array_equal(keys[first][inverse.reshape(-1)], keys):
+        # Two different vertices hashed the same (very unlikely); do it the
+        # slow (but exact) way:
+        _, first, inverse = np.unique(
+            keys, axis=0, return_index=True, return_inverse=True)
+    faces = inverse.reshape(-1)[faces]
+    degenerate = ((faces[:, 0] == faces[:, 1]) | (faces[:, 1] == faces[:, 2])
+                  | (faces[:, 0] == faces[:, 2]))
+    return Mesh(vertices[first].astype(np.float64), faces[~degenerate])
+
+def _triangle_soup(tris):
+    """
+    Turns an `(M, 3, 3)` array of triangle coordinates into a welded `Mesh`.
+    """
+    vertices = tris.reshape(-1, 3)
+    faces = np.arange(len(vertices)).reshape(-1, 3)
+    return weld(vertices, faces)
+
+def _is_binary_stl(path):
+    size = path.stat().st_size
+    if size < 84:
+        return False
+    with open(path, "rb") as f:
+        header = f.read(84)
+    count = int.from_bytes(header[80:84], "little")
+    # ASCII STLs start with "solid" but so do some binary ones (the header is
+    # free-form) so the size is what really tells them apart:
+    return size == 84 + count * 50
+
+def stl_records(path):
+    """
+    Memory-maps the binary STL at *path* as a structured array (see
+    `stl_dtype()`; fields `normal`, `vertices` and `attr`) without reading or
+    copying anything.
+    """
+    require_numpy()
+    path = Path(path)
+    if not _is_binary_stl(path):
+        raise MeshException(f"{path}: not a binary STL")
+    if path.stat().st_size == 84: # np.memmap() doesn't do empty files
+        return np.zeros(0, dtype=stl_dtype())
+    return np.memmap(path, dtype=stl_dtype(), mode="r", offset=84)
+
+def _whitespace_table():
+    table = np.zeros(256, dtype=bool)
+    table[list(b" \t\r\n")] = True
+    return table
+
+def _gather_strings(buf, starts, ends):
+    """
+    Returns the byte strings `buf[starts[i]:ends[i]]` (*buf* being a uint8
+    array) as a NumPy bytes array so they can be converted with `astype()`.
+    """
+    if not len(starts):
+        return np.zeros(0, dtype="S1")
+    width = max(int((ends - starts).max()), 1)
+    index = starts[:, None] + np.arange(width)
+    chars = buf[np.minimum(index, len(buf) - 1)]
+    chars[index >= ends[:, None]] = 0 # Trailing NULs get ignored
+    return chars.view(f"S{width}").ravel()
+
+def _ascii_stl_triangles(data):
+    """
+    Returns the `(M, 3, 3)` triangle coordinates in ASCII STL *data* (bytes
+    or mmap).  Every "vertex" keyword is followed by its three coordinates
+    so once we know where every token starts/ends (figured out for the whole
+    file at once) it's just a matter of indexing.
+    """
+    buf = np.frombuffer(data, dtype=np.uint8)
+    space = _whitespace_table()[buf]
+    # Token i spans buf[token_starts[i]:token_ends[i]]:
+    edges = np.flatnonzero(space[1:] != space[:-1]) + 1
+    if len(buf) and not space[0]:
+        edges = np.concatenate([[0], edges])
+    if len(buf) and not space[-1]:
+        edges = np.concatenate([edges, [len(buf)]])
+    token_starts, token_ends = edges[0::2], edges[1::2]
+    # Tokens that are exactly "vertex":
+    keyword = np.frombuffer(b"vertex", dtype=np.uint8)
+    candidates = np.flatnonzero(token_ends - token_starts == len(keyword))
+    for i, char in enumerate(keyword):
+        candidates = candidates[buf[token_starts[candidates] + i] == char]
+    if len(candidates) % 3 or (
+            len(candidates) and candidates[-1] + 3 >= len(token_starts)):
+        raise MeshException("truncated ASCII STL")
+    coords = candidates[:, None] + np.arange(1, 4)
+    strings = _gather_strings(
+        buf, token_starts[coords.ravel()], token_ends[coords.ravel()])
+    try:
+        return strings.astype(np.float64).reshape(-1, 3, 3)
+    except ValueError as e:
+        raise MeshException(f"bad ASCII STL ({e})")
+
+def load_stl(path):
+    """
+    Loads an STL (binary or ASCII) file as a welded `Mesh`.  The file is
+    memory-mapped rather than read into memory all at once.
+    """
+    require_numpy()
+    path = Path(path)
+    if _is_binary_stl(path):
+        return _triangle_soup(stl_records(path)["vertices"])
+    if not path.stat().st_size:
+        raise MeshException(f"{path}: empty file")
+    with open(path, "rb") as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            try:
+                tris = _ascii_stl_triangles(data)
+            except MeshException as e:
+                raise MeshException(f"{path}: {e}")
+    return _triangle_soup(tris)
+
+def _attributes_regex(block, names, dtype):
+    """
+    The slow (but picky-free) version of `_attributes()`.
+    """
+    pairs = ATTRIBUTE.findall(block)
+    if not pairs:
+        return np.zeros((0, len(names)), dtype=dtype)
+    pairs = np.array(pairs)
+    columns = [pairs[pairs[:, 0] == name, 1] for name in names]
+    if len({len(column) for column in columns}) != 1:
+        raise MeshException(
+            f"not every element has {b', '.join(names).decode()}")
+    return np.stack(columns, axis=1).astype(dtype)
+
+def _attributes(block, names, dtype):
+    """
+    Returns the values of the attributes *names* (one or two characters
+    each) of every element in the 3MF *block* (e.g. the `<vertices>` section)
+    as an `(N, len(names))` array.  Each element has to have every one of
+    *names*; other attributes are ignored.  Works directly on the bytes
+    (vectorized) as long as attributes are written like `x="1.5"` (which is
+    what everything writes); anything else goes through a regex instead.
+    """
+    buf = np.frombuffer(block, dtype=np.uint8)
+    quotes = np.flatnonzero(buf == ord('"'))
+    opens, closes = quotes[0::2], quotes[1::2]
+    if (len(quotes) % 2 or (opens < 3).any()
+            or (buf[opens - 1] != ord("=")).any()
+            or np.count_nonzero(buf == ord("=")) != len(opens)):
+        return _attributes_regex(block, names, dtype)
+    # Attribute names are whatever comes between the whitespace and '="':
+    space = _whitespace_table()
+    last, before = buf[opens - 2].astype(np.int64), buf[opens - 3]
+    before2 = buf[np.maximum(opens - 4, 0)]
+    codes = np.where(space[before], last,
+        np.where(space[before2], before.astype(np.int64) * 256 + last, -1))
+    wanted_codes = [int.from_bytes(name, "big") for name in names]
+    wanted = np.isin(codes, wanted_codes)
+    codes = codes[wanted]
+    values = _gather_strings(buf, opens[wanted] + 1, closes[wanted])
+    columns = [values[codes == code] for code in wanted_codes]
+    if len({len(column) for column in columns}) != 1:
+        raise MeshException(
+            f"not every element has {b', '.join(names).decode()}")
+    return np.stack(columns, axis=1).astype(dtype)
+
+def _sections(data, tag, start=0, end=None):
+    """
+    Yields the `<tag ...>...</tag>` sections of *data* (3MF model bytes)
+    between *start* and *end* (any namespace prefix is fine).
+    """
+    end = len(data) if end is None else end
+    opening = re.compile(rb"<((?:\w+:)?)" + tag + rb"[\s>]")
+    while True:
+        match = opening.search(data, start, end)
+        if not match:
+            return
+        closing = b"</" + match.group(1) + tag
+        close = data.find(closing, match.end(), end)
+        if close == -1:
+            raise MeshException(f"unterminated <{tag.decode()}>")
+        yield match.end(), close
+        start = close + len(closing)
+
+def load_3mf(path):
+    """
+    Loads all the objects in a 3MF file as a single `Mesh` (vertex indices
+    are offset so objects stay separate).
+    """
+    require_numpy()
+    try:
+        with zipfile.ZipFile(path) as archive:
+            model = archive.read("3D/3dmodel.model")
+    except (zipfile.BadZipFile, KeyError) as e:
+        raise MeshException(f"{path}: not a valid 3MF file ({e})")
+    all_vertices = []
+    all_faces = []
+    offset = 0
+    for mesh_start, mesh_end in _sections(model, b"mesh"):
+        sections = [
+            next(_sections(model, tag, mesh_start, mesh_end), None)
+            for tag in (b"vertices", b"triangles")]
+        if None in sections:
+            continue
+        try:
+            vertices, faces = (
+                _attributes(model[start:end], names, dtype)
+                for (start, end), names, dtype in zip(sections,
+                    ((b"x", b"y", b"z"), (b"v1", b"v2", b"v3")),
+                    (np.float64, np.int64)))
+        except (MeshException, ValueError) as e:
+            raise MeshException(f"{path}: bad 3MF mesh ({e})")
+        for (start, end), rows in zip(sections, (vertices, faces)):
+            # Elements missing attributes (or that we couldn't parse):
+            elements = model.count(b"<", start, end) - model.count(b"</", start, end)
+            if elements != len(rows):
+                raise MeshException(f"{path}: bad 3MF mesh ({elements} "
+                    f"elements but only {len(rows)} usable ones)")
+        if not len(faces):
+            continue
+        if faces.min() < 0 or faces.max() >= len(vertices):
+            raise MeshException(f"{path}: triangle uses a missing vertex")
+        all_vertices.append(vertices)
+        all_faces.append(faces + offset)
+        offset += len(vertices)
+    if not all_faces:
+        return Mesh(np.zeros((0, 3)), np.zeros((0, 3), dtype=np.int64))
+    return weld(np.concatenate(all_vertices), np.concatenate(all_faces))
+
+def load_mesh(path):
+    """
+    Loads *path* (`.stl` or `.3mf`) as a `Mesh`.
+    """
+    suffix = Path(path).suffix.lower()
+    if suffix == ".stl":
+        return load_stl(path)
+    if suffix == ".3mf":
+        return load_3mf(path)
+    raise MeshException(f"Don't know how to load {suffix} files")
+
+def save_3mf(objects, path):
+    """
+    Writes *objects* (a list of `(name, Mesh)`) to a 3MF file at *path*.  Each
+    mesh becomes its own (named) object so slicers show them separately.
+    """
+    require_numpy()
+    resources = []
+    items = []
+    for object_id, (name, mesh) in enumerate(objects, start=1):
+        # One big % per list (much faster than formatting them one by one):
+        vertices = ('<vertex x="%.6g" y="%.6g" z="%.6g"/>' * len(mesh.vertices)
+            ) % tuple(mesh.vertices.ravel().tolist())
+        triangles = ('<triangle v1="%d" v2="%d" v3="%d"/>' * len(mesh.faces)
+            ) % tuple(mesh.faces.ravel().tolist())
+        name = (name.replace("&", "&amp;").replace('"', "&quot;")
+                .replace("<", "&lt;"))
+        resources.append(
+            f'<object id="{object_id}" type="model" name="{name}"><mesh>'
+            f'<vertices>{vertices}</vertices>'
+            f'<triangles>{triangles}</triangles></mesh></object>')
+        items.append(f'<item objectid="{object_id}"/>')
+    model = (
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        f'<model unit="millimeter" xml:lang="en-US" '
+        f'xmlns="{NS_3MF[1:-1]}"><resources>{"".join(resources)}</resources>'
+        f'<build>{"".join(items)}</build></model>\n')
+    content_types = (
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="model" ContentType="application/vnd.ms-package.3dmanufacturing-3dmodel+xml"/>'
+        '</Types>\n')
+    rels = (
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Target="/3D/3dmodel.model" Id="rel0" '
+        'Type="http://schemas.microsoft.com/3dmanufacturing/2013/01/3dmodel"/>'
+        '</Relationships>\n')
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr("[Content_Types].xml", content_types)
+        archive.writestr("_rels/.rels", rels)
+        archive.writestr("3D/3dmodel.model", model)
+
+def save_stl(mesh, path):
+    """
+    Writes *mesh* to a binary STL file at *path* (normals included).
+    """
+    require_numpy()
+    tris = mesh.triangles()
+    normals = np.cross(tris[:, 1] - tris[:, 0], tris[:, 2] - tris[:, 0])
+    lengths = np.linalg.norm(normals, axis=1)
+    lengths[lengths == 0] = 1 # Degenerate; leave the normal as zeros
+    records = np.zeros(len(tris), dtype=stl_dtype())
+    records["normal"] = normals / lengths[:, None]
+    records["vertices"] = tris
+    with open(path, "wb") as f:
+        f.write(b"Binary STL written by keycap_playground".ljust(80, b" "))
+        f.write(len(records).to_bytes(4, "little"))
+        records.tofile(f)
+
+def save_mesh(mesh, path, name=None):
+    """
+    Writes *mesh* to *path* (`.stl` or `.3mf`; *name* is the 3MF object
+    name, defaulting to the file name).
+    """
+    suffix = Path(path).suffix.lower()
+    if suffix == ".stl":
+        return save_stl(mesh, path)
+    if suffix == ".3mf":
+        return save_3mf([(name or Path(path).stem, mesh)], path)
+    raise MeshException(f"Don't know how to save {suffix} files")
+
+def combine(meshes):
+    """
+    Returns a single `Mesh` made of all the triangles in *meshes*.  Nothing
+    gets unioned: parts that overlap (e.g. a stem poking into the underside of
+    its keycap) stay separate (closed) shells which is fine for slicers (they
+    union overlapping shells of the same object when slicing).
+
+    .. note::
+
+        Since the shells aren't unioned overlapping parts get counted twice
+        by `Mesh.volume()` (two overlapping unit cubes come out as 2.0) and
+        each shell is its own connected component.
+    """
+    require_numpy()
+    offsets = np.cumsum([0] + [len(mesh.vertices) for mesh in meshes[:-1]])
+    return Mesh(
+        np.concatenate([mesh.vertices for mesh in meshes]),
+        np.concatenate([
+            mesh.faces + offset for mesh, offset in zip(meshes, offsets)]))
+
+def merge_files(paths, output, name=None):
+    """
+    Loads the meshes at *paths* and writes them to *output* as one mesh (see
+    `combine()`).  *name* is the 3MF object name.  Returns the number of
+    triangles written.
+    """
+    mesh = combine([load_mesh(path) for path in paths])
+    save_mesh(mesh, output, name=name)
+    return len(mesh)
+
+def rotation_matrix(rotation):
+    """
+    Returns the 3x3 matrix for an OpenSCAD-style `rotate([x, y, z])` (degrees;
+    applied X first, then Y, then Z).
+    """
+    x, y, z = np.radians(rotation)
+    rx = np.array([[1, 0, 0], [0, np.cos(x), -np.sin(x)], [0, np.sin(x), np.cos(x)]])
+    ry = np.array([[np.cos(y), 0, np.sin(y)], [0, 1, 0], [-np.sin(y), 0, np.cos(y)]])
+    rz = np.array([[np.cos(z), -np.sin(z), 0], [np.sin(z), np.cos(z), 0], [0, 0, 1]])
+    return rz @ ry @ rx
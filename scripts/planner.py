@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+
+"""
+Dry-run build planning.  Before kicking off a multi-hour build you can run any
+of the keyset scripts with `--plan` to see every job that would run (and which
+ones are already done according to the build journal) along with estimates of
+how long the whole thing will take and how much memory it'll need at the given
+concurrency (`--jobs`)::
+
+    $ ./scripts/riskeycap_full.py --out /tmp/output_dir --legends --plan --jobs 12
+
+Jobs that are in the `--cache` (see `artifactcache.py`) count as cached too
+and with `--split` every part of a keycap gets planned as its own job (the
+same way `RenderEngine` runs them).
+
+Estimates come from (in order of preference):
+
+ * The recorded duration/peak memory of the exact same job (e.g. when
+   re-rendering with `--force`).
+ * The cost model in `costmodel.py` calibrated against every job in the
+   build journal, using the job's CSG tree stats (see `csgtree.py`) if it's
+   been preflighted.
+ * The cost model's defaults if there's no history at all.
+"""
+
+# stdlib imports
+import heapq
+# 3rd party stuff
+from colorama import Style
+# Our own stuff
+from costmodel import CostModel
+from engine import split_jobs
+from artifactcache import cache_key
+
+class PlannedJob(object):
+    """
+    A job in a build plan along with its estimated cost.  Split jobs have
+    their *parts* (more `PlannedJob`s) and cost whatever those add up to.
+    """
+    def __init__(self, keycap, status, seconds, memory_mb, source, parts=None):
+        self.keycap = keycap
+        self.status = status # "render", "done" (journal) or "cached"
+        self.seconds = seconds
+        self.memory_mb = memory_mb
+        self.source = source # "history", "csg", "model" or "split"
+        self.parts = parts or []
+
+    @property
+    def cached(self):
+        return self.status != "render"
+
+def format_duration(seconds):
+    """
+    Returns *seconds* as a human-friendly string like "1h23m" or "4m05s".
+    """
+    seconds = int(round(seconds))
+    hours, remainder = divmod(seconds, 3600)
+    minutes, seconds = divmod(remainder, 60)
+    if hours:
+        return f"{hours}h{minutes:02d}m"
+    return f"{minutes}m{seconds:02d}s"
+
+def simulate(jobs, concurrency):
+    """
+    Simulates running *jobs* (`PlannedJob` instances that aren't cached) in
+    order with *concurrency* workers (the same way `RenderEngine.run()` hands
+    them out; the parts of split jobs each get their own worker).  Returns
+    `(wall_seconds, peak_memory_mb)`.
+    """
+    running = [] # Heap of (finish_time, memory_mb)
+    now = 0.0
+    memory = 0.0
+    peak_memory = 0.0
+    for job in (part for job in jobs for part in job.parts or [job]):
+        if len(running) >= concurrency:
+            now, freed = heapq.heappop(running)
+            memory -= freed
+        heapq.heappush(running, (now + job.seconds, job.memory_mb))
+        memory += job.memory_mb
+        peak_memory = max(peak_memory, memory)
+    wall = max((finish for finish, _ in running), default=now)
+    return wall, peak_memory
+
+def job_status(keycap, journal, cache=None, force=False):
+    """
+    Returns what a build would do with *keycap*: "done" if *journal* says
+    it's already been rendered (ignored if *force*), "cached" if it's in
+    *cache* (see `artifactcache.py`), otherwise "render".  Same order of
+    checks as `build.py`.
+    """
+    if not force and journal.is_done(keycap):
+        return "done"
+    if cache is not None and cache.lookup(cache_key(keycap)) is not None:
+        return "cached"
+    return "render"
+
+def plan(jobs, journal, force=False, model=None, cache=None, split=False):
+    """
+    Returns a list of `PlannedJob` for *jobs* (keycaps).  Jobs that are
+    already done according to *journal* (unless *force*) or in *cache* are
+    marked as cached.  With *split* keycaps that `engine.split_jobs()`
+    splits get planned as their parts.
+    """
+    if model is None:
+        model = CostModel().calibrate(journal)
+    planned = []
+    for keycap in jobs:
+        status = job_status(keycap, journal, cache=cache, force=force)
+        parts = split_jobs(keycap) if split else []
+        entry = journal.entry(keycap)
+        if parts:
+            # The journal only has the wall time of the parts put together:
+            parts = [
+                PlannedJob(part, status, *model.estimate(part),
+                    model.source(part))
+                for part in parts]
+            seconds = sum(part.seconds for part in parts)
+            memory_mb = sum(part.memory_mb for part in parts) # Side by side
+            source = "split"
+        elif entry and entry.get("status") == "done" and entry.get("duration"):
+            seconds = entry["duration"]
+            memory_mb = entry.get("peak_memory_mb") or model.estimate(keycap)[1]
+            source = "history"
+        else:
+            seconds, memory_mb = model.estimate(keycap)
+            source = model.source(keycap)
+        planned.append(
+            PlannedJob(keycap, status, seconds, memory_mb, source, parts))
+    return planned
+
+def print_plan(planned, concurrency, model=None):
+    """
+    Prints a build plan (from `plan()`) along with its totals.
+    """
+    print(Style.BRIGHT +
+        f"{'Job':<32} {'Render':<24} {'Format':<6} {'Status':<8} "
+        f"{'Time':>8} {'Memory':>9}  Estimate" + Style.RESET_ALL)
+    for job in planned:
+        keycap = job.keycap
+        print(
+            f"{keycap.name:<32} {','.join(keycap.render):<24} "
+            f"{keycap.file_type:<6} {job.status:<8} "
+            f"{format_duration(job.seconds):>8} {job.memory_mb:>7.0f}MB  "
+            f"{job.source}")
+        for part in job.parts:
+            print(
+                f"  {part.keycap.name:<30} {','.join(part.keycap.render):<24} "
+                f"{part.keycap.file_type:<6} {'':<8} "
+                f"{format_duration(part.seconds):>8} "
+                f"{part.memory_mb:>7.0f}MB  {part.source}")
+    to_run = [job for job in planned if not job.cached]
+    wall, peak_memory = simulate(to_run, concurrency)
+    cpu = sum(job.seconds for job in to_run)
+    print("")
+    print(Style.BRIGHT +
+        f"{len(planned)} jobs: {len(to_run)} to render, "
+        f"{len(planned) - len(to_run)} cached" + Style.RESET_ALL)
+    if model is not None:
+        print(f"Cost model calibrated from {model.samples} recorded job(s)")
+    print(f"Total render (CPU) time: {format_duration(cpu)}")
+    print(f"Estimated wall time with {concurrency} concurrent job(s): "
+          f"{format_duration(wall)}")
+    print(f"Estimated peak memory with {concurrency} concurrent job(s): "
+          f"{peak_memory:.0f}MB")
@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+
+"""
+Runs every job through OpenSCAD in its cheapest mode (exporting the CSG tree
+evaluates the whole script but never builds any geometry) so parameter
+mistakes show up in seconds instead of after a full CGAL render::
+
+    $ ./scripts/preflight.py riskeyboard_70
+    [numlock] WARNING: LEGEND_TRANS only has 2 entries for 3 legends (...)
+    [tilde] WARNING: Unknown KEY_PROFILE "riskycap" (...)
+
+`keycap_playground.scad` checks its own parameters (see `check_parameters()`
+in there) for things like unknown `KEY_PROFILE`/`RENDER` values or legend
+settings that don't line up with `LEGENDS` and reports them with `warning()`
+from `utils.scad`.  Those (and any warnings/errors from OpenSCAD itself) get
+the job rejected; `note()` output is just passed along.  `build.py` runs this
+before rendering anything (see `--no-preflight`).
+
+Since the CSG tree gets exported anyway it's analyzed too (see `csgtree.py`)
+and its stats cached so `costmodel.py` can estimate render times of keycaps
+that have never been rendered.
+"""
+
+# stdlib imports
+import re
+import sys
+import time
+import hashlib
+import asyncio
+import argparse
+import importlib
+import tempfile
+from pathlib import Path
+# 3rd party stuff
+from colorama import Style
+# Our own stuff
+from engine import classify, PROBLEMS, MAX_RUNNERS
+from csgtree import csg_args, load_stats, CsgException
+
+PREFLIGHT_TIMEOUT = 60 # Seconds; evaluating the script should take ~1s
+# note()/warning() in utils.scad wrap their messages in HTML for the GUI:
+HTML_TAG = re.compile(r"<[^>]+>")
+
+def clean(line):
+    """
+    Strips the HTML (colors, bold) `note()`/`warning()` add to *line*.
+    """
+    return HTML_TAG.sub("", line).strip()
+
+class PreflightResult(object):
+    """
+    The outcome of preflighting a single keycap.
+    """
+    def __init__(self, keycap):
+        self.keycap = keycap
+        self.retcode = None
+        self.duration = 0.0
+        self.problems = [] # List of (category, line)
+        self.notes = []
+        self.csg = None # csgtree.CsgStats
+        self.csg_digest = None # sha256 of the CSG tree (what'd get rendered)
+
+    @property
+    def ok(self):
+        return self.retcode == 0 and not self.problems
+
+    def add(self, line):
+        line = clean(line)
+        if not line:
+            return
+        category = classify(line)
+        if category in PROBLEMS:
+            if (category, line) not in self.problems:
+                self.problems.append((category, line))
+        elif category == "note" and line not in self.notes:
+            self.notes.append(line)
+
+async def _check(keycap, csg_file, timeout=PREFLIGHT_TIMEOUT):
+    """
+    Preflights *keycap* (exporting its CSG tree to *csg_file*) and returns a
+    `PreflightResult`.
+    """
+    result = PreflightResult(keycap)
+    start = time.monotonic()
+    try:
+        proc = await asyncio.create_subprocess_exec(
+            *csg_args(keycap, csg_file),
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE)
+    except OSError as e: # e.g. Wrong openscad_path
+        result.retcode = 127
+        result.problems.append(("error", f"Could not run OpenSCAD: {e}"))
+        return result
+    try:
+        stdout, stderr = await asyncio.wait_for(proc.communicate(), timeout)
+    except asyncio.TimeoutError:
+        proc.kill()
+        await proc.wait()
+        result.retcode = -1
+        result.problems.append(
+            ("error", f"Took longer than {timeout}s to evaluate"))
+        return result
+    result.retcode = proc.returncode
+    result.duration = time.monotonic() - start
+    output = (stdout + stderr).decode("utf-8", errors="replace")
+    for line in output.splitlines():
+        result.add(line)
+    if result.ok and csg_file.exists():
+        result.csg_digest = hashlib.sha256(csg_file.read_bytes()).hexdigest()
+        try:
+            result.csg = load_stats(keycap, csg_file)
+        except CsgException as e: # Not a reason to reject the job
+            result.notes.append(f"Could not analyze the CSG tree: {e}")
+    if csg_file.exists():
+        csg_file.unlink()
+    if result.retcode and not result.problems:
+        result.problems.append(
+            ("error", f"OpenSCAD exited with code {result.retcode}"))
+    return result
+
+async def run_preflight(jobs, max_runners=MAX_RUNNERS):
+    """
+    Preflights all *jobs* (up to *max_runners* at a time) and returns a list
+    of `PreflightResult` (in the same order).
+    """
+    sem = asyncio.Semaphore(max_runners)
+    with tempfile.TemporaryDirectory(prefix="preflight-") as directory:
+        async def check(i, keycap):
+            async with sem: # Names aren't always unique so use the index:
+                return await _check(keycap, Path(directory) / f"{i}.csg")
+        return await asyncio.gather(
+            *(check(i, keycap) for i, keycap in enumerate(jobs)))
+
+def preflight(jobs, max_runners=MAX_RUNNERS):
+    """
+    Synchronous wrapper around `run_preflight()`.
+    """
+    return asyncio.run(run_preflight(jobs, max_runners=max_runners))
+
+def print_preflight(results, notes=False):
+    """
+    Prints the problems (and *notes* if `True`) found by `preflight()`.
+    Returns the names of the keycaps that failed.
+    """
+    failed = []
+    for result in results:
+        name = result.keycap.name
+        if notes:
+            for line in result.notes:
+                print(f"{Style.DIM}[{name}]{Style.RESET_ALL} {line}")
+        if result.ok:
+            continue
+        failed.append(name)
+        for category, line in result.problems:
+            print(Style.BRIGHT + f"[{name}]" + Style.RESET_ALL
+                  + f" [{category}] {line}")
+    return failed
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Check keycaps for parameter mistakes by evaluating them "
+                    "in OpenSCAD (without rendering anything).")
+    parser.add_argument('--jobs',
+        metavar='<n>', type=int, default=MAX_RUNNERS,
+        help=f'How many OpenSCAD processes to run at once (default: {MAX_RUNNERS}).')
+    parser.add_argument('--notes',
+        required=False, action='store_true',
+        help="Also print note() output.")
+    parser.add_argument('module',
+        metavar="module",
+        help="The keyset script to check (e.g. riskeycap_full).")
+    parser.add_argument('names',
+        nargs='*', metavar="name",
+        help='Only check the keycaps with these names.')
+    args = parser.parse_args()
+    keycaps = importlib.import_module(args.module).KEYCAPS
+    if args.names:
+        lowered = [name.lower() for name in args.names]
+        keycaps = [k for k in keycaps if k.name.lower() in lowered]
+    start = time.monotonic()
+    results = preflight(keycaps, max_runners=args.jobs)
+    failed = print_preflight(results, notes=args.notes)
+    elapsed = time.monotonic() - start
+    if failed:
+        print(Style.BRIGHT + f"{len(failed)} of {len(keycaps)} keycap(s) "
+              f"failed preflight ({elapsed:.1f}s)" + Style.RESET_ALL)
+        sys.exit(1)
+    print(f"All {len(keycaps)} keycap(s) passed preflight ({elapsed:.1f}s)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,605 @@
+#!/usr/bin/env python3
+
+"""
+Geometry regression testing.  Compares freshly-rendered keycaps against
+reference meshes (e.g. the ones in `pregenerated/` or the output of a
+previous build) and reports any whose shape changed beyond tolerance.  Handy
+after making changes to `profiles.scad` or `keycaps.scad`::
+
+    $ ./scripts/regress.py pregenerated/ /tmp/output_dir/
+    $ ./scripts/regress.py /tmp/before/ /tmp/after/ --tolerance 0.02
+    $ ./scripts/regress.py "pregenerated/Riskable Profile 4.0.stl" /tmp/new.stl
+
+With `--against <git revision>` a set of reference keycaps
+(`REFERENCE_CASES`) gets rendered twice instead: once with the `.scad` files
+from that revision and once with the ones in the working tree.  That's how
+to check that a change to how something gets *built* (e.g. fewer facets)
+didn't change what comes out::
+
+    $ ./scripts/regress.py --against HEAD~1 --out /tmp/regress
+    $ ./scripts/regress.py --against master dish_sphere_1u
+
+When given directories files are matched up by name.  For each pair we
+compute:
+
+ * The difference in volume (absolute and relative).
+ * The largest difference between the bounding boxes' corners.
+ * The surface distance: points are sampled (area-weighted) all over each
+   mesh and the distance to the closest point on the other mesh is found via
+   a spatial index (a uniform grid; exact point-to-triangle distances are
+   computed for the triangles nearby).  The maximum of both
+   directions is a close approximation of the Hausdorff distance.
+
+Meshes are loaded with memory-mapped NumPy arrays (see `mesh.py`).  The
+triangle counts of both meshes get reported too (so "same shape, fewer
+facets" shows up as an OK with a lower second number).
+"""
+
+# stdlib imports
+import io
+import sys
+import asyncio
+import tarfile
+import argparse
+import tempfile
+import subprocess
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+# 3rd party stuff
+from colorama import Style
+from colorama import init as color_init
+color_init()
+# Our own stuff
+from mesh import load_mesh, MeshException, np
+from keycap import Keycap, KEY_UNIT, BETWEENSPACE
+from engine import RenderEngine, MAX_RUNNERS
+
+SAMPLES = 20000 # Points sampled on each surface
+TOLERANCE = 0.05 # Max surface distance (mm) before we call it a change
+VOLUME_TOLERANCE = 0.5 # Max volume difference (percent)
+MESH_SUFFIXES = (".stl", ".3mf")
+REPO_DIR = Path(__file__).resolve().parent.parent
+# What gets rendered for --against (name -> Keycap() arguments).  Only the
+# keycap itself (no stem/legends) unless a case says otherwise:
+REFERENCE_CASES = {
+    # Dishes (cut with cylinder_patch()/sphere_patch() instead of full
+    # cylinder()/sphere() primitives):
+    "dish_cylinder_1u": dict(key_profile="", dish_type="cylinder"),
+    "dish_cylinder_2u": dict(key_profile="", dish_type="cylinder",
+        key_length=KEY_UNIT*2-BETWEENSPACE),
+    "dish_sphere_1u": dict(key_profile="", dish_type="sphere"),
+    "dish_sphere_tilted": dict(key_profile="", dish_type="sphere",
+        dish_tilt=-5),
+    # Every profile whose body goes through _poly_keycap() (a single lofted
+    # polyhedron instead of hulls of each pair of layers):
+    "profile_dsa": dict(key_profile="dsa"),
+    "profile_dcs": dict(key_profile="dcs"),
+    "profile_dss": dict(key_profile="dss"),
+    "profile_kat": dict(key_profile="kat"),
+    "profile_riskeycap": dict(key_profile="riskeycap"),
+    "profile_gem": dict(key_profile="gem"),
+    "profile_xda": dict(key_profile="xda"),
+    # Legends (the body gets clipped to a band around the top under each
+    # legend before it's intersected with them):
+    "legend_top": dict(key_profile="riskeycap", legends=["F1", "Q"],
+        trans=[[2.7,2.75,0], [2.7,-2,0]], font_sizes=[3.5, 3.5]),
+    "legend_carved": dict(key_profile="riskeycap", legends=["Q"],
+        font_sizes=[5], legend_carved=True),
+    "legend_front": dict(key_profile="riskeycap", legends=["Q", "W"],
+        trans=[[0,0,0], [0,-7.5,0]], rotation=[[0,0,0], [68,0,0]],
+        font_sizes=[5, 3]),
+}
+
+class RegressException(Exception):
+    """
+    Raised when the reference keycaps can't be rendered.
+    """
+    pass
+
+def sample_surface(mesh, count, rng):
+    """
+    Returns `(points, face_indices)` for *count* points sampled uniformly
+    (area-weighted) over the surface of *mesh*.
+    """
+    areas = mesh.areas()
+    faces = rng.choice(len(areas), size=count, p=areas / areas.sum())
+    u, v = rng.random((2, count))
+    flip = u + v > 1
+    u[flip], v[flip] = 1 - u[flip], 1 - v[flip]
+    tris = mesh.triangles()[faces]
+    points = (tris[:, 0] + u[:, None] * (tris[:, 1] - tris[:, 0])
+              + v[:, None] * (tris[:, 2] - tris[:, 0]))
+    return points, faces
+
+def closest_points_on_triangles(p, a, b, c):
+    """
+    Returns the closest point on each triangle (*a*, *b*, *c*) to each point
+    in *p* (all `(N, 3)` arrays).  Vectorized version of the algorithm from
+    Ericson's "Real-Time Collision Detection" (regions are assigned in
+    reverse order of precedence so the same region wins on ties).
+    """
+    dot = lambda x, y: np.einsum("ij,ij->i", x, y)
+    ab, ac, ap = b - a, c - a, p - a
+    d1, d2 = dot(ab, ap), dot(ac, ap)
+    bp = p - b
+    d3, d4 = dot(ab, bp), dot(ac, bp)
+    cp = p - c
+    d5, d6 = dot(ab, cp), dot(ac, cp)
+    va = d3 * d6 - d5 * d4
+    vb = d5 * d2 - d1 * d6
+    vc = d1 * d4 - d3 * d2
+    with np.errstate(divide="ignore", invalid="ignore"):
+        # Inside the face (the default)
+        denom = 1.0 / (va + vb + vc)
+        v = vb * denom
+        w = vc * denom
+        result = a + ab * v[:, None] + ac * w[:, None]
+        # Edge BC
+        t_bc = (d4 - d3) / ((d4 - d3) + (d5 - d6))
+        mask = (va <= 0) & (d4 - d3 >= 0) & (d5 - d6 >= 0)
+        result[mask] = (b + (c - b) * t_bc[:, None])[mask]
+        # Edge AC
+        t_ac = d2 / (d2 - d6)
+        mask = (vb <= 0) & (d2 >= 0) & (d6 <= 0)
+        result[mask] = (a + ac * t_ac[:, None])[mask]
+        # Vertex C
+        mask = (d6 >= 0) & (d5 <= d6)
+        result[mask] = c[mask]
+        # Edge AB
+        t_ab = d1 / (d1 - d3)
+        mask = (vc <= 0) & (d1 >= 0) & (d3 <= 0)
+        result[mask] = (a + ab * t_ab[:, None])[mask]
+    # Vertices A and B
+    mask = (d3 >= 0) & (d4 <= d3)
+    result[mask] = b[mask]
+    mask = (d1 <= 0) & (d2 <= 0)
+    result[mask] = a[mask]
+    # Degenerate triangles (zero area) just use the closest vertex
+    bad = ~np.isfinite(result).all(axis=1)
+    if bad.any():
+        corners = np.stack([a[bad], b[bad], c[bad]], axis=1)
+        nearest = np.argmin(
+            np.linalg.norm(corners - p[bad][:, None], axis=2), axis=1)
+        result[bad] = corners[np.arange(len(corners)), nearest]
+    return result
+
+def _expand(counts):
+    """
+    Returns `(owners, offsets)` enumerating `range(count)` for every count in
+    *counts* (without a Python loop).
+    """
+    owners = np.repeat(np.arange(len(counts)), counts)
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    return owners, offsets
+
+class GridIndex(object):
+    """
+    A uniform grid spatial index over *points*.  `neighbors()` returns every
+    point in the same cell as each query plus the 26 cells around it (i.e.
+    everything within *cell_size* and then some).
+    """
+    def __init__(self, points, cell_size):
+        self.points = points
+        self.cell_size = cell_size
+        self.origin = points.min(axis=0)
+        cells = self._cells(points)
+        self.dims = cells.max(axis=0) + 2 # Room for the neighbor offsets
+        keys = self._keys(cells)
+        self.order = np.argsort(keys, kind="stable")
+        self.sorted_keys = keys[self.order]
+
+    def _cells(self, points):
+        return np.floor(
+            (points - self.origin) / self.cell_size).astype(np.int64) + 1
+
+    def _keys(self, cells):
+        return (cells[:, 0] * self.dims[1] + cells[:, 1]) * self.dims[2] + cells[:, 2]
+
+    def neighbors(self, queries):
+        """
+        Returns `(query_indices, point_indices)`: every (query, point) pair
+        where the point is in a cell neighboring the query's.
+        """
+        cells = self._cells(queries)
+        offsets = np.stack(np.meshgrid(
+            [-1, 0, 1], [-1, 0, 1], [-1, 0, 1]), axis=-1).reshape(-1, 3)
+        all_queries, all_points = [], []
+        for offset in offsets:
+            neighbor = cells + offset
+            inside = np.all((neighbor >= 0) & (neighbor < self.dims), axis=1)
+            keys = self._keys(np.where(inside[:, None], neighbor, 0))
+            start = np.searchsorted(self.sorted_keys, keys, side="left")
+            end = np.searchsorted(self.sorted_keys, keys, side="right")
+            counts = np.where(inside, end - start, 0)
+            total = counts.sum()
+            if not total:
+                continue
+            owners, within = _expand(counts)
+            all_queries.append(owners)
+            all_points.append(self.order[start[owners] + within])
+        if not all_queries:
+            empty = np.zeros(0, dtype=np.int64)
+            return empty, empty
+        return np.concatenate(all_queries), np.concatenate(all_points)
+
+def _point_triangle_distances(points, triangles):
+    """
+    Returns the distance from each of *points* to the matching triangle.
+    """
+    closest = closest_points_on_triangles(
+        points, triangles[:, 0], triangles[:, 1], triangles[:, 2])
+    return np.linalg.norm(points - closest, axis=1)
+
+def triangle_grid_samples(tris, spacing):
+    """
+    Returns `(points, face_indices)` covering every triangle in *tris* with
+    sample points so that no point on any triangle is more than *spacing*
+    away from one of its samples.  The number of samples is proportional to
+    each triangle's area (plus its perimeter) so long, thin triangles don't
+    get more than they need.
+    """
+    # Reorder the vertices so AB is the longest edge
+    lengths = np.linalg.norm(np.roll(tris, -1, axis=1) - tris, axis=2)
+    longest = lengths.argmax(axis=1)
+    order = (np.arange(3)[None, :] + longest[:, None]) % 3
+    tris = tris[np.arange(len(tris))[:, None], order]
+    a, b, c = tris[:, 0], tris[:, 1], tris[:, 2]
+    length = np.linalg.norm(b - a, axis=1)
+    small = length <= spacing # Within *spacing* of the centroid already
+    all_points = [tris[small].mean(axis=1)]
+    all_faces = [np.nonzero(small)[0]]
+    big = np.nonzero(~small)[0]
+    a, b, c, length = a[big], b[big], c[big], length[big]
+    # A grid over the rectangle spanned by AB and the triangle's height...
+    along = (b - a) / length[:, None]
+    foot = np.einsum("ij,ij->i", c - a, along)
+    up = c - a - foot[:, None] * along
+    height = np.linalg.norm(up, axis=1)
+    up = up / np.maximum(height, 1e-12)[:, None]
+    columns = np.ceil(length / spacing).astype(np.int64)
+    rows = np.ceil(height / spacing).astype(np.int64)
+    owner, k = _expand((columns + 1) * (rows + 1))
+    x = (k // (rows[owner] + 1)) / columns[owner] * length[owner]
+    y = (k % (rows[owner] + 1)) / np.maximum(rows[owner], 1) * height[owner]
+    # ...minus the parts that aren't inside the triangle
+    tolerance = 1e-9 * length[owner] * height[owner]
+    inside = ((y * foot[owner] <= height[owner] * x + tolerance)
+              & (y * (length[owner] - foot[owner])
+                 <= height[owner] * (length[owner] - x) + tolerance))
+    owner, x, y = owner[inside], x[inside], y[inside]
+    all_points.append(a[owner] + x[:, None] * along[owner] + y[:, None] * up[owner])
+    all_faces.append(big[owner])
+    # Plus points along every edge to cover what got trimmed
+    for start, end in ((a, b), (b, c), (c, a)):
+        steps = np.ceil(np.linalg.norm(end - start, axis=1) / spacing)
+        steps = np.maximum(steps, 1).astype(np.int64)
+        owner, k = _expand(steps)
+        t = (k / steps[owner])[:, None]
+        all_points.append(start[owner] + t * (end[owner] - start[owner]))
+        all_faces.append(big[owner])
+    return np.concatenate(all_points), np.concatenate(all_faces)
+
+def _nearest_triangles(points, tris, samples, sample_faces, cell_size,
+        chunk_size=2048):
+    """
+    Returns the exact distance from each of *points* to the closest of *tris*
+    or `inf` if it isn't within `cell_size / 2` (where the grid can't be sure
+    it found the closest one).  *samples* must come from
+    `triangle_grid_samples(tris, cell_size / 2)`.
+    """
+    spacing = cell_size / 2
+    index = GridIndex(samples, cell_size=cell_size)
+    distances = np.full(len(points), np.inf)
+    for start in range(0, len(points), chunk_size):
+        chunk = points[start:start + chunk_size]
+        query, candidate = index.neighbors(chunk)
+        if not len(query):
+            continue
+        # The closest sample is an upper bound on the distance and no point
+        # on a triangle is more than *spacing* from one of its samples so any
+        # triangle whose samples are all further than that can be skipped:
+        sample_distances = np.linalg.norm(
+            samples[candidate] - chunk[query], axis=1)
+        upper = np.full(len(chunk), np.inf)
+        np.minimum.at(upper, query, sample_distances)
+        keep = sample_distances - spacing <= upper[query]
+        query, candidate = query[keep], candidate[keep]
+        # Each (query, triangle) pair only needs checking once:
+        pairs = np.unique(query * len(tris) + sample_faces[candidate])
+        query, face = pairs // len(tris), pairs % len(tris)
+        d = _point_triangle_distances(chunk[query], tris[face])
+        best = np.full(len(chunk), np.inf)
+        np.minimum.at(best, query, d)
+        distances[start:start + chunk_size] = best
+    distances[distances > spacing] = np.inf
+    return distances
+
+def _nearest_samples(points, samples, cell_size, chunk_size=2048):
+    """
+    Returns the distance from each of *points* to the closest of *samples* or
+    `inf` if it isn't within *cell_size*.
+    """
+    index = GridIndex(samples, cell_size=cell_size)
+    distances = np.full(len(points), np.inf)
+    for start in range(0, len(points), chunk_size):
+        chunk = points[start:start + chunk_size]
+        query, candidate = index.neighbors(chunk)
+        best = np.full(len(chunk), np.inf)
+        np.minimum.at(best, query, np.linalg.norm(
+            samples[candidate] - chunk[query], axis=1))
+        distances[start:start + chunk_size] = best
+    distances[distances > cell_size] = np.inf
+    return distances
+
+def surface_distances(source, target, count, rng):
+    """
+    Returns the distance from *count* points sampled on *source* to the
+    surface of *target* (both `Mesh` instances).
+
+    Every triangle of *target* is covered with sample points (see
+    `triangle_grid_samples()`) that go into a `GridIndex`.  Each source point
+    then gets the exact distance to every triangle with a sample in the
+    neighboring cells.  That's guaranteed to include the closest triangle as
+    long as it's within half a cell (~0.25mm with the default number of
+    samples) which covers anything that's anywhere near the tolerance.
+
+    Points that are further away than that (big changes) are measured against
+    the samples instead (thinned out on increasingly coarse grids) which is
+    much faster and accurate to within about half of the grid's cell size.
+    """
+    tris = target.triangles()
+    points, _ = sample_surface(source, count, rng)
+    cell_size = max(2 * np.sqrt(target.areas().sum() / count), 1e-3)
+    samples, sample_faces = triangle_grid_samples(tris, cell_size / 2)
+    distances = _nearest_triangles(
+        points, tris, samples, sample_faces, cell_size)
+    everything = np.concatenate([points, samples])
+    diagonal = np.linalg.norm(everything.max(axis=0) - everything.min(axis=0))
+    remaining = np.nonzero(~np.isfinite(distances))[0]
+    while len(remaining):
+        cell_size *= 4
+        if cell_size >= diagonal: # Everything is within range
+            cell_size = diagonal + 1e-3
+        # One sample per voxel (a quarter of a cell) is plenty:
+        voxels = np.floor(samples / (cell_size / 4)).astype(np.int64)
+        _, keep = np.unique(voxels, axis=0, return_index=True)
+        found = _nearest_samples(points[remaining], samples[keep], cell_size)
+        resolved = np.isfinite(found)
+        distances[remaining[resolved]] = found[resolved]
+        remaining = remaining[~resolved]
+    return distances
+
+def compare_meshes(reference, candidate, samples=SAMPLES, seed=0):
+    """
+    Compares *candidate* against *reference* (`Mesh` instances) and returns a
+    dict of differences (volume, bounding box, and surface distance).
+    """
+    rng = np.random.default_rng(seed)
+    ref_low, ref_high = reference.bounds()
+    low, high = candidate.bounds()
+    ref_volume = float(reference.volume())
+    volume = float(candidate.volume())
+    forward = surface_distances(candidate, reference, samples, rng)
+    backward = surface_distances(reference, candidate, samples, rng)
+    both = np.concatenate([forward, backward])
+    return {
+        "triangles": (len(reference), len(candidate)),
+        "volume": (round(ref_volume, 3), round(volume, 3)),
+        "volume_delta": round(volume - ref_volume, 3),
+        "volume_delta_percent": round(
+            100.0 * (volume - ref_volume) / ref_volume, 3)
+            if ref_volume else float("inf"),
+        "bbox_delta": round(float(max(
+            np.abs(low - ref_low).max(), np.abs(high - ref_high).max())), 4),
+        "distance_mean": round(float(both.mean()), 4),
+        "distance_p95": round(float(np.percentile(both, 95)), 4),
+        "distance_max": round(float(both.max()), 4),
+    }
+
+def compare_files(reference_path, candidate_path, tolerance=TOLERANCE,
+        volume_tolerance=VOLUME_TOLERANCE, samples=SAMPLES):
+    """
+    Loads and compares two mesh files.  Returns `(changes, stats)` where
+    *changes* is a list of reasons the candidate is considered different
+    (empty if it matches the reference).
+    """
+    try:
+        reference = load_mesh(reference_path)
+        candidate = load_mesh(candidate_path)
+    except (MeshException, OSError, ValueError) as e:
+        return [f"Could not load mesh: {e}"], {}
+    if not len(reference) or not len(candidate):
+        return ["Mesh is empty"], {}
+    stats = compare_meshes(reference, candidate, samples=samples)
+    changes = []
+    if abs(stats["volume_delta_percent"]) > volume_tolerance:
+        changes.append(
+            f"Volume changed by {stats['volume_delta']:+.3f}mm³ "
+            f"({stats['volume_delta_percent']:+.2f}%)")
+    if stats["bbox_delta"] > tolerance:
+        changes.append(f"Bounding box moved by {stats['bbox_delta']:.3f}mm")
+    if stats["distance_max"] > tolerance:
+        changes.append(
+            f"Surface moved by up to {stats['distance_max']:.3f}mm "
+            f"(mean {stats['distance_mean']:.4f}mm, "
+            f"95th percentile {stats['distance_p95']:.4f}mm)")
+    return changes, stats
+
+def pair_files(reference, candidate):
+    """
+    Returns a list of `(reference_file, candidate_file)` to compare.  If
+    *reference* and *candidate* are directories files get paired by name.
+    """
+    reference, candidate = Path(reference), Path(candidate)
+    if reference.is_dir():
+        references = sorted(
+            f for f in reference.iterdir() if f.suffix.lower() in MESH_SUFFIXES)
+        if candidate.is_dir():
+            return [(f, candidate / f.name) for f in references]
+        return [(f, candidate) for f in references if f.name == candidate.name]
+    if candidate.is_dir():
+        return [(reference, candidate / reference.name)]
+    return [(reference, candidate)]
+
+def _compare(job):
+    reference, candidate, tolerance, volume_tolerance, samples = job
+    if not candidate.exists():
+        return reference, candidate, None, {}
+    return (reference, candidate) + compare_files(
+        reference, candidate, tolerance, volume_tolerance, samples)
+
+def export_scad(rev, dest, repo=REPO_DIR):
+    """
+    Extracts the `.scad` files from git revision *rev* of *repo* into *dest*.
+    """
+    try:
+        archive = subprocess.run(
+            ["git", "-C", str(repo), "archive", "--format=tar", rev, "--",
+             "*.scad"], capture_output=True, check=True)
+    except (OSError, subprocess.CalledProcessError) as e:
+        stderr = getattr(e, "stderr", b"") or b""
+        raise RegressException(f"Could not get the .scad files from {rev}: "
+            f"{stderr.decode(errors='replace').strip() or e}")
+    with tarfile.open(fileobj=io.BytesIO(archive.stdout)) as tar:
+        tar.extractall(dest)
+
+def reference_jobs(playground, out, openscad_path, cases=REFERENCE_CASES):
+    """
+    Returns the keycaps for *cases* rendered with *playground* into *out*.
+    """
+    jobs = []
+    for name, params in cases.items():
+        params = dict(dict(render=["keycap"], file_type="stl"), **params)
+        jobs.append(Keycap(name=name, output_path=Path(out),
+            openscad_path=Path(openscad_path),
+            keycap_playground_path=Path(playground), **params))
+    return jobs
+
+def render_references(rev, out, openscad_path, cases=REFERENCE_CASES,
+        max_runners=MAX_RUNNERS, repo=REPO_DIR):
+    """
+    Renders *cases* with the `.scad` files from git revision *rev* (into
+    `out/reference`) and with the ones in the working tree of *repo* (into
+    `out/candidate`).  Returns `(reference_dir, candidate_dir, problems)`
+    where *problems* maps the name of every case with problems (failed
+    renders, CGAL/manifold warnings, invalid meshes) to their descriptions.
+    """
+    out = Path(out)
+    reference, candidate = out / "reference", out / "candidate"
+    scad = out / "scad"
+    for directory in (reference, candidate, scad):
+        directory.mkdir(parents=True, exist_ok=True)
+    export_scad(rev, scad, repo)
+    jobs = (
+        reference_jobs(scad / "keycap_playground.scad", reference,
+            openscad_path, cases)
+        + reference_jobs(Path(repo) / "keycap_playground.scad", candidate,
+            openscad_path, cases))
+    engine = RenderEngine(max_runners=max_runners, quiet=True)
+    problems = {}
+    for result in asyncio.run(engine.run(jobs)):
+        lines = [line for _, line in result.problems]
+        if not result.ok and not lines:
+            lines = [f"OpenSCAD exited with code {result.retcode}"]
+        if lines:
+            where = "reference" if result.keycap.output_path == reference \
+                else "candidate"
+            problems.setdefault(result.keycap.name, []).extend(
+                f"{where}: {line}" for line in lines)
+    return reference, candidate, problems
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare rendered keycaps against reference meshes.")
+    parser.add_argument('--tolerance',
+        metavar='<mm>', type=float, default=TOLERANCE,
+        help=f'Max surface/bounding box difference (default: {TOLERANCE}mm).')
+    parser.add_argument('--volume-tolerance',
+        metavar='<percent>', type=float, default=VOLUME_TOLERANCE,
+        help=f'Max volume difference (default: {VOLUME_TOLERANCE}%%).')
+    parser.add_argument('--samples',
+        metavar='<n>', type=int, default=SAMPLES,
+        help=f'Points to sample on each surface (default: {SAMPLES}).')
+    parser.add_argument('--jobs',
+        metavar='<n>', type=int, default=None,
+        help='How many comparisons to run at once (default: number of CPUs).')
+    parser.add_argument('--against',
+        metavar='<revision>', type=str, default=None,
+        help="Render REFERENCE_CASES with the .scad files from this git "
+             "revision and the working tree and compare those instead.")
+    parser.add_argument('--out',
+        metavar='<path>', type=str, default=None,
+        help="Where --against renders (default: a temporary directory).")
+    parser.add_argument('--openscad',
+        metavar='<path>', type=str, default="/usr/bin/openscad",
+        help="The OpenSCAD to render with (for --against).")
+    parser.add_argument('reference',
+        nargs='?',
+        help='Reference mesh file or directory (e.g. pregenerated/).  With '
+             '--against: which REFERENCE_CASES to render (default: all).')
+    parser.add_argument('candidate',
+        nargs='*',
+        help='Mesh file or directory to compare against the reference.')
+    args = parser.parse_args()
+    problems = {}
+    if args.against:
+        names = [args.reference] + args.candidate if args.reference else []
+        unknown = [name for name in names if name not in REFERENCE_CASES]
+        if unknown:
+            print(f"Unknown reference case(s): {', '.join(unknown)} (try one "
+                  f"of: {', '.join(REFERENCE_CASES)})")
+            sys.exit(1)
+        cases = {
+            name: params for name, params in REFERENCE_CASES.items()
+            if not names or name in names}
+        out = args.out or tempfile.mkdtemp(prefix="regress-")
+        try:
+            reference, candidate, problems = render_references(
+                args.against, out, args.openscad, cases,
+                max_runners=args.jobs or MAX_RUNNERS)
+        except RegressException as e:
+            print(e)
+            sys.exit(1)
+        print(f"Rendered {len(cases)} reference case(s) into {out}")
+    elif args.reference and len(args.candidate) == 1:
+        reference, candidate = args.reference, args.candidate[0]
+    else:
+        parser.error("Give a reference and a candidate (or use --against)")
+    jobs = [
+        (reference, candidate, args.tolerance, args.volume_tolerance,
+         args.samples)
+        for reference, candidate in pair_files(reference, candidate)]
+    if not jobs:
+        print("Nothing to compare")
+        sys.exit(1)
+    changed = 0
+    missing = 0
+    with ProcessPoolExecutor(max_workers=args.jobs) as executor:
+        for reference, candidate, changes, stats in executor.map(_compare, jobs):
+            # (Reference cases are named after the case; outputs that failed
+            # validation end up as e.g. name.invalid.stl)
+            rendering = problems.get(candidate.name.partition(".")[0], [])
+            if changes is None:
+                missing += 1
+                print(f"{candidate}: missing (no candidate for {reference.name})")
+                for problem in rendering:
+                    print(f"    {problem}")
+                continue
+            changes = changes + rendering
+            if not changes:
+                print(f"{candidate}: OK (max surface distance "
+                      f"{stats['distance_max']:.4f}mm, triangles "
+                      f"{stats['triangles'][0]} -> {stats['triangles'][1]})")
+                continue
+            changed += 1
+            print(Style.BRIGHT + f"{candidate}: CHANGED" + Style.RESET_ALL)
+            for change in changes:
+                print(f"    {change}")
+    if changed or missing:
+        print(Style.BRIGHT +
+            f"{changed} changed, {missing} missing out of {len(jobs)}"
+            + Style.RESET_ALL)
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
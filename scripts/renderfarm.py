@@ -0,0 +1,643 @@
+#!/usr/bin/env python3
+
+"""
+A tiny render farm for builds that are too big for one machine.  A job server
+hands out jobs (serialized `JobSpec`s; see `jobspec.py`) over HTTP (JSON;
+nothing but the standard library on either end) and any number of worker
+daemons render them with their own local OpenSCAD and upload the results
+(plus how long they took and how much memory they needed) back to the
+server::
+
+    server$ ./scripts/renderfarm.py serve riskeycap_full --out /tmp/out --legends
+    box1$ ./scripts/renderfarm.py work http://server:8765 --slots 8
+    box2$ ./scripts/renderfarm.py work http://server:8765 --slots 4
+
+    # Or everything on localhost (handy for testing):
+    $ ./scripts/renderfarm.py serve riskeycap_full --out /tmp/out --local-workers 3
+
+The server owns the output directory and its build journal (see `journal.py`)
+so jobs that are already done get skipped just like with `build.py`.  Uploads
+are validated (see `validate.py`) and renamed into place atomically.
+
+Workers send a heartbeat every `HEARTBEAT_INTERVAL` seconds for the jobs
+they're running.  If a worker goes quiet for `LEASE_TIMEOUT` seconds (crashed,
+lost its network, got unplugged) its jobs go back in the queue for someone
+else.  When the queue runs dry idle workers steal a copy of the job that's
+been running the longest (once it's been going for `STEAL_AFTER` seconds);
+whichever copy finishes first wins and the other gets cancelled.
+
+Protocol (all POST, JSON bodies/responses)::
+
+    /lease      {"worker": id}              -> {"job": {...}|null, "done": bool}
+    /heartbeat  {"worker": id, "jobs": [..]} -> {"cancel": [job ids]}
+    /result/<job id>  (body: the rendered file; X-Worker and X-Result headers)
+    /status     (GET)                       -> counts, running jobs, workers
+"""
+
+# stdlib imports
+import os
+import sys
+import json
+import time
+import uuid
+import signal
+import socket
+import argparse
+import threading
+import importlib
+import subprocess
+import tempfile
+import urllib.request
+import urllib.error
+from pathlib import Path
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+# 3rd party stuff
+from colorama import Style
+# Our own stuff
+from journal import BuildJournal, partial_output_file
+from engine import read_peak_memory, invalid_output_file, MEMORY_POLL_INTERVAL
+from costmodel import CostModel
+from jobspec import JobSpec, freeze
+try:
+    from validate import check_mesh, expectations
+    from mesh import np
+except ImportError: # NumPy isn't required if you don't validate
+    np = None
+
+DEFAULT_PORT = 8765
+HEARTBEAT_INTERVAL = 5 # Seconds between worker heartbeats
+LEASE_TIMEOUT = 30 # Seconds without a heartbeat before a job gets reassigned
+STEAL_AFTER = 60 # Seconds a job has to be running before idle workers steal it
+MAX_ATTEMPTS = 2 # How many times a job gets tried before giving up on it
+IDLE_POLL = 2 # Seconds an idle worker waits before asking for work again
+CONNECT_RETRIES = 5 # How many times workers retry when the server is gone
+
+class FarmJob(object):
+    """
+    A job on the server: the *keycap* plus who's working on it.
+    """
+    def __init__(self, job_id, keycap, seconds):
+        self.id = job_id
+        self.keycap = keycap
+        self.seconds = seconds # Estimated
+        self.status = "pending" # pending, running, done, failed
+        self.leases = {} # worker -> [started, last heartbeat]
+        self.attempts = 0
+        self.result = None # What the winning (or last failed) worker sent
+        self.problems = []
+
+    def payload(self):
+        """
+        What workers get: the job's `JobSpec` (see `JobSpec.as_dict()`).  The
+        paths in it are ours; workers swap in their own.
+        """
+        keycap = self.keycap
+        # RENDER gets decided here since workers might not have colorscad.sh:
+        spec = JobSpec.from_keycap(keycap)._replace(
+            render=freeze(keycap.render_targets()))
+        return {
+            "id": self.id,
+            "spec": spec.as_dict(),
+            "colorscad": keycap.uses_colorscad(),
+        }
+
+class RenderFarm(object):
+    """
+    The server side state: a queue of jobs (biggest first) and their leases.
+    Thread safe (every request gets its own thread).
+    """
+    def __init__(self, jobs, journal, validate=True,
+            lease_timeout=LEASE_TIMEOUT, steal_after=STEAL_AFTER,
+            max_attempts=MAX_ATTEMPTS):
+        model = CostModel().calibrate(journal)
+        self.jobs = {}
+        for i, keycap in enumerate(jobs):
+            self.jobs[str(i)] = FarmJob(str(i), keycap, model.estimate(keycap)[0])
+        self.journal = journal
+        self.validate = validate and np is not None
+        self.lease_timeout = lease_timeout
+        self.steal_after = steal_after
+        self.max_attempts = max_attempts
+        self.workers = {} # worker -> last seen
+        self.lock = threading.Lock()
+        self.finished = threading.Event()
+        self._check_finished()
+
+    def _check_finished(self):
+        if all(job.status in ("done", "failed") for job in self.jobs.values()):
+            self.finished.set()
+
+    def _release(self, job, worker):
+        """
+        Drops *worker*'s lease on *job*; if nobody else is working on it it
+        goes back in the queue (or fails if it's been tried enough).
+        """
+        job.leases.pop(worker, None)
+        if job.status != "running" or job.leases:
+            return
+        if job.attempts >= self.max_attempts:
+            job.status = "failed"
+            if self.journal:
+                self.journal.fail(job.keycap, 0.0, "\n".join(job.problems))
+        else:
+            job.status = "pending"
+
+    def reap(self):
+        """
+        Takes jobs away from workers that stopped sending heartbeats.
+        """
+        now = time.monotonic()
+        with self.lock:
+            for job in self.jobs.values():
+                for worker, (_, seen) in list(job.leases.items()):
+                    if now - seen > self.lease_timeout:
+                        job.problems.append(f"{worker} stopped responding")
+                        print(Style.BRIGHT + f"[{job.keycap.name}] {worker} "
+                              f"stopped responding; reassigning"
+                              + Style.RESET_ALL, flush=True)
+                        self._release(job, worker)
+            self._check_finished()
+
+    def lease(self, worker):
+        """
+        Returns the next job (payload dict) for *worker* or `None` if there's
+        nothing for it to do right now.
+        """
+        now = time.monotonic()
+        with self.lock:
+            self.workers[worker] = now
+            pending = [j for j in self.jobs.values() if j.status == "pending"]
+            if pending:
+                job = max(pending, key=lambda j: (j.seconds, -int(j.id)))
+                job.status = "running"
+                job.attempts += 1
+            else:
+                # Work stealing: help out with the job that's been running the
+                # longest (if nobody's helping with it already):
+                running = [
+                    j for j in self.jobs.values()
+                    if j.status == "running" and len(j.leases) == 1
+                    and worker not in j.leases
+                    and now - min(s for s, _ in j.leases.values())
+                        > self.steal_after]
+                if not running:
+                    return None
+                job = min(running,
+                    key=lambda j: min(s for s, _ in j.leases.values()))
+                print(Style.BRIGHT + f"[{job.keycap.name}] {worker} is "
+                      f"stealing it" + Style.RESET_ALL, flush=True)
+            job.leases[worker] = [now, now]
+            if self.journal and len(job.leases) == 1:
+                self.journal.start(job.keycap)
+            print(f"[{job.keycap.name}] leased to {worker}", flush=True)
+            return job.payload()
+
+    def heartbeat(self, worker, job_ids):
+        """
+        Records that *worker* is still working on *job_ids*.  Returns the ids
+        it should cancel (someone else finished them or they were
+        reassigned).
+        """
+        now = time.monotonic()
+        cancel = []
+        with self.lock:
+            self.workers[worker] = now
+            for job_id in job_ids:
+                job = self.jobs.get(job_id)
+                if job is None or worker not in job.leases:
+                    cancel.append(job_id)
+                else:
+                    job.leases[worker][1] = now
+        return cancel
+
+    def submit(self, job_id, worker, result, data):
+        """
+        Handles a result upload.  *result* is the worker's metadata (retcode,
+        duration, peak memory, output) and *data* the rendered file.  Returns
+        `(accepted, message)`.
+        """
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None:
+                return False, "No such job"
+            if job.status == "done" or worker not in job.leases:
+                return False, "Job was already finished or reassigned"
+            keycap = job.keycap
+            if result.get("retcode") or not data:
+                job.problems.append(
+                    f"{worker}: exit code {result.get('retcode')}: "
+                    f"{result.get('output', '')[-1000:]}")
+                job.result = result
+                self._release(job, worker)
+                self._check_finished()
+                return True, "Failure recorded"
+            tmp_file = partial_output_file(keycap.output_file)
+            tmp_file = tmp_file.with_name(f"{tmp_file.stem}.{worker}{tmp_file.suffix}")
+        # Don't hold the lock while validating (other workers need it):
+        tmp_file.write_bytes(data)
+        report = None
+        if self.validate:
+            report = check_mesh(str(tmp_file), expectations(keycap))
+        with self.lock:
+            if job.status == "done" or worker not in job.leases:
+                tmp_file.unlink()
+                return False, "Job was already finished or reassigned"
+            job.result = result
+            if report is not None and not report.ok:
+                job.problems += [f"{worker}: {p}" for p in report.problems]
+                os.replace(tmp_file, invalid_output_file(keycap.output_file))
+                job.attempts = self.max_attempts # Same params; same result
+                self._release(job, worker)
+                self._check_finished()
+                return True, "Failed validation"
+            os.replace(tmp_file, keycap.output_file)
+            job.status = "done"
+            job.leases.clear()
+            if self.journal:
+                self.journal.finish(keycap, result.get("duration", 0.0),
+                    result.get("peak_memory_mb"),
+                    validation=report.stats if report else None)
+            print(Style.BRIGHT + f"[{keycap.name}] done by {worker} "
+                  f"({result.get('duration', 0):.1f}s)" + Style.RESET_ALL,
+                  flush=True)
+            self._check_finished()
+            return True, "Accepted"
+
+    def status(self):
+        now = time.monotonic()
+        with self.lock:
+            counts = {}
+            for job in self.jobs.values():
+                counts[job.status] = counts.get(job.status, 0) + 1
+            return {
+                "jobs": counts,
+                "running": {
+                    job.keycap.name: sorted(job.leases)
+                    for job in self.jobs.values() if job.status == "running"},
+                "workers": {
+                    worker: round(now - seen, 1)
+                    for worker, seen in self.workers.items()},
+                "done": self.finished.is_set(),
+            }
+
+class FarmHandler(BaseHTTPRequestHandler):
+    """
+    The HTTP side of `RenderFarm` (`self.server.farm`).
+    """
+    def log_message(self, format, *args):
+        pass # Way too chatty; the farm prints what matters
+
+    def _send(self, data, code=200):
+        body = json.dumps(data).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _body(self):
+        return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+    def do_GET(self):
+        if self.path == "/status":
+            self._send(self.server.farm.status())
+        else:
+            self._send({"error": "Not found"}, 404)
+
+    def do_POST(self):
+        farm = self.server.farm
+        try:
+            if self.path.startswith("/result/"):
+                worker = self.headers.get("X-Worker", "unknown")
+                result = json.loads(self.headers.get("X-Result", "{}"))
+                accepted, message = farm.submit(
+                    self.path[len("/result/"):], worker, result, self._body())
+                self._send({"accepted": accepted, "message": message})
+                return
+            request = json.loads(self._body() or b"{}")
+            worker = request.get("worker", "unknown")
+            if self.path == "/lease":
+                job = farm.lease(worker)
+                self._send({"job": job, "done": farm.finished.is_set()})
+            elif self.path == "/heartbeat":
+                self._send(
+                    {"cancel": farm.heartbeat(worker, request.get("jobs", []))})
+            else:
+                self._send({"error": "Not found"}, 404)
+        except (ValueError, KeyError) as e:
+            self._send({"error": str(e)}, 400)
+
+def serve(farm, host="0.0.0.0", port=DEFAULT_PORT, local_workers=0, slots=1):
+    """
+    Runs the job server until every job in *farm* is done (or failed).  If
+    *local_workers* is given that many workers (with *slots* each) get
+    started on this machine too.  Returns the `FarmJob`s.
+    """
+    server = ThreadingHTTPServer((host, port), FarmHandler)
+    server.daemon_threads = True
+    server.farm = farm
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    url = f"http://{'127.0.0.1' if host == '0.0.0.0' else host}:{server.server_port}"
+    print(Style.BRIGHT + f"Serving {len(farm.jobs)} job(s) at {url}"
+          + Style.RESET_ALL, flush=True)
+    workers = [
+        subprocess.Popen([sys.executable, __file__, "work", url,
+            "--slots", str(slots), "--name", f"{socket.gethostname()}-{i}"])
+        for i in range(local_workers)]
+    try:
+        while not farm.finished.wait(1):
+            farm.reap()
+        # Give the workers a chance to hear that we're done:
+        time.sleep(IDLE_POLL + 1)
+    finally:
+        server.shutdown()
+        for proc in workers:
+            try:
+                proc.wait(timeout=HEARTBEAT_INTERVAL*2)
+            except subprocess.TimeoutExpired:
+                proc.terminate()
+    return list(farm.jobs.values())
+
+def _post(url, path, data=None, body=None, headers=None, timeout=60):
+    """
+    POSTs *data* (JSON) or *body* (bytes) to the server and returns the
+    decoded JSON response.
+    """
+    if body is None:
+        body = json.dumps(data or {}).encode("utf-8")
+    request = urllib.request.Request(
+        url.rstrip("/") + path, data=body, headers=headers or {},
+        method="POST")
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        return json.loads(response.read())
+
+class Worker(object):
+    """
+    Leases jobs from the server at *url* and renders them (up to *slots* at a
+    time) with the local *openscad_path* (and *colorscad_path* for jobs that
+    need it) and *keycap_playground_path*.
+    """
+    def __init__(self, url, slots=1, name=None,
+            openscad_path=Path("/usr/bin/openscad"), colorscad_path=None,
+            keycap_playground_path=Path("./keycap_playground.scad")):
+        self.url = url
+        self.slots = slots
+        self.name = name or f"{socket.gethostname()}-{uuid.uuid4().hex[:6]}"
+        self.openscad_path = Path(openscad_path)
+        self.colorscad_path = colorscad_path
+        self.keycap_playground_path = Path(keycap_playground_path).resolve()
+        self.processes = {} # job id -> Popen
+        self.cancelled = set() # Job ids we killed because the server said so
+        self.uploading = set() # Job ids whose results are being uploaded
+        self.lock = threading.Lock()
+        self.stopping = threading.Event()
+
+    def keycap(self, job):
+        """
+        Returns the `Keycap` for *job* (a payload from the server) with this
+        machine's paths.
+        """
+        colorscad_path = ""
+        if job["colorscad"] and self.colorscad_path:
+            colorscad_path = self.colorscad_path
+        spec = JobSpec.from_dict(job["spec"]).with_params(
+            openscad_path=self.openscad_path,
+            colorscad_path=colorscad_path,
+            keycap_playground_path=self.keycap_playground_path)
+        return spec.keycap()
+
+    def _call(self, path, data=None, **kwargs):
+        """
+        Talks to the server (retrying for a while if it can't be reached).
+        Returns `None` if it's gone for good.
+        """
+        for attempt in range(CONNECT_RETRIES):
+            if self.stopping.is_set():
+                return None
+            try:
+                return _post(self.url, path, data, **kwargs)
+            except (urllib.error.URLError, ConnectionError, socket.timeout,
+                    ValueError):
+                time.sleep(min(2**attempt, 10))
+        return None
+
+    def render(self, job, directory):
+        """
+        Renders *job* and uploads the result.
+        """
+        keycap = self.keycap(job)
+        output_file = Path(directory) / f"{job['id']}.{keycap.file_type}"
+        result = {"retcode": None, "duration": 0.0, "peak_memory_mb": None}
+        start = time.monotonic()
+        try:
+            proc = subprocess.Popen(keycap.args(output_file=output_file),
+                stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                env=keycap.environment(),
+                start_new_session=True) # So cancelling gets all of it
+        except OSError as e:
+            result.update(retcode=127, output=f"Could not run OpenSCAD: {e}")
+            with self.lock:
+                self.uploading.add(job["id"])
+        else:
+            with self.lock:
+                self.processes[job["id"]] = proc
+            peak = [None]
+            def watch_memory():
+                while proc.poll() is None:
+                    memory = read_peak_memory(proc.pid)
+                    if memory is not None:
+                        peak[0] = max(peak[0] or 0, memory)
+                    time.sleep(MEMORY_POLL_INTERVAL)
+            watcher = threading.Thread(target=watch_memory, daemon=True)
+            watcher.start()
+            output = proc.communicate()[0].decode("utf-8", errors="replace")
+            watcher.join()
+            with self.lock:
+                self.processes.pop(job["id"], None)
+                cancelled = job["id"] in self.cancelled
+                self.cancelled.discard(job["id"])
+                if not cancelled: # Keep the lease alive until it's uploaded
+                    self.uploading.add(job["id"])
+            result.update(retcode=proc.returncode, output=output[-4000:],
+                duration=round(time.monotonic() - start, 3),
+                peak_memory_mb=peak[0])
+            if cancelled:
+                if output_file.exists():
+                    output_file.unlink()
+                print(f"[{keycap.name}] cancelled", flush=True)
+                return
+        try:
+            data = b""
+            if result["retcode"] == 0 and output_file.exists():
+                data = output_file.read_bytes()
+            if output_file.exists():
+                output_file.unlink()
+            response = self._call(f"/result/{job['id']}", body=data, headers={
+                "X-Worker": self.name,
+                "X-Result": json.dumps(result, ensure_ascii=True),
+                "Content-Type": "application/octet-stream"})
+        finally:
+            with self.lock:
+                self.uploading.discard(job["id"])
+        if response:
+            print(f"[{keycap.name}] {response['message']} "
+                  f"({result['duration']:.1f}s)", flush=True)
+
+    def _cancel(self, job_id):
+        """
+        Kills the OpenSCAD process (group) rendering *job_id* (if it's still
+        running) and remembers that we did so `render()` doesn't report it as
+        a failure.  Call with `self.lock` held.
+        """
+        proc = self.processes.get(job_id)
+        if proc is None or proc.poll() is not None:
+            return
+        self.cancelled.add(job_id)
+        try:
+            os.killpg(proc.pid, signal.SIGTERM)
+        except (ProcessLookupError, PermissionError):
+            pass
+
+    def beat(self):
+        """
+        Tells the server what we're working on (rendering or still uploading)
+        and kills anything it says to cancel.
+        """
+        with self.lock:
+            job_ids = list(self.processes) + sorted(self.uploading)
+        if not job_ids:
+            return
+        response = self._call("/heartbeat",
+            {"worker": self.name, "jobs": job_ids})
+        for job_id in (response or {}).get("cancel", []):
+            with self.lock:
+                self._cancel(job_id)
+
+    def heartbeat(self):
+        """
+        Calls `beat()` every `HEARTBEAT_INTERVAL` seconds until we stop.
+        """
+        while not self.stopping.wait(HEARTBEAT_INTERVAL):
+            self.beat()
+
+    def slot(self, directory):
+        """
+        One render slot: keeps leasing and rendering jobs until the server
+        says everything's done (or goes away).
+        """
+        while not self.stopping.is_set():
+            response = self._call("/lease", {"worker": self.name})
+            if response is None or (response["done"] and not response["job"]):
+                return
+            if not response["job"]:
+                time.sleep(IDLE_POLL)
+                continue
+            self.render(response["job"], directory)
+
+    def run(self):
+        print(Style.BRIGHT + f"Worker {self.name} ({self.slots} slot(s)) "
+              f"working for {self.url}" + Style.RESET_ALL, flush=True)
+        beats = threading.Thread(target=self.heartbeat, daemon=True)
+        beats.start()
+        with tempfile.TemporaryDirectory(prefix="renderfarm-") as directory:
+            slots = [
+                threading.Thread(target=self.slot, args=(directory,))
+                for _ in range(self.slots)]
+            for thread in slots:
+                thread.start()
+            try:
+                for thread in slots:
+                    thread.join()
+            finally:
+                self.stopping.set()
+                with self.lock:
+                    for job_id in list(self.processes):
+                        self._cancel(job_id)
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Render keycaps on several machines: a job server and "
+                    "the workers that do the rendering.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    server = subparsers.add_parser("serve", help="Run the job server.")
+    server.add_argument('module',
+        metavar="module",
+        help="The keyset script to render (e.g. riskeycap_full).")
+    server.add_argument('names',
+        nargs='*', metavar="name",
+        help='Only render the keycaps with these names.')
+    server.add_argument('--out',
+        metavar='<filepath>', type=str, default=".",
+        help='Where the rendered files will go (on the server).')
+    server.add_argument('--legends',
+        required=False, action='store_true',
+        help='Also render separate legends files.')
+    server.add_argument('--force',
+        required=False, action='store_true',
+        help='Re-render keycaps even if they already exist.')
+    server.add_argument('--no-validate',
+        required=False, action='store_true',
+        help="Don't check uploaded files (see validate.py).")
+    server.add_argument('--host',
+        type=str, default="0.0.0.0",
+        help="Address to listen on (default: all of them).")
+    server.add_argument('--port',
+        type=int, default=DEFAULT_PORT,
+        help=f"Port to listen on (default: {DEFAULT_PORT}; 0 picks one).")
+    server.add_argument('--local-workers',
+        metavar='<n>', type=int, default=0,
+        help="Also start this many workers on this machine.")
+    server.add_argument('--slots',
+        metavar='<n>', type=int, default=1,
+        help="Render slots per local worker.")
+    worker = subparsers.add_parser("work", help="Run a worker.")
+    worker.add_argument('url',
+        help=f"The job server (e.g. http://server:{DEFAULT_PORT}).")
+    worker.add_argument('--slots',
+        metavar='<n>', type=int, default=os.cpu_count() or 1,
+        help="How many jobs to render at once (default: one per CPU).")
+    worker.add_argument('--name',
+        type=str, default=None,
+        help="What to call this worker (default: hostname + random).")
+    worker.add_argument('--openscad',
+        metavar='<path>', type=str, default="/usr/bin/openscad",
+        help="This machine's OpenSCAD.")
+    worker.add_argument('--colorscad',
+        metavar='<path>', type=str, default=None,
+        help="This machine's colorscad (for multi-color 3MF jobs).")
+    worker.add_argument('--playground',
+        metavar='<path>', type=str, default="./keycap_playground.scad",
+        help="This machine's keycap_playground.scad.")
+    args = parser.parse_args()
+    if args.command == "work":
+        Worker(args.url, slots=args.slots, name=args.name,
+            openscad_path=args.openscad, colorscad_path=args.colorscad,
+            keycap_playground_path=args.playground).run()
+        return
+    from build import select_jobs
+    os.makedirs(args.out, exist_ok=True)
+    keycaps = importlib.import_module(args.module).KEYCAPS
+    journal = BuildJournal(args.out)
+    jobs = [
+        keycap for keycap in select_jobs(keycaps, args.out,
+            names=args.names, legends=args.legends)
+        if args.force or not journal.is_done(keycap)]
+    farm = RenderFarm(jobs, journal, validate=not args.no_validate)
+    try:
+        finished = serve(farm, host=args.host, port=args.port,
+            local_workers=args.local_workers, slots=args.slots)
+    except KeyboardInterrupt:
+        sys.exit(130)
+    failed = [job for job in finished if job.status != "done"]
+    for job in failed:
+        print(Style.BRIGHT + f"{job.keycap.name}: failed" + Style.RESET_ALL)
+        for problem in job.problems:
+            print(f"    {problem.strip()}")
+    print(Style.BRIGHT + f"{len(finished) - len(failed)} of {len(finished)} "
+          f"job(s) rendered" + Style.RESET_ALL)
+    if failed:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
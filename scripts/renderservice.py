@@ -0,0 +1,561 @@
+#!/usr/bin/env python3
+
+"""
+A local render service: ask for a keycap over HTTP (JSON) instead of running
+the scripts.  Every client shares the same pool of OpenSCAD processes (see
+`engine.py`) and the same render cache (see `artifactcache.py`) so the
+second person to ask for a keycap gets it right away::
+
+    $ ./scripts/renderservice.py --out /tmp/service --jobs 4
+    $ ./scripts/renderservice.py --out /tmp/service --cache http://buildbox:8766
+
+    $ curl -s localhost:8767/render -d '{"base": "riskeycap_full:1U_blank",
+        "params": {"legends": ["Q"], "file_type": "stl"}}'
+    {"id": "3f9c...", "status": "queued", ...}
+    $ curl -s 'localhost:8767/jobs/3f9c...?wait=60'
+    {"id": "3f9c...", "status": "done", "artifact": "/jobs/3f9c.../artifact", ...}
+    $ curl -s -o Q.stl localhost:8767/jobs/3f9c.../artifact
+
+Requests are a `base` keycap (`module:name` from one of the keysets the
+service was started with; see `--keyset`) or a plain `Keycap()` if there's no
+`base`, plus `params`: the `Keycap` fields to change.  Fields that point at
+files or programs (paths, `openscad_args`, etc) can't be set by clients and
+every value has to have the same type as the base keycap's (see
+`check_param()`; e.g. `legends` has to be a list of strings).
+
+A job's id is its cache key (`artifactcache.cache_key()`) so identical
+requests always end up as the same job: asking for something that's already
+queued or rendering just gets you that job (no second render) and asking for
+something that's in the cache gets you a finished job immediately.
+
+API (JSON responses)::
+
+    POST /render           {"base": ..., "params": {...}, "name": ...,
+                            "wait": seconds} -> job (202 until it's done)
+    GET  /jobs/<id>        (?wait=seconds to block until it's done) -> job
+    GET  /jobs/<id>/artifact                  -> the rendered file
+    GET  /status                              -> job counts, cache stats
+
+.. note::
+
+    The `.scad` files are only read once (the cache key covers them).
+    Restart the service after changing them.
+"""
+
+# stdlib imports
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import importlib
+import threading
+from pathlib import Path
+from collections import OrderedDict
+from urllib.parse import urlsplit, parse_qs
+from concurrent.futures import ProcessPoolExecutor
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+# 3rd party stuff
+from colorama import Style
+# Our own stuff
+from keycap import Keycap
+from jobspec import JobSpec
+from engine import RenderEngine, MAX_RUNNERS
+from artifactcache import (
+    CacheException, open_cache, parse_size, cache_key, print_stats)
+
+DEFAULT_PORT = 8767
+KEYSETS = ("riskeycap_full", "riskeyboard_70", "gem_full")
+MAX_FINISHED = 1000 # How many finished jobs to remember
+MAX_WAIT = 600 # Longest a client can block waiting for a job (seconds)
+FILE_TYPES = ("stl", "3mf")
+CONTENT_TYPES = {"stl": "model/stl", "3mf": "model/3mf"}
+# Fields clients can't set (they'd let them run/read/write whatever they want):
+RESERVED = ("name", "output_path", "openscad_path", "colorscad_path",
+            "keycap_playground_path", "openscad_args")
+
+class ServiceException(Exception):
+    """
+    Raised for requests the service can't do anything with.
+    """
+    pass
+
+def _describe(current, plural=False):
+    if isinstance(current, bool):
+        return "true/false"
+    if current is None:
+        return "numbers or null" if plural else "a number or null"
+    if isinstance(current, (int, float)):
+        return "numbers" if plural else "a number"
+    if isinstance(current, str):
+        return "strings" if plural else "a string"
+    if isinstance(current, list):
+        items = (_describe(current[0], plural=True) if current
+                 else "strings/numbers")
+        return f"lists of {items}" if plural else f"a list of {items}"
+    return type(current).__name__
+
+def _matches(value, current):
+    """
+    Returns `True` if *value* (from JSON) has the same type as *current* (the
+    base keycap's value).  Numbers are interchangeable (but not with bools).
+    """
+    is_number = isinstance(value, (int, float)) and not isinstance(value, bool)
+    if isinstance(current, bool):
+        return isinstance(value, bool)
+    if current is None: # e.g. fn
+        return value is None or is_number
+    if isinstance(current, (int, float)):
+        return is_number
+    if isinstance(current, str):
+        return isinstance(value, str)
+    if isinstance(current, list):
+        if not isinstance(value, list):
+            return False
+        if current:
+            return all(_matches(item, current[0]) for item in value)
+        # Nothing to go on (e.g. fonts=[]); plain values only:
+        return all(isinstance(item, str)
+            or (isinstance(item, (int, float)) and not isinstance(item, bool))
+            for item in value)
+    return False # Paths and whatever else aren't settable
+
+def check_param(field, value, current):
+    """
+    Raises `ServiceException` if *value* can't be used for *field* (whose
+    value in the base keycap is *current*).
+    """
+    if not _matches(value, current):
+        raise ServiceException(
+            f"{field} must be {_describe(current)} (got {json.dumps(value)})")
+
+class ServiceJob(object):
+    """
+    A (deduplicated) render request: *keycap* (already pointed at where it
+    gets rendered) and how it's going.
+    """
+    def __init__(self, job_id, name, keycap):
+        self.id = job_id
+        self.name = name # What the client called it
+        self.keycap = keycap
+        self.status = "queued" # queued, running, done, failed
+        self.cached = False
+        self.requests = 1 # How many requests ended up as this job
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+        self.duration = None
+        self.peak_memory_mb = None
+        self.problems = []
+        self.event = threading.Event() # Set once it's done (or failed)
+
+    def finish(self, status, problems=None):
+        self.status = status
+        self.finished = time.time()
+        self.problems = problems or []
+        self.event.set()
+
+    def as_dict(self):
+        data = {
+            "id": self.id,
+            "name": self.name,
+            "status": self.status,
+            "cached": self.cached,
+            "requests": self.requests,
+            "file_type": self.keycap.file_type,
+            "submitted": self.submitted,
+            "started": self.started,
+            "finished": self.finished,
+            "duration": self.duration,
+            "peak_memory_mb": self.peak_memory_mb,
+            "problems": self.problems,
+        }
+        if self.status == "done":
+            data["artifact"] = f"/jobs/{self.id}/artifact"
+        return data
+
+class RenderService(object):
+    """
+    Keeps track of the jobs, renders them (via `RenderEngine` in an asyncio
+    loop running in its own thread) and stores the results in *cache*.
+    Rendered files go in *out*.  Thread safe (every HTTP request gets its own
+    thread).
+    """
+    def __init__(self, out, cache, max_runners=MAX_RUNNERS, validate=True,
+            keysets=KEYSETS, openscad_path=Path("/usr/bin/openscad"),
+            colorscad_path=Path(""),
+            keycap_playground_path=Path("./keycap_playground.scad")):
+        self.renders = Path(out) / "renders"
+        self.renders.mkdir(parents=True, exist_ok=True)
+        self.cache = cache
+        self.max_runners = max_runners
+        self.keysets = keysets
+        self.paths = {
+            "openscad_path": Path(openscad_path),
+            "colorscad_path": Path(colorscad_path),
+            "keycap_playground_path": Path(keycap_playground_path).resolve(),
+        }
+        self.engine = RenderEngine(
+            max_runners=max_runners, quiet=True, validate=validate)
+        self.jobs = OrderedDict() # id -> ServiceJob (oldest first)
+        self.lock = threading.Lock()
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self._run_loop, daemon=True)
+        self.semaphore = None
+        self.tasks = set()
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self.loop)
+        self.semaphore = asyncio.Semaphore(self.max_runners)
+        self.loop.run_forever()
+
+    def start(self):
+        if self.engine.validate:
+            self.engine.executor = ProcessPoolExecutor(
+                max_workers=self.max_runners)
+        self.thread.start()
+
+    def stop(self):
+        """
+        Cancels everything that's still rendering (killing the OpenSCAD
+        processes) and stops the render loop.
+        """
+        async def cancel_all():
+            for task in list(self.tasks):
+                task.cancel()
+            await asyncio.gather(*self.tasks, return_exceptions=True)
+        if self.thread.is_alive():
+            asyncio.run_coroutine_threadsafe(cancel_all(), self.loop).result()
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join()
+        if self.engine.executor:
+            self.engine.executor.shutdown(cancel_futures=True)
+            self.engine.executor = None
+
+    def base(self, spec):
+        """
+        Returns the base keycap for *spec* (`module:name` or `None`).  Don't
+        modify it; it's the one in the keyset's `KEYCAPS`.
+        """
+        if not spec:
+            return Keycap()
+        module_name, _, name = str(spec).partition(":")
+        if module_name not in self.keysets:
+            raise ServiceException(
+                f"Unknown keyset {module_name!r} (try one of: "
+                f"{', '.join(self.keysets)})")
+        for keycap in importlib.import_module(module_name).KEYCAPS:
+            if keycap.name.lower() == name.lower():
+                return keycap
+        raise ServiceException(f"{module_name} has no keycap named {name!r}")
+
+    def keycap(self, request):
+        """
+        Returns the `Keycap` described by *request* (a dict; see the module
+        docs).
+        """
+        if not isinstance(request, dict):
+            raise ServiceException("Expected a JSON object")
+        base = self.base(request.get("base"))
+        params = request.get("params", {})
+        if not isinstance(params, dict):
+            raise ServiceException("params must be a JSON object")
+        for field, value in params.items():
+            if (field in RESERVED or field.startswith("_")
+                    or not hasattr(base, field)
+                    or callable(getattr(base, field))):
+                raise ServiceException(f"Can't set {field!r}")
+            check_param(field, value, getattr(base, field))
+        spec = JobSpec.from_keycap(base).with_params(**params, **self.paths)
+        if spec.file_type not in FILE_TYPES:
+            raise ServiceException(
+                f"file_type must be one of: {', '.join(FILE_TYPES)}")
+        return spec.keycap()
+
+    def submit(self, request):
+        """
+        Returns the `ServiceJob` for *request*: an existing one if the same
+        keycap is already queued, rendering, or done, otherwise a new one
+        (finished straight away if it's in the cache).
+        """
+        keycap = self.keycap(request)
+        name = str(request.get("name") or keycap.name)
+        job_id = cache_key(keycap)
+        keycap = JobSpec.from_keycap(keycap, output_path=self.renders)._replace(
+            name=job_id).keycap()
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is not None and job.status != "failed":
+                job.requests += 1
+                return job
+            job = ServiceJob(job_id, name, keycap)
+            self.jobs[job_id] = job
+            self.jobs.move_to_end(job_id)
+        # Everyone else asking for it now gets this job while we check:
+        if self.fetch(job):
+            return job
+        print(Style.BRIGHT + f"[{name}] queued ({job_id[:12]})"
+              + Style.RESET_ALL, flush=True)
+        asyncio.run_coroutine_threadsafe(self._track(job), self.loop)
+        return job
+
+    def fetch(self, job):
+        """
+        Finishes *job* with the file from the cache if it's there.  Returns
+        `True` if it was.
+        """
+        try:
+            entry = self.cache.fetch(job.id, job.keycap.output_file)
+        except (CacheException, OSError) as e:
+            print(Style.BRIGHT + f"Could not check the cache: {e}"
+                  + Style.RESET_ALL, flush=True)
+            return False
+        if entry is None:
+            return False
+        job.cached = True
+        job.duration = entry.get("duration")
+        job.peak_memory_mb = entry.get("peak_memory_mb")
+        job.finish("done")
+        self._forget_old()
+        print(Style.BRIGHT + f"[{job.name}] served from the cache"
+              + Style.RESET_ALL, flush=True)
+        return True
+
+    async def _track(self, job):
+        task = asyncio.ensure_future(self._render(job))
+        self.tasks.add(task)
+        try:
+            await task
+        except asyncio.CancelledError:
+            job.finish("failed", ["Cancelled (the service is shutting down)"])
+        finally:
+            self.tasks.discard(task)
+
+    async def _render(self, job):
+        keycap = job.keycap
+        async with self.semaphore:
+            job.status = "running"
+            job.started = time.time()
+            result = await self.engine.render(keycap)
+        job.duration = round(result.duration, 3)
+        job.peak_memory_mb = result.peak_memory_mb
+        if not result.ok:
+            problems = [line for _, line in result.problems]
+            job.finish("failed", problems or result.lines[-5:])
+            print(Style.BRIGHT + f"[{job.name}] failed" + Style.RESET_ALL,
+                  flush=True)
+            return
+        meta = {
+            "name": job.name,
+            "duration": job.duration,
+            "peak_memory_mb": result.peak_memory_mb,
+            "validation": result.validation.stats
+                if result.validation else None,
+        }
+        try: # Might be an HTTP cache; don't hold up the loop
+            await asyncio.get_running_loop().run_in_executor(
+                None, self.cache.publish, job.id, keycap.output_file, meta)
+        except (CacheException, OSError) as e:
+            print(Style.BRIGHT + f"Could not store {job.name} in the cache: "
+                  f"{e}" + Style.RESET_ALL, flush=True)
+        job.finish("done")
+        self._forget_old()
+        print(Style.BRIGHT + f"[{job.name}] done ({job.duration:.1f}s)"
+              + Style.RESET_ALL, flush=True)
+
+    def _forget_old(self):
+        """
+        Drops the oldest finished jobs (and their files; they're in the
+        cache) once there's more than `MAX_FINISHED` of them.
+        """
+        with self.lock:
+            finished = [job for job in self.jobs.values()
+                        if job.status in ("done", "failed")]
+            for job in finished[:max(0, len(finished) - MAX_FINISHED)]:
+                del self.jobs[job.id]
+                try:
+                    job.keycap.output_file.unlink()
+                except OSError:
+                    pass
+
+    def job(self, job_id):
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def status(self):
+        with self.lock:
+            counts = {}
+            for job in self.jobs.values():
+                counts[job.status] = counts.get(job.status, 0) + 1
+        try:
+            cache = self.cache.stats()
+        except (CacheException, OSError) as e:
+            cache = {"error": str(e)}
+        return {
+            "jobs": counts,
+            "max_runners": self.max_runners,
+            "cache": str(self.cache),
+            "cache_stats": cache,
+        }
+
+def _wait_time(value):
+    try:
+        return min(max(float(value), 0), MAX_WAIT)
+    except (TypeError, ValueError):
+        raise ServiceException(f"Invalid wait: {value!r}")
+
+class ServiceHandler(BaseHTTPRequestHandler):
+    """
+    The HTTP side of `RenderService` (`self.server.service`).
+    """
+    def log_message(self, format, *args):
+        pass # The service prints what matters
+
+    def _send(self, data, code=200):
+        body = json.dumps(data).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_job(self, job, wait=0):
+        if wait:
+            job.event.wait(wait)
+        self._send(job.as_dict(), 200 if job.event.is_set() else 202)
+
+    def _send_artifact(self, job):
+        path = job.keycap.output_file
+        try:
+            data = path.read_bytes()
+        except OSError: # Forgotten in the meantime
+            self._send({"error": "Gone; submit it again"}, 410)
+            return
+        file_type = job.keycap.file_type
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPES[file_type])
+        self.send_header("Content-Length", str(len(data)))
+        self.send_header("Content-Disposition",
+            f'attachment; filename="{job.name}.{file_type}"')
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        service = self.server.service
+        url = urlsplit(self.path)
+        parts = url.path.strip("/").split("/")
+        try:
+            if parts == ["status"]:
+                self._send(service.status())
+                return
+            job = service.job(parts[1]) if (
+                len(parts) in (2, 3) and parts[0] == "jobs") else None
+            if job is None:
+                self._send({"error": "Not found"}, 404)
+            elif len(parts) == 2:
+                wait = parse_qs(url.query).get("wait", [0])[0]
+                self._send_job(job, _wait_time(wait))
+            elif parts[2] != "artifact":
+                self._send({"error": "Not found"}, 404)
+            elif job.status != "done":
+                self._send(job.as_dict(), 409)
+            else:
+                self._send_artifact(job)
+        except ServiceException as e:
+            self._send({"error": str(e)}, 400)
+
+    def do_POST(self):
+        if self.path != "/render":
+            self._send({"error": "Not found"}, 404)
+            return
+        try:
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            request = json.loads(body or b"{}")
+            wait = _wait_time(request.get("wait", 0)
+                if isinstance(request, dict) else 0)
+            job = self.server.service.submit(request)
+        except ValueError as e:
+            self._send({"error": f"Bad JSON: {e}"}, 400)
+            return
+        except (ServiceException, TypeError) as e:
+            self._send({"error": str(e)}, 400)
+            return
+        self._send_job(job, wait)
+
+def serve(service, host="127.0.0.1", port=DEFAULT_PORT):
+    """
+    Runs *service* (a `RenderService`) over HTTP until interrupted.
+    """
+    server = ThreadingHTTPServer((host, port), ServiceHandler)
+    server.daemon_threads = True
+    server.service = service
+    service.start()
+    print(Style.BRIGHT + f"Render service listening on "
+          f"http://{host}:{server.server_port} (cache: {service.cache})"
+          + Style.RESET_ALL, flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.stop()
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Render keycaps on request via a local HTTP/JSON API.")
+    parser.add_argument('--out',
+        metavar='<filepath>', type=str, default=".",
+        help='Where rendered files (and the default cache) go.')
+    parser.add_argument('--host',
+        type=str, default="127.0.0.1",
+        help="Address to listen on (default: localhost only).")
+    parser.add_argument('--port',
+        type=int, default=DEFAULT_PORT,
+        help=f"Port to listen on (default: {DEFAULT_PORT}; 0 picks one).")
+    parser.add_argument('--jobs',
+        metavar='<n>', type=int, default=MAX_RUNNERS,
+        help=f'How many OpenSCAD processes to run at once (default: {MAX_RUNNERS}).')
+    parser.add_argument('--cache',
+        metavar='<dir|url>', type=str,
+        default=os.environ.get("KEYCAP_CACHE"),
+        help="Render cache (a directory or http:// URL; see "
+             "artifactcache.py).  Defaults to $KEYCAP_CACHE or <out>/cache.")
+    parser.add_argument('--cache-size',
+        metavar='<size>', type=str, default=None,
+        help="Size cap for a --cache directory (e.g. 20G).")
+    parser.add_argument('--keyset',
+        metavar='<module>', action='append', default=None,
+        help="Keyset script clients can use as a base (can be given more "
+             f"than once; default: {', '.join(KEYSETS)}).")
+    parser.add_argument('--no-validate',
+        required=False, action='store_true',
+        help="Don't check rendered keycaps for problems (see validate.py).")
+    parser.add_argument('--openscad',
+        metavar='<path>', type=str, default="/usr/bin/openscad",
+        help="The OpenSCAD to render with.")
+    parser.add_argument('--colorscad',
+        metavar='<path>', type=str, default="",
+        help="colorscad.sh (for multi-color 3MF files).")
+    parser.add_argument('--playground',
+        metavar='<path>', type=str, default="./keycap_playground.scad",
+        help="The keycap_playground.scad to render with.")
+    args = parser.parse_args()
+    os.makedirs(args.out, exist_ok=True)
+    try:
+        max_bytes = parse_size(args.cache_size) if args.cache_size else None
+        cache = open_cache(
+            args.cache or os.path.join(args.out, "cache"), max_bytes=max_bytes)
+    except CacheException as e:
+        print(Style.BRIGHT + str(e) + Style.RESET_ALL)
+        sys.exit(1)
+    service = RenderService(args.out, cache, max_runners=args.jobs,
+        validate=not args.no_validate, keysets=args.keyset or KEYSETS,
+        openscad_path=args.openscad, colorscad_path=args.colorscad,
+        keycap_playground_path=args.playground)
+    serve(service, host=args.host, port=args.port)
+    print_stats(cache.stats())
+
+if __name__ == "__main__":
+    main()
@@ -10,17 +10,10 @@ to use this script is from within the `keycap_playground` directory.
 """
 
 # stdlib imports
-import os, sys
-import json
-import argparse
 from copy import deepcopy
-from subprocess import getstatusoutput
-# 3rd party stuff
-from colorama import Fore, Back, Style
-from colorama import init as color_init
-color_init()
 # Our own stuff
 from keycap import Keycap
+from build import main
 
 KEY_UNIT = 19.05 # Square that makes up the entire space of a key
 BETWEENSPACE = 0.8 # Space between keycaps
@@ -603,128 +596,5 @@ KEYCAPS = [
     riskeyboard70_alphas(name="numpadminus", legends=["-"]),
 ]
 
-def print_keycaps():
-    """
-    Prints the names of all keycaps in KEYCAPS.
-    """
-    print(Style.BRIGHT +
-          f"Here's all the keycaps we can render:\n" + Style.RESET_ALL)
-    keycap_names = ", ".join(a.name for a in KEYCAPS)
-    print(f"{keycap_names}")
-
 if __name__ == "__main__":
-    parser = argparse.ArgumentParser(
-        description="Render keycap STLs for all the Riskeyboard 70's switches.")
-    parser.add_argument('--out',
-        metavar='<filepath>', type=str, default=".",
-        help='Where the generated STL files will go.')
-    parser.add_argument('--force',
-        required=False, action='store_true',
-        help='Forcibly re-render STL files even if they already exist.')
-    parser.add_argument('--legends',
-        required=False, action='store_true',
-        help='If True, generate a separate set of STLs for legends.')
-    parser.add_argument('--keycaps',
-        required=False, action='store_true',
-        help='If True, prints out the names of all keycaps we can render.')
-    parser.add_argument('names',
-        nargs='*', metavar="name",
-        help='Optional name of specific keycap you wish to render')
-    args = parser.parse_args()
-    #print(args)
-    if len(sys.argv) == 1:
-        parser.print_help()
-        print("")
-        print_keycaps()
-        sys.exit(1)
-    if args.keycaps:
-        print_keycaps()
-        sys.exit(1)
-    if not os.path.exists(args.out):
-        print(Style.BRIGHT +
-              f"Output path, '{args.out}' does not exist; making it..."
-              + Style.RESET_ALL)
-        os.mkdir(args.out)
-    print(Style.BRIGHT + f"Outputting to: {args.out}" + Style.RESET_ALL)
-    if args.names: # Just render the specified keycaps
-        matched = False
-        for name in args.names:
-            for keycap in KEYCAPS:
-                if keycap.name.lower() == name.lower():
-                    keycap.output_path = f"{args.out}"
-                    matched = True
-                    exists = False
-                    if not args.force:
-                        if os.path.exists(f"{args.out}/{keycap.name}.stl"):
-                            print(Style.BRIGHT +
-                                f"{args.out}/{keycap.name}.stl exists; "
-                                f"skipping..."
-                                + Style.RESET_ALL)
-                            exists = True
-                    if not exists:
-                        print(Style.BRIGHT +
-                            f"Rendering {args.out}/{keycap.name}.stl..."
-                            + Style.RESET_ALL)
-                        print(keycap)
-                        retcode, output = getstatusoutput(str(keycap))
-                        if retcode == 0: # Success!
-                            print(
-                                f"{args.out}/{keycap.name}.stl "
-                                f"rendered successfully")
-                    if args.legends:
-                        keycap.name = f"{keycap.name}_legends"
-                        if os.path.exists(f"{args.out}/{keycap.name}.stl"):
-                            print(Style.BRIGHT +
-                                f"{args.out}/{keycap.name}.stl exists; "
-                                f"skipping..."
-                                + Style.RESET_ALL)
-                            continue
-                        print(Style.BRIGHT +
-                            f"Rendering {args.out}/{keycap.name}.stl..."
-                            + Style.RESET_ALL)
-                        print(keycap)
-                        retcode, output = getstatusoutput(str(keycap))
-                        if retcode == 0: # Success!
-                            print(
-                                f"{args.out}/{keycap.name}.stl "
-                                f"rendered successfully")
-        if not matched:
-            print(f"Cound not find a keycap named {name}")
-    else:
-        # First render the keycaps
-        for keycap in KEYCAPS:
-            keycap.output_path = f"{args.out}"
-            if not args.force:
-                if os.path.exists(f"{args.out}/{keycap.name}.stl"):
-                    print(Style.BRIGHT +
-                        f"{args.out}/{keycap.name}.stl exists; skipping..."
-                        + Style.RESET_ALL)
-                    continue
-            print(Style.BRIGHT +
-                f"Rendering {args.out}/{keycap.name}.stl..."
-                + Style.RESET_ALL)
-            print(keycap)
-            retcode, output = getstatusoutput(str(keycap))
-            if retcode == 0: # Success!
-                print(f"{args.out}/{keycap.name}.stl rendered successfully")
-        # Next render the legends (for multi-material, non-transparent legends)
-        if args.legends:
-            for legend in KEYCAPS:
-                if legend.legends == [""]:
-                    continue # No actual legends
-                legend.name = f"{legend.name}_legends"
-                legend.output_path = f"{args.out}"
-                legend.render = ["legends"]
-                if not args.force:
-                    if os.path.exists(f"{args.out}/{legend.name}.stl"):
-                        print(Style.BRIGHT +
-                            f"{args.out}/{legend.name}.stl exists; skipping..."
-                            + Style.RESET_ALL)
-                        continue
-                print(Style.BRIGHT +
-                    f"Rendering {args.out}/{legend.name}.stl..."
-                    + Style.RESET_ALL)
-                print(legend)
-                retcode, output = getstatusoutput(str(legend))
-                if retcode == 0: # Success!
-                    print(f"{args.out}/{legend.name}.stl rendered successfully")
+    main(KEYCAPS, description="Render keycaps for all the Riskeyboard 70's switches.")
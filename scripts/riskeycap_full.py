@@ -30,23 +30,11 @@ Fonts used by this script:
 """
 
 # stdlib imports
-import os, sys
 from pathlib import Path
-import json
-import argparse
 from copy import deepcopy
-from subprocess import getstatusoutput
-import asyncio
-import subprocess
-from functools import partial
-from typing import Sequence, Any
-from asyncio import ensure_future
-# 3rd party stuff
-from colorama import Fore, Back, Style
-from colorama import init as color_init
-color_init()
 # Our own stuff
 from keycap import Keycap
+from build import main
 
 # Change these to the correct paths in your environment:
 OPENSCAD_PATH = Path("/home/riskable/downloads/OpenSCAD-2022.12.06.ai12948-x86_64.AppImage")
@@ -56,71 +44,6 @@ KEY_UNIT = 19.05 # Square that makes up the entire space of a key
 BETWEENSPACE = 0.8 # Space between keycaps
 FILE_TYPE = "3mf" # 3mf or stl
 
-# BEGIN Async stuff
-# Mostly copied from https://gist.github.com/anti1869/e02c4212ce16286ea40f
-COMMANDS = []
-MAX_RUNNERS = 8
-
-SEM = asyncio.Semaphore(MAX_RUNNERS)
-
-def run_command(cmd: str) -> str:
-    """
-    Run prepared behave command in shell and return its output.
-    :param cmd: Well-formed behave command to run.
-    :return: Command output as string.
-    """
-    try:
-        output = subprocess.check_output(
-            cmd,
-            stderr=subprocess.STDOUT,
-            universal_newlines=True,
-            shell=True,
-            cwd=os.getcwd(),
-        )
-
-    except subprocess.CalledProcessError as e:
-        output = e.output
-
-    return output
-
-
-# @asyncio.coroutine
-async def run_command_on_loop(loop: asyncio.AbstractEventLoop, command: str) -> bool:
-    """
-    Run test for one particular feature, check its result and return report.
-    :param loop: Loop to use.
-    :param command: Command to run.
-    :return: Result of the command.
-    """
-    async with SEM:
-        runner = partial(run_command, command)
-        output = await loop.run_in_executor(None, runner)
-        await asyncio.sleep(1)  # Slowing a bit for demonstration purposes
-        return output
-
-
-@asyncio.coroutine
-def run_all_commands(command_list: Sequence[str] = COMMANDS) -> None:
-    """
-    Run all commands in a list
-    :param command_list: List of commands to run.
-    """
-    loop = asyncio.get_event_loop()
-    fs = [run_command_on_loop(loop, command) for command in command_list]
-    for f in asyncio.as_completed(fs):
-        result = yield from f
-        ensure_future(process_result(result))
-
-
-@asyncio.coroutine
-def process_result(result: Any):
-    """
-    Do something useful with result of the commands
-    """
-    print(result)
-
-# END Async stuff
-
 class riskeycap_base(Keycap):
     """
     Base keycap definitions for the riskeycap profile + our personal prefs.
@@ -964,140 +887,5 @@ KEYCAPS = [
         font_sizes=[6], scale=[[1.4,1,3]], trans = [[2.9,0,0]]),
 ]
 
-def print_keycaps():
-    """
-    Prints the names of all keycaps in KEYCAPS.
-    """
-    print(Style.BRIGHT +
-          f"Here's all the keycaps we can render:\n" + Style.RESET_ALL)
-    keycap_names = ", ".join(a.name for a in KEYCAPS)
-    print(f"{keycap_names}")
-
 if __name__ == "__main__":
-    parser = argparse.ArgumentParser(
-        description="Render a full set of riskeycap keycaps.")
-    parser.add_argument('--out',
-        metavar='<filepath>', type=str, default=".",
-        help='Where the generated files will go.')
-    parser.add_argument('--force',
-        required=False, action='store_true',
-        help='Forcibly re-render keycaps even if they already exist.')
-    parser.add_argument('--legends',
-        required=False, action='store_true',
-        help=f'If True, generate a separate set of {FILE_TYPE} files for legends.')
-    parser.add_argument('--keycaps',
-        required=False, action='store_true',
-        help='If True, prints out the names of all keycaps we can render.')
-    parser.add_argument('names',
-        nargs='*', metavar="name",
-        help='Optional name of specific keycap you wish to render')
-    args = parser.parse_args()
-    #print(args)
-    if len(sys.argv) == 1:
-        parser.print_help()
-        print("")
-        print_keycaps()
-        sys.exit(1)
-    if args.keycaps:
-        print_keycaps()
-        sys.exit(1)
-    if not os.path.exists(args.out):
-        print(Style.BRIGHT +
-              f"Output path, '{args.out}' does not exist; making it..."
-              + Style.RESET_ALL)
-        os.mkdir(args.out)
-    print(Style.BRIGHT + f"Outputting to: {args.out}" + Style.RESET_ALL)
-    if args.names: # Just render the specified keycaps
-        matched = False
-        for name in args.names:
-            for keycap in KEYCAPS:
-                if keycap.name.lower() == name.lower():
-                    keycap.output_path = f"{args.out}"
-                    matched = True
-                    exists = False
-                    if not args.force:
-                        if os.path.exists(f"{args.out}/{keycap.name}.{keycap.file_type}"):
-                            print(Style.BRIGHT +
-                                f"{args.out}/{keycap.name}.{keycap.file_type} exists; "
-                                f"skipping..."
-                                + Style.RESET_ALL)
-                            exists = True
-                    if not exists:
-                        print(Style.BRIGHT +
-                            f"Rendering {args.out}/{keycap.name}.{keycap.file_type}..."
-                            + Style.RESET_ALL)
-                        print(keycap)
-                        COMMANDS.append(str(keycap))
-                        # retcode, output = getstatusoutput(str(keycap))
-                        # if retcode == 0: # Success!
-                        #     print(
-                        #         f"{args.out}/{keycap.name}.{keycap.file_type} "
-                        #         f"rendered successfully")
-                    if args.legends:
-                        keycap.name = f"{keycap.name}_legends"
-                        # Change it to .stl since PrusaSlicer doesn't like .3mf
-                        # for "parts" for unknown reasons...
-                        keycap.file_type = "stl"
-                        if os.path.exists(f"{args.out}/{keycap.name}.{keycap.file_type}"):
-                            print(Style.BRIGHT +
-                                f"{args.out}/{keycap.name}.{keycap.file_type} exists; "
-                                f"skipping..."
-                                + Style.RESET_ALL)
-                            continue
-                        print(Style.BRIGHT +
-                            f"Rendering {args.out}/{keycap.name}.{keycap.file_type}..."
-                            + Style.RESET_ALL)
-                        print(keycap)
-                        COMMANDS.append(str(keycap))
-                        # retcode, output = getstatusoutput(str(keycap))
-                        # if retcode == 0: # Success!
-                        #     print(
-                        #         f"{args.out}/{keycap.name}.{keycap.file_type} "
-                        #         f"rendered successfully")
-        if not matched:
-            print(f"Cound not find a keycap named {name}")
-    else:
-        # First render the keycaps
-        for keycap in KEYCAPS:
-            keycap.output_path = f"{args.out}"
-            if not args.force:
-                if os.path.exists(f"{args.out}/{keycap.name}.{keycap.file_type}"):
-                    print(Style.BRIGHT +
-                        f"{args.out}/{keycap.name}.{keycap.file_type} exists; skipping..."
-                        + Style.RESET_ALL)
-                    continue
-            print(Style.BRIGHT +
-                f"Rendering {args.out}/{keycap.name}.{keycap.file_type}..."
-                + Style.RESET_ALL)
-            print(keycap)
-            COMMANDS.append(str(keycap))
-            # retcode, output = getstatusoutput(str(keycap))
-            # if retcode == 0: # Success!
-            #     print(f"{args.out}/{keycap.name}.{keycap.file_type} rendered successfully")
-        # Next render the legends (for multi-material, non-transparent legends)
-        if args.legends:
-            for legend in KEYCAPS:
-                if legend.legends == [""]:
-                    continue # No actual legends
-                legend.name = f"{legend.name}_legends"
-                legend.output_path = f"{args.out}"
-                legend.render = ["legends"]
-                # Change it to .stl since PrusaSlicer doesn't like .3mf
-                # for "parts" for unknown reasons...
-                legend.file_type = "stl"
-                if not args.force:
-                    if os.path.exists(f"{args.out}/{legend.name}.{legend.file_type}"):
-                        print(Style.BRIGHT +
-                            f"{args.out}/{legend.name}.{legend.file_type} exists; skipping..."
-                            + Style.RESET_ALL)
-                        continue
-                print(Style.BRIGHT +
-                    f"Rendering {args.out}/{legend.name}.{legend.file_type}..."
-                    + Style.RESET_ALL)
-                print(legend)
-                COMMANDS.append(str(keycap))
-                # retcode, output = getstatusoutput(str(legend))
-                # if retcode == 0: # Success!
-                #     print(f"{args.out}/{legend.name}.{legend.file_type} rendered successfully")
-    loop = asyncio.get_event_loop()
-    loop.run_until_complete(run_all_commands())
+    main(KEYCAPS, description="Render a full set of riskeycap keycaps.")
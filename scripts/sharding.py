@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+
+"""
+Splits a keyset build across several machines.  Every machine runs the same
+command with a different `--shard i/N` and gets a deterministic, roughly
+equal (by predicted render time) share of the jobs::
+
+    box1$ ./scripts/riskeycap_full.py --out /tmp/out --legends --shard 1/3
+    box2$ ./scripts/riskeycap_full.py --out /tmp/out --legends --shard 2/3
+    box3$ ./scripts/riskeycap_full.py --out /tmp/out --legends --shard 3/3
+
+Shards are assigned using only the keycaps' parameters (see
+`costmodel.cost_units()` and `shard_key()`; never the local build journal,
+caches or paths) so every machine comes up with exactly the same split even
+if OpenSCAD/colorscad live in different places.  Each shard writes a manifest
+(`shard-<i>-of-<N>.json` in the output directory) listing its jobs and how
+they turned out.  Once they're all done collect the manifests and check that
+together they cover the whole keyset exactly once::
+
+    $ ./scripts/sharding.py merge box*/shard-*-of-3.json
+"""
+
+# stdlib imports
+import sys
+import json
+import time
+import hashlib
+import argparse
+# 3rd party stuff
+from colorama import Style
+# Our own stuff
+from costmodel import features, cost_units
+
+MANIFEST_VERSION = 2
+
+class ShardException(Exception):
+    """
+    Raised for bad `--shard` values and manifests that don't add up.
+    """
+    pass
+
+def parse_shard(value):
+    """
+    Parses a `--shard` value like "2/4" into `(index, count)` (1-based index).
+    """
+    try:
+        index, count = (int(part) for part in value.split("/"))
+    except ValueError:
+        raise ShardException(f"Invalid shard {value!r} (expected e.g. 2/4)")
+    if count < 1 or not 1 <= index <= count:
+        raise ShardException(
+            f"Invalid shard {value!r} (need 1 <= i <= N)")
+    return index, count
+
+def shard_key(keycap):
+    """
+    Returns a hash of *keycap*'s name and OpenSCAD parameters.  Unlike
+    `journal.job_hash()` it doesn't include anything machine-specific (the
+    `openscad_path`, `keycap_playground_path` or whether colorscad is
+    installed) so it's the same on every machine.
+    """
+    definitions = keycap.definitions(render=list(keycap.render))
+    return hashlib.sha256(
+        f"{keycap.name}\0{keycap.file_type}\0{definitions}".encode("utf-8")
+    ).hexdigest()
+
+def keyset_digest(jobs):
+    """
+    Returns a digest identifying the exact set of *jobs* (names + parameters)
+    so shards of different versions of a keyset can't be mixed up.
+    """
+    digest = hashlib.sha256()
+    for hash_ in sorted(shard_key(keycap) for keycap in jobs):
+        digest.update(hash_.encode("ascii"))
+    return digest.hexdigest()
+
+def assign_shards(jobs, count):
+    """
+    Splits *jobs* into *count* lists with about the same predicted cost:
+    most expensive first, each to the shard with the least work so far (ties
+    go to the lowest shard).  Jobs with the same cost are ordered by
+    `shard_key()` so the result never depends on the order of *jobs* (or the
+    machine).
+    """
+    costed = sorted(
+        ((cost_units(features(keycap)), shard_key(keycap), keycap)
+         for keycap in jobs),
+        key=lambda item: (-item[0], item[1]))
+    shards = [[] for _ in range(count)]
+    loads = [0.0] * count
+    for units, _, keycap in costed:
+        lightest = min(range(count), key=lambda i: (loads[i], i))
+        shards[lightest].append(keycap)
+        loads[lightest] += units
+    return shards, loads
+
+def select_shard(jobs, index, count):
+    """
+    Returns the jobs of shard *index* (1-based) of *count*.
+    """
+    shards, _ = assign_shards(jobs, count)
+    chosen = {id(keycap) for keycap in shards[index - 1]}
+    return [keycap for keycap in jobs if id(keycap) in chosen]
+
+def manifest_name(index, count):
+    return f"shard-{index}-of-{count}.json"
+
+def write_manifest(path, index, count, all_jobs, shard_jobs, journal=None):
+    """
+    Writes the manifest for shard *index* of *count* to *path*.  *all_jobs*
+    is the whole keyset (for the digest) and *shard_jobs* this shard's jobs.
+    If a *journal* is given each job's status gets recorded too.
+    """
+    entries = []
+    for keycap in shard_jobs:
+        entry = {
+            "name": keycap.name,
+            "output": keycap.output_file.name,
+            "job_key": shard_key(keycap),
+            "units": round(cost_units(features(keycap)), 4),
+        }
+        if journal is not None:
+            entry["status"] = "done" if journal.is_done(keycap) else "missing"
+        entries.append(entry)
+    manifest = {
+        "version": MANIFEST_VERSION,
+        "shard": index,
+        "shards": count,
+        "keyset": keyset_digest(all_jobs),
+        "total_jobs": len(all_jobs),
+        "finished": time.time(),
+        "jobs": entries,
+    }
+    with open(path, "w") as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+def merge_manifests(manifests):
+    """
+    Checks that *manifests* (loaded JSON) are all the shards of the same
+    keyset and that together they cover every job exactly once.  Returns
+    `(jobs, problems)` where *jobs* is the merged list of job entries and
+    *problems* a list of strings (empty if everything adds up).
+    """
+    problems = []
+    if not manifests:
+        return [], ["No manifests given"]
+    old = [m for m in manifests if m.get("version") != MANIFEST_VERSION]
+    if old:
+        return [], [
+            f"Shard {m.get('shard')} manifest is version {m.get('version')} "
+            f"(expected {MANIFEST_VERSION}); re-run that shard"
+            for m in old]
+    first = manifests[0]
+    count = first["shards"]
+    seen_shards = {}
+    for manifest in manifests:
+        for key in ("shards", "keyset", "total_jobs"):
+            if manifest[key] != first[key]:
+                problems.append(
+                    f"Shard {manifest['shard']} has a different {key} "
+                    f"({manifest[key]} vs {first[key]}); were they built "
+                    f"from the same keyset?")
+        seen_shards[manifest["shard"]] = seen_shards.get(manifest["shard"], 0) + 1
+    for index in range(1, count + 1):
+        if index not in seen_shards:
+            problems.append(f"Shard {index}/{count} is missing")
+        elif seen_shards[index] > 1:
+            problems.append(
+                f"Shard {index}/{count} given {seen_shards[index]} times")
+    jobs = {}
+    merged = set()
+    for manifest in manifests:
+        if manifest["shard"] in merged:
+            continue # Already complained about it above
+        merged.add(manifest["shard"])
+        for entry in manifest["jobs"]:
+            if entry["job_key"] in jobs:
+                problems.append(
+                    f"{entry['name']} is in more than one shard")
+                continue
+            jobs[entry["job_key"]] = entry
+            if entry.get("status", "done") != "done":
+                problems.append(
+                    f"{entry['name']} (shard {manifest['shard']}) is "
+                    f"{entry['status']}")
+    if len(jobs) != first["total_jobs"]:
+        problems.append(
+            f"Shards cover {len(jobs)} of {first['total_jobs']} job(s)")
+    digest = hashlib.sha256()
+    for hash_ in sorted(jobs):
+        digest.update(hash_.encode("ascii"))
+    if len(jobs) == first["total_jobs"] and digest.hexdigest() != first["keyset"]:
+        problems.append("The jobs in the shards don't match the keyset")
+    return list(jobs.values()), problems
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Work with the manifests of sharded builds (--shard i/N).")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    merge = subparsers.add_parser("merge",
+        help="Check that shard manifests cover the whole keyset exactly once.")
+    merge.add_argument('manifests',
+        nargs='+', metavar="manifest",
+        help="The shard-<i>-of-<N>.json files (one per shard).")
+    merge.add_argument('--out',
+        metavar='<filepath>', type=str,
+        help="Write the merged manifest here.")
+    args = parser.parse_args()
+    manifests = []
+    for path in args.manifests:
+        try:
+            with open(path) as f:
+                manifests.append(json.load(f))
+        except (OSError, ValueError) as e:
+            print(f"Could not read {path}: {e}")
+            sys.exit(1)
+    jobs, problems = merge_manifests(manifests)
+    for problem in problems:
+        print(Style.BRIGHT + problem + Style.RESET_ALL)
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump({
+                "version": MANIFEST_VERSION,
+                "keyset": manifests[0]["keyset"],
+                "total_jobs": manifests[0]["total_jobs"],
+                "ok": not problems,
+                "jobs": sorted(jobs, key=lambda entry: entry["name"]),
+            }, f, indent=2)
+    if problems:
+        sys.exit(1)
+    units = sum(entry["units"] for entry in jobs)
+    print(f"{len(manifests)} shard(s) cover all {len(jobs)} job(s) exactly "
+          f"once ({units:.1f} cost units)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,531 @@
+#!/usr/bin/env python3
+
+"""
+An analytic (NumPy-vectorized) model of the outer shell `_poly_keycap()` in
+`keycaps.scad` produces.  It answers questions like "how tall is the keycap at
+this point?" and "which way is the top facing over here?" for thousands of
+points in a few milliseconds instead of the minutes a full OpenSCAD render
+takes::
+
+    >>> shell = Shell.from_keycap(keycap)
+    >>> shell.height_at([0, 3.5], [0, -2]) # Top surface Z at (0,0) and (3.5,-2)
+    >>> shell.normal_at([0, 3.5], [0, -2]) # Unit normals there
+
+The model mirrors the SCAD code: the body is a stack of `polygon_layers`
+rounded rectangles (shrinking by `top_difference` following `polygon_curve`,
+corners growing with `corner_radius_curve`, tilting with `dish_tilt`) that get
+hull()ed together pairwise, then the dish (`cylinder`, `sphere` or
+`inv_pyramid`) is cut out of the top or, for inverted dishes, hull()ed on top.
+Profiles (`key_profile`) are resolved the same way `profiles.scad` does it.
+
+Coordinates are in the keycap's own frame (before `key_rotation` is applied)
+with the origin at the center of the bottom of the keycap.  Only regular
+4-sided keycaps are supported (`polygon_edges=4`).
+
+The hulls between layers are approximated by linearly interpolating the
+distance to each layer's outline which is exact along the flat sides and
+slightly conservative (a few hundredths of a mm with the default layers)
+around the corners.
+
+.. note::
+
+    Requires NumPy (`pip install numpy`).
+"""
+
+# stdlib imports
+import sys
+import time
+import argparse
+# 3rd party stuff
+try:
+    import numpy as np
+except ImportError:
+    np = None
+# Our own stuff
+from keycap import KEY_UNIT
+
+# Step (mm) used for the finite differences in `Shell.normal_at()`
+NORMAL_STEP = 1e-3
+
+class ShellException(Exception):
+    """
+    Raised when a keycap can't be modeled (unsupported parameters or no NumPy).
+    """
+    pass
+
+def require_numpy():
+    if np is None:
+        raise ShellException(
+            "NumPy is required for the shell model (pip install numpy)")
+
+def polygon_slice(step, amplitude, total_steps=10):
+    """
+    Same as `polygon_slice()` in `utils.scad`.
+    """
+    return (1 - step/total_steps) * amplitude
+
+# Per-row tables from profiles.scad (index 0 is unused just like in the SCAD)
+_DCS_ROWS = {
+    "height": [0, 9.5, 7.39, 7.39, 9, 12.5],
+    "dish_tilt": [0, -1, 3, 7, 16, -6],
+    "dish_z": [0, -0.11, -0.38, -0.78, 0.6, -0.75],
+}
+_DSS_ROWS = {
+    "height": [0, 10.4, 8.7, 8.5, 10.6],
+    "dish_tilt": [0, -1, 3, 8, 16],
+    "dish_y": [0, 1.2, -2.5, -5.7, -11.4],
+    "dish_z": [0, 0, 0, 0, -1.1],
+}
+_KAT_ROWS = {
+    "height": [0, 10.95, 9.15, 10.9, 11.9, 13.8],
+    "dish_tilt": [0, -5, -0.5, 4.5, 1.95, 7.5],
+    "dish_y": [0, 4, 0.25, -3.75, -1.65, -6],
+    "top_y": [0, 0.75, 0.75, 0.75, 0.65, 0],
+    "dish_z": [0, -0.25, 0, -0.25, -0.25, -0.5],
+}
+
+def profile_parameters(keycap, row=1):
+    """
+    Returns the `_poly_keycap()` arguments (as a dict of `Shell` keyword
+    arguments) that *keycap* ends up with once its `key_profile` module in
+    `profiles.scad` has had its say.  *row* is only used by the profiles that
+    have per-row shapes (DCS, DSS, KAT) and defaults to what the playground
+    uses (`KEY_ROW=1`).
+    """
+    params = dict(
+        length=keycap.key_length, width=keycap.key_width,
+        height=keycap.key_height, top_difference=keycap.key_top_difference,
+        top_x=keycap.key_top_x, top_y=keycap.key_top_y,
+        dish_type=keycap.dish_type, dish_depth=keycap.dish_depth,
+        dish_x=keycap.dish_x, dish_y=keycap.dish_y, dish_z=keycap.dish_z,
+        dish_tilt=keycap.dish_tilt, dish_tilt_curve=keycap.dish_tilt_curve,
+        dish_invert=keycap.dish_invert,
+        dish_division_x=keycap.dish_invert_division_x,
+        dish_division_y=keycap.dish_invert_division_y,
+        polygon_layers=keycap.polygon_layers,
+        polygon_layer_rotation=keycap.polygon_layer_rotation,
+        polygon_rotation=keycap.polygon_rotation,
+        polygon_edges=keycap.polygon_edges,
+        polygon_curve=0, # Keycap doesn't set POLYGON_CURVE
+        corner_radius=keycap.corner_radius,
+        corner_radius_curve=keycap.corner_radius_curve)
+    profile = keycap.key_profile
+    if not profile:
+        return params # Custom keycap; everything comes from the Keycap
+    invert = keycap.dish_invert
+    # Everything the profiles have in common:
+    params.update(
+        top_x=0, top_y=0, dish_x=0, dish_y=0, dish_z=0, dish_tilt=0,
+        dish_tilt_curve=False, polygon_layer_rotation=0,
+        polygon_rotation=False, polygon_edges=4, polygon_curve=0)
+    if profile in ("riskeycap", "gem"):
+        height_extra = 0.35 if keycap.key_length >= KEY_UNIT*1.25 else 0
+        params.update(
+            height=(6.5 if invert else 8.2) + height_extra,
+            top_difference=6 if profile == "riskeycap" else 5.5,
+            dish_type="sphere", dish_depth=1 if invert else 1.5,
+            corner_radius=0.5,
+            corner_radius_curve=0.75 if profile == "riskeycap" else 6)
+    elif profile == "dsa":
+        params.update(
+            height=6.3914 if invert else 7.3914, top_difference=6.08,
+            dish_type="sphere", dish_depth=0.8, dish_z=0.111,
+            corner_radius=0.5, corner_radius_curve=2, polygon_curve=4.5)
+    elif profile == "kam":
+        params.update(
+            height=8.05 if invert else 9.05, top_difference=6.35,
+            dish_type="cylinder" if invert else "sphere", dish_depth=1,
+            corner_radius=0.5, corner_radius_curve=1.5, polygon_curve=4.5)
+    elif profile == "dcs":
+        row = min(max(row, 1), 5)
+        params.update(
+            height=_DCS_ROWS["height"][row], top_difference=6, top_y=-1.75,
+            dish_type="cylinder", dish_depth=1,
+            dish_tilt=_DCS_ROWS["dish_tilt"][row],
+            dish_z=_DCS_ROWS["dish_z"][row], corner_radius_curve=0)
+    elif profile == "dss":
+        row = min(max(row, 1), 4)
+        params.update(
+            height=_DSS_ROWS["height"][row] - (1 if invert else 0),
+            top_difference=5.54, dish_type="sphere", dish_depth=1,
+            dish_tilt=_DSS_ROWS["dish_tilt"][row],
+            dish_y=_DSS_ROWS["dish_y"][row], dish_z=_DSS_ROWS["dish_z"][row],
+            corner_radius_curve=1.5, polygon_curve=4)
+    elif profile == "kat":
+        row = min(max(row, 1), 5)
+        params.update(
+            height=_KAT_ROWS["height"][row], top_difference=6.5,
+            top_y=_KAT_ROWS["top_y"][row],
+            dish_type="cylinder" if invert else "sphere", dish_depth=0.75,
+            dish_tilt=_KAT_ROWS["dish_tilt"][row],
+            dish_y=_KAT_ROWS["dish_y"][row], dish_z=_KAT_ROWS["dish_z"][row],
+            corner_radius=0.35, corner_radius_curve=2.75, polygon_curve=7)
+    else:
+        raise ShellException(f"Unknown key_profile: {profile}")
+    return params
+
+class Section(object):
+    """
+    A horizontal (well, possibly tilted) rounded rectangle: one of the layers
+    `_poly_keycap()` hull()s together.  *size* is the full `(x, y)` size
+    (including the rounded corners) and *offset* is where its center ends up
+    before *tilt* (degrees around X) and *rotation* (degrees around Z) are
+    applied.  If *curved* the tilt happens around the origin (after the
+    translation; `dish_tilt_curve=true`) instead of around the section itself.
+    """
+    def __init__(self, size, radius, offset, tilt=0, curved=False, rotation=0):
+        self.size = size
+        self.radius = radius
+        self.offset = offset
+        self.tilt = tilt
+        self.curved = curved
+        self.rotation = rotation
+
+    def locate(self, x, y):
+        """
+        Returns `(margin, z)` for the points at *x*, *y* (arrays): how far
+        inside the outline each point is (negative means outside) and the Z
+        of the section's plane right above/below it.
+        """
+        if self.rotation:
+            angle = np.radians(-self.rotation)
+            x, y = (x*np.cos(angle) - y*np.sin(angle),
+                    x*np.sin(angle) + y*np.cos(angle))
+        ox, oy, oz = self.offset
+        tilt = np.radians(self.tilt)
+        if self.curved: # Tilted around the origin
+            v = (y + oz*np.sin(tilt))/np.cos(tilt) - oy
+            z = (oy + v)*np.sin(tilt) + oz*np.cos(tilt)
+        else: # Tilted around the section's own center
+            v = (y - oy)/np.cos(tilt)
+            z = oz + v*np.sin(tilt)
+        u = x - ox
+        r = self.radius
+        qx = np.abs(u) - (self.size[0]/2 - r)
+        qy = np.abs(v) - (self.size[1]/2 - r)
+        distance = (np.hypot(np.maximum(qx, 0), np.maximum(qy, 0))
+                    + np.minimum(np.maximum(qx, qy), 0) - r)
+        return -distance, z
+
+def _envelope(sections, x, y, pairs, upper=True):
+    """
+    Returns the upper (or lower if not *upper*) surface Z of the union of the
+    hull()s of *pairs* (index tuples) of *sections* at *x*, *y*.  Points that
+    aren't inside any of them come back as NaN.
+    """
+    located = [section.locate(x, y) for section in sections]
+    margins = np.array([margin for margin, _ in located])
+    heights = np.array([z for _, z in located])
+    fill = -np.inf if upper else np.inf
+    best = np.full(x.shape, fill)
+    pick = np.maximum if upper else np.minimum
+    for index in set(i for pair in pairs for i in pair):
+        best = pick(best, np.where(margins[index] >= 0, heights[index], fill))
+    for i, j in pairs:
+        a, b = margins[i], margins[j]
+        crossing = (a >= 0) != (b >= 0)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            t = a/(a - b)
+        z = heights[i] + (heights[j] - heights[i])*t
+        best = pick(best, np.where(crossing, z, fill))
+    return np.where(np.isinf(best), np.nan, best)
+
+class Shell(object):
+    """
+    The outer shell of a keycap.  The arguments are the same (and have the
+    same meaning) as `_poly_keycap()`'s; use `Shell.from_keycap()` to get one
+    for a `Keycap`.
+    """
+    def __init__(self, length=18, width=18, height=9.0, top_difference=6,
+            top_x=0, top_y=0, dish_type="cylinder", dish_depth=1, dish_x=0,
+            dish_y=0, dish_z=-0.75, dish_tilt=-4, dish_tilt_curve=False,
+            dish_invert=False, dish_division_x=4, dish_division_y=1,
+            polygon_layers=5, polygon_layer_rotation=10,
+            polygon_rotation=False, polygon_edges=4, polygon_curve=0,
+            corner_radius=0.5, corner_radius_curve=0):
+        require_numpy()
+        if polygon_edges != 4:
+            raise ShellException(
+                f"Only 4-sided keycaps can be modeled (polygon_edges="
+                f"{polygon_edges})")
+        if dish_type not in ("cylinder", "sphere", "inv_pyramid"):
+            raise ShellException(f"Unknown dish_type: {dish_type}")
+        self.length = length
+        self.width = width
+        self.height = height
+        self.top_difference = top_difference
+        self.top_x = top_x
+        self.top_y = top_y
+        self.dish_type = dish_type
+        self.dish_depth = dish_depth
+        self.dish_x = dish_x
+        self.dish_y = dish_y
+        self.dish_z = dish_z
+        self.dish_tilt = dish_tilt
+        self.dish_tilt_curve = dish_tilt_curve
+        self.dish_invert = dish_invert
+        self.dish_division_x = dish_division_x
+        self.dish_division_y = dish_division_y
+        self.polygon_layers = polygon_layers
+        self.polygon_layer_rotation = polygon_layer_rotation
+        self.polygon_rotation = polygon_rotation
+        self.polygon_curve = polygon_curve
+        self.corner_radius = corner_radius
+        self.corner_radius_curve = corner_radius_curve
+        # Same fudge _poly_keycap() uses to make up for tilted corners rising:
+        reduction_factor = 2.25 if dish_tilt_curve else 2.35
+        tilt = np.radians(dish_tilt)
+        self.height_adjust = (
+            (abs(width*np.sin(tilt)) + abs(height*np.cos(tilt))) - height
+        )/polygon_layers/reduction_factor
+        self.layers = [self._layer(l) for l in range(polygon_layers + 1)]
+        self.dish_sections = self._dish_sections()
+
+    @classmethod
+    def from_keycap(cls, keycap, row=1):
+        """
+        Returns the `Shell` for *keycap* (a `Keycap`), taking its
+        `key_profile` into account (see `profile_parameters()`).
+        """
+        return cls(**profile_parameters(keycap, row=row))
+
+    def _tilts(self, step):
+        """
+        Returns `(tilt, curved)` for the layer at *step*.
+        """
+        return self.dish_tilt/self.polygon_layers*step, self.dish_tilt_curve
+
+    def _layer(self, l):
+        """
+        Returns the `Section` for layer *l* (0 is the bottom).
+        """
+        layers = self.polygon_layers
+        reduction = polygon_slice(l, self.polygon_curve, total_steps=layers)
+        curve_val = (self.top_difference - reduction)*(l/layers)
+        radius = (self.corner_radius
+            + self.corner_radius*self.corner_radius_curve/layers*l)
+        if self.polygon_rotation:
+            rotation = self.polygon_layer_rotation*l
+        else: # Alternates direction every layer (see _poly_keycap())
+            sign = 1 if l % 2 else -1
+            rotation = sign*self.polygon_layer_rotation*l
+        if l == 0:
+            offset = (0, 0, 0)
+        else:
+            offset = (self.top_x/layers*l, self.top_y/layers*l,
+                      self.height/layers*l - self.height_adjust*l)
+        tilt, curved = self._tilts(l)
+        return Section(
+            (self.length - curve_val, self.width - curve_val), radius, offset,
+            tilt=tilt, curved=curved, rotation=rotation)
+
+    def _dish_dimension(self):
+        if self.length > self.width:
+            return self.length - self.top_difference
+        return self.width - self.top_difference
+
+    def _dish_center(self, z):
+        """
+        Returns the (tilted) center of the dish cutter at *z*.
+        """
+        x = self.dish_x + self.top_x
+        y = self.dish_y + self.top_y
+        tilt, curved = self._tilts(self.polygon_layers)
+        if curved:
+            angle = np.radians(tilt)
+            y, z = (y*np.cos(angle) - z*np.sin(angle),
+                    y*np.sin(angle) + z*np.cos(angle))
+        return x, y, z
+
+    def _dish_sections(self):
+        """
+        Returns the `Section`s that get hull()ed together to make an inverted
+        dish (empty if there isn't one).
+        """
+        if not self.dish_invert or not self.dish_depth:
+            return []
+        if self.dish_type not in ("sphere", "cylinder"):
+            return [] # _poly_keycap() only warns about inv_pyramid
+        layers = self.polygon_layers
+        top = self.layers[-1]
+        tilt, curved = self._tilts(layers)
+        rotation = self.polygon_layer_rotation*layers
+        top_z = top.offset[2]
+        curve_val = self.top_difference # polygon_slice() is 0 at the top
+
+        def section(size, radius, z):
+            return Section(size, radius,
+                (self.top_x, self.top_y, top_z + z), tilt=tilt, curved=curved,
+                rotation=rotation)
+
+        base = (self.length - curve_val - self.top_difference,
+                self.width - curve_val - self.top_difference)
+        sections = [section(base, top.radius, 0), section(base, top.radius, 0.1)]
+        depth_step = self.dish_depth/layers
+        depth_curve_factor = -self.dish_depth*4
+        adjusted_length = self.length - self.top_difference
+        adjusted_width = self.width - self.top_difference
+        for bend in range(layers):
+            if self.dish_type == "sphere":
+                ratio = np.sin(np.radians(bend/(layers*2)*180))
+                size = (
+                    adjusted_length - adjusted_length*ratio/self.dish_division_x,
+                    adjusted_width - adjusted_width*ratio/self.dish_division_y)
+            else:
+                ratio = np.sin(np.radians(bend/(layers*1.5)*180))
+                size = (adjusted_length - adjusted_length*ratio/30,
+                        adjusted_width - adjusted_width*ratio)
+            reduction = polygon_slice(bend, depth_curve_factor, total_steps=layers)
+            z = (depth_step - reduction)*(bend/layers)
+            sections.append(section(size, top.radius*(1 - ratio), z))
+        return sections
+
+    def _cut(self, x, y):
+        """
+        Returns the Z of the bottom of the (non-inverted) dish cutter at *x*,
+        *y* (`inf` where it doesn't reach).
+        """
+        z_adjust = self.height_adjust*(self.polygon_layers + 2)
+        depth = self.dish_depth
+        if self.dish_type == "inv_pyramid":
+            tilt, curved = self._tilts(self.polygon_layers)
+            radius = self.layers[-1].radius
+            bottom = (self.height - depth + self.dish_z - z_adjust - 0.1)
+            offset = (self.dish_x + self.top_x, self.dish_y + self.top_y)
+            size = (self.length - self.top_difference + 0.5,
+                    self.width - self.top_difference + 0.5)
+            pyramid = [
+                Section((radius/10 + radius*2,)*2, radius,
+                    offset + (bottom,), tilt=tilt, curved=curved),
+                Section(size, radius, offset + (bottom + depth + 0.1,),
+                    tilt=tilt, curved=curved)]
+            cut = _envelope(pyramid, x, y, [(0, 1)], upper=False)
+            cut = np.where(np.isnan(cut), np.inf, cut)
+            # Everything above the pyramid gets cut off too:
+            return np.minimum(cut, self.height + self.dish_z - 0.02)
+        if not depth:
+            return np.full(x.shape, np.inf)
+        adjusted = self._dish_dimension()
+        rad = (adjusted**2 + 4*depth**2)/(8*depth)
+        if self.dish_type == "cylinder":
+            chord_length = (adjusted**2 - 4*depth**2)/(8*depth)
+            cx, cy, cz = self._dish_center(
+                chord_length + self.height + self.dish_z - z_adjust)
+            # The cylinder's axis runs along Y (tilted around X):
+            tilt = np.radians(self._tilts(self.polygon_layers)[0])
+            under = rad**2 - (x - cx)**2
+            with np.errstate(invalid="ignore"):
+                cut = cz + ((y - cy)*np.sin(tilt) - np.sqrt(under))/np.cos(tilt)
+        else: # Sphere
+            rad *= 2
+            cx, cy, cz = self._dish_center(
+                rad + self.height - depth + self.dish_z - z_adjust)
+            under = rad**2 - (x - cx)**2 - (y - cy)**2
+            with np.errstate(invalid="ignore"):
+                cut = cz - np.sqrt(under)
+        return np.where(under >= 0, cut, np.inf)
+
+    def dish_bottom_at(self, x, y):
+        """
+        Returns the Z of the bottom of the dish cutter (the cylinder, sphere
+        or pyramid that gets subtracted from the top) at *x*, *y*: `inf`
+        where it doesn't reach or if the dish is inverted.
+        """
+        x, y = np.broadcast_arrays(np.asarray(x, float), np.asarray(y, float))
+        if self.dish_invert:
+            return np.full(x.shape, np.inf)
+        return self._cut(x, y)
+
+    def contains(self, x, y):
+        """
+        Returns a boolean array: whether each point is within the keycap's
+        footprint (its bottom outline).
+        """
+        x, y = np.broadcast_arrays(np.asarray(x, float), np.asarray(y, float))
+        margin, _ = self.layers[0].locate(x, y)
+        return margin >= 0
+
+    def height_at(self, x, y):
+        """
+        Returns the Z of the top of the keycap at each of the points *x*, *y*
+        (array-likes; anything that broadcasts).  Points outside the footprint
+        come back as NaN.
+        """
+        x, y = np.broadcast_arrays(np.asarray(x, float), np.asarray(y, float))
+        pairs = [(l, l + 1) for l in range(self.polygon_layers)]
+        z = _envelope(self.layers, x, y, pairs)
+        if self.dish_sections:
+            count = len(self.dish_sections)
+            pairs = [(i, j) for i in range(count) for j in range(i + 1, count)]
+            dome = _envelope(self.dish_sections, x, y, pairs)
+            z = np.fmax(z, dome)
+        elif not self.dish_invert:
+            z = np.minimum(z, self._cut(x, y))
+        return z
+
+    def normal_at(self, x, y):
+        """
+        Returns the `(..., 3)` array of (unit) normals of the top of the
+        keycap at *x*, *y* (NaN outside the footprint).
+        """
+        x, y = np.broadcast_arrays(np.asarray(x, float), np.asarray(y, float))
+        step = NORMAL_STEP
+        dx = (self.height_at(x + step, y) - self.height_at(x - step, y))/(2*step)
+        dy = (self.height_at(x, y + step) - self.height_at(x, y - step))/(2*step)
+        normals = np.stack([-dx, -dy, np.ones_like(dx)], axis=-1)
+        return normals/np.linalg.norm(normals, axis=-1, keepdims=True)
+
+    def surface_at(self, x, y):
+        """
+        Returns the `(..., 3)` array of points on the top of the keycap at
+        *x*, *y*.
+        """
+        x, y = np.broadcast_arrays(np.asarray(x, float), np.asarray(y, float))
+        return np.stack([x, y, self.height_at(x, y)], axis=-1)
+
+    def grid(self, spacing=0.5):
+        """
+        Returns `(x, y, z)` 2D arrays of the top of the keycap sampled every
+        *spacing* mm (centered on the keycap) across its bounding box.
+        """
+        steps_x = int(self.length/2/spacing)
+        steps_y = int(self.width/2/spacing)
+        xs = np.arange(-steps_x, steps_x + 1)*spacing
+        ys = np.arange(-steps_y, steps_y + 1)*spacing
+        x, y = np.meshgrid(xs, ys)
+        return x, y, self.height_at(x, y)
+
+def main():
+    # Imported here so the library doesn't depend on the scripts
+    from sweep import load_base
+    parser = argparse.ArgumentParser(
+        description="Print a height map of a keycap's top (without rendering "
+                    "it).")
+    parser.add_argument('--base',
+        metavar='<module:name>', type=str, default=None,
+        help="The keycap to model (e.g. riskeycap_full:1U_blank; default: "
+             "a default Keycap()).")
+    parser.add_argument('--row',
+        metavar='<n>', type=int, default=1,
+        help="Row for profiles with per-row shapes (DCS, DSS, KAT).")
+    parser.add_argument('--spacing',
+        metavar='<mm>', type=float, default=1.0,
+        help="Distance between samples (default: 1.0).")
+    args = parser.parse_args()
+    keycap = load_base(args.base)
+    try:
+        shell = Shell.from_keycap(keycap, row=args.row)
+    except ShellException as e:
+        print(e)
+        sys.exit(1)
+    start = time.perf_counter()
+    x, y, z = shell.grid(args.spacing)
+    elapsed = time.perf_counter() - start
+    print(f"{keycap.name} ({keycap.key_profile or 'custom'}): "
+          f"{z.size} points in {elapsed*1000:.1f}ms, top at "
+          f"{np.nanmax(z):.2f}mm, center at {float(shell.height_at(0, 0)):.2f}mm")
+    for row in z[::-1]: # +Y at the top
+        print(" ".join("  -  " if np.isnan(v) else f"{v:5.2f}" for v in row))
+
+if __name__ == "__main__":
+    main()
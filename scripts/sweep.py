@@ -0,0 +1,347 @@
+#!/usr/bin/env python3
+
+"""
+Parameter sweeps.  Dialing in things like `stem_inside_tolerance` or
+`wall_thickness` for a new printer/material means trying lots of variations
+of the same keycap.  This generates all of them at once, renders them in
+parallel, and packs the results onto a single test plate (`plate.3mf`) with
+every object named after the values it was made with::
+
+    $ ./scripts/sweep.py --out /tmp/sweep \
+        --param stem_inside_tolerance=0.1:0.3:0.05 \
+        --param stem_outside_tolerance_x=0.05,0.1
+
+    $ ./scripts/sweep.py --out /tmp/sweep --base riskeycap_full:1U_blank \
+        --param wall_thickness=1.2:2.0 --param dish_depth=0.8:1.6 --lhs 8
+
+Parameter ranges can be given as:
+
+ * `start:stop:step` (inclusive)
+ * `start:stop` (only with `--lhs`; sampled continuously)
+ * A comma-separated list of values: `0.1,0.15,0.25`
+ * A JSON list (for list-valued fields): `[[0,0,0,0],[1,0,1,0]]`
+
+By default every combination gets rendered (cartesian product).  With
+`--lhs N` you get N variants picked via Latin hypercube sampling instead
+(good coverage of lots of parameters without the combinatorial explosion).
+
+If every parameter being swept only affects the stem (`stem_*`) only the
+stem gets rendered which is *much* faster (use `--full` to render the whole
+keycap anyway).
+
+The API is just as simple::
+
+    variants = sweep(Keycap(), {"stem_inside_tolerance": [0.1, 0.15, 0.2]})
+"""
+
+# stdlib imports
+import os, sys
+import json
+import random
+import asyncio
+import argparse
+import importlib
+import itertools
+from pathlib import Path
+# 3rd party stuff
+from colorama import Style
+from colorama import init as color_init
+color_init()
+# Our own stuff
+from keycap import Keycap
+from jobspec import JobSpec
+from journal import BuildJournal
+from engine import RenderEngine, MAX_RUNNERS
+from build import print_problems
+
+PLATE_NAME = "plate.3mf"
+MANIFEST_NAME = "sweep.json"
+PLATE_WIDTH = 200 # mm; fits most printers
+PLATE_SPACING = 5 # mm between objects on the plate
+
+def parse_value(value):
+    """
+    Converts a string from the command line into a number, bool, list, or
+    (failing all that) leaves it as a string.
+    """
+    value = value.strip()
+    if value.lower() in ("true", "false"):
+        return value.lower() == "true"
+    try:
+        return json.loads(value)
+    except ValueError:
+        return value
+
+class ParamRange(object):
+    """
+    The values to try for a single `Keycap` *field*.  Either a discrete list
+    of *values* or a continuous range (*low*, *high*) which can only be
+    sampled via `latin_hypercube()`.
+    """
+    def __init__(self, field, values=None, low=None, high=None):
+        self.field = field
+        self.values = values
+        self.low = low
+        self.high = high
+
+    @property
+    def continuous(self):
+        return self.values is None
+
+    def at(self, fraction):
+        """
+        Returns the value at *fraction* (0 to 1) of the way through the range.
+        """
+        if self.continuous:
+            return round(self.low + fraction * (self.high - self.low), 4)
+        index = min(int(fraction * len(self.values)), len(self.values) - 1)
+        return self.values[index]
+
+    @classmethod
+    def parse(cls, spec):
+        """
+        Parses a `field=range` *spec* from the command line.
+        """
+        if "=" not in spec:
+            raise ValueError(f"Expected field=range, got {spec!r}")
+        field, spec = spec.split("=", 1)
+        field, spec = field.strip(), spec.strip()
+        if spec.startswith("["):
+            values = json.loads(spec)
+            if not isinstance(values, list) or not values:
+                raise ValueError(f"{field}: expected a non-empty JSON list")
+            return cls(field, values=values)
+        if ":" in spec:
+            parts = [float(p) for p in spec.split(":")]
+            if len(parts) == 2:
+                return cls(field, low=parts[0], high=parts[1])
+            start, stop, step = parts
+            if step <= 0 or stop < start:
+                raise ValueError(f"{field}: bad range {spec!r}")
+            count = int(round((stop - start) / step)) + 1
+            return cls(field, values=[
+                round(start + i * step, 6) for i in range(count)])
+        return cls(field, values=[parse_value(v) for v in spec.split(",")])
+
+def cartesian(ranges):
+    """
+    Returns a list of dicts (field -> value): every combination of *ranges*
+    (`ParamRange` list).
+    """
+    for r in ranges:
+        if r.continuous:
+            raise ValueError(
+                f"{r.field}: continuous ranges need a step (start:stop:step) "
+                f"unless you're using Latin hypercube sampling")
+    fields = [r.field for r in ranges]
+    return [dict(zip(fields, combo))
+            for combo in itertools.product(*(r.values for r in ranges))]
+
+def latin_hypercube(ranges, samples, seed=0):
+    """
+    Returns *samples* dicts (field -> value) picked from *ranges* via Latin
+    hypercube sampling: each range is split into *samples* equal strata and
+    every stratum gets used exactly once.
+    """
+    rng = random.Random(seed)
+    columns = []
+    for r in ranges:
+        strata = list(range(samples))
+        rng.shuffle(strata)
+        columns.append([
+            r.at((stratum + rng.random()) / samples) for stratum in strata])
+    return [
+        {r.field: column[i] for r, column in zip(ranges, columns)}
+        for i in range(samples)]
+
+def format_value(value):
+    if isinstance(value, float):
+        return f"{value:g}"
+    if isinstance(value, (list, tuple)):
+        return "-".join(format_value(v) for v in value)
+    return str(value)
+
+def variant_name(base_name, params):
+    """
+    Returns a name for the variant of *base_name* with *params* (used for
+    the output file and its label on the plate).
+    """
+    parts = [base_name] + [
+        f"{field}={format_value(value)}" for field, value in params.items()]
+    return "_".join(parts).replace("/", "-").replace(" ", "")
+
+def stem_only(fields):
+    """
+    Returns `True` if *fields* only affect the stem.
+    """
+    return all(field.startswith("stem_") for field in fields)
+
+def sweep(base, params, method="cartesian", samples=None, seed=0, full=False,
+        output_path=None):
+    """
+    Returns a list of `(params, Keycap)`: a copy of *base* (`Keycap`) for
+    each combination of *params* (a dict of field -> list of values or a list
+    of `ParamRange`).  *method* is "cartesian" or "lhs" (Latin hypercube;
+    requires *samples*).  Unless *full* is `True` only the stem gets rendered
+    if all the swept fields are stem-related.  The copies render into
+    *output_path* (defaults to *base*'s).
+    """
+    if isinstance(params, dict):
+        ranges = [ParamRange(field, values=list(values))
+                  for field, values in params.items()]
+    else:
+        ranges = list(params)
+    for r in ranges:
+        if not hasattr(base, r.field):
+            raise AttributeError(f"Keycap has no field named {r.field!r}")
+    if method == "lhs":
+        if not samples:
+            raise ValueError("Latin hypercube sampling needs a sample count")
+        combos = latin_hypercube(ranges, samples, seed=seed)
+    else:
+        combos = cartesian(ranges)
+    fast = not full and stem_only([r.field for r in ranges])
+    variants = []
+    for combo in combos:
+        spec = JobSpec.from_keycap(base, output_path).with_params(**combo,
+            name=variant_name(base.name, combo))
+        if fast:
+            spec = spec._replace(render=("stem",))
+        variants.append((combo, spec.keycap()))
+    return variants
+
+def load_base(spec):
+    """
+    Returns the base `Keycap` for *spec* which is either `None` (a default
+    `Keycap()`) or `module:name` (the keycap named *name* in *module*'s
+    `KEYCAPS` list, e.g. `riskeycap_full:1U_blank`).
+    """
+    if not spec:
+        return Keycap(name="sweep")
+    module_name, _, name = spec.partition(":")
+    module = importlib.import_module(module_name)
+    keycaps = getattr(module, "KEYCAPS", [])
+    if not name:
+        return keycaps[0]
+    for keycap in keycaps:
+        if keycap.name.lower() == name.lower():
+            return keycap
+    raise ValueError(f"Could not find a keycap named {name} in {module_name}")
+
+def pack_plate(outputs, path, width=PLATE_WIDTH, spacing=PLATE_SPACING):
+    """
+    Loads *outputs* (a list of `(label, output_file)`) and arranges them in
+    rows on a single plate (a multi-object 3MF at *path*) with each object
+    named after its *label*.  Returns the number of objects placed.
+    """
+    from mesh import load_mesh, save_3mf, Mesh # Requires NumPy
+    placed = []
+    for label, output_file in outputs:
+        mesh = load_mesh(output_file)
+        if not len(mesh):
+            continue
+        low, high = mesh.bounds()
+        placed.append((label, mesh, low, high - low))
+    # Simple shelf packing: tallest (in Y) first so rows are tight
+    placed.sort(key=lambda item: -item[3][1])
+    objects = []
+    x = y = row_depth = 0.0
+    for label, mesh, low, size in placed:
+        if x and x + size[0] > width:
+            x = 0.0
+            y += row_depth + spacing
+            row_depth = 0.0
+        offset = [x - low[0], y - low[1], -low[2]] # Sitting on the bed
+        objects.append((label, Mesh(mesh.vertices + offset, mesh.faces)))
+        x += size[0] + spacing
+        row_depth = max(row_depth, size[1])
+    save_3mf(objects, path)
+    return len(objects)
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Render variations of a keycap over ranges of parameters.")
+    parser.add_argument('--out',
+        metavar='<filepath>', type=str, default=".",
+        help='Where the generated files will go.')
+    parser.add_argument('--base',
+        metavar='<module:name>', type=str, default=None,
+        help="Keycap to start from, e.g. riskeycap_full:1U_blank (default: "
+             "a plain Keycap()).")
+    parser.add_argument('--param',
+        metavar='<field=range>', action='append', required=True,
+        help='A Keycap field and the values to try (can be repeated).')
+    parser.add_argument('--lhs',
+        metavar='<n>', type=int, default=None,
+        help='Use Latin hypercube sampling to pick n variants instead of '
+             'rendering every combination.')
+    parser.add_argument('--seed',
+        metavar='<n>', type=int, default=0,
+        help='Random seed for --lhs (default: 0).')
+    parser.add_argument('--full',
+        required=False, action='store_true',
+        help="Always render the whole keycap (not just the stem).")
+    parser.add_argument('--jobs',
+        metavar='<n>', type=int, default=MAX_RUNNERS,
+        help=f'How many OpenSCAD processes to run at once (default: {MAX_RUNNERS}).')
+    parser.add_argument('--force',
+        required=False, action='store_true',
+        help='Forcibly re-render variants even if they already exist.')
+    parser.add_argument('--no-plate',
+        required=False, action='store_true',
+        help=f"Don't pack the results onto a single plate ({PLATE_NAME}).")
+    parser.add_argument('--plate-width',
+        metavar='<mm>', type=float, default=PLATE_WIDTH,
+        help=f'Width of the plate (default: {PLATE_WIDTH}mm).')
+    parser.add_argument('--list',
+        required=False, action='store_true',
+        help="Just print the variants that would be rendered.")
+    args = parser.parse_args()
+    try:
+        base = load_base(args.base)
+        ranges = [ParamRange.parse(spec) for spec in args.param]
+        variants = sweep(base, ranges,
+            method="lhs" if args.lhs else "cartesian", samples=args.lhs,
+            seed=args.seed, full=args.full, output_path=args.out)
+    except (ValueError, AttributeError, ImportError) as e:
+        parser.error(str(e))
+    if args.list:
+        for params, keycap in variants:
+            print(f"{keycap.name} ({', '.join(keycap.render)})")
+        sys.exit(0)
+    if not os.path.exists(args.out):
+        os.makedirs(args.out)
+    print(Style.BRIGHT + f"Rendering {len(variants)} variant(s) to {args.out}"
+          + Style.RESET_ALL)
+    journal = BuildJournal(args.out)
+    jobs = []
+    for params, keycap in variants:
+        if args.force or not journal.is_done(keycap):
+            jobs.append(keycap)
+    engine = RenderEngine(max_runners=args.jobs, journal=journal, quiet=True)
+    results = asyncio.run(engine.run(jobs))
+    print_problems(results)
+    if engine.cancelled:
+        sys.exit(130)
+    manifest = [
+        {"name": keycap.name, "params": params,
+         "output": str(keycap.output_file),
+         "ok": journal.is_done(keycap)}
+        for params, keycap in variants]
+    with open(Path(args.out) / MANIFEST_NAME, "w") as f:
+        json.dump(manifest, f, indent=2)
+    done = [(entry["name"], entry["output"]) for entry in manifest
+            if entry["ok"]]
+    if done and not args.no_plate:
+        plate = Path(args.out) / PLATE_NAME
+        count = pack_plate(done, plate, width=args.plate_width)
+        print(Style.BRIGHT + f"Packed {count} variant(s) onto {plate}"
+              + Style.RESET_ALL)
+    failed = len(variants) - len(done)
+    if failed:
+        print(Style.BRIGHT + f"{failed} variant(s) failed to render"
+              + Style.RESET_ALL)
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+
+"""
+Works out how many facets each keycap actually needs.  Instead of picking
+`dish_fn`, `dish_corner_fn`, `polygon_layers` and `$fn` by hand (and
+forgetting to raise `dish_fn` for spacebars or leaving it at 256 for
+everything) give a maximum chord error in millimeters (how far a facet is
+allowed to stray from the true curve) and every keycap gets the fewest
+facets that stay within it::
+
+    $ ./scripts/tessellation.py riskeycap_full          # What would change
+    $ ./scripts/tessellation.py --max-error 0.01 riskeyboard_70 spacebar
+    $ ./scripts/riskeycap_full.py --out /tmp/out --max-error 0.02
+
+The error of a circle of radius `r` split into `n` segments is
+`r*(1-cos(180/n))` so:
+
+ * `dish_fn` comes from the radius of the dish's cylinder/sphere (which grows
+   quickly with key length; that's why spacebars look blocky) or the corner
+   radius at the top for `inv_pyramid` dishes.
+ * `dish_corner_fn` comes from the biggest corner radius (the top layer's;
+   `corner_radius` grows with `corner_radius_curve`).
+ * `polygon_layers` comes from how curved the sides are (`polygon_curve` of
+   the profile, `dish_tilt` with `dish_tilt_curve`, and the sine-shaped bends
+   of inverted dishes): the sides are piecewise linear with one piece per
+   layer so the error shrinks with the square of the layer count.
+ * `$fn` (legends) comes from the font sizes (glyph curves are assumed to
+   have a radius of about `GLYPH_RADIUS` times the font size).
+
+Profiles are resolved the same way `shell.py` does it.  Anything that would
+change the *shape* (not just its resolution) is left alone: `polygon_layers`
+when the layers are rotated (`polygon_layer_rotation`) or the dish is tilted
+(the dish height depends on the layer count), deliberately low-poly
+`dish_corner_fn` values (`STYLE_FN` or less) and profiles `shell.py` doesn't
+know about.
+"""
+
+# stdlib imports
+import sys
+import math
+import argparse
+import importlib
+# 3rd party stuff
+from colorama import Style
+# Our own stuff
+from shell import profile_parameters, ShellException
+
+DEFAULT_MAX_ERROR = 0.02 # mm; well under what an FDM/resin printer can show
+MIN_FN = 8
+MAX_DISH_FN = 512 # Spheres get slow (fn²/2 facets) beyond this
+MIN_LEGEND_FN = 16 # $fn also applies to anything else without its own $fn
+MIN_POLYGON_LAYERS = 2
+MAX_POLYGON_LAYERS = 40
+GLYPH_RADIUS = 0.25 # Tightest curves in a glyph vs the font size (roughly)
+STYLE_FN = 8 # dish_corner_fn this low is a look (chamfered corners), not a resolution
+TESSELLATION_FIELDS = ("dish_fn", "dish_corner_fn", "polygon_layers", "fn")
+
+def segments(radius, max_error, minimum=MIN_FN, maximum=None, multiple=4):
+    """
+    Returns the fewest segments (a multiple of *multiple* so shapes stay
+    symmetric) a full circle of *radius* needs for its chord error to stay
+    under *max_error*.
+    """
+    if radius <= max_error:
+        count = minimum
+    else:
+        count = math.ceil(math.pi / math.acos(1 - max_error / radius))
+    count = max(minimum, math.ceil(count / multiple) * multiple)
+    return min(count, maximum) if maximum else count
+
+def dish_radius(params):
+    """
+    Returns the radius of the cylinder/sphere `_poly_keycap()` cuts the dish
+    with (same math as `keycaps.scad`) or `None` if there isn't one.
+    """
+    depth = params["dish_depth"]
+    if params["dish_invert"] or depth <= 0:
+        return None
+    if params["dish_type"] not in ("cylinder", "sphere"):
+        return None
+    length = params["length"] - params["top_difference"]
+    width = params["width"] - params["top_difference"]
+    dimension = length if params["length"] > params["width"] else width
+    radius = (dimension**2 + 4 * depth**2) / (8 * depth)
+    return radius * 2 if params["dish_type"] == "sphere" else radius
+
+def top_corner_radius(params):
+    return params["corner_radius"] * (1 + params["corner_radius_curve"])
+
+def layer_error(params, layers):
+    """
+    Returns how far (mm) the piecewise-linear sides made of *layers* layers
+    stray from the curve they approximate.  Every curve involved is (close
+    to) quadratic so this is `K/layers²`.
+    """
+    # Each side moves in by (top_difference - (1-t)*curve)*t/2 at height t:
+    coefficient = abs(params["polygon_curve"]) / 8
+    if params["dish_tilt_curve"] and params["dish_tilt"]:
+        # The layers follow an arc turning dish_tilt degrees over the height
+        coefficient += params["height"] * abs(math.radians(params["dish_tilt"])) / 8
+    if params["dish_invert"] and params["dish_depth"]:
+        # The bends are a quarter sine wave (amplitude: the biggest change)
+        amplitude = max(
+            abs(params["dish_depth"]),
+            (params["length"] - params["top_difference"])
+                / (2 * params["dish_division_x"]),
+            (params["width"] - params["top_difference"])
+                / (2 * params["dish_division_y"]))
+        coefficient += amplitude * (math.pi / 2)**2 / 8
+    return coefficient / layers**2
+
+def polygon_layers(params, max_error):
+    """
+    Returns the fewest layers that keep `layer_error()` under *max_error*.
+    """
+    for layers in range(MIN_POLYGON_LAYERS, MAX_POLYGON_LAYERS):
+        if layer_error(params, layers) <= max_error:
+            return layers
+    return MAX_POLYGON_LAYERS
+
+def legend_fn(keycap, max_error):
+    """
+    Returns the `$fn` the legends of *keycap* need or `None` if it has none.
+    """
+    sizes = [
+        keycap.font_sizes[i] if i < len(keycap.font_sizes) else keycap.font_sizes[-1]
+        for i, legend in enumerate(keycap.legends) if legend]
+    if not sizes or not keycap.font_sizes:
+        return None
+    return segments(max(sizes) * GLYPH_RADIUS, max_error,
+        minimum=MIN_LEGEND_FN)
+
+def tessellation(keycap, max_error=DEFAULT_MAX_ERROR):
+    """
+    Returns a dict with the `dish_fn`, `dish_corner_fn`, `polygon_layers`
+    and `fn` (`$fn`) values *keycap* needs to stay within *max_error* (mm).
+    Values that shouldn't (or can't) be worked out for this keycap are left
+    out.
+    """
+    try:
+        params = profile_parameters(keycap)
+    except ShellException: # A profile we can't model; don't touch it
+        return {}
+    values = {}
+    radius = dish_radius(params)
+    if radius is not None:
+        values["dish_fn"] = segments(radius, max_error, maximum=MAX_DISH_FN)
+    elif params["dish_type"] == "inv_pyramid" and not params["dish_invert"]:
+        values["dish_fn"] = segments(top_corner_radius(params), max_error)
+    # (The GEM profile always uses 4 for its chamfered corners)
+    if keycap.dish_corner_fn > STYLE_FN and keycap.key_profile != "gem":
+        values["dish_corner_fn"] = segments(
+            top_corner_radius(params), max_error)
+    layers_change_shape = (
+        (params["polygon_rotation"] and params["polygon_layer_rotation"])
+        or params["dish_tilt"])
+    if not layers_change_shape:
+        values["polygon_layers"] = polygon_layers(params, max_error)
+    fn = legend_fn(keycap, max_error)
+    if fn:
+        values["fn"] = fn
+    return values
+
+def apply_tessellation(keycaps, max_error=DEFAULT_MAX_ERROR):
+    """
+    Sets the tessellation of every keycap in *keycaps* from *max_error*.
+    Returns a list of `(keycap, before, after)` (dicts of the values that
+    changed) for the keycaps that changed.
+    """
+    changed = []
+    for keycap in keycaps:
+        after = {
+            field: value
+            for field, value in tessellation(keycap, max_error).items()
+            if getattr(keycap, field) != value}
+        if not after:
+            continue
+        before = {field: getattr(keycap, field) for field in after}
+        for field, value in after.items():
+            setattr(keycap, field, value)
+        changed.append((keycap, before, after))
+    return changed
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Show the dish_fn/dish_corner_fn/polygon_layers/$fn each "
+                    "keycap needs for a given maximum chord error.")
+    parser.add_argument('--max-error',
+        metavar='<mm>', type=float, default=DEFAULT_MAX_ERROR,
+        help=f"Maximum chord error in mm (default: {DEFAULT_MAX_ERROR}).")
+    parser.add_argument('module',
+        metavar="module",
+        help="The keyset script (e.g. riskeycap_full).")
+    parser.add_argument('names',
+        nargs='*', metavar="name",
+        help='Only show the keycaps with these names.')
+    args = parser.parse_args()
+    keycaps = importlib.import_module(args.module).KEYCAPS
+    if args.names:
+        lowered = [name.lower() for name in args.names]
+        keycaps = [k for k in keycaps if k.name.lower() in lowered]
+    if not keycaps:
+        print("No keycaps to look at")
+        sys.exit(1)
+    print(Style.BRIGHT + f"{'name':<20}" + "".join(
+        f"{field:>22}" for field in TESSELLATION_FIELDS) + Style.RESET_ALL)
+    for keycap in keycaps:
+        values = tessellation(keycap, args.max_error)
+        columns = []
+        for field in TESSELLATION_FIELDS:
+            current = getattr(keycap, field)
+            if values.get(field, current) == current:
+                columns.append(f"{str(current):>22}")
+            else:
+                columns.append(f"{f'{current} -> {values[field]}':>22}")
+        print(f"{keycap.name:<20}" + "".join(columns))
+
+if __name__ == "__main__":
+    main()
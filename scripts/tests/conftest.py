@@ -0,0 +1,98 @@
+"""
+Shared fixtures for the tests of the build scripts.  Run them from the top of
+the repository with::
+
+    $ python -m pytest -q scripts/tests
+"""
+
+# stdlib imports
+import os
+import sys
+import tempfile
+from pathlib import Path
+# 3rd party stuff
+import pytest
+
+# The scripts aren't a package; they import each other by module name:
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+# Keep the tests away from (and out of) the real caches (CSG stats, font
+# metrics); this has to happen before any of the scripts get imported:
+os.environ["XDG_CACHE_HOME"] = tempfile.mkdtemp(prefix="keycap-tests-")
+
+# A unit cube (outward-facing, counterclockwise triangles)
+CUBE_VERTICES = [
+    [0, 0, 0], [1, 0, 0], [1, 1, 0], [0, 1, 0],
+    [0, 0, 1], [1, 0, 1], [1, 1, 1], [0, 1, 1],
+]
+CUBE_FACES = [
+    [0, 2, 1], [0, 3, 2], # Bottom
+    [4, 5, 6], [4, 6, 7], # Top
+    [0, 1, 5], [0, 5, 4], # Front
+    [2, 3, 7], [2, 7, 6], # Back
+    [1, 2, 6], [1, 6, 5], # Right
+    [3, 0, 4], [3, 4, 7], # Left
+]
+
+@pytest.fixture
+def cube():
+    """
+    Returns a function that makes a (`Mesh`) cube of the given *size* at
+    *offset*.
+    """
+    np = pytest.importorskip("numpy")
+    from mesh import Mesh
+    def make(size=1.0, offset=(0, 0, 0)):
+        return Mesh(
+            np.array(CUBE_VERTICES, float) * size + np.array(offset, float),
+            np.array(CUBE_FACES, dtype=np.int64))
+    return make
+
+# The font the `font` fixture installs (see `make_font()`)
+TEST_FONT = "Keycap Test"
+
+def make_font(path, family=TEST_FONT):
+    """
+    Writes a tiny TrueType font to *path*: "A" is a 500x700 box (600 units
+    wide with its side bearings) and there's a space; nothing else.
+    """
+    from fontTools.fontBuilder import FontBuilder
+    from fontTools.pens.ttGlyphPen import TTGlyphPen
+    def box(x0, y0, x1, y1):
+        pen = TTGlyphPen(None)
+        pen.moveTo((x0, y0))
+        pen.lineTo((x0, y1))
+        pen.lineTo((x1, y1))
+        pen.lineTo((x1, y0))
+        pen.closePath()
+        return pen.glyph()
+    builder = FontBuilder(1000, isTTF=True)
+    builder.setupGlyphOrder([".notdef", "A", "space"])
+    builder.setupCharacterMap({ord("A"): "A", ord(" "): "space"})
+    builder.setupGlyf({
+        ".notdef": box(50, 0, 450, 700), "A": box(50, 0, 550, 700),
+        "space": TTGlyphPen(None).glyph()})
+    builder.setupHorizontalMetrics(
+        {".notdef": (500, 50), "A": (600, 50), "space": (250, 0)})
+    builder.setupHorizontalHeader(ascent=800, descent=-200)
+    builder.setupNameTable({"familyName": family, "styleName": "Regular"})
+    builder.setupOS2()
+    builder.setupPost()
+    builder.save(str(path))
+
+@pytest.fixture
+def font(tmp_path, monkeypatch):
+    """
+    Installs `TEST_FONT` (via `OPENSCAD_FONT_PATH`) and makes `fonts.py`
+    forget about any fonts it's already looked up.  Returns the font's name.
+    """
+    pytest.importorskip("numpy")
+    pytest.importorskip("fontTools")
+    import fonts
+    font_dir = tmp_path / "fonts"
+    font_dir.mkdir()
+    make_font(font_dir / "KeycapTest.ttf")
+    monkeypatch.setenv("OPENSCAD_FONT_PATH", str(font_dir))
+    monkeypatch.setattr(fonts, "_index", None)
+    monkeypatch.setattr(fonts, "_found", {})
+    monkeypatch.setattr(fonts.FontMetrics, "_instances", {})
+    return TEST_FONT
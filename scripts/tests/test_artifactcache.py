@@ -0,0 +1,62 @@
+"""
+Tests for the `artifactcache.DirectoryCache`.
+"""
+
+# stdlib imports
+import os
+# 3rd party stuff
+import pytest
+# Our own stuff
+from artifactcache import DirectoryCache, parse_size
+
+def publish(cache, tmp_path, key, size, when):
+    """
+    Publishes *size* bytes under *key* and backdates its blob to *when* (the
+    mtime is the LRU timestamp).
+    """
+    source = tmp_path / f"{key}.stl"
+    source.write_bytes(key.encode("ascii") * size)
+    entry = cache.publish(key, source, {"name": key})
+    os.utime(cache.read_blob(entry["blob"]), (when, when))
+    return entry
+
+def test_fetch(tmp_path):
+    cache = DirectoryCache(tmp_path / "cache")
+    source = tmp_path / "tilde.stl"
+    source.write_bytes(b"solid tilde")
+    cache.publish("k", source, {"name": "tilde"})
+    dest = tmp_path / "out.stl"
+    assert cache.fetch("k", dest)["name"] == "tilde"
+    assert dest.read_bytes() == b"solid tilde"
+    assert cache.fetch("missing", tmp_path / "nope.stl") is None
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["stores"]) == (1, 1, 1)
+
+def test_evicts_least_recently_used(tmp_path):
+    cache = DirectoryCache(tmp_path / "cache")
+    for i, key in enumerate("abc"):
+        publish(cache, tmp_path, key, 1000, 1000000 + i)
+    # Using "a" makes it the most recently used:
+    assert cache.fetch("a", tmp_path / "a.out")
+    assert cache.evict(max_bytes=2500) == 1
+    assert cache.size() <= 2500
+    assert cache.lookup("b") is not None # Entries stay...
+    assert cache.fetch("b", tmp_path / "b.out") is None # ...as misses
+    assert cache.fetch("a", tmp_path / "a.out")
+    assert cache.fetch("c", tmp_path / "c.out")
+    assert cache.stats()["evictions"] == 1
+
+def test_publish_stays_under_max_bytes(tmp_path):
+    cache = DirectoryCache(tmp_path / "cache", max_bytes=2500)
+    for i, key in enumerate("abcde"):
+        publish(cache, tmp_path, key, 1000, 1000000 + i)
+        assert cache.size() <= 2500
+    # The newest one always survives:
+    assert cache.fetch("e", tmp_path / "e.out")
+
+def test_parse_size():
+    assert parse_size("20G") == 20 * 1024**3
+    assert parse_size("512k") == 512 * 1024
+    assert parse_size("100") == 100
+    with pytest.raises(Exception):
+        parse_size("lots")
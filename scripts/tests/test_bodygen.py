@@ -0,0 +1,107 @@
+"""
+Tests for generating keycap bodies without OpenSCAD (`bodygen.py`).
+"""
+
+# stdlib imports
+import math
+# 3rd party stuff
+import pytest
+np = pytest.importorskip("numpy")
+# Our own stuff
+from keycap import Keycap
+from mesh import load_mesh
+from shell import Shell
+from bodygen import (
+    Body, BodyException, outline, generate, compare, reference_job,
+    body_file, REFERENCE_DIR)
+
+def area(points):
+    x, y = points[:, 0], points[:, 1]
+    return (np.dot(x, np.roll(y, -1)) - np.dot(y, np.roll(x, -1))) / 2
+
+def test_outline():
+    points = outline((18, 14), 2, 64)
+    assert points.shape == (4 * (16 + 1), 2)
+    # Counterclockwise and (close to) a rounded rectangle:
+    assert area(points) == pytest.approx(18*14 - (4 - math.pi)*2**2, rel=1e-3)
+    assert np.abs(points).max(axis=0) == pytest.approx([9, 7])
+    # Extra points along the sides don't change the shape:
+    more = outline((18, 14), 2, 64, side_points=(3, 2))
+    assert len(more) == len(points) + 2*(3 + 2)
+    assert area(more) == pytest.approx(area(points))
+    # Same corner_fn, same number of points (so layers can be lofted):
+    assert len(outline((10, 30), 0.5, 64)) == len(points)
+    assert len(outline((18, 14), 0, 64)) == 4 # Sharp corners
+
+@pytest.mark.parametrize("kwargs", [
+    dict(key_profile="riskeycap"), dict(key_profile="gem"),
+    dict(key_profile="", dish_type="cylinder"),
+    dict(key_profile="riskeycap", uniform_wall_thickness=False),
+    dict(key_profile="riskeycap", key_length=19.05*2 - 0.8),
+])
+def test_body(kwargs):
+    keycap = Keycap(name="body", **kwargs)
+    body = Body(keycap)
+    mesh = body.mesh()
+    params = body.params
+    assert mesh.is_watertight()
+    assert len(mesh.components()) == 1
+    low, high = mesh.bounds()
+    assert low.tolist() == pytest.approx(
+        [-params["length"]/2, -params["width"]/2, 0])
+    assert high[:2].tolist() == pytest.approx(
+        [params["length"]/2, params["width"]/2])
+    assert high[2] <= params["height"] + 0.1
+    # The middle of the top is the bottom of the dish:
+    vertices = mesh.vertices
+    middle = vertices[np.hypot(vertices[:, 0], vertices[:, 1]) < 0.5]
+    assert middle[:, 2].max() == pytest.approx(
+        Shell(**params).dish_bottom_at(np.zeros(1), np.zeros(1))[0], abs=0.02)
+    # Hollow (the interior got taken out):
+    assert 0 < mesh.volume() < 0.5*np.prod(high - low)
+
+def test_max_error():
+    coarse = Body(Keycap(), max_error=0.05).mesh()
+    fine = Body(Keycap(), max_error=0.005).mesh()
+    assert len(fine) > len(coarse)
+    assert compare(fine, coarse) == [] # Same shape
+
+def test_rotation():
+    plain = Body(Keycap()).mesh()
+    rotated = Body(Keycap(key_rotation=[0, 0, 90])).mesh()
+    assert rotated.volume() == pytest.approx(plain.volume())
+    assert rotated.bounds()[1].tolist() == pytest.approx(
+        plain.bounds()[1].tolist())
+    tall = Body(Keycap(key_length=19.05*2 - 0.8, key_rotation=[0, 0, 90]))
+    low, high = tall.mesh().bounds()
+    assert (high - low)[1] > (high - low)[0] # Long side now along Y
+
+@pytest.mark.parametrize("kwargs, message", [
+    (dict(key_profile="dsa"), "Unsupported key_profile"),
+    (dict(key_profile="", dish_tilt=5), "dish_tilt"),
+    (dict(key_profile="", dish_invert=True), "dish_invert"),
+    (dict(key_profile="", dish_type="inv_pyramid"), "dish_type=inv_pyramid"),
+    (dict(key_profile="", polygon_edges=6), "polygon_edges"),
+    (dict(homing_dot_length=3), "homing_dot_length"),
+])
+def test_unsupported(kwargs, message):
+    with pytest.raises(BodyException, match=message):
+        Body(Keycap(name="nope", **kwargs))
+
+def test_generate_and_compare(tmp_path):
+    keycap = Keycap(name="blank", file_type="stl")
+    path, mesh, seconds = generate(keycap, tmp_path)
+    assert path == body_file(keycap, tmp_path) == tmp_path / "blank_body.stl"
+    loaded = load_mesh(path)
+    assert compare(loaded, mesh) == []
+    gem = Body(Keycap(key_profile="gem")).mesh()
+    problems = compare(gem, mesh)
+    assert any(problem.startswith("Bounding box max") for problem in problems)
+
+def test_reference_job(tmp_path):
+    keycap = Keycap(name="Q", legends=["Q"], render=["keycap", "stem"])
+    job = reference_job(keycap, tmp_path)
+    assert job.output_file.parent == tmp_path / REFERENCE_DIR
+    assert (list(job.render), list(job.legends)) == (["keycap"], [""])
+    assert (list(keycap.render), list(keycap.legends)) == (
+        ["keycap", "stem"], ["Q"])
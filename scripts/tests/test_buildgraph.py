@@ -0,0 +1,114 @@
+"""
+Tests for exporting builds as Ninja build files (`buildgraph.py`).  If
+`ninja` is installed the generated file gets built for real with a fake
+`openscad`.
+"""
+
+# stdlib imports
+import os
+import sys
+import time
+import shutil
+import subprocess
+# 3rd party stuff
+import pytest
+# Our own stuff
+from keycap import Keycap
+from buildgraph import (
+    NINJA_FILE, ninja_path, artifact_jobs, write_if_changed, write_ninja)
+
+FAKE_OPENSCAD = """#!{python}
+import sys
+args = sys.argv[1:]
+with open(args[args.index("-o") + 1], "w") as f:
+    f.write(args[args.index("-D") + 1])
+with open("openscad.log", "a") as f:
+    f.write(args[args.index("-o") + 1] + "\\n")
+"""
+
+def keycaps(tmp_path, **kwargs):
+    """
+    Returns a keycap and its legends-only job (what `build.py --legends`
+    would select) that use a fake openscad and a .scad file in *tmp_path*.
+    """
+    openscad = tmp_path / "openscad"
+    openscad.write_text(FAKE_OPENSCAD.format(python=sys.executable))
+    openscad.chmod(0o755)
+    playground = tmp_path / "keycap_playground.scad"
+    if not playground.exists():
+        playground.write_text("// v1\n")
+    out = tmp_path / "out"
+    common = dict(output_path=out, openscad_path=openscad,
+        keycap_playground_path=playground, legends=["A"], **kwargs)
+    return [Keycap(name="tilde", **common),
+            Keycap(name="tilde_legends", render=["legends"], **common)]
+
+def ninja(out, *args):
+    return subprocess.run(["ninja", "-C", str(out), *args],
+        capture_output=True, text=True, check=True).stdout
+
+def test_ninja_path():
+    assert ninja_path("a b:c$d") == "a$ b$:c$$d"
+
+def test_artifact_jobs():
+    keycap = Keycap(name="tilde", legends=["A"], render=["keycap", "stem"])
+    assert [job.output_file.name for job in artifact_jobs(keycap)] == [
+        "tilde.3mf"]
+    assert [job.output_file.name for job in artifact_jobs(
+        keycap, formats=["stl", "3mf"])] == ["tilde.stl", "tilde.3mf"]
+    split = artifact_jobs(keycap, split=True)
+    assert [list(job.render) for job in split] == [["keycap"], ["stem"]]
+    assert split[0].output_file.name != split[1].output_file.name
+
+def test_write_if_changed(tmp_path):
+    path = tmp_path / "a" / "b.params"
+    assert write_if_changed(path, "x")
+    assert not write_if_changed(path, "x")
+    assert write_if_changed(path, "y")
+    assert path.read_text() == "y"
+
+def test_write_ninja(tmp_path):
+    jobs = keycaps(tmp_path)
+    out = tmp_path / "out"
+    path = write_ninja(jobs, out, max_runners=2,
+        generator=[sys.executable, "-c", "pass"])
+    assert path == out / NINJA_FILE
+    content = path.read_text()
+    assert "pool openscad\n  depth = 2" in content
+    assert "build tilde: phony tilde.3mf tilde_legends.3mf" in content
+    assert "build tilde.3mf: openscad .params/tilde.3mf.params | " in content
+    params = (out / ".params" / "tilde.3mf.params").read_text()
+    assert params == jobs[0].definitions()
+    # Nothing changed, nothing gets rewritten:
+    mtime = path.stat().st_mtime_ns
+    write_ninja(jobs, out, max_runners=2,
+        generator=[sys.executable, "-c", "pass"])
+    assert path.stat().st_mtime_ns == mtime
+
+@pytest.mark.skipif(not shutil.which("ninja"), reason="ninja isn't installed")
+def test_incremental_builds(tmp_path):
+    out = tmp_path / "out"
+    generator = [sys.executable, "-c", "pass"]
+    write_ninja(keycaps(tmp_path), out, generator=generator)
+    ninja(out)
+    log = out / "openscad.log"
+    assert sorted(log.read_text().split()) == [
+        ".tilde.partial.3mf", ".tilde_legends.partial.3mf"]
+    assert (out / "tilde.3mf").read_text() == keycaps(tmp_path)[0].definitions()
+    assert not list(out.glob(".*.partial.*"))
+    assert "no work to do" in ninja(out)
+    # Only the keycap whose parameters changed gets re-rendered:
+    log.unlink()
+    jobs = keycaps(tmp_path)
+    jobs[0].key_height = 9
+    write_ninja(jobs, out, generator=generator)
+    ninja(out)
+    assert log.read_text().split() == [".tilde.partial.3mf"]
+    # ...but changing the .scad files re-renders everything:
+    log.unlink()
+    playground = tmp_path / "keycap_playground.scad"
+    playground.write_text("// v2\n")
+    later = time.time() + 10 # Newer than the outputs even with coarse mtimes
+    os.utime(playground, (later, later))
+    ninja(out, "tilde")
+    assert len(log.read_text().split()) == 2
@@ -0,0 +1,89 @@
+"""
+Tests for parsing and analyzing CSG trees (`csgtree.py`).
+"""
+
+# 3rd party stuff
+import pytest
+# Our own stuff
+from keycap import Keycap
+from csgtree import (
+    CsgException, CsgStats, parse_csg, analyze, fragments, cache_file,
+    cached_stats, store_stats)
+
+CSG = """
+// Exported by OpenSCAD
+group() {
+    difference() {
+        multmatrix([[1, 0, 0, 0], [0, 1, 0, 0], [0, 0, 1, 0], [0, 0, 0, 1]]) {
+            hull() {
+                cylinder($fn = 16, $fa = 12, $fs = 2, h = 1, r1 = 2, r2 = 1, center = false);
+                sphere($fn = 0, $fa = 12, $fs = 2, r = 1);
+            }
+        }
+        linear_extrude(height = 1, center = false, slices = 1) {
+            text(text = "A,)\\"", size = 4, font = "Gotham Rounded:style=Bold");
+        }
+    }
+    %cube(size = [1, 1, 1], center = false);
+    polygon(points = [[0, 0], [1, 0], [0, 1]], paths = undef, convexity = 1);
+}
+"""
+
+def test_parse_csg():
+    group, = parse_csg(CSG)
+    assert group.name == "group"
+    difference, cube, polygon = group.children
+    assert [child.name for child in difference.children] == [
+        "multmatrix", "linear_extrude"]
+    text = difference.children[1].children[0]
+    # Commas/parens inside strings don't confuse it:
+    assert text.args["text"] == '"A,)\\""'
+    assert text.number("size") == 4
+    assert cube.name == "cube" # Modifier (%) stripped
+    assert polygon.args["points"] == "[[0, 0], [1, 0], [0, 1]]"
+    assert polygon.number("convexity") == 1
+    assert polygon.number("paths", default=-1) == -1 # undef isn't a number
+
+@pytest.mark.parametrize("text", [
+    "group() {", "group() }", "cube(size = [1, 1, 1];", "group() { 42 }"])
+def test_bad_csg(text):
+    with pytest.raises(CsgException):
+        parse_csg(text)
+
+def test_fragments():
+    assert fragments(10, fn=64) == 64
+    assert fragments(10, fn=2) == 3
+    assert fragments(0) == 3
+    assert fragments(1) == 5 # $fs limited (2*pi*1/2 -> at least 5)
+    assert fragments(100) == 30 # $fa limited (360/12)
+
+def test_analyze():
+    stats = analyze(CSG)
+    assert stats.counts["hull"] == 1
+    assert stats.counts["difference"] == 1
+    assert stats.counts["linear_extrude"] == 1
+    cylinder = 16 + 2
+    sphere = 5*3 # fragments(1) == 5 -> 5 * ((5 + 1)//2)
+    assert stats.hull_facets == cylinder + sphere
+    text = 4*40*(1 + 2) # 4 chars, EDGES_PER_CHAR, (slices + 2)
+    assert stats.text_nodes == 1 and stats.text_chars == 4
+    assert stats.boolean_facets == cylinder + sphere + text
+    assert stats.facets == cylinder + sphere + text + 6 + 3
+
+def test_minkowski():
+    stats = analyze("minkowski() { cube(size = 1); sphere($fn = 8, r = 1); }")
+    assert stats.minkowski_facets == 6*32
+    assert stats.facets == 6*32
+
+def test_stats_cache(tmp_path):
+    keycap = Keycap(name="tilde", keycap_playground_path=tmp_path / "kp.scad")
+    (tmp_path / "kp.scad").write_text("// v1")
+    assert cached_stats(keycap) is None
+    store_stats(keycap, analyze(CSG))
+    assert cached_stats(keycap).as_dict() == analyze(CSG).as_dict()
+    # Different parameters, different entry:
+    assert cache_file(Keycap(name="tilde", key_height=9,
+        keycap_playground_path=tmp_path / "kp.scad")) != cache_file(keycap)
+    assert str(CsgStats()) == (
+        "no operations; 0 facets (0 in hulls, 0 in booleans, 0 minkowski), "
+        "0 text (0 chars)")
@@ -0,0 +1,81 @@
+"""
+Tests for `engine.RenderEngine` (using a fake `openscad` so they run anywhere).
+"""
+
+# stdlib imports
+import sys
+import asyncio
+# Our own stuff
+from keycap import Keycap
+from journal import BuildJournal
+from engine import RenderEngine, classify
+
+FAKE_OPENSCAD = """#!{python}
+import sys
+args = sys.argv[1:]
+output = args[args.index("-o") + 1]
+print("WARNING: Can't get font Gotham Rounded", file=sys.stderr)
+if "FAIL" in args[args.index("-D") + 1]:
+    print("ERROR: Parser error in line 1", file=sys.stderr)
+    sys.exit(1)
+with open(output, "w") as f:
+    f.write("solid fake\\nendsolid fake\\n")
+print("Total rendering time: 0:00:00.001")
+"""
+
+def fake_openscad(tmp_path):
+    path = tmp_path / "openscad"
+    path.write_text(FAKE_OPENSCAD.format(python=sys.executable))
+    path.chmod(0o755)
+    return path
+
+def keycap(tmp_path, name, **kwargs):
+    return Keycap(name=name, output_path=tmp_path,
+        openscad_path=fake_openscad(tmp_path), **kwargs)
+
+def run(engine, jobs):
+    return asyncio.run(engine.run(jobs))
+
+def test_classify():
+    assert classify("WARNING: Can't get font Gotham Rounded") == "font"
+    assert classify("ERROR: CGAL error in CGAL_Nef_polyhedron") == "cgal"
+    assert classify("WARNING: Object may not be a valid 2-manifold") == "manifold"
+    assert classify("WARNING: PolySet is not closed") == "manifold"
+    assert classify("Total rendering time: 0:01:32.412") is None
+
+def test_render(tmp_path):
+    journal = BuildJournal(tmp_path)
+    good = keycap(tmp_path, "good")
+    bad = keycap(tmp_path, "bad", legends=["FAIL"])
+    results = run(RenderEngine(journal=journal, quiet=True, validate=False),
+        [good, bad])
+    assert [result.keycap.name for result in results] == ["good", "bad"]
+    assert results[0].ok
+    assert good.output_file.read_text().startswith("solid fake")
+    assert ("font", "WARNING: Can't get font Gotham Rounded") in (
+        results[0].problems)
+    assert results[1].retcode == 1
+    assert ("error", "ERROR: Parser error in line 1") in results[1].problems
+    assert not bad.output_file.exists() # Nor its .partial file
+    assert not list(tmp_path.glob(".*.partial.*"))
+    assert journal.is_done(good)
+    assert journal.entry(bad)["status"] == "failed"
+
+def test_missing_openscad(tmp_path):
+    job = Keycap(name="tilde", output_path=tmp_path,
+        openscad_path=tmp_path / "nope")
+    result, = run(RenderEngine(quiet=True, validate=False), [job])
+    assert result.retcode == 127
+    assert result.problems[0][1].startswith("Could not run OpenSCAD")
+
+def test_exceptions_are_recorded(tmp_path):
+    class BuggyEngine(RenderEngine):
+        async def render(self, keycap, record=True):
+            if keycap.name == "buggy":
+                raise RuntimeError("oops")
+            return await super().render(keycap, record)
+    jobs = [keycap(tmp_path, "good"), keycap(tmp_path, "buggy", key_height=9)]
+    good, buggy = run(BuggyEngine(quiet=True, validate=False), jobs)
+    assert good.ok
+    assert not buggy.ok and buggy.retcode
+    assert buggy.problems == [("error", "Render crashed: RuntimeError('oops')")]
@@ -0,0 +1,49 @@
+"""
+Tests for finding fonts and reading (and caching) their metrics (`fonts.py`).
+"""
+
+# 3rd party stuff
+import pytest
+# Our own stuff
+from fonts import FontMetrics, FontException, parse_font_name, find_font
+
+def test_parse_font_name():
+    assert parse_font_name("Gotham Rounded:style=Bold") == (
+        "Gotham Rounded", "Bold")
+    assert parse_font_name("Roboto") == ("Roboto", "Regular")
+    assert parse_font_name(None) == ("Roboto", "Regular")
+
+def test_find_font(font):
+    assert find_font(font).name == "KeycapTest.ttf"
+    assert find_font(f"{font}:style=Regular") == find_font(font)
+    assert find_font("No Such Font") is None
+    with pytest.raises(FontException):
+        FontMetrics.for_font("No Such Font")
+
+def test_outline(font):
+    metrics = FontMetrics.for_font(font)
+    # At size 7.2 one font unit is 0.01mm (OpenSCAD's 100dpi):
+    assert metrics.scale(7.2) == pytest.approx(0.01)
+    assert metrics.advance("A A", 7.2) == pytest.approx(14.5)
+    points = metrics.outline("A", 7.2)
+    # Centered on the advance width horizontally and on the ink vertically:
+    assert points.min(axis=0) == pytest.approx([-2.5, -3.5])
+    assert points.max(axis=0) == pytest.approx([2.5, 3.5])
+    assert metrics.outline(" ", 7.2).shape == (0, 2)
+
+def test_missing_glyphs(font):
+    metrics = FontMetrics.for_font(font)
+    assert metrics.missing("A ⌘B⌘") == ["⌘", "B"]
+    # Missing glyphs get the .notdef box (what OpenSCAD would render):
+    assert metrics.glyph("⌘")["advance"] == 500
+
+def test_cache(font):
+    metrics = FontMetrics.for_font(font)
+    metrics.glyph("A")
+    metrics.missing("⌘")
+    metrics.save()
+    assert metrics.cache_file.exists()
+    cached = FontMetrics(metrics.path, metrics.cache_file.parent)
+    assert cached.glyphs == metrics.glyphs
+    assert cached.missing("⌘") == ["⌘"]
+    assert cached._font is None # Never had to open the font
@@ -0,0 +1,99 @@
+"""
+Tests for the immutable job specs (`jobspec.py`).
+"""
+
+# stdlib imports
+import json
+import pickle
+from pathlib import Path
+# Our own stuff
+from keycap import Keycap
+from jobspec import (
+    JobSpec, freeze, thaw, legends_spec, artifact_specs, LEGENDS_FILE_TYPE)
+
+class Alpha(Keycap):
+    """
+    Like the keycap subclasses in the keyset scripts.
+    """
+    def __init__(self, **kwargs):
+        super().__init__(key_profile="riskeycap", **kwargs)
+
+def tilde(**kwargs):
+    return Alpha(name="tilde", legends=["`", "~"], font_sizes=[4, 4.5],
+        trans=[[-3, 0, 0], [3, 0, 0]], output_path=Path("/tmp/keys"),
+        **kwargs)
+
+def test_freeze_thaw():
+    value = [[1, [2, 3]], "a", (4,)]
+    assert freeze(value) == ((1, (2, 3)), "a", (4,))
+    assert thaw(freeze(value)) == [[1, [2, 3]], "a", [4]]
+    assert freeze("abc") == "abc"
+
+def test_from_keycap():
+    keycap = tilde()
+    spec = JobSpec.from_keycap(keycap)
+    assert (spec.name, spec.render, spec.file_type, spec.output_path) == (
+        "tilde", ("keycap", "stem"), "3mf", "/tmp/keys")
+    assert spec.param("trans") == ((-3, 0, 0), (3, 0, 0))
+    assert spec.output_file == keycap.output_file
+    assert hash(spec) == hash(JobSpec.from_keycap(tilde())) # Same params
+    assert JobSpec.from_keycap(keycap, output_path="/elsewhere").output_path \
+        == "/elsewhere"
+    assert pickle.loads(pickle.dumps(spec)) == spec
+
+def test_keycap():
+    original = tilde()
+    job = JobSpec.from_keycap(original).keycap()
+    assert type(job) is Keycap
+    assert job is not original
+    assert job.definitions() == original.definitions()
+    assert job.output_file == original.output_file
+    job.legends.append("!") # Nobody else's list
+    assert JobSpec.from_keycap(original).keycap().legends == ["`", "~"]
+
+def test_dict_round_trip():
+    spec = JobSpec.from_keycap(tilde())
+    data = json.loads(json.dumps(spec.as_dict()))
+    assert data["params"]["openscad_path"] == "/usr/bin/openscad"
+    assert data["params"]["trans"] == [[-3, 0, 0], [3, 0, 0]]
+    again = JobSpec.from_dict(data)
+    assert again.as_dict() == spec.as_dict()
+    assert again.keycap().definitions() == spec.keycap().definitions()
+    assert again.keycap().args() == spec.keycap().args()
+
+def test_with_params():
+    keycap = tilde()
+    spec = JobSpec.from_keycap(keycap)
+    draft = spec.with_params(dish_fn=32, legends=["x"], name="draft",
+        output_path=Path("/tmp/drafts"))
+    assert (draft.name, draft.output_path) == ("draft", "/tmp/drafts")
+    assert draft.param("dish_fn") == 32
+    assert draft.param("legends") == ("x",)
+    assert draft.keycap().legends == ["x"]
+    # Nothing else changed (including the spec and keycap it came from):
+    assert spec.param("dish_fn") == keycap.dish_fn == 256
+    assert keycap.legends == ["`", "~"]
+    assert draft.with_params(dish_fn=256, legends=["`", "~"], name="tilde",
+        output_path="/tmp/keys") == spec
+
+def test_legends_spec():
+    spec = JobSpec.from_keycap(tilde())
+    legends = legends_spec(spec)
+    assert (legends.name, legends.render, legends.file_type) == (
+        "tilde_legends", ("legends",), LEGENDS_FILE_TYPE)
+    assert legends.params == spec.params
+
+def test_artifact_specs():
+    spec = JobSpec.from_keycap(tilde(render=["keycap", "%stem"]))
+    names = [(s.name, s.render, s.file_type) for s in artifact_specs(
+        spec, formats=["3mf", "stl"], output_path="/tmp/parts")]
+    assert names == [
+        ("tilde_keycap", ("keycap",), "3mf"),
+        ("tilde_stem", ("%stem",), "3mf"),
+        ("tilde_keycap", ("keycap",), "stl"),
+        ("tilde_stem", ("%stem",), "stl")]
+    # Everything together keeps the name:
+    together, = artifact_specs(spec, targets=[spec.render], formats=["stl"])
+    assert (together.name, together.output_path) == ("tilde", "/tmp/keys")
+    assert all(s.output_path == "/tmp/parts" for s in artifact_specs(
+        spec, output_path="/tmp/parts"))
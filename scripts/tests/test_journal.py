@@ -0,0 +1,72 @@
+"""
+Tests for `journal.BuildJournal`: picking up where an interrupted build left
+off.
+"""
+
+# Our own stuff
+import journal
+from keycap import Keycap
+from journal import BuildJournal
+
+def render(journal, keycap, data=b"solid keycap"):
+    """
+    Pretends to render *keycap* (the way `engine.RenderEngine` records it).
+    """
+    journal.start(keycap)
+    keycap.output_file.write_bytes(data)
+    journal.finish(keycap, 1.5, peak_memory_mb=100)
+
+def test_resume(tmp_path):
+    keycaps = [Keycap(name=f"key{i}", output_path=tmp_path) for i in range(4)]
+    build = BuildJournal(tmp_path)
+    for keycap in keycaps[:2]:
+        render(build, keycap)
+    build.start(keycaps[2]) # Killed while rendering this one
+    resumed = BuildJournal(tmp_path)
+    assert [resumed.is_done(k) for k in keycaps] == [True, True, False, False]
+    assert resumed.entry(keycaps[2])["status"] == "running"
+    assert resumed.entry(keycaps[0])["duration"] == 1.5
+
+def test_changed_parameters_or_output(tmp_path):
+    keycap = Keycap(name="tilde", output_path=tmp_path)
+    render(BuildJournal(tmp_path), keycap)
+    resumed = BuildJournal(tmp_path)
+    assert resumed.is_done(keycap)
+    keycap.output_file.write_bytes(b"solid trunc") # Changed/truncated output
+    assert not resumed.is_done(keycap)
+    render(resumed, keycap)
+    changed = Keycap(name="tilde", output_path=tmp_path, key_height=9)
+    assert not BuildJournal(tmp_path).is_done(changed)
+
+def test_failures_are_not_done(tmp_path):
+    keycap = Keycap(name="tilde", output_path=tmp_path)
+    build = BuildJournal(tmp_path)
+    build.start(keycap)
+    build.fail(keycap, 2.0, "x" * 5000)
+    entry = BuildJournal(tmp_path).entry(keycap)
+    assert entry["status"] == "failed"
+    assert len(entry["error"]) == 2000
+
+def test_log_compaction(tmp_path, monkeypatch):
+    monkeypatch.setattr(journal, "COMPACT_AFTER", 3)
+    keycaps = [Keycap(name=f"key{i}", output_path=tmp_path) for i in range(3)]
+    build = BuildJournal(tmp_path)
+    for keycap in keycaps:
+        render(build, keycap)
+    assert build.path.exists()
+    assert build.logged < 3
+    resumed = BuildJournal(tmp_path)
+    assert all(resumed.is_done(keycap) for keycap in keycaps)
+
+def test_crash_mid_record(tmp_path):
+    keycaps = [Keycap(name=f"key{i}", output_path=tmp_path) for i in range(2)]
+    build = BuildJournal(tmp_path)
+    render(build, keycaps[0])
+    with open(build.log_path, "a") as f:
+        f.write('["0123", {"status": "do') # Power went out
+    resumed = BuildJournal(tmp_path)
+    assert resumed.is_done(keycaps[0])
+    render(resumed, keycaps[1])
+    final = BuildJournal(tmp_path)
+    assert all(final.is_done(keycap) for keycap in keycaps)
+    assert "0123" not in final.entries
@@ -0,0 +1,101 @@
+"""
+Tests for checking that legends fit on the top of the keycap and that their
+fonts are installed (`legends.py`).  They use the `font` fixture's font where
+"A" is a box that's `size*100/72*0.5` wide and `size*100/72*0.7` tall.
+"""
+
+# 3rd party stuff
+import pytest
+np = pytest.importorskip("numpy")
+# Our own stuff
+from keycap import Keycap
+from legends import (
+    LegendSolver, Placement, LEGEND_MARGIN, unescape, legend_problems,
+    font_problems, font_preflight)
+
+def riskeycap(font, legends, **kwargs):
+    """
+    Returns a (riskeycap profile) `Keycap` with *legends* in the test *font*.
+    """
+    return Keycap(legends=legends, fonts=[font], **kwargs)
+
+def test_unescape():
+    assert unescape("\\u005c") == "\\"
+    assert unescape('\\"A\\"') == '"A"'
+    assert unescape("\\x41\\U01F600") == "A\U0001F600"
+    assert unescape(None) == ""
+
+def test_placement_falls_back_to_the_first_legend():
+    keycap = Keycap(legends=["A", "B"], fonts=["Gotham"], font_sizes=[5],
+        trans=[[1, 2, 0]], rotation=[[0, 0, 0], [0, 0, 90]])
+    placement = Placement(keycap, 1)
+    assert (placement.text, placement.font, placement.size) == ("B", "Gotham", 5)
+    assert placement.trans == [1, 2, 0]
+    assert placement.rotation == [0, 0, 90]
+
+def test_centered_legend_fits(font):
+    solver = LegendSolver(riskeycap(font, ["A"], font_sizes=[4]))
+    fit, = solver.check()
+    assert fit.status == "ok" and fit.overflow == 0
+    low, high = fit.bounds
+    # Straight down onto the top so it lands exactly where it was drawn:
+    assert list(low) == pytest.approx([-4*100/72*0.25, -4*100/72*0.35])
+    assert list(high) == pytest.approx([4*100/72*0.25, 4*100/72*0.35])
+
+def test_overflowing_legend_gets_moved(font):
+    keycap = riskeycap(font, ["A"], font_sizes=[4], trans=[[7, 0, 0]])
+    solver = LegendSolver(keycap)
+    fit, = solver.check()
+    assert fit.status == "overflow" and not fit.ok
+    assert fit.overflow > 2
+    assert fit.size == 4 # Moving it is enough...
+    assert fit.trans[0] < 7
+    moved = riskeycap(font, ["A"], font_sizes=[4], trans=[fit.trans])
+    moved_fit, = LegendSolver(moved).check()
+    assert moved_fit.status == "ok" # ...and it fits there
+    assert moved_fit.bounds[1][0] <= solver.top.size[0]/2 - LEGEND_MARGIN
+
+def test_oversized_legend_gets_shrunk(font):
+    keycap = riskeycap(font, ["AAAAAA"], font_sizes=[6])
+    fit, = LegendSolver(keycap).check()
+    assert fit.status == "overflow"
+    assert 2 <= fit.size < 6
+    smaller = riskeycap(font, ["AAAAAA"], font_sizes=[fit.size], trans=[fit.trans])
+    assert LegendSolver(smaller).check()[0].ok
+
+def test_side_legends_and_missing_fonts_are_skipped(font):
+    keycap = riskeycap(font, ["A", "A"], font_sizes=[20],
+        rotation=[[68, 0, 0], [0, 0, 0]])
+    keycap.fonts = [font, "No Such Font"]
+    side, no_font = LegendSolver(keycap).check()
+    assert side.status == "side" and side.ok
+    assert no_font.status == "no font" and no_font.ok
+    assert legend_problems(keycap) == []
+
+def test_legend_problems(font):
+    keycap = riskeycap(font, ["A", "A", "AAAAAA"], font_sizes=[4, 4, 6],
+        trans=[[0, 0, 0], [1, 0, 0], [0, 0, 0]],
+        rotation=[[0, 0, 0], [0, 0, 0], [0, 0, 0]])
+    problems = legend_problems(keycap)
+    assert problems[0].startswith("'AAAAAA' misses the top entirely (try "
+        "font_sizes[2]=")
+    assert problems[1] == "'A' and 'A' overlap"
+    assert legend_problems(Keycap(legends=[""])) == []
+
+def test_font_problems(font):
+    keycap = riskeycap(font, ["A⌘", "", "A"])
+    keycap.fonts = [font, font, "No Such Font:style=Bold"]
+    assert font_problems(keycap) == [
+        f"{font} has no glyph for '⌘' (U+2318) in legend 'A⌘'",
+        "Font not installed: No Such Font:style=Bold"]
+    keycap.render = ["stem"] # No legends in the output
+    assert font_problems(keycap) == []
+
+def test_font_preflight(font, capsys):
+    from build import print_font_problems
+    good = riskeycap(font, ["A"], name="good")
+    bad = riskeycap(font, ["B"], name="bad")
+    assert font_preflight([good, bad]) == {
+        "bad": [f"{font} has no glyph for 'B' (U+0042) in legend 'B'"]}
+    assert print_font_problems([good, bad]) == ["bad"]
+    assert "bad: font problems" in capsys.readouterr().out
@@ -0,0 +1,45 @@
+"""
+Tests for `mesh.py`: loading/saving STL and 3MF files and welding.
+"""
+
+# 3rd party stuff
+import pytest
+np = pytest.importorskip("numpy")
+# Our own stuff
+from mesh import weld, load_mesh, save_mesh, save_3mf, load_3mf
+
+def test_weld_merges_duplicate_vertices(cube):
+    mesh = cube()
+    # STL style: three vertices per triangle (plus a bit of noise)
+    soup = mesh.triangles().reshape(-1, 3) + 1e-7
+    faces = np.arange(len(soup)).reshape(-1, 3)
+    welded = weld(soup, faces)
+    assert len(welded.vertices) == 8
+    assert len(welded) == 12
+    assert welded.is_watertight()
+
+def test_weld_drops_degenerate_triangles(cube):
+    mesh = cube()
+    vertices = np.vstack([mesh.vertices, mesh.vertices[:1] + 1e-9])
+    faces = np.vstack([mesh.faces, [[0, 1, 8]]]) # 0 and 8 are the same point
+    assert len(weld(vertices, faces)) == 12
+
+@pytest.mark.parametrize("suffix", ["stl", "3mf"])
+def test_round_trip(cube, tmp_path, suffix):
+    mesh = cube(size=2.5, offset=(-1, 2, 3))
+    path = tmp_path / f"cube.{suffix}"
+    save_mesh(mesh, path)
+    loaded = load_mesh(path)
+    assert len(loaded) == 12
+    assert loaded.is_watertight()
+    assert loaded.volume() == pytest.approx(2.5**3)
+    low, high = loaded.bounds()
+    assert low.tolist() == pytest.approx([-1, 2, 3])
+    assert high.tolist() == pytest.approx([1.5, 4.5, 5.5])
+
+def test_3mf_with_several_objects(cube, tmp_path):
+    path = tmp_path / "two.3mf"
+    save_3mf([("a", cube()), ("b", cube(offset=(3, 0, 0)))], path)
+    loaded = load_3mf(path)
+    assert len(loaded) == 24
+    assert len(loaded.components()) == 2
@@ -0,0 +1,153 @@
+"""
+Tests for the build planner (`planner.py`) and the cost model behind its
+estimates (`costmodel.py`).
+"""
+
+# stdlib imports
+from pathlib import Path
+# 3rd party stuff
+import pytest
+# Our own stuff
+from keycap import Keycap
+from journal import BuildJournal
+from artifactcache import DirectoryCache, cache_key
+from costmodel import CostModel, features, cost_units, loft_facets
+from planner import PlannedJob, plan, simulate, job_status, format_duration
+
+def planned(seconds, memory_mb=100, parts=None):
+    return PlannedJob(None, "render", seconds, memory_mb, "model", parts)
+
+def rendered(journal, keycap, duration=10.0, peak_memory_mb=300):
+    journal.start(keycap)
+    Path(keycap.output_file).write_bytes(b"solid " + keycap.name.encode())
+    journal.finish(keycap, duration, peak_memory_mb)
+
+def test_format_duration():
+    assert format_duration(65) == "1m05s"
+    assert format_duration(3600 + 23*60 + 10) == "1h23m"
+
+def test_simulate():
+    jobs = [planned(10), planned(10), planned(10), planned(5)]
+    wall, peak = simulate(jobs, 2)
+    assert wall == 20 # 10+10 on one runner, 10+5 on the other
+    assert peak == 200
+    assert simulate(jobs, 10) == (10, 400)
+    assert simulate([], 4) == (0, 0)
+
+def test_simulate_split_parts_get_their_own_runners():
+    job = planned(30, parts=[planned(20, 100), planned(10, 50)])
+    assert simulate([job], 2) == (20, 150)
+    assert simulate([job], 1) == (30, 100)
+
+def test_job_status(tmp_path):
+    # (The cache doesn't care about names, only parameters)
+    done, cached, todo = (
+        Keycap(name=name, output_path=tmp_path, key_height=height)
+        for name, height in (("done", 8), ("cached", 9), ("todo", 10)))
+    journal = BuildJournal(tmp_path)
+    rendered(journal, done)
+    cache = DirectoryCache(tmp_path / "cache")
+    source = tmp_path / "source.stl"
+    source.write_bytes(b"solid cached")
+    cache.publish(cache_key(cached), source)
+    assert job_status(done, journal, cache) == "done"
+    assert job_status(cached, journal, cache) == "cached"
+    assert job_status(todo, journal, cache) == "render"
+    assert job_status(cached, journal) == "render" # No cache, no hit
+    # --force re-renders what's in the journal but still uses the cache:
+    assert job_status(done, journal, cache, force=True) == "render"
+    assert job_status(cached, journal, cache, force=True) == "cached"
+
+def test_plan_uses_history(tmp_path):
+    journal = BuildJournal(tmp_path)
+    old = Keycap(name="old", output_path=tmp_path)
+    rendered(journal, old, duration=42.0, peak_memory_mb=321)
+    new = Keycap(name="new", output_path=tmp_path)
+    jobs = plan([old, new], journal)
+    assert [job.status for job in jobs] == ["done", "render"]
+    assert (jobs[0].seconds, jobs[0].memory_mb) == (42.0, 321)
+    assert jobs[0].source == "history"
+    assert jobs[1].source == "model"
+    assert plan([old], journal, force=True)[0].status == "render"
+
+def test_plan_split(tmp_path):
+    journal = BuildJournal(tmp_path)
+    keycap = Keycap(name="tilde", output_path=tmp_path, legends=["~"],
+        render=["keycap", "stem", "legends"])
+    whole, = plan([keycap], journal)
+    split, = plan([keycap], journal, split=True)
+    assert whole.parts == []
+    assert [part.keycap.name for part in split.parts] == [
+        "tilde_keycap", "tilde_stem", "tilde_legends"]
+    assert split.source == "split"
+    assert split.seconds == pytest.approx(
+        sum(part.seconds for part in split.parts))
+    # One job, one target: nothing to split
+    stem = Keycap(name="stem", output_path=tmp_path, render=["stem"])
+    assert plan([stem], journal, split=True)[0].parts == []
+
+def test_cost_units_follow_the_parameters():
+    base = features(Keycap(legends=["A"]))
+    def units(**changes):
+        return cost_units(dict(base, **changes))
+    assert units(legends=3) > units(legends=1)
+    assert units(area=base["area"] * 4) > units()
+    assert units(dish_type="sphere", dish_fn=512) > units(
+        dish_type="cylinder", dish_fn=512)
+    assert units(polygon_layers=20) > units(polygon_layers=10)
+    assert units(render=["stem"]) < units(render=["keycap", "stem"])
+    assert units(render=[]) == 0.05 # Never free
+
+def test_calibrate(tmp_path):
+    journal = BuildJournal(tmp_path)
+    keycaps = [
+        Keycap(name=f"key{i}", output_path=tmp_path, legends=["A"] * i)
+        for i in range(1, 4)]
+    model = CostModel()
+    for keycap in keycaps:
+        # Exactly 30 seconds per unit on this (imaginary) machine
+        rendered(journal, keycap,
+            duration=30 * cost_units(features(keycap)),
+            peak_memory_mb=100 + 200 * cost_units(features(keycap)))
+    model.calibrate(journal)
+    assert model.samples == 3
+    assert model.seconds_per_unit == pytest.approx(30)
+    assert model.base_memory_mb == pytest.approx(100)
+    assert model.memory_mb_per_unit == pytest.approx(200)
+    seconds, memory_mb = model.estimate(keycaps[0])
+    assert seconds == pytest.approx(30 * cost_units(features(keycaps[0])))
+    assert model.source(keycaps[0]) == "model"
+
+def loft(layers, count):
+    """
+    Returns the faces `loft()` (utils.scad) makes for *layers* outlines of
+    *count* points each.
+    """
+    last = layers - 1
+    faces = [list(range(count))] # Bottom
+    for layer in range(last):
+        for i in range(count):
+            j = (i + 1) % count
+            faces.append([(layer+1)*count + i, (layer+1)*count + j,
+                layer*count + j])
+            faces.append([(layer+1)*count + i, layer*count + j,
+                layer*count + i])
+    faces.append([last*count + i for i in range(count - 1, -1, -1)]) # Top
+    return faces
+
+def test_loft_facets():
+    assert loft_facets(10, 64) == 2*10*68 + 2
+    assert loft_facets(20, 64) - 2 == 2*(loft_facets(10, 64) - 2)
+    assert loft_facets(10, 16) < loft_facets(10, 64)
+    # Same count as the actual polyhedron (polygon_layers + 1 outlines):
+    assert len(loft(11, 68)) == loft_facets(10, 64)
+
+def test_loft_is_closed():
+    # Every edge is used exactly once in each direction (closed and
+    # consistently oriented; what CGAL needs to not complain):
+    edges = {}
+    for face in loft(5, 12):
+        for a, b in zip(face, face[1:] + face[:1]):
+            edges[a, b] = edges.get((a, b), 0) + 1
+    assert set(edges.values()) == {1}
+    assert all((b, a) in edges for a, b in edges)
@@ -0,0 +1,67 @@
+"""
+Tests for preflighting jobs (`preflight.py`) using a fake `openscad` that
+"exports" a tiny CSG tree and echoes what `check_parameters()` would.
+"""
+
+# stdlib imports
+import sys
+# Our own stuff
+from keycap import Keycap
+from preflight import preflight, print_preflight, clean
+
+FAKE_OPENSCAD = """#!{python}
+import sys
+args = sys.argv[1:]
+definitions = args[args.index("-D") + 1]
+print("ECHO: \\"<span style='color:yellow'><b>NOTE: </b>Hello</span>\\"")
+if "riskycap" in definitions:
+    print("ECHO: \\"<span style='color:orange'><b>WARNING: </b>Unknown "
+          "KEY_PROFILE riskycap</span>\\"", file=sys.stderr)
+if "crash" in definitions:
+    sys.exit(1)
+with open(args[args.index("-o") + 1], "w") as f:
+    f.write("difference() {{ cube(size = [1, 1, 1]); "
+            "sphere($fn = 8, r = 1); }}\\n")
+"""
+
+def keycap(tmp_path, name, **kwargs):
+    openscad = tmp_path / "openscad"
+    if not openscad.exists():
+        openscad.write_text(FAKE_OPENSCAD.format(python=sys.executable))
+        openscad.chmod(0o755)
+    return Keycap(name=name, output_path=tmp_path, openscad_path=openscad,
+        **kwargs)
+
+def test_clean():
+    assert clean("ECHO: \"<span style='color:orange'><b>WARNING: </b>"
+                 "Oops</span>\"") == 'ECHO: "WARNING: Oops"'
+
+def test_preflight(tmp_path, capsys):
+    good = keycap(tmp_path, "good")
+    typo = keycap(tmp_path, "typo", key_profile="riskycap")
+    crash = keycap(tmp_path, "crash", legends=["crash"])
+    results = preflight([good, typo, crash], max_runners=2)
+    assert [result.keycap.name for result in results] == [
+        "good", "typo", "crash"]
+    assert results[0].ok
+    assert results[0].notes == ['ECHO: "NOTE: Hello"']
+    # The CSG tree got analyzed (and its digest recorded):
+    assert results[0].csg.counts["difference"] == 1
+    assert results[0].csg.boolean_facets == 6 + 8*4
+    assert len(results[0].csg_digest) == 64
+    assert not results[1].ok
+    assert results[1].problems == [
+        ("warning", 'ECHO: "WARNING: Unknown KEY_PROFILE riskycap"')]
+    assert not results[2].ok
+    assert results[2].problems == [("error", "OpenSCAD exited with code 1")]
+    assert print_preflight(results, notes=True) == ["typo", "crash"]
+    output = capsys.readouterr().out
+    assert "Unknown KEY_PROFILE riskycap" in output
+    assert "NOTE: Hello" in output
+
+def test_missing_openscad(tmp_path):
+    job = Keycap(name="tilde", output_path=tmp_path,
+        openscad_path=tmp_path / "nope")
+    result, = preflight([job])
+    assert result.retcode == 127
+    assert result.problems[0][1].startswith("Could not run OpenSCAD")
@@ -0,0 +1,162 @@
+"""
+Tests for the geometry comparisons in `regress.py`.  The `--against`
+reference renders get tested with a fake `openscad`; set
+`KEYCAP_REGRESS_OPENSCAD` (a real OpenSCAD) and `KEYCAP_REGRESS_AGAINST` (a
+git revision) to render the actual `REFERENCE_CASES` too.
+"""
+
+# stdlib imports
+import os
+import sys
+import subprocess
+# 3rd party stuff
+import pytest
+np = pytest.importorskip("numpy")
+# Our own stuff
+from mesh import save_mesh
+from regress import (
+    closest_points_on_triangles, compare_meshes, compare_files, pair_files,
+    render_references, REFERENCE_CASES, RegressException)
+
+# Renders a (frustum-shaped) block the size of the keycap: 12 triangles with
+# the "v1" keycap_playground.scad, the same block with every side split in 4
+# with "v2":
+FAKE_OPENSCAD = """#!{python}
+import re, sys
+args = sys.argv[1:]
+definitions = args[args.index("-D") + 1]
+names = ("KEY_LENGTH", "KEY_WIDTH", "KEY_HEIGHT", "KEY_TOP_DIFFERENCE")
+size = [float(re.search(name + r"=([0-9.]+)", definitions).group(1))
+    for name in names]
+split = "v2" in open(args[-1]).read()
+corners = [[(x - 0.5) * (size[0] - z * size[3]),
+    (y - 0.5) * (size[1] - z * size[3]), z * size[2]]
+    for x in (0, 1) for y in (0, 1) for z in (0, 1)]
+sides = [[0, 1, 3, 2], [4, 6, 7, 5], [0, 4, 5, 1], [2, 3, 7, 6],
+    [0, 2, 6, 4], [1, 5, 7, 3]]
+triangles = []
+for side in sides:
+    points = [corners[i] for i in side]
+    if split:
+        middle = [sum(p[axis] for p in points) / 4 for axis in range(3)]
+        triangles += [[points[i], points[(i + 1) % 4], middle]
+            for i in range(4)]
+    else:
+        triangles += [points[:3], [points[0], points[2], points[3]]]
+with open(args[args.index("-o") + 1], "w") as f:
+    f.write("solid box\\n")
+    for triangle in triangles:
+        f.write("facet normal 0 0 0\\nouter loop\\n")
+        for point in triangle:
+            f.write("vertex %f %f %f\\n" % tuple(point))
+        f.write("endloop\\nendfacet\\n")
+    f.write("endsolid box\\n")
+"""
+
+def test_closest_points_on_triangles():
+    a, b, c = (np.array([[x, y, 0.0]] * 4)
+        for x, y in ((0, 0), (1, 0), (0, 1)))
+    points = np.array([
+        [0.25, 0.25, 2], # Above the face
+        [-1, -1, 0], # Past vertex a
+        [0.5, -1, 0], # Below edge ab
+        [1, 1, 0], # Past edge bc
+    ], float)
+    closest = closest_points_on_triangles(points, a, b, c)
+    assert closest == pytest.approx(np.array([
+        [0.25, 0.25, 0], [0, 0, 0], [0.5, 0, 0], [0.5, 0.5, 0]]))
+
+def test_identical_meshes(cube):
+    stats = compare_meshes(cube(size=10), cube(size=10), samples=2000)
+    assert stats["distance_max"] == pytest.approx(0, abs=1e-6)
+    assert stats["volume_delta"] == 0
+    assert stats["bbox_delta"] == 0
+
+def test_moved_surface(cube):
+    stats = compare_meshes(
+        cube(size=10), cube(size=10, offset=(0.2, 0, 0)), samples=2000)
+    assert stats["bbox_delta"] == pytest.approx(0.2)
+    assert stats["distance_max"] == pytest.approx(0.2, abs=0.01)
+    assert stats["volume_delta"] == pytest.approx(0, abs=1e-6)
+
+def test_far_away_surface(cube):
+    # Way past the spatial index's first cell size so these get measured
+    # against the (coarser) samples instead:
+    stats = compare_meshes(
+        cube(size=10), cube(size=10, offset=(0, 0, 50)), samples=2000)
+    assert stats["distance_max"] == pytest.approx(50, rel=0.05)
+
+def test_compare_files(cube, tmp_path):
+    for name, mesh in (("same", cube(size=10)), ("bigger", cube(size=10.5))):
+        save_mesh(cube(size=10), tmp_path / f"ref_{name}.stl")
+        save_mesh(mesh, tmp_path / f"{name}.stl")
+    changes, stats = compare_files(
+        tmp_path / "ref_same.stl", tmp_path / "same.stl", samples=2000)
+    assert changes == []
+    changes, stats = compare_files(
+        tmp_path / "ref_bigger.stl", tmp_path / "bigger.stl", samples=2000)
+    assert stats["volume_delta_percent"] == pytest.approx(15.762, abs=0.001)
+    assert [change.split()[0] for change in changes] == [
+        "Volume", "Bounding", "Surface"]
+    changes, _ = compare_files(tmp_path / "nope.stl", tmp_path / "same.stl")
+    assert changes[0].startswith("Could not load mesh")
+
+def test_pair_files(tmp_path):
+    reference, candidate = tmp_path / "ref", tmp_path / "new"
+    reference.mkdir()
+    candidate.mkdir()
+    for name in ("a.stl", "b.3mf", "notes.txt"):
+        (reference / name).write_text("")
+    assert pair_files(reference, candidate) == [
+        (reference / "a.stl", candidate / "a.stl"),
+        (reference / "b.3mf", candidate / "b.3mf")]
+    assert pair_files(reference / "a.stl", candidate) == [
+        (reference / "a.stl", candidate / "a.stl")]
+
+def git(repo, *args):
+    subprocess.run(["git", "-C", str(repo), "-c", "user.name=Test",
+        "-c", "user.email=test@example.com", *args],
+        check=True, capture_output=True)
+
+def test_render_references(tmp_path):
+    openscad = tmp_path / "openscad"
+    openscad.write_text(FAKE_OPENSCAD.format(python=sys.executable))
+    openscad.chmod(0o755)
+    repo = tmp_path / "repo"
+    repo.mkdir()
+    playground = repo / "keycap_playground.scad"
+    playground.write_text("// v2\n")
+    git(repo, "init", "-q")
+    git(repo, "add", "keycap_playground.scad")
+    git(repo, "commit", "-q", "-m", "v2")
+    playground.write_text("// v1\n") # Fewer facets in the working tree
+    cases = {name: REFERENCE_CASES[name]
+             for name in ("dish_cylinder_1u", "dish_sphere_1u")}
+    reference, candidate, problems = render_references("HEAD",
+        tmp_path / "out", openscad, cases, repo=repo)
+    assert problems == {}
+    pairs = pair_files(reference, candidate)
+    assert [c.name for _, c in pairs] == [
+        "dish_cylinder_1u.stl", "dish_sphere_1u.stl"]
+    for reference_file, candidate_file in pairs:
+        changes, stats = compare_files(reference_file, candidate_file)
+        assert changes == [] # Same shape...
+        assert stats["triangles"] == (24, 12) # ...fewer facets
+    with pytest.raises(RegressException, match="nope"):
+        render_references("nope", tmp_path / "out2", openscad, cases,
+            repo=repo)
+
+@pytest.mark.skipif(
+    not (os.environ.get("KEYCAP_REGRESS_OPENSCAD")
+         and os.environ.get("KEYCAP_REGRESS_AGAINST")),
+    reason="KEYCAP_REGRESS_OPENSCAD/KEYCAP_REGRESS_AGAINST aren't set")
+@pytest.mark.parametrize("name", REFERENCE_CASES)
+def test_reference_cases(tmp_path, name):
+    reference, candidate, problems = render_references(
+        os.environ["KEYCAP_REGRESS_AGAINST"], tmp_path,
+        os.environ["KEYCAP_REGRESS_OPENSCAD"], {name: REFERENCE_CASES[name]})
+    assert problems == {}
+    (reference_file, candidate_file), = pair_files(reference, candidate)
+    changes, stats = compare_files(reference_file, candidate_file)
+    assert changes == []
+    assert stats["triangles"][1] <= stats["triangles"][0]
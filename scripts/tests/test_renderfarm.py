@@ -0,0 +1,161 @@
+"""
+Tests for the render farm (`renderfarm.py`): the server's leases, reaping and
+work stealing and the worker's rendering/cancelling (with a fake `openscad`
+and a fake server).
+"""
+
+# stdlib imports
+import sys
+import json
+import time
+import threading
+# Our own stuff
+from keycap import Keycap
+from journal import BuildJournal
+from renderfarm import RenderFarm, FarmJob, Worker
+
+FAKE_OPENSCAD = """#!{python}
+import os, sys, time, signal
+args = sys.argv[1:]
+definitions = args[args.index("-D") + 1]
+if "crash" in definitions:
+    os.kill(os.getpid(), signal.SIGKILL)
+if "slow" in definitions:
+    time.sleep(30)
+with open(args[args.index("-o") + 1], "w") as f:
+    f.write("solid fake")
+"""
+
+def farm(tmp_path, count=2, **kwargs):
+    jobs = [Keycap(name=f"key{i}", output_path=tmp_path, key_height=8 + i)
+            for i in range(count)]
+    return RenderFarm(jobs, BuildJournal(tmp_path), validate=False, **kwargs)
+
+def test_lease_biggest_first(tmp_path):
+    server = farm(tmp_path, count=3)
+    for job_id, seconds in (("0", 10), ("1", 30), ("2", 20)):
+        server.jobs[job_id].seconds = seconds
+    leased = [server.lease(f"w{i}")["id"] for i in range(3)]
+    assert leased == ["1", "2", "0"]
+    assert server.lease("w3") is None # Nothing left (and too soon to steal)
+    payload = server.jobs["0"].payload()
+    assert payload["spec"]["name"] == "key0"
+    json.dumps(payload) # Has to go over the wire
+
+def test_submit(tmp_path):
+    server = farm(tmp_path, count=1)
+    job = server.lease("w1")
+    assert server.heartbeat("w1", [job["id"], "nope"]) == ["nope"]
+    assert server.submit(job["id"], "w2", {"retcode": 0}, b"solid") == (
+        False, "Job was already finished or reassigned")
+    assert server.submit(job["id"], "w1", {"retcode": 0, "duration": 3},
+        b"solid fake") == (True, "Accepted")
+    keycap = server.jobs[job["id"]].keycap
+    assert keycap.output_file.read_bytes() == b"solid fake"
+    assert server.journal.is_done(keycap)
+    assert server.finished.is_set()
+    assert server.status()["jobs"] == {"done": 1}
+
+def test_failures_get_retried(tmp_path):
+    server = farm(tmp_path, count=1, max_attempts=2)
+    for attempt in range(2):
+        job = server.lease("w1")
+        assert job is not None
+        assert server.submit(job["id"], "w1", {"retcode": 1, "output": "oops"},
+            b"") == (True, "Failure recorded")
+    assert server.jobs["0"].status == "failed"
+    assert len(server.jobs["0"].problems) == 2
+    assert server.finished.is_set()
+
+def test_reap(tmp_path):
+    server = farm(tmp_path, count=1, lease_timeout=0.05)
+    job = server.lease("w1")
+    server.reap()
+    assert server.jobs[job["id"]].status == "running" # Not yet
+    time.sleep(0.1)
+    server.reap()
+    assert server.jobs[job["id"]].status == "pending"
+    assert server.jobs[job["id"]].problems == ["w1 stopped responding"]
+    assert server.heartbeat("w1", [job["id"]]) == [job["id"]] # Too late
+    assert server.lease("w2")["id"] == job["id"]
+
+def test_work_stealing(tmp_path):
+    server = farm(tmp_path, count=1, steal_after=0)
+    job = server.lease("slow")
+    assert server.lease("slow") is None # Can't steal from yourself
+    assert server.lease("fast")["id"] == job["id"]
+    assert server.lease("faster") is None # Only one copy gets stolen
+    assert server.submit(job["id"], "fast", {"retcode": 0}, b"solid")[0]
+    # The slow one gets told to stop and its result isn't wanted:
+    assert server.heartbeat("slow", [job["id"]]) == [job["id"]]
+    assert not server.submit(job["id"], "slow", {"retcode": 0}, b"solid")[0]
+
+class FakeServer(object):
+    """
+    Stands in for `Worker._call()`: records the calls and, like a slow
+    upload would, lets a heartbeat happen while a result is uploading.
+    """
+    def __init__(self, worker, cancel=()):
+        self.worker = worker
+        self.cancel = list(cancel)
+        self.calls = []
+        self.heartbeats = []
+
+    def __call__(self, path, data=None, **kwargs):
+        self.calls.append(path)
+        if path == "/heartbeat":
+            self.heartbeats.append(data["jobs"])
+            return {"cancel": self.cancel}
+        if path.startswith("/result/"):
+            self.result = json.loads(kwargs["headers"]["X-Result"])
+            self.body = kwargs["body"]
+            self.worker.beat()
+            return {"message": "Accepted"}
+        return None
+
+def worker(tmp_path):
+    openscad = tmp_path / "openscad"
+    openscad.write_text(FAKE_OPENSCAD.format(python=sys.executable))
+    openscad.chmod(0o755)
+    result = Worker("http://farm", name="w1", openscad_path=openscad)
+    result.server = FakeServer(result)
+    result._call = result.server
+    return result
+
+def payload(tmp_path, legend=""):
+    """
+    Returns what the server would hand out for a keycap with *legend*.
+    """
+    keycap = Keycap(name="tilde", output_path=tmp_path, legends=[legend])
+    return FarmJob("0", keycap, 1.0).payload()
+
+def test_worker_uploads_while_heartbeating(tmp_path):
+    w = worker(tmp_path)
+    w.render(payload(tmp_path), tmp_path)
+    assert w.server.calls == ["/result/0", "/heartbeat"]
+    assert w.server.heartbeats == [["0"]] # Still ours while uploading
+    assert w.server.result["retcode"] == 0
+    assert w.server.body == b"solid fake"
+    assert not w.uploading and not w.processes
+
+def test_worker_reports_crashes(tmp_path):
+    w = worker(tmp_path)
+    w.render(payload(tmp_path, "crash"), tmp_path)
+    assert w.server.calls[0] == "/result/0"
+    assert w.server.result["retcode"] == -9 # Killed, but not by us
+    assert w.server.body == b""
+
+def test_worker_cancels(tmp_path):
+    w = worker(tmp_path)
+    w.server.cancel = ["0"]
+    thread = threading.Thread(
+        target=w.render, args=(payload(tmp_path, "slow"), tmp_path))
+    thread.start()
+    deadline = time.monotonic() + 10
+    while not w.processes and time.monotonic() < deadline:
+        time.sleep(0.01)
+    w.beat() # Server says someone else already finished it
+    thread.join(10)
+    assert not thread.is_alive()
+    assert w.server.calls == ["/heartbeat"] # No result uploaded
+    assert not w.cancelled
@@ -0,0 +1,96 @@
+"""
+Tests for the render service (`renderservice.py`): what clients are allowed
+to ask for and how identical requests end up as the same job (with a fake
+`openscad`).
+"""
+
+# stdlib imports
+import sys
+# 3rd party stuff
+import pytest
+# Our own stuff
+from artifactcache import DirectoryCache
+from renderservice import (
+    RenderService, ServiceException, check_param, RESERVED)
+
+FAKE_OPENSCAD = """#!{python}
+import sys
+args = sys.argv[1:]
+with open(args[args.index("-o") + 1], "w") as f:
+    f.write(args[args.index("-D") + 1])
+"""
+
+@pytest.mark.parametrize("field, value, current", [
+    ("key_height", 9, 8.5), ("key_height", 9.5, 8), ("fn", None, None),
+    ("fn", 64, None), ("legends", ["A", "B"], ["X"]), ("fonts", ["A"], []),
+    ("fonts", [], ["Gotham"]), ("polygon_rotation", True, False),
+    ("legend_scale", [[1, 1, 1]], [[1, 1, 1]]),
+])
+def test_check_param_ok(field, value, current):
+    check_param(field, value, current)
+
+@pytest.mark.parametrize("field, value, current, message", [
+    ("key_height", "9", 8.5, "key_height must be a number"),
+    ("key_height", True, 8.5, "key_height must be a number"),
+    ("polygon_rotation", 1, False, "polygon_rotation must be true/false"),
+    ("fn", "64", None, "fn must be a number or null"),
+    ("legends", "A", ["X"], "legends must be a list of strings"),
+    ("legends", ["A", 1], ["X"], "legends must be a list of strings"),
+    ("fonts", [["A"]], [], "fonts must be a list of strings/numbers"),
+])
+def test_check_param_rejects(field, value, current, message):
+    with pytest.raises(ServiceException, match=message):
+        check_param(field, value, current)
+
+@pytest.fixture
+def service(tmp_path):
+    openscad = tmp_path / "openscad"
+    openscad.write_text(FAKE_OPENSCAD.format(python=sys.executable))
+    openscad.chmod(0o755)
+    services = []
+    def start(cache=None):
+        result = RenderService(tmp_path / f"out{len(services)}",
+            cache or DirectoryCache(tmp_path / "cache"), max_runners=2,
+            validate=False, keysets=(), openscad_path=openscad)
+        result.start()
+        services.append(result)
+        return result
+    yield start
+    for result in services:
+        result.stop()
+
+def test_bad_requests(service):
+    svc = service()
+    for field in RESERVED + ("_private", "definitions", "nope"):
+        with pytest.raises(ServiceException, match="Can't set"):
+            svc.keycap({"params": {field: "x"}})
+    with pytest.raises(ServiceException, match="file_type must be one of"):
+        svc.keycap({"params": {"file_type": "obj"}})
+    with pytest.raises(ServiceException, match="Unknown keyset"):
+        svc.keycap({"base": "os:path"})
+    with pytest.raises(ServiceException, match="Expected a JSON object"):
+        svc.keycap([])
+    keycap = svc.keycap({"params": {"legends": ["Q"], "file_type": "stl"}})
+    assert keycap.legends == ["Q"] and keycap.file_type == "stl"
+    assert keycap.openscad_path == svc.paths["openscad_path"]
+
+def test_identical_requests_share_a_job(service):
+    svc = service()
+    request = {"params": {"legends": ["Q"]}, "name": "q"}
+    job = svc.submit(request)
+    assert svc.submit(dict(request, name="other")) is job
+    assert job.event.wait(30)
+    assert job.status == "done" and not job.cached
+    assert job.keycap.output_file.exists()
+    assert svc.submit(request) is job
+    assert job.requests == 3
+    other = svc.submit({"params": {"legends": ["W"]}})
+    assert other is not job
+    assert other.event.wait(30)
+    assert svc.status()["jobs"] == {"done": 2}
+    # A second service with the same cache doesn't render it again:
+    again = service(svc.cache).submit(request)
+    assert again.id == job.id
+    assert again.status == "done" and again.cached
+    assert again.keycap.output_file.read_text() == (
+        job.keycap.output_file.read_text())
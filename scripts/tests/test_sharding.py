@@ -0,0 +1,70 @@
+"""
+Tests for `sharding.py`: every machine has to come up with the same shards.
+"""
+
+# stdlib imports
+import random
+from pathlib import Path
+# Our own stuff
+from keycap import Keycap
+from jobspec import JobSpec
+from sharding import assign_shards, select_shard, keyset_digest
+
+def keyset():
+    """
+    A little keyset with a bunch of jobs that cost exactly the same.
+    """
+    keycaps = [Keycap(name=f"key{i}", legends=[chr(65 + i)])
+               for i in range(12)]
+    keycaps += [Keycap(name=f"wide{i}", key_length=18.25 * 2)
+                for i in range(3)]
+    return keycaps
+
+def on_machine(keycaps, home):
+    """
+    Returns copies of *keycaps* with paths like they'd have on someone else's
+    machine.
+    """
+    return [JobSpec.from_keycap(keycap, output_path=f"{home}/out").with_params(
+        openscad_path=Path(f"{home}/bin/openscad"),
+        keycap_playground_path=Path(f"{home}/src/keycap_playground.scad"),
+        ).keycap() for keycap in keycaps]
+
+def names(shards):
+    return [[keycap.name for keycap in shard] for shard in shards]
+
+def test_every_job_once():
+    keycaps = keyset()
+    shards, loads = assign_shards(keycaps, 4)
+    assigned = sorted(name for shard in names(shards) for name in shard)
+    assert assigned == sorted(keycap.name for keycap in keycaps)
+    assert len(loads) == 4
+    # Greedy: no shard is more than one job heavier than the lightest
+    assert max(loads) - min(loads) <= max(loads) / len(shards[0])
+
+def test_order_independent():
+    keycaps = keyset()
+    shuffled = list(keycaps)
+    random.Random(1).shuffle(shuffled)
+    assert names(assign_shards(keycaps, 3)[0]) == names(
+        assign_shards(shuffled, 3)[0])
+
+def test_machine_independent():
+    alice = on_machine(keyset(), "/home/alice")
+    bob = on_machine(keyset(), "/Users/bob")
+    assert names(assign_shards(alice, 3)[0]) == names(
+        assign_shards(bob, 3)[0])
+    assert keyset_digest(alice) == keyset_digest(bob)
+
+def test_select_shard_keeps_order():
+    keycaps = keyset()
+    selected = [select_shard(keycaps, i, 3) for i in (1, 2, 3)]
+    for shard in selected:
+        assert shard == [k for k in keycaps if k in shard]
+    assert sum(len(shard) for shard in selected) == len(keycaps)
+
+def test_digest_changes_with_parameters():
+    keycaps = keyset()
+    changed = keyset()
+    changed[0].key_height += 1
+    assert keyset_digest(keycaps) != keyset_digest(changed)
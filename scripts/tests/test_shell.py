@@ -0,0 +1,71 @@
+"""
+Tests for the analytic shell model (`shell.py`).
+"""
+
+# 3rd party stuff
+import pytest
+np = pytest.importorskip("numpy")
+# Our own stuff
+from keycap import Keycap, KEY_UNIT
+from shell import Shell, ShellException, profile_parameters
+
+def test_profile_parameters():
+    custom = Keycap(key_profile="", key_height=8, dish_depth=1)
+    assert profile_parameters(custom)["height"] == 8
+    riskeycap = Keycap(key_profile="riskeycap", key_height=20)
+    params = profile_parameters(riskeycap)
+    assert (params["height"], params["dish_type"]) == (8.2, "sphere")
+    riskeycap.key_length = KEY_UNIT*2
+    assert profile_parameters(riskeycap)["height"] == pytest.approx(8.55)
+    dcs = Keycap(key_profile="dcs")
+    assert [profile_parameters(dcs, row)["height"] for row in (1, 3, 9)] == [
+        9.5, 7.39, 12.5] # Rows past the end get clamped
+    with pytest.raises(ShellException):
+        profile_parameters(Keycap(key_profile="nope"))
+
+def test_sphere_dish():
+    shell = Shell.from_keycap(Keycap(key_profile="riskeycap"))
+    # The bottom of the dish is right in the middle, dish_depth down:
+    assert float(shell.height_at(0, 0)) == pytest.approx(8.2 - 1.5)
+    assert float(shell.dish_bottom_at(0, 0)) == pytest.approx(8.2 - 1.5)
+    z = shell.height_at([3, -3, 0, 0], [0, 0, 3, -3])
+    assert z == pytest.approx([z[0]] * 4) # Round
+    assert z[0] > shell.height_at(0, 0)
+    assert shell.normal_at(0, 0) == pytest.approx([0, 0, 1])
+    assert shell.normal_at(3, 0)[0] < 0 # Facing back towards the middle
+
+def test_cylinder_dish():
+    shell = Shell.from_keycap(Keycap(key_profile="", key_height=8,
+        dish_type="cylinder", dish_depth=1, dish_tilt=0, dish_z=0))
+    assert float(shell.height_at(0, 0)) == pytest.approx(7)
+    # Curved along X, straight along Y:
+    assert float(shell.height_at(3, 0)) > 7
+    assert shell.height_at(0, [-3, 3]) == pytest.approx([7, 7])
+
+def test_tilted_dish():
+    shell = Shell.from_keycap(Keycap(key_profile="dcs")) # dish_tilt=-1
+    normal = shell.normal_at(0, 0)
+    assert normal == pytest.approx(
+        [0, np.sin(np.radians(1)), np.cos(np.radians(1))], abs=1e-4)
+
+def test_inverted_dish():
+    shell = Shell.from_keycap(Keycap(key_profile="riskeycap", dish_invert=True))
+    assert shell.height == 6.5
+    assert float(shell.height_at(0, 0)) > shell.height # Domed
+    assert float(shell.dish_bottom_at(0, 0)) == np.inf # Nothing cut out
+
+def test_footprint():
+    shell = Shell.from_keycap(Keycap(key_profile="riskeycap"))
+    half = shell.length/2
+    assert list(shell.contains([0, half - 0.1, half + 0.5], 0)) == [
+        True, True, False]
+    assert np.isnan(shell.height_at(half + 0.5, 0))
+    x, y, z = shell.grid(1.0)
+    assert x.shape == y.shape == z.shape == (19, 19)
+    assert np.nanmax(z) < shell.height # The dish takes a bit off everywhere
+
+def test_unsupported():
+    with pytest.raises(ShellException):
+        Shell(polygon_edges=6)
+    with pytest.raises(ShellException):
+        Shell(dish_type="bowl")
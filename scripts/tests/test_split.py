@@ -0,0 +1,113 @@
+"""
+Tests for splitting keycaps into one job per render target and merging the
+parts (`engine.split_jobs()`, `RenderEngine.render_split()` and
+`mesh.merge_files()`) with a fake `openscad` that renders each target as a
+cube.
+"""
+
+# stdlib imports
+import sys
+import asyncio
+# 3rd party stuff
+import pytest
+np = pytest.importorskip("numpy")
+# Our own stuff
+from keycap import Keycap
+from journal import BuildJournal
+from mesh import load_mesh, save_mesh, combine, merge_files
+from engine import RenderEngine, split_jobs, PARTS_DIR, PART_FILE_TYPE
+
+# A unit cube per target (stems two units up, legends four); "FAIL" legends
+# make the legends fail:
+FAKE_OPENSCAD = """#!{python}
+import re, sys
+args = sys.argv[1:]
+definitions = args[args.index("-D") + 1]
+target = re.search(r'RENDER=\\["(\\w+)"\\]', definitions).group(1)
+if target == "legends" and "FAIL" in definitions:
+    print("ERROR: Parser error in line 1", file=sys.stderr)
+    sys.exit(1)
+z = {{"keycap": 0, "stem": 2, "legends": 4}}[target]
+corners = [(x, y, z + h) for x in (0, 1) for y in (0, 1) for h in (0, 1)]
+sides = [(0, 1, 3, 2), (4, 6, 7, 5), (0, 4, 5, 1), (2, 3, 7, 6),
+    (0, 2, 6, 4), (1, 5, 7, 3)]
+with open(args[args.index("-o") + 1], "w") as f:
+    f.write("solid cube\\n")
+    for a, b, c, d in sides:
+        for triangle in ((a, b, c), (a, c, d)):
+            f.write("facet normal 0 0 0\\nouter loop\\n")
+            for i in triangle:
+                f.write("vertex %d %d %d\\n" % corners[i])
+            f.write("endloop\\nendfacet\\n")
+    f.write("endsolid cube\\n")
+"""
+
+def keycap(tmp_path, **kwargs):
+    openscad = tmp_path / "openscad"
+    openscad.write_text(FAKE_OPENSCAD.format(python=sys.executable))
+    openscad.chmod(0o755)
+    return Keycap(name="tilde", output_path=tmp_path, openscad_path=openscad,
+        **kwargs)
+
+def test_split_jobs(tmp_path):
+    tilde = keycap(tmp_path, legends=["~"],
+        render=["keycap", "stem", "legends", "%underset_mask"])
+    parts = split_jobs(tilde)
+    assert [list(part.render) for part in parts] == [
+        ["keycap"], ["stem"], ["legends"]]
+    for part in parts:
+        assert part.output_file.parent == tmp_path / PARTS_DIR
+        assert part.file_type == PART_FILE_TYPE
+        assert list(part.legends) == ["~"]
+    assert len({part.output_file for part in parts}) == 3
+    assert list(tilde.render) == [
+        "keycap", "stem", "legends", "%underset_mask"] # Left alone
+    # Nothing to split:
+    assert split_jobs(keycap(tmp_path, render=["keycap"])) == []
+    assert split_jobs(keycap(tmp_path, render=["keycap", "legends"])) == []
+    colorscad = tmp_path / "colorscad.sh"
+    colorscad.write_text("")
+    assert split_jobs(keycap(tmp_path, colorscad_path=colorscad)) == []
+
+def test_render_split(tmp_path):
+    journal = BuildJournal(tmp_path)
+    tilde = keycap(tmp_path, legends=["~"],
+        render=["keycap", "stem", "legends"])
+    engine = RenderEngine(journal=journal, quiet=True, validate=False,
+        split=True)
+    result, = asyncio.run(engine.run([tilde]))
+    assert result.ok
+    merged = load_mesh(tilde.output_file)
+    assert len(merged) == 3*12
+    assert len(merged.components()) == 3
+    assert merged.bounds()[1].tolist() == [1, 1, 5]
+    assert journal.is_done(tilde)
+    assert not list((tmp_path / PARTS_DIR).iterdir()) # Parts cleaned up
+    assert not list(tmp_path.glob(".*.partial.*"))
+
+def test_render_split_failure(tmp_path):
+    journal = BuildJournal(tmp_path)
+    tilde = keycap(tmp_path, legends=["FAIL"],
+        render=["keycap", "stem", "legends"])
+    engine = RenderEngine(journal=journal, quiet=True, validate=False,
+        split=True)
+    result, = asyncio.run(engine.run([tilde]))
+    assert not result.ok
+    assert ("error", "ERROR: Parser error in line 1") in result.problems
+    assert any(line.startswith("[legends] ") for line in result.lines)
+    assert not tilde.output_file.exists()
+    assert not journal.is_done(tilde)
+    assert not list((tmp_path / PARTS_DIR).iterdir())
+
+def test_merge_files(cube, tmp_path):
+    paths = []
+    for i in range(2):
+        paths.append(tmp_path / f"part{i}.stl")
+        save_mesh(cube(offset=(0, 0, i * 0.5)), paths[-1])
+    output = tmp_path / "merged.3mf"
+    assert merge_files(paths, output) == 24
+    merged = load_mesh(output)
+    # Overlapping shells stay separate (and get counted twice):
+    assert len(merged.components()) == 2
+    assert merged.volume() == pytest.approx(2.0)
+    assert combine([cube(), cube()]).volume() == pytest.approx(2.0)
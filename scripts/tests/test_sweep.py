@@ -0,0 +1,99 @@
+"""
+Tests for parameter sweeps (`sweep.py`).
+"""
+
+# stdlib imports
+import zipfile
+# 3rd party stuff
+import pytest
+# Our own stuff
+from keycap import Keycap
+from sweep import (
+    ParamRange, cartesian, latin_hypercube, variant_name, sweep, load_base,
+    pack_plate)
+
+def test_parse_ranges():
+    assert ParamRange.parse("wall_thickness=1:2:0.25").values == [
+        1, 1.25, 1.5, 1.75, 2]
+    assert ParamRange.parse("dish_invert=true,false").values == [True, False]
+    assert ParamRange.parse("stem_sides_wall_thickness=[[0,0],[1,1]]").values == [
+        [0, 0], [1, 1]]
+    continuous = ParamRange.parse("dish_depth=0.8:1.6")
+    assert continuous.continuous
+    assert (continuous.low, continuous.high) == (0.8, 1.6)
+    with pytest.raises(ValueError):
+        ParamRange.parse("dish_depth")
+    with pytest.raises(ValueError):
+        ParamRange.parse("dish_depth=2:1:0.1")
+
+def test_cartesian():
+    combos = cartesian([
+        ParamRange("a", values=[1, 2]), ParamRange("b", values=["x", "y"])])
+    assert combos == [
+        {"a": 1, "b": "x"}, {"a": 1, "b": "y"},
+        {"a": 2, "b": "x"}, {"a": 2, "b": "y"}]
+    with pytest.raises(ValueError): # Needs a step
+        cartesian([ParamRange("a", low=0, high=1)])
+
+def test_latin_hypercube_uses_every_stratum_once():
+    samples = 8
+    combos = latin_hypercube([
+        ParamRange("a", low=0, high=1), ParamRange("b", low=10, high=20)],
+        samples, seed=1)
+    assert len(combos) == samples
+    assert sorted(int(c["a"] * samples) for c in combos) == list(range(8))
+    assert sorted(int((c["b"] - 10) / 10 * samples) for c in combos) == list(
+        range(8))
+    assert combos == latin_hypercube([
+        ParamRange("a", low=0, high=1), ParamRange("b", low=10, high=20)],
+        samples, seed=1) # Repeatable
+
+def test_variant_name():
+    assert variant_name("1U blank", {
+        "stem_inside_tolerance": 0.15, "key_rotation": [0, 110.1, 0]}) == (
+        "1Ublank_stem_inside_tolerance=0.15_key_rotation=0-110.1-0")
+
+def test_sweep(tmp_path):
+    base = Keycap(name="tol", output_path=tmp_path)
+    tolerance = base.stem_inside_tolerance
+    variants = sweep(base, {"stem_inside_tolerance": [0.1, 0.3]},
+        output_path=tmp_path / "sweep")
+    assert [params for params, _ in variants] == [
+        {"stem_inside_tolerance": 0.1}, {"stem_inside_tolerance": 0.3}]
+    keycaps = [keycap for _, keycap in variants]
+    assert [k.stem_inside_tolerance for k in keycaps] == [0.1, 0.3]
+    assert [list(k.render) for k in keycaps] == [["stem"], ["stem"]]
+    assert keycaps[0].output_file.parent == tmp_path / "sweep"
+    assert base.stem_inside_tolerance == tolerance # Left alone
+    full = sweep(base, {"stem_inside_tolerance": [0.1]}, full=True)
+    assert list(full[0][1].render) == list(base.render)
+    mixed = sweep(base, {"wall_thickness": [1.5], "stem_inside_tolerance": [0.1]})
+    assert list(mixed[0][1].render) == list(base.render)
+    with pytest.raises(AttributeError):
+        sweep(base, {"no_such_thing": [1]})
+    lhs = sweep(base, [ParamRange("dish_depth", low=0.5, high=1.5)],
+        method="lhs", samples=3)
+    assert len(lhs) == 3
+
+def test_load_base():
+    assert load_base(None).name == "sweep"
+    with pytest.raises(ValueError):
+        load_base("riskeycap_full:nope")
+
+def test_pack_plate(cube, tmp_path):
+    from mesh import save_mesh, load_3mf
+    outputs = []
+    for i, size in enumerate((10, 20, 10)):
+        path = tmp_path / f"{i}.stl"
+        save_mesh(cube(size=size, offset=(-50, -50, 7)), path)
+        outputs.append((f"variant{i}", path))
+    plate = tmp_path / "plate.3mf"
+    assert pack_plate(outputs, plate, width=40, spacing=5) == 3
+    model = zipfile.ZipFile(plate).read("3D/3dmodel.model").decode()
+    for label, _ in outputs:
+        assert f'name="{label}"' in model
+    # The biggest goes first, one of the small ones fits next to it and the
+    # other one wraps onto the next row (everything sitting on the bed):
+    low, high = load_3mf(plate).bounds()
+    assert list(low) == pytest.approx([0, 0, 0])
+    assert list(high) == pytest.approx([35, 35, 20])
@@ -0,0 +1,88 @@
+"""
+Tests for working out tessellation from a chord error (`tessellation.py`).
+"""
+
+# stdlib imports
+import math
+# 3rd party stuff
+import pytest
+# Our own stuff
+from keycap import Keycap
+from shell import profile_parameters
+from tessellation import (
+    segments, dish_radius, layer_error, polygon_layers, tessellation,
+    apply_tessellation, MAX_DISH_FN, MIN_FN)
+
+def chord_error(radius, count):
+    return radius * (1 - math.cos(math.pi / count))
+
+@pytest.mark.parametrize("radius, max_error", [
+    (1, 0.02), (10, 0.02), (10, 0.005), (77.3, 0.01), (500, 0.1)])
+def test_segments(radius, max_error):
+    count = segments(radius, max_error)
+    assert count % 4 == 0
+    assert chord_error(radius, count) <= max_error
+    # ...and it's the fewest (symmetric) count that gets there:
+    assert count == MIN_FN or chord_error(radius, count - 4) > max_error
+
+def test_segments_limits():
+    assert segments(0.01, 0.02) == MIN_FN # Smaller than the error itself
+    assert segments(1e6, 0.001, maximum=MAX_DISH_FN) == MAX_DISH_FN
+    assert segments(10, 0.02, multiple=1) == 50
+
+def test_dish_radius():
+    params = profile_parameters(Keycap(key_profile="", dish_type="cylinder"))
+    radius = dish_radius(params)
+    # A circle of that radius dips dish_depth over the top's width:
+    half = (params["width"] - params["top_difference"]) / 2
+    assert radius - math.sqrt(radius**2 - half**2) == pytest.approx(
+        params["dish_depth"])
+    assert dish_radius(dict(params, dish_type="sphere")) == 2 * radius
+    assert dish_radius(dict(params, dish_invert=True)) is None
+    assert dish_radius(dict(params, dish_depth=0)) is None
+    assert dish_radius(dict(params, dish_type="inv_pyramid")) is None
+
+def test_polygon_layers():
+    params = profile_parameters(Keycap(key_profile="dsa"))
+    assert layer_error(params, 10) == pytest.approx(layer_error(params, 5) / 4)
+    for max_error in (0.05, 0.02, 0.005):
+        layers = polygon_layers(params, max_error)
+        assert layer_error(params, layers) <= max_error
+        assert layer_error(params, layers - 1) > max_error
+    flat = dict(params, polygon_curve=0)
+    assert polygon_layers(flat, 0.001) == 2 # Straight sides
+
+def test_tessellation():
+    one = tessellation(Keycap(key_profile="dsa"))
+    assert set(one) == {"dish_fn", "dish_corner_fn", "polygon_layers"}
+    # Longer keys have flatter (bigger) dishes and need more segments:
+    two = tessellation(Keycap(key_profile="dsa", key_length=18.25*2-0.2))
+    assert two["dish_fn"] > one["dish_fn"]
+    spacebar = tessellation(Keycap(key_profile="dsa", key_length=18.25*7))
+    assert spacebar["dish_fn"] == MAX_DISH_FN
+    # Tighter tolerances need more of everything:
+    fine = tessellation(Keycap(key_profile="dsa"), max_error=0.005)
+    assert all(fine[field] >= one[field] for field in one)
+    legends = tessellation(Keycap(legends=["A"], font_sizes=[5.5]))
+    assert legends["fn"] == segments(5.5 * 0.25, 0.02, minimum=16)
+
+def test_shape_is_left_alone():
+    assert tessellation(Keycap(key_profile="xda")) == {} # Unknown to shell.py
+    assert "dish_corner_fn" not in tessellation(Keycap(key_profile="gem"))
+    assert "dish_corner_fn" not in tessellation(
+        Keycap(key_profile="", dish_corner_fn=4)) # Chamfered on purpose
+    assert "polygon_layers" not in tessellation(
+        Keycap(key_profile="", dish_tilt=5))
+
+def test_apply_tessellation():
+    keycaps = [Keycap(name="a", key_profile="dsa"), Keycap(name="b",
+        key_profile="xda")]
+    expected = tessellation(keycaps[0])
+    changed = apply_tessellation(keycaps)
+    assert [keycap.name for keycap, _, _ in changed] == ["a"]
+    _, before, after = changed[0]
+    assert before["dish_fn"] == 256 and after == {
+        field: value for field, value in expected.items()
+        if before[field] != value}
+    assert keycaps[0].dish_fn == expected["dish_fn"]
+    assert apply_tessellation(keycaps) == [] # Already there
@@ -0,0 +1,98 @@
+"""
+Tests for `validate.check_mesh()` and the `validate.expectations()` it checks
+against.
+"""
+
+# 3rd party stuff
+import pytest
+np = pytest.importorskip("numpy")
+# Our own stuff
+from keycap import Keycap, KEY_UNIT
+from mesh import Mesh, save_mesh, save_3mf
+from validate import check_mesh, expectations
+
+def hollow_box(cube):
+    """
+    Returns a 10mm box with 1mm walls (a solid block isn't very keycap-like).
+    """
+    outside, inside = cube(size=10), cube(size=8, offset=(1, 1, 1))
+    return Mesh(np.vstack([outside.vertices, inside.vertices]),
+        np.vstack([outside.faces, inside.faces[:, ::-1] + 8]))
+
+def test_hollow_box_passes(cube, tmp_path):
+    path = tmp_path / "box.stl"
+    save_mesh(hollow_box(cube), path)
+    report = check_mesh(path)
+    assert report.ok, report.problems
+    assert report.stats["watertight"]
+    assert report.stats["components"] == 2
+    assert report.stats["volume"] == pytest.approx(1000 - 512)
+
+def test_solid_block_is_implausible(cube, tmp_path):
+    path = tmp_path / "cube.stl"
+    save_mesh(cube(size=10), path)
+    report = check_mesh(path)
+    assert report.stats["watertight"]
+    assert report.problems == [
+        "Implausible volume: 1000.0mm³ is 100.0% of its bounding box"]
+
+def test_leaky_mesh(cube, tmp_path):
+    mesh = cube(size=10)
+    path = tmp_path / "leaky.stl"
+    save_mesh(Mesh(mesh.vertices, mesh.faces[2:]), path) # No bottom
+    report = check_mesh(path)
+    assert not report.ok
+    assert not report.stats["watertight"]
+    assert "4 open edge(s)" in report.problems[0]
+
+def test_inside_out_mesh(cube, tmp_path):
+    mesh = cube(size=10)
+    path = tmp_path / "inside_out.stl"
+    save_mesh(Mesh(mesh.vertices, mesh.faces[:, ::-1]), path)
+    report = check_mesh(path)
+    assert any("inside-out" in problem for problem in report.problems)
+
+def test_multiple_shells(cube, tmp_path):
+    path = tmp_path / "two.3mf"
+    save_3mf([("a", cube(size=10)), ("b", cube(offset=(20, 0, 0)))], path)
+    report = check_mesh(path)
+    assert report.ok, report.problems # Fine without expectations...
+    assert report.stats["components"] == 2
+    expected = {
+        "render": ["keycap"], "length": 21, "width": 10, "height": None,
+        "height_tolerance": 1, "components": 1, "rotation": None}
+    report = check_mesh(path, expected)
+    assert not report.ok # ...but not if it should be one piece
+    assert report.problems[0].startswith("2 separate piece(s) (expected 1)")
+    assert "stray piece of 12 triangles at x=20.0..21.0" in report.problems[0]
+
+def test_unreadable_file(tmp_path):
+    path = tmp_path / "empty.stl"
+    path.write_bytes(b"")
+    report = check_mesh(path)
+    assert not report.ok
+    assert report.problems[0].startswith("Could not load mesh")
+
+def test_expectations_follow_the_profile():
+    custom = expectations(Keycap(key_profile="", key_height=9, dish_depth=1))
+    assert (custom["height"], custom["height_tolerance"]) == (9, 1.5)
+    riskeycap = Keycap(key_profile="riskeycap", key_height=20)
+    assert expectations(riskeycap)["height"] == 8.2 # key_height is ignored
+    riskeycap.key_length = KEY_UNIT*1.25
+    assert expectations(riskeycap)["height"] == pytest.approx(8.55)
+    riskeycap.dish_invert = True
+    assert expectations(riskeycap)["height"] == pytest.approx(6.85)
+    dcs = expectations(Keycap(key_profile="dcs")) # Row 1 (like KEY_ROW)
+    assert (dcs["height"], dcs["height_tolerance"]) == (9.5, 1.5)
+    assert expectations(Keycap(key_profile="xda"))["height"] is None
+
+def test_wrong_height(cube, tmp_path):
+    path = tmp_path / "box.stl"
+    save_mesh(hollow_box(cube), path)
+    keycap = Keycap(key_profile="", key_length=10, key_width=10,
+        key_height=5, dish_depth=1, render=["keycap"])
+    expected = dict(expectations(keycap), components=None)
+    assert check_mesh(path, expected).problems == [
+        "Wrong height: top is at 10.00mm (expected ~5.00mm)"]
+    keycap.key_height = 9.5 # Within DIMENSION_TOLERANCE + dish_depth
+    assert check_mesh(path, dict(expectations(keycap), components=None)).ok
@@ -0,0 +1,95 @@
+"""
+Tests for watch mode (`watch.py`): what gets watched and what gets
+re-rendered when something changes (with a fake `openscad` whose CSG tree
+only depends on `KEY_HEIGHT`).
+"""
+
+# stdlib imports
+import sys
+import asyncio
+from pathlib import Path
+# Our own stuff
+from keycap import Keycap
+from watch import Watcher, scad_dependencies, draft_job, DRAFTS_DIR
+
+FAKE_OPENSCAD = """#!{python}
+import re, sys
+args = sys.argv[1:]
+height = re.search(r"KEY_HEIGHT=([0-9.]+)", args[args.index("-D") + 1])
+with open(args[args.index("-o") + 1], "w") as f:
+    f.write(f"cube(size = {{height.group(1)}});\\n")
+"""
+
+KEYSET = """
+from pathlib import Path
+from keycap import Keycap
+common = dict(openscad_path=Path({openscad!r}),
+    keycap_playground_path=Path({playground!r}))
+KEYCAPS = [
+    Keycap(name="a", key_height={a}, legends=["A"], **common),
+    Keycap(name="b", key_height=9, legends=[{b!r}], **common),
+]
+"""
+
+def test_scad_dependencies(tmp_path, monkeypatch):
+    library = tmp_path / "library"
+    (tmp_path / "lib").mkdir()
+    library.mkdir()
+    (tmp_path / "a.scad").write_text(
+        "use <b.scad>\n  include <lib/c.scad>\nuse <d.scad>\nuse <gone.scad>\n")
+    (tmp_path / "b.scad").write_text("use <a.scad> // Circular\n")
+    (tmp_path / "lib" / "c.scad").write_text("// c\n")
+    (library / "d.scad").write_text("// d\n")
+    (tmp_path / "unused.scad").write_text("// Nobody uses this\n")
+    monkeypatch.setenv("OPENSCADPATH", str(library))
+    found = scad_dependencies(tmp_path / "a.scad")
+    assert found == {
+        (tmp_path / name).resolve()
+        for name in ("a.scad", "b.scad", "lib/c.scad", "library/d.scad")}
+    assert scad_dependencies(tmp_path / "gone.scad") == set()
+
+def test_draft_job(tmp_path):
+    keycap = Keycap(name="tilde", output_path=tmp_path, dish_fn=256,
+        dish_corner_fn=8, polygon_layers=10)
+    draft = draft_job(keycap, tmp_path)
+    assert draft.output_file.parent == tmp_path / DRAFTS_DIR
+    assert (draft.dish_fn, draft.dish_corner_fn, draft.polygon_layers) == (
+        32, 8, 4) # Lowered (never raised)
+    assert (keycap.dish_fn, keycap.polygon_layers) == (256, 10)
+    assert draft.output_file.name == keycap.output_file.name
+
+def test_only_changed_keycaps_get_rendered(tmp_path, monkeypatch, capsys):
+    openscad = tmp_path / "openscad"
+    openscad.write_text(FAKE_OPENSCAD.format(python=sys.executable))
+    openscad.chmod(0o755)
+    playground = tmp_path / "keycap_playground.scad"
+    playground.write_text("// Playground\n")
+    keyset = tmp_path / "keyset_watch_test.py"
+    def write_keyset(a, b):
+        keyset.write_text(KEYSET.format(openscad=str(openscad),
+            playground=str(playground), a=a, b=b))
+    write_keyset(8, "B")
+    monkeypatch.syspath_prepend(str(tmp_path))
+    monkeypatch.setattr(sys, "dont_write_bytecode", True) # Reload from source
+    monkeypatch.delitem(sys.modules, "keyset_watch_test", raising=False)
+    watcher = Watcher("keyset_watch_test", tmp_path / "out", validate=False)
+    scheduled = []
+    monkeypatch.setattr(watcher, "schedule",
+        lambda names, drafts=True: scheduled.append((names, drafts)))
+
+    async def watch():
+        await watcher.update(initial=True)
+        assert scheduled == [(["a", "b"], False)]
+        assert Path(playground).resolve() in watcher.watched_files()
+        # The legend doesn't change b's CSG tree (in this fake) but a's
+        # height does (and cancels the render of a that's in progress):
+        in_progress = asyncio.get_running_loop().create_future()
+        watcher.tasks["a"] = [in_progress]
+        write_keyset(10, "C")
+        await watcher.update()
+        assert scheduled[1] == (["a"], True)
+        assert in_progress.cancelled()
+        await watcher.update()
+        assert len(scheduled) == 2
+    asyncio.run(watch())
+    assert "Nothing that affects the output changed" in capsys.readouterr().out
@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+
+"""
+Sanity checks for rendered keycaps.  Every output file gets loaded (see
+`mesh.py`) and checked for the sorts of problems that you'd otherwise only
+find out about hours later in the slicer:
+
+ * Empty output or a mesh that isn't watertight (holes, non-manifold edges,
+   flipped triangles).
+ * Negative (inside-out) or implausible volume.
+ * A bounding box that doesn't match the keycap's `key_length`/`key_width`
+   and expected height (undoing `key_rotation` first).
+ * More than one connected component (e.g. a stem that isn't attached to the
+   body or stray legend slivers floating above the top).
+
+`engine.py` runs `check_mesh()` on every successful render (in a process pool
+so it happens in parallel) and fails the job if anything looks wrong.  You can
+also run it directly on any existing files::
+
+    $ ./scripts/validate.py /tmp/output_dir/*.3mf
+"""
+
+# stdlib imports
+import sys
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+# 3rd party stuff
+from colorama import Style
+# Our own stuff
+from shell import profile_parameters, ShellException
+from mesh import load_mesh, rotation_matrix, MeshException, np
+
+# How far off (mm) the length/width/height can be before we complain
+DIMENSION_TOLERANCE = 0.5
+# A keycap is mostly air; anything below this fraction of its bounding box
+# volume is paper thin (or an empty shell) and anything above is a solid block
+MIN_FILL = 0.01
+MAX_FILL = 0.9
+
+def profile_shape(keycap):
+    """
+    Returns the `(height, dish_depth)` *keycap* ends up with once its
+    `key_profile` (if any) has been applied (see `shell.profile_parameters()`)
+    or `None` if we can't know that ahead of time (profiles the shell model
+    doesn't know about).
+    """
+    try:
+        params = profile_parameters(keycap)
+    except ShellException:
+        return None
+    return params["height"], params["dish_depth"]
+
+def expectations(keycap):
+    """
+    Returns a (picklable) dict describing what *keycap*'s output should look
+    like.  This is what gets handed to `check_mesh()`.
+    """
+    render = [r for r in keycap.render_targets() if not r.startswith("%")]
+    if set(render) <= {"keycap", "stem"}:
+        if "keycap" in render:
+            components = 1
+        else:
+            components = len(keycap.stem_locations)
+    else:
+        components = None # Legends and underset masks are in lots of pieces
+    height, dish_depth = profile_shape(keycap) or (None, keycap.dish_depth)
+    return {
+        "name": keycap.name,
+        "render": render,
+        "length": keycap.key_length,
+        "width": keycap.key_width,
+        "height": height,
+        "height_tolerance": DIMENSION_TOLERANCE + abs(dish_depth),
+        "rotation": list(keycap.key_rotation),
+        "components": components,
+    }
+
+class ValidationReport(object):
+    """
+    The result of `check_mesh()`: a list of *problems* (strings; empty means
+    the mesh passed) and some *stats* about the mesh.
+    """
+    def __init__(self, path):
+        self.path = str(path)
+        self.problems = []
+        self.stats = {}
+
+    @property
+    def ok(self):
+        return not self.problems
+
+def _describe_piece(piece):
+    low, high = piece.bounds()
+    return (f"{len(piece)} triangles at x={low[0]:.1f}..{high[0]:.1f} "
+            f"y={low[1]:.1f}..{high[1]:.1f} z={low[2]:.1f}..{high[2]:.1f}")
+
+def check_mesh(path, expected=None):
+    """
+    Loads the mesh at *path* and checks it against *expected* (a dict from
+    `expectations()`; if `None` only the keycap-independent checks are done).
+    Returns a `ValidationReport`.
+    """
+    report = ValidationReport(path)
+    try:
+        mesh = load_mesh(path)
+    except (MeshException, OSError, ValueError) as e:
+        report.problems.append(f"Could not load mesh: {e}")
+        return report
+    report.stats["triangles"] = len(mesh)
+    if not len(mesh):
+        report.problems.append("Mesh is empty (nothing was rendered)")
+        return report
+    if expected and expected.get("rotation") and any(expected["rotation"]):
+        # Undo key_rotation so we can compare against length/width/height:
+        mesh.vertices = mesh.vertices @ rotation_matrix(expected["rotation"])
+    boundary, non_manifold, flipped = mesh.edge_stats()
+    watertight = not (boundary or non_manifold or flipped)
+    report.stats["watertight"] = watertight
+    if not watertight:
+        report.problems.append(
+            f"Not watertight: {boundary} open edge(s), {non_manifold} "
+            f"non-manifold edge(s), {flipped} inconsistently-oriented edge(s)")
+    low, high = mesh.bounds()
+    extents = high - low
+    report.stats["extents"] = [round(float(e), 3) for e in extents]
+    volume = float(mesh.volume())
+    report.stats["volume"] = round(volume, 3)
+    if watertight and volume <= 0:
+        report.problems.append(
+            f"Mesh is inside-out (volume is {volume:.1f}mm³)")
+    elif watertight:
+        fill = volume / max(float(np.prod(extents)), 1e-9)
+        if not MIN_FILL <= fill <= MAX_FILL:
+            report.problems.append(
+                f"Implausible volume: {volume:.1f}mm³ is {fill:.1%} of its "
+                f"bounding box")
+    pieces = mesh.components()
+    report.stats["components"] = len(pieces)
+    if expected is None:
+        return report
+    # Dimensions
+    length, width = expected["length"], expected["width"]
+    height = expected["height"]
+    if "keycap" in expected["render"]:
+        for axis, actual, want in (
+                ("length (X)", extents[0], length),
+                ("width (Y)", extents[1], width)):
+            if abs(actual - want) > DIMENSION_TOLERANCE:
+                report.problems.append(
+                    f"Wrong {axis}: {actual:.2f}mm (expected {want:.2f}mm)")
+        if height is not None:
+            if abs(high[2] - height) > expected["height_tolerance"]:
+                report.problems.append(
+                    f"Wrong height: top is at {high[2]:.2f}mm (expected "
+                    f"~{height:.2f}mm)")
+    else:
+        # Stems and legends need to fit within the keycap
+        if (np.any(np.abs(low[:2]) > [length/2 + DIMENSION_TOLERANCE,
+                                      width/2 + DIMENSION_TOLERANCE])
+                or np.any(np.abs(high[:2]) > [length/2 + DIMENSION_TOLERANCE,
+                                              width/2 + DIMENSION_TOLERANCE])):
+            report.problems.append(
+                f"Extends outside the keycap's {length:.2f}x{width:.2f}mm "
+                f"footprint")
+        if height is not None and high[2] > height + expected["height_tolerance"]:
+            report.problems.append(
+                f"Sticks out of the top of the keycap ({high[2]:.2f}mm > "
+                f"{height:.2f}mm)")
+    # Connected components (is everything attached?)
+    want = expected["components"]
+    if want is not None and len(pieces) != want:
+        problem = f"{len(pieces)} separate piece(s) (expected {want})"
+        strays = pieces[want:] if len(pieces) > want else []
+        for piece in strays[:3]:
+            problem += f"; stray piece of {_describe_piece(piece)}"
+        if len(strays) > 3:
+            problem += f"; ...and {len(strays) - 3} more"
+        report.problems.append(problem)
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Check rendered keycaps (.stl/.3mf) for problems.")
+    parser.add_argument('--jobs',
+        metavar='<n>', type=int, default=None,
+        help='How many files to check at once (default: number of CPUs).')
+    parser.add_argument('files',
+        nargs='+', metavar="file",
+        help='The .stl/.3mf files to check.')
+    args = parser.parse_args()
+    failed = 0
+    with ProcessPoolExecutor(max_workers=args.jobs) as executor:
+        for report in executor.map(check_mesh, args.files):
+            stats = ", ".join(f"{k}={v}" for k, v in report.stats.items())
+            if report.ok:
+                print(f"{report.path}: OK ({stats})")
+                continue
+            failed += 1
+            print(Style.BRIGHT + f"{report.path}: FAILED ({stats})"
+                  + Style.RESET_ALL)
+            for problem in report.problems:
+                print(f"    {problem}")
+    if failed:
+        print(Style.BRIGHT + f"{failed} file(s) failed validation"
+              + Style.RESET_ALL)
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
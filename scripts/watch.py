@@ -0,0 +1,318 @@
+#!/usr/bin/env python3
+
+"""
+Watch mode: keeps a build directory up to date while you tune `profiles.scad`
+(or any other `.scad` file) or a keyset script::
+
+    $ ./scripts/watch.py --out /tmp/output_dir riskeyboard_70
+    $ ./scripts/watch.py --out /tmp/output_dir riskeyboard_70 tilde Q W
+
+Watched files are the keyset script (plus the other scripts in this
+directory) and every `.scad` file `keycap_playground.scad` pulls in via
+`use <...>`/`include <...>` (recursively).  When any of them change the
+keyset gets reloaded and every keycap gets preflighted (see `preflight.py`;
+exporting the CSG tree only takes a moment).  Only keycaps whose CSG tree
+actually changed get re-rendered so tweaking the DSA profile doesn't
+re-render all the GEM keycaps.  Renders of keycaps that changed again while
+they were being rendered are cancelled.
+
+Changed keycaps get a quick draft render first (low `$fn`/layer counts, see
+`DRAFT_QUALITY`; in `drafts/` under the output directory) so you can look at
+them right away and then the real thing (final quality; written to the output
+directory and recorded in its build journal just like `build.py` does).
+"""
+
+# stdlib imports
+import os
+import re
+import sys
+import time
+import asyncio
+import argparse
+import importlib
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+# 3rd party stuff
+from colorama import Style
+# Our own stuff
+from build import select_jobs
+from engine import RenderEngine, MAX_RUNNERS
+from journal import BuildJournal
+from jobspec import JobSpec
+from preflight import run_preflight, print_preflight
+
+POLL_INTERVAL = 0.5 # Seconds between checking files for changes
+SETTLE_TIME = 0.5 # Wait until files have stopped changing for this long
+# What gets lowered for draft renders (never raised):
+DRAFT_QUALITY = {
+    "dish_fn": 32,
+    "dish_corner_fn": 16,
+    "polygon_layers": 4,
+}
+DRAFTS_DIR = "drafts"
+SCAD_DEPENDENCY = re.compile(r"^\s*(?:use|include)\s*<([^>]+)>", re.M)
+
+def scad_dependencies(path, seen=None):
+    """
+    Returns the set of `.scad` files *path* depends on (including itself) by
+    following its `use <...>`/`include <...>` statements.  Paths are
+    resolved relative to the including file (then `OPENSCADPATH`) the same
+    way OpenSCAD does it.
+    """
+    path = Path(path).resolve()
+    seen = set() if seen is None else seen
+    if path in seen or not path.exists():
+        return seen
+    seen.add(path)
+    search = [path.parent] + [
+        Path(p) for p in os.environ.get("OPENSCADPATH", "").split(os.pathsep)
+        if p]
+    for name in SCAD_DEPENDENCY.findall(path.read_text(errors="replace")):
+        for directory in search:
+            candidate = directory / name
+            if candidate.exists():
+                scad_dependencies(candidate, seen)
+                break
+    return seen
+
+def draft_job(keycap, out):
+    """
+    Returns a new keycap (*keycap* is left alone) that renders at draft
+    quality into the drafts directory under *out*.
+    """
+    spec = JobSpec.from_keycap(keycap, output_path=Path(out) / DRAFTS_DIR)
+    return spec.with_params(**{
+        attr: min(getattr(keycap, attr), value)
+        for attr, value in DRAFT_QUALITY.items()}).keycap()
+
+class Watcher(object):
+    """
+    Watches the keyset in *module_name* (optionally just the keycaps in
+    *names*) and keeps *out* up to date.
+    """
+    def __init__(self, module_name, out, names=None, legends=False,
+            max_runners=MAX_RUNNERS, drafts=True, quiet=True, validate=True):
+        self.module_name = module_name
+        self.out = Path(out)
+        self.names = names
+        self.legends = legends
+        self.max_runners = max_runners
+        self.drafts = drafts
+        self.journal = BuildJournal(self.out)
+        (self.out / DRAFTS_DIR).mkdir(parents=True, exist_ok=True)
+        self.engine = RenderEngine(max_runners=max_runners,
+            journal=self.journal, quiet=quiet, validate=validate)
+        self.draft_engine = RenderEngine(max_runners=max_runners,
+            quiet=quiet, validate=False)
+        self.semaphore = None # Shared by both engines (created in run())
+        self.module = None
+        self.jobs = {} # name -> keycap
+        self.fingerprints = {} # name -> what was last rendered (or queued)
+        self.tasks = {} # name -> [asyncio.Task, ...]
+        self.mtimes = {}
+        self.loaded_at = 0
+
+    def load(self):
+        """
+        (Re-)imports the keyset and returns its jobs by name.  Modules from
+        this directory that changed get reloaded first.
+        """
+        scripts = Path(__file__).resolve().parent
+        for module in list(sys.modules.values()):
+            path = getattr(module, "__file__", None)
+            if (path and Path(path).resolve().parent == scripts
+                    and module.__name__ not in ("__main__", __name__)
+                    and self.mtimes.get(Path(path).resolve(), 0)
+                        > self.loaded_at):
+                importlib.reload(module)
+        if self.module is None:
+            self.module = importlib.import_module(self.module_name)
+        else:
+            self.module = importlib.reload(self.module)
+        self.loaded_at = time.time()
+        jobs = select_jobs(self.module.KEYCAPS, str(self.out),
+            names=self.names, legends=self.legends)
+        return {keycap.name: keycap for keycap in jobs}
+
+    def watched_files(self):
+        files = set(Path(__file__).resolve().parent.glob("*.py"))
+        for keycap in self.jobs.values():
+            files |= scad_dependencies(keycap.keycap_playground_path)
+        return files
+
+    def changed_files(self):
+        """
+        Returns the watched files that changed since the last call.
+        """
+        changed = []
+        for path in self.watched_files():
+            try:
+                mtime = path.stat().st_mtime
+            except OSError:
+                continue
+            if self.mtimes.get(path) != mtime:
+                if path in self.mtimes:
+                    changed.append(path)
+                self.mtimes[path] = mtime
+        return changed
+
+    async def fingerprint(self, jobs):
+        """
+        Preflights *jobs* and returns `{name: fingerprint}` (the CSG tree
+        digest plus everything else that affects the output) for the ones
+        that passed.
+        """
+        results = await run_preflight(
+            list(jobs.values()), max_runners=self.max_runners)
+        print_preflight(results)
+        return {
+            result.keycap.name: (result.csg_digest, result.keycap.file_type,
+                                 tuple(result.keycap.render),
+                                 result.keycap.uses_colorscad())
+            for result in results if result.ok}
+
+    def cancel(self, name):
+        for task in self.tasks.pop(name, []):
+            if not task.done():
+                print(Style.BRIGHT + f"[{name}] changed again; cancelling "
+                      f"the render in progress" + Style.RESET_ALL, flush=True)
+                task.cancel()
+
+    async def _render(self, engine, keycap):
+        async with self.semaphore:
+            print(Style.BRIGHT + f"Rendering {keycap.output_file}..."
+                  + Style.RESET_ALL, flush=True)
+            result = await engine.render(keycap)
+        if result.ok:
+            print(Style.BRIGHT + f"{keycap.output_file} done "
+                  f"({result.duration:.1f}s)" + Style.RESET_ALL, flush=True)
+        else:
+            print(Style.BRIGHT + f"{keycap.output_file} failed"
+                  + Style.RESET_ALL, flush=True)
+        return result
+
+    def schedule(self, names, drafts=True):
+        """
+        Queues renders of *names*: all the drafts first, then the finals.
+        """
+        queued = []
+        if drafts and self.drafts:
+            for name in names:
+                draft = draft_job(self.jobs[name], self.out)
+                queued.append((name, self.draft_engine, draft))
+        for name in names:
+            queued.append((name, self.engine, self.jobs[name]))
+        for name, engine, keycap in queued:
+            task = asyncio.ensure_future(self._render(engine, keycap))
+            self.tasks.setdefault(name, []).append(task)
+
+    async def update(self, initial=False):
+        """
+        Reloads the keyset, works out which keycaps changed, and (re)queues
+        them.
+        """
+        try:
+            jobs = self.load()
+        except Exception as e: # Typo in the keyset script; keep watching
+            print(Style.BRIGHT + f"Could not load {self.module_name}: "
+                  f"{e.__class__.__name__}: {e}" + Style.RESET_ALL, flush=True)
+            return
+        self.jobs = jobs
+        fingerprints = await self.fingerprint(jobs)
+        for name in list(self.tasks):
+            if (name not in jobs
+                    or fingerprints.get(name) != self.fingerprints.get(name)):
+                self.cancel(name)
+        if initial:
+            changed = [
+                name for name in fingerprints
+                if not self.journal.is_done(jobs[name])]
+            self.fingerprints = dict(fingerprints)
+        else:
+            changed = [
+                name for name, fingerprint in fingerprints.items()
+                if self.fingerprints.get(name) != fingerprint]
+            self.fingerprints.update(fingerprints)
+        if changed:
+            print(Style.BRIGHT + f"{len(changed)} keycap(s) to render: "
+                  + ", ".join(changed) + Style.RESET_ALL, flush=True)
+            self.schedule(changed, drafts=not initial)
+        elif not initial:
+            print("Nothing that affects the output changed", flush=True)
+
+    async def run(self):
+        self.semaphore = asyncio.Semaphore(self.max_runners)
+        if self.engine.validate:
+            self.engine.executor = ProcessPoolExecutor(
+                max_workers=self.max_runners)
+        await self.update(initial=True)
+        self.changed_files() # Record the starting mtimes
+        print(Style.BRIGHT + f"Watching {len(self.mtimes)} file(s) for "
+              f"changes (Ctrl-C to stop)" + Style.RESET_ALL, flush=True)
+        try:
+            while True:
+                await asyncio.sleep(POLL_INTERVAL)
+                changed = self.changed_files()
+                if not changed:
+                    continue
+                # Editors often write files in several steps:
+                while True:
+                    await asyncio.sleep(SETTLE_TIME)
+                    more = self.changed_files()
+                    if not more:
+                        break
+                    changed += more
+                print(Style.BRIGHT + "Changed: " + ", ".join(
+                    sorted({p.name for p in changed})) + Style.RESET_ALL,
+                    flush=True)
+                await self.update()
+                self.changed_files() # Dependencies might have changed too
+        finally:
+            for name in list(self.tasks):
+                for task in self.tasks.pop(name):
+                    task.cancel()
+            if self.engine.executor:
+                self.engine.executor.shutdown(cancel_futures=True)
+                self.engine.executor = None
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Re-render keycaps (draft first, then final quality) "
+                    "whenever the .scad files or keyset script change.")
+    parser.add_argument('--out',
+        metavar='<filepath>', type=str, default=".",
+        help='Where the generated files will go.')
+    parser.add_argument('--legends',
+        required=False, action='store_true',
+        help='Also render separate legends files.')
+    parser.add_argument('--jobs',
+        metavar='<n>', type=int, default=MAX_RUNNERS,
+        help=f'How many OpenSCAD processes to run at once (default: {MAX_RUNNERS}).')
+    parser.add_argument('--no-drafts',
+        required=False, action='store_true',
+        help="Skip the draft renders; just render at final quality.")
+    parser.add_argument('--no-validate',
+        required=False, action='store_true',
+        help="Don't check rendered keycaps for problems (see validate.py).")
+    parser.add_argument('--verbose',
+        required=False, action='store_true',
+        help="Show all OpenSCAD output (not just problems).")
+    parser.add_argument('module',
+        metavar="module",
+        help="The keyset script to watch (e.g. riskeycap_full).")
+    parser.add_argument('names',
+        nargs='*', metavar="name",
+        help='Only render the keycaps with these names.')
+    args = parser.parse_args()
+    os.makedirs(args.out, exist_ok=True)
+    watcher = Watcher(args.module, args.out, names=args.names,
+        legends=args.legends, max_runners=args.jobs,
+        drafts=not args.no_drafts, quiet=not args.verbose,
+        validate=not args.no_validate)
+    try:
+        asyncio.run(watcher.run())
+    except KeyboardInterrupt:
+        print("")
+
+if __name__ == "__main__":
+    main()